@@ -0,0 +1,476 @@
+"""
+工作日历
+功能：WorkCalendar 工作日位图（可由 generate_calendar.py 生成的二进制文件直接加载），
+      基于工作时间/非工作时间前缀和向量化计算DueTime和非工作日时长；
+      SFC固定周末（周六8:00到周一8:00）按周期公式直接计算
+说明：日历日按 当天8:00 ~ 次日8:00 划分，与MES逐日累加算法（calculate_due_time_by_workdays）保持一致
+      （文中提到的逐行函数为测试参考实现，见 02_测试验证脚本/rowwise_oracles.py）
+"""
+
+import os
+import base64
+import logging
+from typing import Any, Dict, Optional
+
+import numpy as np
+import pandas as pd
+
+
+# 时间常量（纳秒）
+NS_PER_HOUR = 3600 * 10**9
+NS_PER_DAY = 24 * NS_PER_HOUR
+DAY_START_HOUR = 8
+
+# 逐日算法的最大遍历天数（防止无限循环）
+MAX_DUE_DAYS = 365
+
+# SFC固定周末：周六8:00到周一8:00，以 1970-01-03（周六）8:00 为周期原点，每周前48小时为周末
+WEEKEND_ORIGIN_NS = 2 * NS_PER_DAY + DAY_START_HOUR * NS_PER_HOUR
+NS_PER_WEEK = 7 * NS_PER_DAY
+WEEKEND_NS = 2 * NS_PER_DAY
+
+
+def to_datetime64_ns(values: Any) -> np.ndarray:
+    """将Series/数组/标量统一转换为 datetime64[ns] 数组（无法解析的值为NaT）"""
+    converted = pd.to_datetime(pd.Series(values), errors="coerce")
+    return converted.to_numpy(dtype="datetime64[ns]")
+
+
+class WorkCalendar:
+    """
+    工作日历：以天序号（自1970-01-01起的天数）索引的工作日位图
+    位图范围外的日期按默认逻辑判断（周一到周五为工作日），与 is_workday 一致；
+    不含位图的空日历即“周六8:00到周一8:00为周末”的固定周末规则
+    """
+
+    def __init__(self, first_day: int = 0, workdays: Optional[np.ndarray] = None, source: str = ""):
+        self.first_day = int(first_day)
+        self.workdays = np.asarray(workdays if workdays is not None else [], dtype=bool)
+        self.source = source
+
+    def __len__(self) -> int:
+        return len(self.workdays)
+
+    def __repr__(self) -> str:
+        if self.empty:
+            return "WorkCalendar(周一到周五)"
+        first = np.datetime64(self.first_day, "D")
+        return f"WorkCalendar({first} ~ {first + len(self) - 1}, 工作日 {int(self.workdays.sum())} 天)"
+
+    @property
+    def empty(self) -> bool:
+        """是否没有日历数据（仅使用周一到周五的默认逻辑）"""
+        return len(self.workdays) == 0
+
+    @staticmethod
+    def day_ordinals(dates: Any) -> np.ndarray:
+        """日期（Series/数组/标量）转换为天序号（调用方需先过滤空值）"""
+        return to_datetime64_ns(dates).astype("datetime64[D]").astype(np.int64)
+
+    @classmethod
+    def from_dataframe(cls, calendar_df: pd.DataFrame, source: str = "") -> "WorkCalendar":
+        """
+        从日历表DataFrame构建（'日期' 为索引或列，'是否工作日' 为布尔值）
+        '是否工作日' 为空时按工作日处理（与原 bool(is_work) 的行为一致）
+        """
+        if calendar_df is None or calendar_df.empty:
+            return cls(source=source)
+
+        table = calendar_df
+        if "日期" in table.columns:
+            table = table.set_index("日期")
+        if "是否工作日" not in table.columns:
+            logging.error("日历表缺少'是否工作日'列")
+            return cls(source=source)
+
+        values = table["是否工作日"]
+        values = values[~values.index.duplicated(keep="first")]
+        days = pd.DatetimeIndex(pd.to_datetime(values.index)).normalize().to_numpy(dtype="datetime64[D]").astype(np.int64)
+        flags = [bool(v) if not pd.isna(v) else True for v in values.to_numpy(dtype=object)]
+
+        first_day = int(days.min())
+        n_days = int(days.max()) - first_day + 1
+        # 日历表中缺失的日期保持默认逻辑
+        workdays = cls._weekday_flags(first_day, n_days)
+        workdays[days - first_day] = flags
+        return cls(first_day, workdays, source)
+
+    @classmethod
+    def from_csv(cls, calendar_file: str) -> "WorkCalendar":
+        """从日历工作日表CSV加载"""
+        df = pd.read_csv(calendar_file, encoding="utf-8-sig")
+        if "日期" not in df.columns:
+            logging.error("日历表缺少'日期'列")
+            return cls(source=calendar_file)
+        df["日期"] = pd.to_datetime(df["日期"])
+        # CSV中可能是字符串 'True'/'False'，需要转换
+        if "是否工作日" in df.columns and df["是否工作日"].dtype == "object":
+            df["是否工作日"] = df["是否工作日"].map({"True": True, "False": False, True: True, False: False})
+        return cls.from_dataframe(df, source=calendar_file)
+
+    @staticmethod
+    def artifact_path(calendar_file: str) -> str:
+        """日历CSV对应的二进制文件路径（同目录同名 .npz）"""
+        return os.path.splitext(calendar_file)[0] + ".npz"
+
+    @classmethod
+    def load(cls, calendar_file: str) -> "WorkCalendar":
+        """
+        加载日历：优先读取 generate_calendar.py 生成的二进制文件（.npz），
+        二进制文件不存在或比CSV旧时读取CSV；都不存在时返回空日历（周一到周五）
+        """
+        artifact = cls.artifact_path(calendar_file)
+        csv_exists = os.path.exists(calendar_file)
+        try:
+            if os.path.exists(artifact) and (not csv_exists or os.path.getmtime(artifact) >= os.path.getmtime(calendar_file)):
+                with np.load(artifact) as data:
+                    n_days = int(data["n_days"])
+                    workdays = np.unpackbits(data["bitmap"])[:n_days].astype(bool)
+                    calendar = cls(int(data["first_day"]), workdays, artifact)
+            elif csv_exists:
+                calendar = cls.from_csv(calendar_file)
+            else:
+                logging.warning(f"日历表文件不存在: {calendar_file}，将使用默认周末逻辑")
+                return cls()
+        except Exception as e:
+            logging.error(f"加载日历表失败: {calendar_file}, 错误: {e}")
+            return cls()
+
+        logging.info(f"成功加载日历表: {calendar.source}, {calendar}")
+        return calendar
+
+    def save(self, artifact_file: str) -> None:
+        """保存为二进制文件（位图按bit压缩）"""
+        np.savez(artifact_file, first_day=np.int64(self.first_day), n_days=np.int64(len(self)),
+                 bitmap=np.packbits(self.workdays))
+
+    def to_state(self) -> Dict[str, Any]:
+        """导出为可JSON序列化的状态（位图按bit压缩后base64编码），用于记录指标计算时使用的日历"""
+        return {
+            "first_day": self.first_day,
+            "n_days": len(self),
+            "bitmap": base64.b64encode(np.packbits(self.workdays).tobytes()).decode("ascii"),
+        }
+
+    @classmethod
+    def from_state(cls, state: Dict[str, Any]) -> "WorkCalendar":
+        """从 to_state 导出的状态恢复"""
+        bitmap = np.frombuffer(base64.b64decode(state["bitmap"]), dtype=np.uint8)
+        workdays = np.unpackbits(bitmap)[:int(state["n_days"])].astype(bool)
+        return cls(int(state["first_day"]), workdays, "state")
+
+    def changed_days(self, other: "WorkCalendar") -> np.ndarray:
+        """与另一日历工作日标记不同的天序号（升序，两者位图范围外按默认逻辑比较）"""
+        calendars = [c for c in (self, other) if not c.empty]
+        if not calendars:
+            return np.zeros(0, dtype=np.int64)
+        first_day = min(c.first_day for c in calendars)
+        n_days = max(c.first_day + len(c) for c in calendars) - first_day
+        diff = self.flags(first_day, n_days) != other.flags(first_day, n_days)
+        return np.flatnonzero(diff).astype(np.int64) + first_day
+
+    @staticmethod
+    def _weekday_flags(first_day: int, n_days: int) -> np.ndarray:
+        days = np.arange(first_day, first_day + n_days, dtype=np.int64)
+        # 1970-01-01 是周四，(天序号 + 3) % 7 即 Monday=0 ... Sunday=6
+        return (days + 3) % 7 < 5
+
+    def flags(self, first_day: int, n_days: int) -> np.ndarray:
+        """从 first_day 开始连续 n_days 天的工作日标记（位图范围外使用默认逻辑）"""
+        flags = self._weekday_flags(first_day, n_days)
+        lo = max(first_day, self.first_day)
+        hi = min(first_day + n_days, self.first_day + len(self))
+        if lo < hi:
+            flags[lo - first_day:hi - first_day] = self.workdays[lo - self.first_day:hi - self.first_day]
+        return flags
+
+    def is_workday(self, dates: Any) -> Any:
+        """判断日期是否为工作日（按日期部分判断），支持标量和数组"""
+        if np.ndim(dates) == 0:
+            day = int(np.datetime64(pd.Timestamp(dates), "D").astype(np.int64))
+            k = day - self.first_day
+            if 0 <= k < len(self):
+                return bool(self.workdays[k])
+            return bool((day + 3) % 7 < 5)
+        days = self.day_ordinals(dates)
+        if len(days) == 0:
+            return np.zeros(0, dtype=bool)
+        first_day = int(days.min())
+        return self.flags(first_day, int(days.max()) - first_day + 1)[days - first_day]
+
+    def next_workday(self, dates: Any, max_days: int = 30) -> np.ndarray:
+        """
+        下一个工作日的8:00（与 get_next_workday_8am 一致）
+        当前时间已过当天8:00时从次日开始查找，最多查找 max_days 天，找不到时返回起始日8:00
+        """
+        t = to_datetime64_ns(dates)
+        result = np.full(len(t), np.datetime64("NaT"), dtype="datetime64[ns]")
+        valid = ~np.isnat(t)
+        if not valid.any():
+            return result
+
+        ns = t[valid].astype(np.int64)
+        day = np.floor_divide(ns, NS_PER_DAY)
+        day = np.where(ns - day * NS_PER_DAY >= DAY_START_HOUR * NS_PER_HOUR, day + 1, day)
+
+        first_day = int(day.min())
+        n_days = int(day.max()) - first_day + max_days
+        flags = self.flags(first_day, n_days)
+        # 每个位置之后（含）第一个工作日的位置
+        positions = np.where(flags, np.arange(n_days), n_days)
+        next_pos = np.minimum.accumulate(positions[::-1])[::-1]
+        offset = day - first_day
+        found = next_pos[offset] - offset < max_days
+        target = np.where(found, first_day + next_pos[offset], day)
+        result[valid] = (target * NS_PER_DAY + DAY_START_HOUR * NS_PER_HOUR).view("datetime64[ns]")
+        return result
+
+    def working_hours_prefix(self, first_day: int, n_days: int, daily_working_hours: float) -> np.ndarray:
+        """工作时间前缀和（小时），长度 n_days+1，第 k 项为第 k 天之前的工作日累计工时"""
+        prefix = np.zeros(n_days + 1, dtype=np.float64)
+        np.cumsum(self.flags(first_day, n_days) * float(daily_working_hours), out=prefix[1:])
+        return prefix
+
+    def nonworking_prefix_ns(self, first_day: int, n_days: int) -> np.ndarray:
+        """非工作时间前缀和（纳秒），长度 n_days+1"""
+        prefix = np.zeros(n_days + 1, dtype=np.int64)
+        np.cumsum((~self.flags(first_day, n_days)).astype(np.int64) * NS_PER_DAY, out=prefix[1:])
+        return prefix
+
+
+def calendar_day_ordinals(times: Any) -> np.ndarray:
+    """时间所在日历日（8:00 ~ 次日8:00）的天序号，空值为-1"""
+    t = to_datetime64_ns(times)
+    ns = t.astype(np.int64)
+    day = np.floor_divide(ns - DAY_START_HOUR * NS_PER_HOUR, NS_PER_DAY)
+    return np.where(np.isnat(t), -1, day)
+
+
+def as_work_calendar(calendar: Any) -> WorkCalendar:
+    """兼容旧接口：日历表DataFrame/None 转换为 WorkCalendar"""
+    if isinstance(calendar, WorkCalendar):
+        return calendar
+    return WorkCalendar.from_dataframe(calendar)
+
+
+def calculate_due_times(starts: Any, required_hours: Any, calendar: Any,
+                        daily_working_hours: float = 8.0) -> np.ndarray:
+    """
+    向量化计算理论完成时间（与 calculate_due_time_by_workdays 逐行结果一致）
+
+    规则：
+    - 开始当天8:00之后且为工作日：当天可连续生产到次日8:00，完成不了则剩余工时顺延
+    - 开始当天8:00之后但非工作日：从次日8:00开始累计
+    - 开始时间在8:00之前：从当天8:00开始累计
+    - 之后每个工作日累计 daily_working_hours，跳过非工作日，最多累计365天
+
+    Args:
+        starts: 开始时间（Series/数组）
+        required_hours: 需要的理论工时（小时）
+        calendar: WorkCalendar（兼容日历表DataFrame；空日历按周一到周五为工作日）
+        daily_working_hours: 每日工作时间（小时）
+
+    Returns:
+        datetime64[ns] 数组，开始时间或工时为空时为 NaT
+    """
+    start_ns = to_datetime64_ns(starts)
+    hours = pd.to_numeric(pd.Series(required_hours), errors="coerce").to_numpy(dtype=np.float64)
+    result = np.full(len(start_ns), np.datetime64("NaT"), dtype="datetime64[ns]")
+
+    valid = ~np.isnat(start_ns) & ~np.isnan(hours)
+    if not valid.any():
+        return result
+
+    s = start_ns[valid].astype(np.int64)
+    r = hours[valid]
+    out = s.copy()
+
+    day = np.floor_divide(s, NS_PER_DAY)
+    day_8am = day * NS_PER_DAY + DAY_START_HOUR * NS_PER_HOUR
+
+    calendar = as_work_calendar(calendar)
+    first_day = int(day.min())
+    n_days = int(day.max()) - first_day + MAX_DUE_DAYS + 3
+    flags = calendar.flags(first_day, n_days)
+    cum_hours = calendar.working_hours_prefix(first_day, n_days, daily_working_hours)
+    offset = day - first_day
+
+    positive = r > 0
+    after_8am = s >= day_8am
+    start_is_workday = flags[offset]
+
+    # 第一阶段：开始当天（8:00之后且为工作日）的剩余时间
+    hours_until_next_day = (day_8am + NS_PER_DAY - s) / NS_PER_HOUR
+    first_day_workday = positive & after_8am & start_is_workday
+    finish_same_day = first_day_workday & (r <= hours_until_next_day)
+    out[finish_same_day] = s[finish_same_day] + _hours_to_ns(r[finish_same_day])
+
+    # 第二阶段：按工作日累计（从某天8:00开始）
+    rolling = positive & ~finish_same_day
+    remaining = np.where(first_day_workday, r - hours_until_next_day, r)
+    begin_offset = np.where(after_8am, offset + 1, offset)
+
+    if rolling.any():
+        begin = begin_offset[rolling]
+        rem = remaining[rolling]
+        base = cum_hours[begin]
+        # 第一个满足 cum_hours[m] >= 起点累计 + 剩余工时 的位置，完成日为 m-1（必为工作日）
+        m = np.searchsorted(cum_hours, base + rem, side="left")
+        finish = m - 1
+        capped = (m >= len(cum_hours)) | (finish - begin >= MAX_DUE_DAYS)
+        finish = np.where(capped, begin, finish)
+
+        finish_8am = (first_day + finish) * NS_PER_DAY + DAY_START_HOUR * NS_PER_HOUR
+        due = finish_8am + _hours_to_ns(rem - (cum_hours[finish] - base))
+        # 超过最大天数：返回起点后第365天的8:00
+        cap_8am = (first_day + begin + MAX_DUE_DAYS) * NS_PER_DAY + DAY_START_HOUR * NS_PER_HOUR
+        due = np.where(capped, cap_8am, due)
+        if capped.any():
+            logging.warning(f"计算完成时间超过{MAX_DUE_DAYS}天，返回估算值（{int(capped.sum())} 条）")
+
+        out[rolling] = due
+
+    result[valid] = out.view("datetime64[ns]")
+    return result
+
+
+def calculate_nonworkday_hours_between(starts: Any, ends: Any, calendar: Any,
+                                       skip_before_day_start: bool = True) -> np.ndarray:
+    """
+    向量化计算 [start, end] 之间落在非工作日（8:00~次日8:00）内的小时数
+
+    通过非工作时间前缀和计算：hours = F(end) - F(start)，与区间跨度无关
+
+    Args:
+        starts: 开始时间（Series/数组）
+        ends: 结束时间（Series/数组）
+        calendar: WorkCalendar（兼容日历表DataFrame；空日历按周一到周五为工作日，即周六8:00~周一8:00为非工作时间）
+        skip_before_day_start: 开始时间在当天8:00之前时，从当天8:00起算
+            （与MES逐日算法 calculate_nonworkday_hours 一致；SFC周末计算传 False）
+
+    Returns:
+        小时数数组（保留2位小数），end <= start 时为 0.0，任一时间为空时为 NaN
+    """
+    start_ns = to_datetime64_ns(starts)
+    end_ns = to_datetime64_ns(ends)
+    result = np.full(len(start_ns), np.nan, dtype=np.float64)
+
+    both = ~np.isnat(start_ns) & ~np.isnat(end_ns)
+    result[both] = 0.0
+    valid = both & (end_ns > start_ns)
+    if not valid.any():
+        return result
+
+    s = start_ns[valid].astype(np.int64)
+    e = end_ns[valid].astype(np.int64)
+    if skip_before_day_start:
+        s = np.maximum(s, np.floor_divide(s, NS_PER_DAY) * NS_PER_DAY + DAY_START_HOUR * NS_PER_HOUR)
+
+    # 日历日序号：当天8:00~次日8:00 归属当天
+    start_day = np.floor_divide(s - DAY_START_HOUR * NS_PER_HOUR, NS_PER_DAY)
+    end_day = np.floor_divide(e - DAY_START_HOUR * NS_PER_HOUR, NS_PER_DAY)
+    first_day = int(start_day.min())
+    n_days = int(end_day.max()) - first_day + 1
+
+    calendar = as_work_calendar(calendar)
+    non_workday = ~calendar.flags(first_day, n_days)
+    # 非工作时间前缀和（纳秒，整数运算避免累计误差）
+    cum_ns = calendar.nonworking_prefix_ns(first_day, n_days)
+
+    def cumulative(t: np.ndarray, day: np.ndarray) -> np.ndarray:
+        k = day - first_day
+        into_day = t - (day * NS_PER_DAY + DAY_START_HOUR * NS_PER_HOUR)
+        return cum_ns[k] + np.where(non_workday[k], into_day, 0)
+
+    overlap_ns = np.maximum(cumulative(e, end_day) - cumulative(s, start_day), 0)
+    result[valid] = round_values(overlap_ns / NS_PER_HOUR, 2)
+    return result
+
+
+def _weekend_ns_since_origin(t: np.ndarray) -> np.ndarray:
+    """周期原点到 t 之间的周末时长（纳秒）：完整周数×48小时 + 本周已过的周末部分"""
+    x = t - WEEKEND_ORIGIN_NS
+    weeks = np.floor_divide(x, NS_PER_WEEK)
+    return weeks * WEEKEND_NS + np.minimum(x - weeks * NS_PER_WEEK, WEEKEND_NS)
+
+
+def is_weekend(times: Any) -> np.ndarray:
+    """是否落在周末区间（周六8:00 ~ 周一8:00），空值为 False"""
+    t = to_datetime64_ns(times)
+    valid = ~np.isnat(t)
+    result = np.zeros(len(t), dtype=bool)
+    offset = np.mod(t[valid].astype(np.int64) - WEEKEND_ORIGIN_NS, NS_PER_WEEK)
+    result[valid] = offset < WEEKEND_NS
+    return result
+
+
+def calculate_weekend_hours_between(starts: Any, ends: Any) -> np.ndarray:
+    """
+    向量化计算 [start, end] 之间的周末小时数（周六8:00到周一8:00，与 calculate_weekend_hours 一致）
+    按周期公式直接计算，计算量与区间跨度无关
+
+    Returns:
+        小时数数组（保留2位小数），end <= start 时为 0.0，任一时间为空时为 NaN
+    """
+    start_ns = to_datetime64_ns(starts)
+    end_ns = to_datetime64_ns(ends)
+    result = np.full(len(start_ns), np.nan, dtype=np.float64)
+
+    both = ~np.isnat(start_ns) & ~np.isnat(end_ns)
+    result[both] = 0.0
+    valid = both & (end_ns > start_ns)
+    if valid.any():
+        s = start_ns[valid].astype(np.int64)
+        e = end_ns[valid].astype(np.int64)
+        overlap_ns = _weekend_ns_since_origin(e) - _weekend_ns_since_origin(s)
+        result[valid] = round_values(overlap_ns / NS_PER_HOUR, 2)
+    return result
+
+
+def adjust_weekend_due_times(starts: Any, dues: Any) -> np.ndarray:
+    """
+    向量化周末顺延（与 adjust_weekend_sfc 一致）
+    - due 落在周末：顺延到周一8:00（周六+2天、周日+1天，周一8:00前按原逻辑+7天）
+    - 否则：due + start到due之间的周末小时数
+    """
+    start_ns = to_datetime64_ns(starts)
+    due_ns = to_datetime64_ns(dues)
+    result = due_ns.copy()
+
+    valid = ~np.isnat(start_ns) & ~np.isnat(due_ns) & (due_ns > start_ns)
+    if not valid.any():
+        return result
+
+    s = start_ns[valid].astype(np.int64)
+    d = due_ns[valid].astype(np.int64)
+
+    day = np.floor_divide(d, NS_PER_DAY)
+    weekday = (day + 3) % 7
+    in_weekend = np.mod(d - WEEKEND_ORIGIN_NS, NS_PER_WEEK) < WEEKEND_NS
+    days_to_monday = np.select([weekday == 5, weekday == 6], [2, 1], default=7)
+    next_monday = (day + days_to_monday) * NS_PER_DAY + DAY_START_HOUR * NS_PER_HOUR
+
+    weekend_hours = round_values((_weekend_ns_since_origin(d) - _weekend_ns_since_origin(s)) / NS_PER_HOUR, 2)
+    shifted = d + _hours_to_ns(weekend_hours)
+
+    result[valid] = np.where(in_weekend, next_monday, shifted).view("datetime64[ns]")
+    return result
+
+
+def round_values(values: Any, ndigits: int = 2) -> np.ndarray:
+    """
+    向量化保留小数，结果与内置 round(x, ndigits) 逐个计算一致
+    np.round 在 x.xx5 附近可能与内置 round 不同，这些临界值单独按内置 round 处理
+    """
+    values = np.asarray(values, dtype=np.float64)
+    rounded = np.round(values, ndigits)
+    scaled = values * 10**ndigits
+    near_tie = np.abs(np.abs(scaled - np.trunc(scaled)) - 0.5) < 1e-6
+    if near_tie.any():
+        rounded[near_tie] = [round(float(v), ndigits) for v in values[near_tie]]
+    return rounded
+
+
+def _hours_to_ns(hours: np.ndarray) -> np.ndarray:
+    """小时转换为纳秒（按微秒取整，与 timedelta(hours=...) 精度一致）"""
+    return np.round(np.asarray(hours, dtype=np.float64) * 3600 * 10**6).astype(np.int64) * 1000
@@ -10,7 +10,6 @@ import time
 import logging
 import glob
 import json
-import hashlib
 import threading
 from datetime import datetime, timedelta
 from typing import Dict, List, Any, Optional, Set
@@ -23,12 +22,38 @@ from etl_utils import (
     setup_logging,
     load_config,
     read_sharepoint_excel,
+    get_parse_cache,
+    get_excel_checkpoint,
+    get_excel_engine,
+    required_source_columns,
+    get_ingest_workers,
+    get_sync_deferral,
+    parallel_ingest,
     save_to_parquet,
     prompt_refresh_mode,
     update_etl_state,
+    record_fingerprints,
+    load_fingerprint_store,
+    migrate_state_file,
+    remove_etl_state,
+    get_watermark_window,
     get_base_dir,
     ensure_directory_exists
 )
+from etl_calendar import WorkCalendar
+from etl_metrics import (
+    CalendarPolicy,
+    compute_metrics,
+    recompute_rows,
+    changed_rows,
+    rows_touching_days,
+    file_signature,
+    read_metric_inputs,
+    STANDARD_TIME_COLUMNS,
+    METRIC_INPUTS_ATTR,
+)
+from etl_sequencing import sort_by_machine, calculate_setup, calculate_previous_end, recompute_previous_end_tail
+from etl_standard_time import StandardTimeLookup, apply_standard_time
 
 # Windows平台支持
 try:
@@ -54,6 +79,44 @@ BASE_DIR = get_base_dir()
 CONFIG_PATH = os.path.join(BASE_DIR, "..", "03_配置文件", "config", "config_mes_batch_report.yaml")
 
 
+def get_mes_source_columns(cfg: Dict[str, Any]) -> Optional[List[str]]:
+    """
+    需要从MES Excel读取的原始列：mes_mapping中的源列 + Resource（用于提取machine）
+    未启用流式读取或未配置字段映射时返回None（读取全部列）
+    """
+    source_cfg = cfg.get("source", {})
+    if not source_cfg.get("excel_streaming", True):
+        return None
+    column_mapping = {k: v for k, v in cfg.get("mes_mapping", {}).items() if v and not str(v).startswith('#')}
+    if not column_mapping:
+        return None
+    return list(column_mapping) + ["Resource"]
+
+
+# 前处理必需的标准字段（批次过滤、工序号补零、按machine/TrackOutTime排序计算Setup）
+MES_REQUIRED_FIELDS = ["BatchNumber", "CFN", "Operation", "TrackOutTime"]
+
+
+def get_mes_required_columns(cfg: Dict[str, Any]) -> List[str]:
+    """MES Excel必需的原始列：MES_REQUIRED_FIELDS按mes_mapping反查的源列 + Resource（提取machine）"""
+    return required_source_columns(cfg.get("mes_mapping", {}), MES_REQUIRED_FIELDS, ["Resource"])
+
+
+def read_mes_excel(file_path: str, cfg: Dict[str, Any], max_rows: Optional[int] = None,
+                   full_parse: bool = False) -> pd.DataFrame:
+    """
+    读取MES Excel（按字段映射只流式读取需要的列，内容未变化时读取解析缓存，
+    内容有追加时按检查点只解析追加的行；full_parse=True时删除检查点后全量解析）
+    表头缺少必需列时抛出 MissingColumnsError，不解析数据行
+    """
+    chunk_size = cfg.get("source", {}).get("excel_chunk_size", 50000)
+    columns = get_mes_source_columns(cfg)
+    checkpoint = get_excel_checkpoint(cfg)
+    if checkpoint is not None and full_parse:
+        checkpoint.clear(file_path, columns)
+    return read_sharepoint_excel(file_path, max_rows=max_rows, columns=columns, chunk_size=chunk_size,
+                                 cache=get_parse_cache(cfg), checkpoint=checkpoint, engine=get_excel_engine(cfg),
+                                 required=get_mes_required_columns(cfg))
 
 
 def process_mes_data(df: pd.DataFrame, cfg: Dict[str, Any]) -> pd.DataFrame:
@@ -64,6 +127,18 @@ def process_mes_data(df: pd.DataFrame, cfg: Dict[str, Any]) -> pd.DataFrame:
     if df.empty:
         return df
     
+    # 按machine分组，计算TrackInTime和Setup
+    return calculate_trackin_time_and_setup(map_mes_fields(df, cfg))
+
+
+def map_mes_fields(df: pd.DataFrame, cfg: Dict[str, Any]) -> pd.DataFrame:
+    """
+    MES前处理中逐行的部分（字段映射、类型转换、工序/Group/machine清洗），
+    不依赖其他记录，可在读取文件的子进程中按文件执行
+    """
+    if df.empty:
+        return df
+    
     result = df.copy()
     
     # 0. 清理列名的前后空格（避免字段映射失败）
@@ -145,12 +220,14 @@ def process_mes_data(df: pd.DataFrame, cfg: Dict[str, Any]) -> pd.DataFrame:
         result["machine"] = None
         logging.warning("未找到Resource字段，无法提取资源代码")
     
-    # 10. 按machine分组，计算TrackInTime和Setup
-    result = calculate_trackin_time_and_setup(result)
-    
     return result
 
 
+def ingest_mes_file(file_path: str, cfg: Dict[str, Any], max_rows: Optional[int] = None) -> pd.DataFrame:
+    """读取单个MES文件并做逐行前处理（parallel_ingest 子进程中执行）"""
+    return map_mes_fields(read_mes_excel(file_path, cfg, max_rows=max_rows), cfg)
+
+
 def extract_resource_code(resource_str: Any) -> Optional[str]:
     """
     从Resource字段提取资源代码
@@ -343,34 +420,22 @@ def calculate_trackin_time_and_setup(df: pd.DataFrame) -> pd.DataFrame:
         logging.warning("CFN字段不存在，无法进行分组计算，返回原数据")
         return df
     
-    result_list = []
+    # machine为空的记录不参与分组（与按machine分组的结果一致）
+    # 一次排序：machine升序，组内TrackOutTime升序（空值在后），排序标记供PreviousBatchEndTime复用
+    result = sort_by_machine(df[df["machine"].notna()], reset_index=True)
     
-    for resource_code, group in df.groupby("machine"):
-        group_sorted = group.sort_values("TrackOutTime", na_position='last').reset_index(drop=True)
-        
-        # 获取上一行的CFN（用于计算Setup）
-        group_sorted['_prev_cfn'] = group_sorted['CFN'].shift(1)
-        
-        # TrackInTime保持源表的原始值，不进行修改
-        # 如果源表中没有TrackInTime字段，尝试使用StartTime
-        if "TrackInTime" not in group_sorted.columns:
-            if "StartTime" in group_sorted.columns:
-                group_sorted['TrackInTime'] = group_sorted['StartTime']
-            else:
-                group_sorted['TrackInTime'] = None
-        
-        # 计算Setup：如果上一行的CFN与当前CFN相同，则为"No"，否则为"Yes"
-        group_sorted['Setup'] = group_sorted.apply(
-            lambda row: "No" if pd.notna(row['_prev_cfn']) and row['_prev_cfn'] == row.get('CFN', None) else "Yes",
-            axis=1
-        )
-        
-        # 删除临时列
-        group_sorted = group_sorted.drop(columns=['_prev_cfn'])
-        
-        result_list.append(group_sorted)
+    # TrackInTime保持源表的原始值，不进行修改
+    # 如果源表中没有TrackInTime字段，尝试使用StartTime
+    if "TrackInTime" not in result.columns:
+        if "StartTime" in result.columns:
+            result['TrackInTime'] = result['StartTime']
+        else:
+            result['TrackInTime'] = None
     
-    return pd.concat(result_list, ignore_index=True)
+    # 计算Setup：如果同一machine上一行的CFN与当前CFN相同，则为"No"，否则为"Yes"
+    result['Setup'] = calculate_setup(result)
+    
+    return result
 
 
 def merge_sfc_data(mes_df: pd.DataFrame, cfg: Dict[str, Any]) -> pd.DataFrame:
@@ -449,15 +514,8 @@ def merge_sfc_data(mes_df: pd.DataFrame, cfg: Dict[str, Any]) -> pd.DataFrame:
     return result
 
 
-def merge_standard_time(mes_df: pd.DataFrame, cfg: Dict[str, Any]) -> pd.DataFrame:
-    """
-    合并标准时间表（从合并后的parquet文件读取）
-    按CFN、Operation、Group匹配
-    """
-    if mes_df.empty:
-        return mes_df
-    
-    # 获取合并后的标准时间表路径
+def get_standard_time_path(cfg: Dict[str, Any]) -> str:
+    """合并后的标准时间表路径（未配置时使用默认latest文件）"""
     std_time_path = cfg.get("source", {}).get("standard_time_path", "")
     
     # 处理路径：直接使用latest版本
@@ -468,6 +526,19 @@ def merge_standard_time(mes_df: pd.DataFrame, cfg: Dict[str, Any]) -> pd.DataFra
     # 处理相对路径
     if not os.path.isabs(std_time_path):
         std_time_path = os.path.join(BASE_DIR, std_time_path)
+    return std_time_path
+
+
+def merge_standard_time(mes_df: pd.DataFrame, cfg: Dict[str, Any]) -> pd.DataFrame:
+    """
+    合并标准时间表（从合并后的parquet文件读取）
+    按CFN、Operation、Group匹配
+    """
+    if mes_df.empty:
+        return mes_df
+    
+    # 获取合并后的标准时间表路径
+    std_time_path = get_standard_time_path(cfg)
     
     # 检查文件是否存在
     if os.path.exists(std_time_path):
@@ -479,189 +550,33 @@ def merge_standard_time(mes_df: pd.DataFrame, cfg: Dict[str, Any]) -> pd.DataFra
             mes_df[col] = None
         return mes_df
     
-    try:
-        std_time_df = pd.read_parquet(std_time_path)
-        logging.info(f"读取合并后的标准时间表: {len(std_time_df)} 行")
-    except Exception as e:
-        logging.warning(f"读取标准时间表失败: {e}，跳过合并")
+    # 读取标准时间查找表（优先使用SAP Routing ETL生成的 .lookup.arrow）
+    lookup = StandardTimeLookup.load(std_time_path)
+    if lookup is None:
+        logging.warning("读取标准时间表失败，跳过合并")
         for col in ["EH_machine(s)", "EH_labor(s)", "OEE", "Setup Time (h)"]:
             mes_df[col] = None
         return mes_df
     
     # 检查必要字段（至少需要CFN或Material Number之一）
-    required_cols = ["Operation", "Group"]
-    missing_cols = [col for col in required_cols if col not in std_time_df.columns]
-    if missing_cols:
-        logging.warning(f"标准时间表缺少必要字段: {missing_cols}，跳过合并")
+    if not lookup.has_keys(["Operation", "Group"]):
+        logging.warning("标准时间表缺少必要字段: Operation/Group，跳过合并")
         for col in ["EH_machine(s)", "EH_labor(s)", "OEE", "Setup Time (h)"]:
             mes_df[col] = None
         return mes_df
-    
-    # 检查是否有CFN或Material Number字段
-    has_cfn = "CFN" in std_time_df.columns
-    has_material_number = "Material Number" in std_time_df.columns
-    if not has_cfn and not has_material_number:
+    if not lookup.has_keys(["CFN"]) and not lookup.has_keys(["Material Number"]):
         logging.warning("标准时间表缺少CFN和Material Number字段，无法进行匹配")
         for col in ["EH_machine(s)", "EH_labor(s)", "OEE", "Setup Time (h)"]:
             mes_df[col] = None
         return mes_df
     
-    # 准备需要获取的字段：Machine、Labor、Quantity、OEE、Setup Time (h)
-    value_cols = []
-    if "Machine" in std_time_df.columns:
-        value_cols.append("Machine")
-    if "Labor" in std_time_df.columns:
-        value_cols.append("Labor")
-    if "Quantity" in std_time_df.columns:
-        value_cols.append("Quantity")
-    if "OEE" in std_time_df.columns:
-        value_cols.append("OEE")
-    if "Setup Time (h)" in std_time_df.columns:
-        value_cols.append("Setup Time (h)")
-    
-    if not value_cols:
-        logging.warning("标准时间表缺少有效字段，跳过合并")
-        for col in ["EH_machine(s)", "EH_labor(s)", "OEE", "Setup Time (h)"]:
-            mes_df[col] = None
-        return mes_df
-    
-    # 第一步：使用MES的CFN匹配标准表的Material Number
-    if "CFN" in mes_df.columns and "Material Number" in std_time_df.columns:
-        # 准备合并键：MES的CFN对应标准表的Material Number
-        merge_cols_mes = ["CFN", "Operation", "Group"]
-        merge_cols_std = ["Material Number", "Operation", "Group"]
-        
-        # 合并前统一数据类型
-        for i, mes_col in enumerate(merge_cols_mes):
-            std_col = merge_cols_std[i]
-            if mes_col in mes_df.columns and std_col in std_time_df.columns:
-                # 统一转换为字符串类型
-                mes_df[mes_col] = mes_df[mes_col].astype(str)
-                std_time_df[std_col] = std_time_df[std_col].astype(str)
-                # 处理NaN值（转换为空字符串）
-                mes_df[mes_col] = mes_df[mes_col].replace('nan', '').replace('None', '')
-                std_time_df[std_col] = std_time_df[std_col].replace('nan', '').replace('None', '')
-        
-        # 使用left_on和right_on避免列名冲突
-        # 第一步：使用MES的CFN匹配标准表的Material Number
-        result = mes_df.merge(
-            std_time_df[merge_cols_std + value_cols],
-            left_on=merge_cols_mes,
-            right_on=merge_cols_std,
-            how="left"
-        )
-    else:
-        # 如果标准时间表没有Material Number字段，直接使用MES数据，后续用CFN匹配
-        result = mes_df.copy()
-        # 初始化标准时间字段为空
-        for col in value_cols:
-            result[col] = None
-    
-    # 计算单件时间（Machine和Labor除以Quantity，单位：秒）
-    # 重命名为EH_machine(s)和EH_labor(s)
-    if "Machine" in result.columns and "Quantity" in result.columns:
-        # 确保Quantity不为0或空
-        quantity = result["Quantity"].fillna(1).replace(0, 1)
-        # 计算单件Machine时间（秒）
-        result["EH_machine(s)"] = result["Machine"] / quantity
-        # 删除原始Machine字段
-        result = result.drop(columns=["Machine"])
-    else:
-        result["EH_machine(s)"] = None
-    
-    if "Labor" in result.columns and "Quantity" in result.columns:
-        # 确保Quantity不为0或空
-        quantity = result["Quantity"].fillna(1).replace(0, 1)
-        # 计算单件Labor时间（秒）
-        result["EH_labor(s)"] = result["Labor"] / quantity
-        # 删除原始Labor字段
-        result = result.drop(columns=["Labor"])
-    else:
-        result["EH_labor(s)"] = None
-    
-    # 删除Quantity字段（不再需要）
-    if "Quantity" in result.columns:
-        result = result.drop(columns=["Quantity"])
-    
-    # 第二步：对未匹配的记录，使用MES的CFN匹配标准表的CFN
-    # 检查是否有未匹配的记录（EH_machine(s)和EH_labor(s)都为空）
-    unmatched_mask = result["EH_machine(s)"].isna() & result["EH_labor(s)"].isna()
-    unmatched_count = unmatched_mask.sum()
-    
-    if unmatched_count > 0 and "CFN" in std_time_df.columns and "CFN" in mes_df.columns:
-        logging.info(f"第一步Material Number匹配后，还有 {unmatched_count} 条记录未匹配，尝试使用CFN匹配")
-        
-        # 获取未匹配的记录
-        unmatched_df = result[unmatched_mask].copy()
-        
-        # 准备CFN匹配的合并键
-        cfn_merge_cols = ["CFN", "Operation", "Group"]
-        
-        # 统一数据类型
-        for col in cfn_merge_cols:
-            if col in unmatched_df.columns and col in std_time_df.columns:
-                unmatched_df[col] = unmatched_df[col].astype(str)
-                std_time_df[col] = std_time_df[col].astype(str)
-                unmatched_df[col] = unmatched_df[col].replace('nan', '').replace('None', '')
-                std_time_df[col] = std_time_df[col].replace('nan', '').replace('None', '')
-        
-        # 使用CFN匹配
-        cfn_value_cols = []
-        if "Machine" in std_time_df.columns:
-            cfn_value_cols.append("Machine")
-        if "Labor" in std_time_df.columns:
-            cfn_value_cols.append("Labor")
-        if "Quantity" in std_time_df.columns:
-            cfn_value_cols.append("Quantity")
-        if "OEE" in std_time_df.columns:
-            cfn_value_cols.append("OEE")
-        if "Setup Time (h)" in std_time_df.columns:
-            cfn_value_cols.append("Setup Time (h)")
-        
-        if cfn_value_cols:
-            # 合并
-            cfn_matched = unmatched_df.merge(
-                std_time_df[cfn_merge_cols + cfn_value_cols],
-                on=cfn_merge_cols,
-                how="left"
-            )
-            
-            # 计算单件时间
-            if "Machine" in cfn_matched.columns and "Quantity" in cfn_matched.columns:
-                quantity = cfn_matched["Quantity"].fillna(1).replace(0, 1)
-                cfn_matched["EH_machine(s)"] = cfn_matched["Machine"] / quantity
-                cfn_matched = cfn_matched.drop(columns=["Machine"])
-            else:
-                cfn_matched["EH_machine(s)"] = None
-            
-            if "Labor" in cfn_matched.columns and "Quantity" in cfn_matched.columns:
-                quantity = cfn_matched["Quantity"].fillna(1).replace(0, 1)
-                cfn_matched["EH_labor(s)"] = cfn_matched["Labor"] / quantity
-                cfn_matched = cfn_matched.drop(columns=["Labor"])
-            else:
-                cfn_matched["EH_labor(s)"] = None
-            
-            if "Quantity" in cfn_matched.columns:
-                cfn_matched = cfn_matched.drop(columns=["Quantity"])
-            
-            # 更新result中未匹配的记录
-            # 只更新那些在cfn_matched中匹配成功的记录
-            cfn_matched_mask = cfn_matched["EH_machine(s)"].notna() | cfn_matched["EH_labor(s)"].notna()
-            if cfn_matched_mask.any():
-                # 获取匹配成功的记录索引
-                matched_indices = cfn_matched[cfn_matched_mask].index
-                
-                # 更新result中对应索引的记录
-                for col in ["EH_machine(s)", "EH_labor(s)", "OEE", "Setup Time (h)"]:
-                    if col in cfn_matched.columns:
-                        result.loc[matched_indices, col] = cfn_matched.loc[matched_indices, col]
-                
-                cfn_matched_count = len(matched_indices)
-                logging.info(f"第二步CFN匹配成功: {cfn_matched_count} 条记录")
-    
-    # 确保OEE有默认值
-    if "OEE" in result.columns:
-        result["OEE"] = result["OEE"].fillna(0.77).replace(0, 0.77)
+    # 第一步：MES的CFN匹配标准表的Material Number；
+    # 第二步：未匹配到单件时间的记录，MES的CFN匹配标准表的CFN
+    # 输出保留第一步匹配到的Material Number（与原merge结果字段一致）
+    result = apply_standard_time(mes_df, lookup, [
+        (["CFN", "Operation", "Group"], ["Material Number", "Operation", "Group"]),
+        (["CFN", "Operation", "Group"], ["CFN", "Operation", "Group"]),
+    ], keep_keys=["Material Number"])
     
     # 统计匹配结果
     total_matched = (result["EH_machine(s)"].notna() | result["EH_labor(s)"].notna()).sum()
@@ -698,59 +613,36 @@ def calculate_previous_batch_end_time(df: pd.DataFrame) -> pd.DataFrame:
         df["PreviousBatchEndTime"] = None
         return df
     
-    result = df.copy()
-    
     # 确保machine字段存在（如果不存在，创建为None）
-    if "machine" not in result.columns:
+    if "machine" not in df.columns:
         logging.warning("缺少machine字段，无法按machine分组计算 PreviousBatchEndTime")
+        result = df.copy()
         result["PreviousBatchEndTime"] = None
         return result
     
     # 检查machine字段是否有有效值
-    valid_machine_count = result["machine"].notna().sum()
+    valid_machine_count = df["machine"].notna().sum()
     if valid_machine_count == 0:
         logging.warning("machine字段全部为空，无法计算 PreviousBatchEndTime")
+        result = df.copy()
         result["PreviousBatchEndTime"] = None
         return result
     
-    logging.info(f"开始计算 PreviousBatchEndTime：有效machine记录 {valid_machine_count} 条，总计 {len(result)} 条")
+    logging.info(f"开始计算 PreviousBatchEndTime：有效machine记录 {valid_machine_count} 条，总计 {len(df)} 条")
     
-    # 按 machine 分组，按 TrackOutTime 升序排序（最早的在前）
-    # 对于 machine 为空或 TrackOutTime 为空的记录，先处理
-    result = result.sort_values(
-        ["machine", "TrackOutTime"],
-        na_position='last',  # 空值排在最后
-        ascending=[True, True]  # machine 和 TrackOutTime 都升序
-    )
+    # 按 machine 分组，按 TrackOutTime 升序排序（最早的在前，空值排在最后）
+    # 已由 calculate_trackin_time_and_setup 或上一次计算排好序时不再重复排序
+    result = sort_by_machine(df)
     
-    # 使用 shift(1) 获取上一批的 TrackOutTime
-    # 只对machine不为空的记录进行分组计算
-    result["PreviousBatchEndTime"] = None
+    # 确保TrackOutTime、EnterStepTime是datetime类型
+    for col in ("TrackOutTime", "EnterStepTime"):
+        if col in result.columns and result[col].dtype not in ['datetime64[ns]', 'datetime64[us]', 'datetime64[ms]']:
+            result[col] = pd.to_datetime(result[col], errors='coerce')
     
-    # 只对machine不为空的记录进行分组计算
+    # 同一machine上一批的TrackOutTime（整列shift），第一批使用EnterStepTime代替
+    # 只对machine和TrackOutTime都不为空的记录计算
     mask_valid = result["machine"].notna() & result["TrackOutTime"].notna()
-    if mask_valid.any():
-        # 对有效记录进行分组计算
-        # 确保TrackOutTime是datetime类型
-        if result["TrackOutTime"].dtype not in ['datetime64[ns]', 'datetime64[us]', 'datetime64[ms]']:
-            result["TrackOutTime"] = pd.to_datetime(result["TrackOutTime"], errors='coerce')
-        
-        # 使用shift(1)获取上一批的TrackOutTime，保持datetime类型
-        result.loc[mask_valid, "PreviousBatchEndTime"] = (
-            result[mask_valid].groupby("machine")["TrackOutTime"].shift(1)
-        )
-        
-        # 确保PreviousBatchEndTime是datetime类型
-        if "PreviousBatchEndTime" in result.columns:
-            result["PreviousBatchEndTime"] = pd.to_datetime(result["PreviousBatchEndTime"], errors='coerce')
-        
-        # 对于第一批（PreviousBatchEndTime 为空），使用 EnterStepTime 代替
-        mask_first_batch = mask_valid & result["PreviousBatchEndTime"].isna()
-        if "EnterStepTime" in result.columns and mask_first_batch.any():
-            # 确保EnterStepTime是datetime类型
-            if result["EnterStepTime"].dtype not in ['datetime64[ns]', 'datetime64[us]', 'datetime64[ms]']:
-                result["EnterStepTime"] = pd.to_datetime(result["EnterStepTime"], errors='coerce')
-            result.loc[mask_first_batch, "PreviousBatchEndTime"] = result.loc[mask_first_batch, "EnterStepTime"]
+    result["PreviousBatchEndTime"] = calculate_previous_end(result)
     
     # 统计计算结果
     total_count = len(result)
@@ -761,6 +653,112 @@ def calculate_previous_batch_end_time(df: pd.DataFrame) -> pd.DataFrame:
     return result
 
 
+def update_previous_batch_end_time(df: pd.DataFrame, new_df: pd.DataFrame) -> pd.DataFrame:
+    """
+    增量计算上批结束时间（PreviousBatchEndTime）
+    
+    逻辑：
+    - 历史数据的 PreviousBatchEndTime 已是上次全量/增量计算的结果
+    - 只有新数据涉及的machine中，TrackOutTime不早于该machine最早新TrackOutTime的记录可能变化
+    - 对这些记录（加上各machine尾部之前的最后一批）重新排序计算，结果写回
+    
+    历史数据缺少 PreviousBatchEndTime 或缺少必需字段时，退回 calculate_previous_batch_end_time 全量计算
+    """
+    required = {"machine", "TrackOutTime", "PreviousBatchEndTime"}
+    if new_df.empty or not required.issubset(df.columns) or not {"machine", "TrackOutTime"}.issubset(new_df.columns):
+        logging.info("无法增量计算 PreviousBatchEndTime，对全部数据统一计算")
+        return calculate_previous_batch_end_time(df)
+    
+    result = df.copy()
+    
+    # 确保TrackOutTime、EnterStepTime、PreviousBatchEndTime是datetime类型
+    for col in ("TrackOutTime", "EnterStepTime", "PreviousBatchEndTime"):
+        if col in result.columns and result[col].dtype not in ['datetime64[ns]', 'datetime64[us]', 'datetime64[ms]']:
+            result[col] = pd.to_datetime(result[col], errors='coerce')
+    
+    affected, previous_end = recompute_previous_end_tail(result, new_df)
+    if affected.any():
+        result.loc[affected, "PreviousBatchEndTime"] = previous_end
+    
+    touched_machines = result.loc[affected, "machine"].nunique()
+    logging.info(f"增量计算 PreviousBatchEndTime 完成：涉及machine {touched_machines} 个，重算 {int(affected.sum())} 条，总计 {len(result)} 条")
+    
+    return result
+
+
+def get_calendar_policy(cfg: Dict[str, Any]) -> CalendarPolicy:
+    """按配置加载日历表，返回MES非工作时间策略"""
+    calendar_file = cfg.get("source", {}).get("calendar_file", "")
+    calendar = load_calendar_table(calendar_file) if calendar_file else WorkCalendar()
+    daily_working_hours = cfg.get("source", {}).get("daily_working_hours", 8.0)
+    return CalendarPolicy(calendar, daily_working_hours)
+
+
+def get_metric_inputs(cfg: Dict[str, Any], calendar: WorkCalendar) -> Dict[str, Any]:
+    """本次指标计算使用的输入（标准时间表签名、日历位图、每日工作时间），随结果保存"""
+    return {
+        "standard_time": file_signature(get_standard_time_path(cfg)),
+        "calendar": calendar.to_state(),
+        "daily_working_hours": cfg.get("source", {}).get("daily_working_hours", 8.0),
+    }
+
+
+def refresh_standard_time(df: pd.DataFrame, cfg: Dict[str, Any]) -> tuple:
+    """
+    标准时间表变化后，对全部记录重新合并标准时间
+    
+    Returns:
+        (result, changed)：changed为标准时间输入（EH_machine(s)/EH_labor(s)/OEE/Setup Time (h)）有变化的记录
+    """
+    before = df.reindex(columns=STANDARD_TIME_COLUMNS)
+    result = merge_standard_time(df.drop(columns=STANDARD_TIME_COLUMNS, errors="ignore"), cfg)
+    result.attrs = dict(df.attrs)
+    if len(result) != len(df):
+        # 标准时间表存在重复键时合并会产生重复记录，无法逐行对应，全部重新计算
+        logging.warning(f"重新合并标准时间后行数变化（{len(df)} → {len(result)}），全部记录重新计算指标")
+        return result, pd.Series(True, index=result.index)
+    result.index = df.index
+    changed = changed_rows(before, result.reindex(columns=STANDARD_TIME_COLUMNS))
+    return result, changed
+
+
+def refresh_dependent_metrics(df: pd.DataFrame, previous_end_before: pd.Series,
+                              history_inputs: Dict[str, Any], cfg: Dict[str, Any]) -> pd.DataFrame:
+    """
+    合并历史数据后，只对输入发生变化的记录重新计算指标
+    
+    需要重新计算的记录：
+    - PreviousBatchEndTime 变化（新批次插入到历史批次之间）→ PT、DueTime、CompletionStatus 变化
+    - 标准时间表变化且该记录的标准时间输入变化 → ST、DueTime、CompletionStatus 变化
+    - 日历变化且该记录的计算区间覆盖变化的日期 → DueTime、NonWorkday(d)、CompletionStatus 变化
+    历史数据没有输入记录（旧版本生成）时，对应输入视为已变化
+    """
+    policy = get_calendar_policy(cfg)
+    inputs = get_metric_inputs(cfg, policy.calendar)
+    
+    dirty = changed_rows(previous_end_before, df["PreviousBatchEndTime"])
+    logging.info(f"PreviousBatchEndTime 变化: {int(dirty.sum())} 条")
+    
+    if history_inputs.get("standard_time") != inputs["standard_time"]:
+        df, std_changed = refresh_standard_time(df, cfg)
+        dirty = dirty.reindex(df.index, fill_value=True) | std_changed
+        logging.info(f"标准时间表已变化，标准时间输入变化: {int(std_changed.sum())} 条")
+    
+    if history_inputs.get("daily_working_hours") != inputs["daily_working_hours"] or "calendar" not in history_inputs:
+        dirty[:] = True
+        logging.info("日历/每日工作时间没有历史记录或已变化，全部记录重新计算")
+    elif history_inputs["calendar"] != inputs["calendar"]:
+        days = policy.calendar.changed_days(WorkCalendar.from_state(history_inputs["calendar"]))
+        calendar_changed = rows_touching_days(df, days)
+        dirty |= calendar_changed
+        logging.info(f"日历变化 {len(days)} 天，计算区间受影响: {int(calendar_changed.sum())} 条")
+    
+    df = recompute_rows(df, dirty, policy)
+    df.attrs[METRIC_INPUTS_ATTR] = inputs
+    logging.info(f"增量重算指标完成：重算 {int(dirty.sum())} 条，总计 {len(df)} 条")
+    return df
+
+
 def calculate_metrics(df: pd.DataFrame, cfg: Dict[str, Any]) -> pd.DataFrame:
     """
     计算所有指标字段
@@ -774,46 +772,18 @@ def calculate_metrics(df: pd.DataFrame, cfg: Dict[str, Any]) -> pd.DataFrame:
     # 记录实际存在的列名（用于调试）
     logging.debug(f"数据列名: {list(result.columns)}")
     
-    # 加载日历表
-    calendar_file = cfg.get("source", {}).get("calendar_file", "")
-    calendar_df = load_calendar_table(calendar_file) if calendar_file else pd.DataFrame()
-    
-    # 获取每日工作时间配置
-    daily_working_hours = cfg.get("source", {}).get("daily_working_hours", 8.0)
+    # 加载日历表和每日工作时间配置
+    policy = get_calendar_policy(cfg)
     
     # 0. 计算 PreviousBatchEndTime（在计算LT/PT之前）
     # 注意：如果数据是增量处理的，这里只对新数据计算，最终会在合并后统一重新计算
     # 这里先计算是为了后续可能使用该字段进行计算
     result = calculate_previous_batch_end_time(result)
     
-    # 1. 计算LT(d)
-    result["LT(d)"] = result.apply(calculate_lt, axis=1)
-    
-    # 2. 计算PT(d)
-    result["PT(d)"] = result.apply(calculate_pt, axis=1)
-    
-    # 3. 处理OEE默认值
-    if "OEE" in result.columns:
-        result["OEE"] = result["OEE"].fillna(0.77).replace(0, 0.77)
-    
-    # 4. 确保EH_machine(s)和EH_labor(s)字段存在
-    if "EH_machine(s)" not in result.columns:
-        result["EH_machine(s)"] = None
-    if "EH_labor(s)" not in result.columns:
-        result["EH_labor(s)"] = None
-    
-    # 5. 计算ST(d)
-    result["ST(d)"] = result.apply(calculate_st, axis=1)
-    
-    # 6. 计算DueTime和NonWorkday(d)（基于日历表）
-    result["DueTime"] = result.apply(lambda row: calculate_due_time(row, calendar_df, daily_working_hours), axis=1)
-    result["NonWorkday(d)"] = result.apply(lambda row: calculate_nonworkday_days(row, calendar_df), axis=1)
-    
-    # 7. 计算CompletionStatus（基于PT和ST比较，考虑容差和换批时间）
-    result["CompletionStatus"] = result.apply(lambda row: calculate_completion_status(row, calendar_df), axis=1)
-    
-    # 8. 计算容差小时数（单独字段，与SFC逻辑一致）
-    result["Tolerance(h)"] = result.apply(calculate_tolerance_hours, axis=1)
+    # 1-8. 计算LT/PT/ST/DueTime/NonWorkday(d)/CompletionStatus/Tolerance(h)
+    # （列式计算，逻辑同逐行参考实现 calculate_lt/calculate_pt/calculate_st/calculate_due_time 等，见测试脚本 rowwise_oracles.py；
+    #   非工作时间基于日历表）
+    result = compute_metrics(result, policy)
     
     # 9. 计算Machine(#) - 检查machine字段是否存在
     if "machine" in result.columns:
@@ -849,586 +819,13 @@ def calculate_metrics(df: pd.DataFrame, cfg: Dict[str, Any]) -> pd.DataFrame:
     return result
 
 
-def calculate_lt(row: pd.Series) -> Optional[float]:
-    """计算LT(d) - 实际加工时间，不扣除周末"""
-    operation = row.get("Operation", "")
-    trackout = row.get("TrackOutTime", None)
-    checkin_sfc = row.get("Checkin_SFC", None)
-    enter_step = row.get("EnterStepTime", None)
-    trackin = row.get("TrackInTime", None)
-    
-    if pd.isna(trackout):
-        return None
-    
-    # 确定开始时间
-    start_time = None
-    if operation == "0010":
-        # 0010工序：优先使用Checkin_SFC，如果为空则使用EnterStepTime，再为空则使用TrackInTime
-        if pd.notna(checkin_sfc):
-            start_time = checkin_sfc
-        elif pd.notna(enter_step):
-            start_time = enter_step
-        elif pd.notna(trackin):
-            start_time = trackin
-    else:
-        # 非0010工序：使用EnterStepTime
-        if pd.notna(enter_step):
-            start_time = enter_step
-    
-    if start_time is None:
-        return None
-    
-    trackout_dt = pd.to_datetime(trackout)
-    start_dt = pd.to_datetime(start_time)
-    
-    # 计算实际时间差（天），不扣除周末
-    total_seconds = (trackout_dt - start_dt).total_seconds()
-    total_hours = total_seconds / 3600
-    
-    # 转换为天数（不扣除周末）
-    return round(total_hours / 24, 2)
-
-
-def calculate_pt(row: pd.Series) -> Optional[float]:
-    """
-    计算PT(d) - 实际加工时间
-    
-    升级逻辑：避免将设备停产时间计入PT
-    - 正常情况：PT = TrackOutTime - PreviousBatchEndTime
-    - 特殊情况：如果EnterStepTime > PreviousBatchEndTime，说明中间有停产期
-    - 升级后：PT = TrackOutTime - TrackInTime（不包括停产等待时间）
-    
-    根据业务逻辑：
-    1. 如果EnterStepTime <= PreviousBatchEndTime：正常连续生产
-       PT(d) = (TrackOutTime - PreviousBatchEndTime) / 24
-    2. 如果EnterStepTime > PreviousBatchEndTime：中间有停产期
-       PT(d) = (TrackOutTime - TrackInTime) / 24
-    3. 如果PreviousBatchEndTime为空，使用TrackInTime
-    """
-    trackout = row.get("TrackOutTime", None)
-    previous_batch_end = row.get("PreviousBatchEndTime", None)
-    trackin = row.get("TrackInTime", None)
-    enter_step = row.get("EnterStepTime", None)
-    
-    if pd.isna(trackout):
-        return None
-    
-    # 升级逻辑：检查是否有停产期
-    start_time = None
-    
-    # 检查是否存在停产期
-    has_production_gap = False
-    if pd.notna(enter_step) and pd.notna(previous_batch_end):
-        enter_step_dt = pd.to_datetime(enter_step)
-        previous_end_dt = pd.to_datetime(previous_batch_end)
-        if enter_step_dt > previous_end_dt:
-            has_production_gap = True
-            logging.debug(f"检测到停产期: EnterStepTime {enter_step} > PreviousBatchEndTime {previous_batch_end}")
-    
-    # 根据是否有停产期选择开始时间
-    if has_production_gap:
-        # 有停产期：使用TrackInTime作为实际加工开始时间
-        if pd.notna(trackin):
-            start_time = trackin
-            logging.debug(f"使用TrackInTime计算PT: {trackin}")
-        else:
-            # 如果TrackInTime为空，回退到PreviousBatchEndTime
-            start_time = previous_batch_end
-            logging.debug(f"TrackInTime为空，回退到PreviousBatchEndTime: {previous_batch_end}")
-    else:
-        # 正常连续生产：使用PreviousBatchEndTime
-        if pd.notna(previous_batch_end):
-            start_time = previous_batch_end
-            logging.debug(f"正常生产，使用PreviousBatchEndTime: {previous_batch_end}")
-        elif pd.notna(trackin):
-            # 如果PreviousBatchEndTime为空，使用TrackInTime
-            start_time = trackin
-            logging.debug(f"PreviousBatchEndTime为空，使用TrackInTime: {trackin}")
-        else:
-            # 如果两者都为空，返回None
-            return None
-    
-    trackout_dt = pd.to_datetime(trackout)
-    start_dt = pd.to_datetime(start_time)
-    
-    # 确保结束时间大于开始时间
-    if trackout_dt <= start_dt:
-        return None
-    
-    # 计算实际时间差（秒）
-    total_seconds = (trackout_dt - start_dt).total_seconds()
-    
-    # 转换为小时
-    total_hours = total_seconds / 3600.0
-    
-    # 转换为天数（保留2位小数）
-    return round(total_hours / 24.0, 2)
-
-
-def calculate_st(row: pd.Series) -> Optional[float]:
-    """
-    计算ST(d) - 理论加工时间，不考虑周末
-    
-    计算逻辑（与SFC保持一致）：
-    ST = (调试时间 + (合格数量 + 报废数量) × EH_machine或EH_labor / OEE + 0.5小时换批时间) / 24
-    单位：天
-    """
-    # 使用TrackOutQuantity + ScrapQuantity（与SFC保持一致）
-    trackout_qty = row.get("TrackOutQuantity", 0) or 0
-    scrap_qty = row.get("ScrapQuantity", 0) or 0
-    qty = trackout_qty + scrap_qty
-    
-    oee = row.get("OEE", 0.77) or 0.77
-    setup_time = 0  # 调试时间（小时）
-    
-    if row.get("Setup") == "Yes" and pd.notna(row.get("Setup Time (h)")):
-        setup_time = row.get("Setup Time (h)", 0) or 0
-    
-    # 获取单件时间（秒），优先使用EH_machine(s)，否则使用EH_labor(s)
-    machine_time_s = row.get("EH_machine(s)", None)
-    labor_time_s = row.get("EH_labor(s)", None)
-    
-    # 确定使用哪个时间
-    if pd.notna(machine_time_s) and machine_time_s > 0:
-        unit_time_s = machine_time_s
-    elif pd.notna(labor_time_s) and labor_time_s > 0:
-        unit_time_s = labor_time_s
-    else:
-        return None
-    
-    # 转换为小时
-    unit_time_h = unit_time_s / 3600
-    
-    # 计算基础工时（理论时间，不考虑周末）
-    # 公式：调试时间 + (数量 × 单件时间 / OEE) + 0.5小时换批时间
-    base_hours = setup_time + (qty * unit_time_h / oee) + 0.5
-    
-    if base_hours == 0:
-        return None
-    
-    # ST = 基础工时 / 24（不考虑周末）
-    return round(base_hours / 24, 2)
-
-
-
-
-# 全局变量：日历表缓存
-_calendar_df: Optional[pd.DataFrame] = None
-
-
-def load_calendar_table(calendar_file: str) -> pd.DataFrame:
+def load_calendar_table(calendar_file: str) -> WorkCalendar:
     """
     加载日历工作日表
-    返回包含日期、是否工作日的DataFrame
-    """
-    global _calendar_df
-    
-    if _calendar_df is not None:
-        return _calendar_df
-    
-    try:
-        if not os.path.exists(calendar_file):
-            logging.warning(f"日历表文件不存在: {calendar_file}，将使用默认周末逻辑")
-            return pd.DataFrame()
-        
-        df = pd.read_csv(calendar_file, encoding='utf-8-sig')
-        
-        # 确保日期列为datetime类型
-        if '日期' in df.columns:
-            df['日期'] = pd.to_datetime(df['日期'])
-        else:
-            logging.error("日历表缺少'日期'列")
-            return pd.DataFrame()
-        
-        # 确保有'是否工作日'列
-        if '是否工作日' not in df.columns:
-            logging.error("日历表缺少'是否工作日'列")
-            return pd.DataFrame()
-        
-        # 将 '是否工作日' 列转换为布尔类型
-        # CSV中可能是字符串 'True'/'False'，需要转换
-        if df['是否工作日'].dtype == 'object':
-            df['是否工作日'] = df['是否工作日'].map({'True': True, 'False': False, True: True, False: False})
-        
-        # 创建日期索引以便快速查找
-        df = df.set_index('日期')
-        
-        _calendar_df = df
-        logging.info(f"成功加载日历表: {calendar_file}, 共{len(df)}条记录")
-        
-        # 输出一些示例数据用于验证
-        sample_dates = pd.to_datetime(['2024-10-01', '2024-10-07', '2024-10-08'])
-        for date in sample_dates:
-            if date in df.index:
-                is_work = df.loc[date, '是否工作日']
-                logging.debug(f"日历表示例: {date.date()} 是否工作日={is_work}")
-        
-        return df
-        
-    except Exception as e:
-        logging.error(f"加载日历表失败: {calendar_file}, 错误: {e}")
-        return pd.DataFrame()
-
-
-def is_workday(date: datetime, calendar_df: pd.DataFrame) -> bool:
-    """
-    判断指定日期是否为工作日（基于日历表）
-    如果日历表未加载或日期不在范围内，返回默认判断（周一到周五）
-    """
-    if calendar_df.empty:
-        # 如果日历表未加载，使用默认逻辑（周一到周五为工作日）
-        weekday = date.weekday()  # Monday=0, Sunday=6
-        logging.debug(f"日历表未加载，使用默认逻辑判断 {date.date()}: 工作日={weekday < 5}")
-        return weekday < 5
-    
-    # 获取日期部分（去除时间）
-    date_only = date.date()
-    date_key = pd.Timestamp(date_only)
-    
-    if date_key in calendar_df.index:
-        is_work = calendar_df.loc[date_key, '是否工作日']
-        # 确保返回布尔值
-        is_work = bool(is_work)
-        return is_work
-    else:
-        # 如果日期不在日历表中，使用默认逻辑
-        weekday = date.weekday()
-        logging.debug(f"日期 {date.date()} 不在日历表中，使用默认逻辑: 工作日={weekday < 5}")
-        return weekday < 5
-
-
-def get_next_workday_8am(date: datetime, calendar_df: pd.DataFrame) -> datetime:
-    """
-    获取下一个工作日的8:00（基于日历表）
-    """
-    current_date = date.date()
-    current_datetime_8am = date.replace(hour=8, minute=0, second=0, microsecond=0)
-    
-    # 如果当前时间已经超过当天8:00，从下一天开始查找
-    if date.hour >= 8:
-        current_date = current_date + timedelta(days=1)
-        current_datetime_8am = current_datetime_8am + timedelta(days=1)
-    
-    # 最多查找30天（防止无限循环）
-    for _ in range(30):
-        test_datetime = datetime.combine(current_date, datetime.min.time()).replace(hour=8)
-        if is_workday(test_datetime, calendar_df):
-            return test_datetime
-        current_date = current_date + timedelta(days=1)
-    
-    # 如果30天内找不到工作日，返回30天后的8:00
-    logging.warning(f"在30天内未找到工作日，返回默认值: {current_datetime_8am}")
-    return current_datetime_8am
-
-
-def calculate_due_time(row: pd.Series, calendar_df: pd.DataFrame, daily_working_hours: float = 8.0) -> Optional[datetime]:
-    """
-    计算DueTime - 理论完成时间（用于参考，不作为状态判断）
-    
-    逻辑：从 PreviousBatchEndTime 开始到理论完成的时间
-    - 如果 PreviousBatchEndTime 为空，使用 EnterStepTime
-    - 按工作日逐天累加工作时间，跳过非工作日
-    - 工作日按24小时连续生产
+    优先读取 generate_calendar.py 生成的二进制位图（同名.npz），否则读取CSV
+    返回 WorkCalendar（日历表不存在时为空日历，按周一到周五为工作日）
     """
-    # 使用 PreviousBatchEndTime 作为开始时间
-    start_time = row.get("PreviousBatchEndTime", None)
-    
-    # 如果 PreviousBatchEndTime 为空，使用 EnterStepTime
-    if pd.isna(start_time):
-        start_time = row.get("EnterStepTime", None)
-    if pd.isna(start_time):
-        return None
-    
-    start_dt = pd.to_datetime(start_time)
-    
-    setup_time = 0
-    if row.get("Setup") == "Yes" and pd.notna(row.get("Setup Time (h)")):
-        setup_time = row.get("Setup Time (h)", 0) or 0
-    
-    # 获取单件时间（秒）
-    # 优先使用Machine，如果Machine为0或空，则使用Labor
-    machine_time_s = row.get("EH_machine(s)", None)
-    labor_time_s = row.get("EH_labor(s)", None)
-    
-    # 确定使用哪个时间
-    if pd.notna(machine_time_s) and machine_time_s > 0:
-        unit_time_s = machine_time_s
-    elif pd.notna(labor_time_s) and labor_time_s > 0:
-        unit_time_s = labor_time_s
-    else:
-        return None
-    
-    qty = row.get("StepInQuantity", 0) or 0
-    oee = row.get("OEE", 0.77) or 0.77
-    
-    # 计算总时间（秒）= 数量 × 单件时间（秒）/ OEE
-    total_time_s = qty * unit_time_s / oee
-    
-    # 转换为小时
-    total_time_h = total_time_s / 3600
-    
-    # 总工时 = 调试时间 + 加工时间 + 0.5小时换批时间
-    total_hours = setup_time + total_time_h + 0.5
-    
-    # 使用新算法：按工作日逐天累加工作时间
-    due_final = calculate_due_time_by_workdays(start_dt, total_hours, calendar_df, daily_working_hours)
-    
-    return due_final
-
-
-def calculate_due_time_by_workdays(start: datetime, required_hours: float, calendar_df: pd.DataFrame, daily_working_hours: float = 8.0) -> datetime:
-    """
-    更直观的算法：按工作日逐天累加工作时间，跳过非工作日
-    直到累加的工作时间达到理论工时，那一天就是完成时间
-    
-    Args:
-        start: 开始时间
-        required_hours: 需要的理论工时（小时）
-        calendar_df: 日历表
-        daily_working_hours: 每日工作时间（小时），默认8小时
-    
-    Returns:
-        理论完成时间（工作日的8:00）
-    """
-    if required_hours <= 0:
-        return start
-    
-    # 从开始时间开始
-    current_time = start
-    remaining_hours = required_hours
-    
-    # 如果开始时间在当天8:00之后，先计算当天剩余的工作时间
-    start_date_8am = current_time.replace(hour=8, minute=0, second=0, microsecond=0)
-    
-    if current_time >= start_date_8am:
-        # 检查当天是否为工作日
-        if is_workday(start_date_8am, calendar_df):
-            # 当天是工作日，计算当天剩余时间（工作日按24小时连续生产）
-            # 计算到第二天8:00的剩余小时数
-            next_day_8am = start_date_8am + timedelta(days=1)
-            hours_until_next_day = (next_day_8am - current_time).total_seconds() / 3600
-            
-            if hours_until_next_day > 0:
-                if remaining_hours <= hours_until_next_day:
-                    # 当天就能完成
-                    return current_time + timedelta(hours=remaining_hours)
-                else:
-                    # 当天完成不了，减去当天剩余时间
-                    remaining_hours -= hours_until_next_day
-                    # 移动到下一天的8:00
-                    current_time = next_day_8am
-            else:
-                # 移动到下一天的8:00
-                current_time = next_day_8am
-        else:
-            # 当天不是工作日，移动到下一天
-            current_time = start_date_8am + timedelta(days=1)
-    else:
-        # 开始时间在当天8:00之前，从当天8:00开始
-        current_time = start_date_8am
-    
-    # 按天遍历，累加工作日的工作时间
-    max_days = 365  # 防止无限循环
-    days_checked = 0
-    
-    while remaining_hours > 0 and days_checked < max_days:
-        current_date_8am = current_time.replace(hour=8, minute=0, second=0, microsecond=0)
-        
-        if is_workday(current_date_8am, calendar_df):
-            # 工作日，累加工作时间（24小时连续生产）
-            if remaining_hours <= daily_working_hours:
-                # 今天就能完成（从当天8:00开始计算）
-                return current_date_8am + timedelta(hours=remaining_hours)
-            else:
-                # 今天完成不了，减去今天的工作时间，继续下一天
-                remaining_hours -= daily_working_hours
-        
-        # 移动到下一天的8:00
-        current_time = current_date_8am + timedelta(days=1)
-        days_checked += 1
-    
-    # 如果超过最大天数，返回最后计算的时间
-    if days_checked >= max_days:
-        logging.warning(f"计算完成时间超过{max_days}天，返回估算值")
-    
-    return current_time
-
-
-def calculate_nonworkday_hours(start: datetime, end: datetime, calendar_df: pd.DataFrame) -> float:
-    """
-    计算从start到end之间的非工作日小时数（基于日历表）
-    用于NonWorkday(d)字段的计算
-    """
-    if end <= start:
-        return 0.0
-    
-    total_hours = 0.0
-    
-    # 按天遍历时间区间，统计非工作日小时数
-    current_date = start.date()
-    end_date = end.date()
-    current_time = start
-    
-    while current_date <= end_date:
-        # 获取当天的开始时间（8:00）和结束时间（次日8:00）
-        day_start_8am = datetime.combine(current_date, datetime.min.time()).replace(hour=8)
-        day_end_8am = day_start_8am + timedelta(days=1)
-        
-        # 判断当天是否为工作日
-        if not is_workday(day_start_8am, calendar_df):
-            # 非工作日，计算与[current_time, end]重叠的部分
-            overlap_start = max(current_time, day_start_8am)
-            overlap_end = min(end, day_end_8am)
-            
-            if overlap_start < overlap_end:
-                hours = (overlap_end - overlap_start).total_seconds() / 3600
-                total_hours += hours
-        
-        # 移动到下一天
-        current_date = current_date + timedelta(days=1)
-        # 更新current_time为下一天的开始时间（8:00），但不要超过end
-        if current_date <= end_date:
-            current_time = max(current_time, day_end_8am)
-        else:
-            break
-    
-    return round(total_hours, 2)
-
-
-def adjust_weekend(start: datetime, due: datetime, calendar_df: pd.DataFrame) -> datetime:
-    """
-    调整非工作日，顺延到工作日（基于日历表）
-    如果截止时间落在非工作日，顺延到下一个工作日的8:00
-    （保留此函数用于兼容，但推荐使用calculate_due_time_by_workdays）
-    """
-    if due <= start:
-        return due
-    
-    # 检查due是否落在非工作日
-    due_date_8am = due.replace(hour=8, minute=0, second=0, microsecond=0)
-    
-    # 如果due在当天8:00之后，检查当天是否为工作日
-    if due.hour >= 8:
-        if not is_workday(due_date_8am, calendar_df):
-            # 当天是非工作日，顺延到下一个工作日8:00
-            return get_next_workday_8am(due, calendar_df)
-    else:
-        # due在当天8:00之前，检查前一天是否为工作日
-        prev_day = due_date_8am - timedelta(days=1)
-        if not is_workday(prev_day, calendar_df):
-            # 前一天是非工作日，顺延到下一个工作日8:00
-            return get_next_workday_8am(due, calendar_df)
-    
-    # 如果due落在工作日，计算从start到due之间的非工作日小时数并加上
-    non_workday_hours = calculate_nonworkday_hours(start, due, calendar_df)
-    return due + timedelta(hours=non_workday_hours)
-
-
-def calculate_nonworkday_days(row: pd.Series, calendar_df: pd.DataFrame) -> Optional[float]:
-    """
-    计算NonWorkday(d) - 非工作日天数（单位：天）
-    
-    逻辑：计算LT的周期范围内的非工作日天数
-    - 开始时间：和LT计算一致（0010工序用Checkin_SFC，其他工序用EnterStepTime）
-    - 结束时间：TrackOutTime
-    - 统计非工作日小时数后转换为天数
-    """
-    # 获取开始时间：和LT计算逻辑一致
-    operation = row.get("Operation", "")
-    trackout = row.get("TrackOutTime", None)
-    checkin_sfc = row.get("Checkin_SFC", None)
-    enter_step = row.get("EnterStepTime", None)
-    trackin = row.get("TrackInTime", None)
-    
-    if pd.isna(trackout):
-        return None
-    
-    # 确定开始时间（和calculate_lt逻辑一致）
-    start_time = None
-    if operation == "0010":
-        # 0010工序：优先使用Checkin_SFC，如果为空则使用EnterStepTime，再为空则使用TrackInTime
-        if pd.notna(checkin_sfc):
-            start_time = checkin_sfc
-        elif pd.notna(enter_step):
-            start_time = enter_step
-        elif pd.notna(trackin):
-            start_time = trackin
-    else:
-        # 非0010工序：使用EnterStepTime
-        if pd.notna(enter_step):
-            start_time = enter_step
-    
-    if pd.isna(start_time):
-        return None
-    
-    start_dt = pd.to_datetime(start_time)
-    end_dt = pd.to_datetime(trackout)
-    
-    if end_dt <= start_dt:
-        return None
-    
-    # 计算从开始时间到结束时间之间的非工作日小时数（基于日历表）
-    non_workday_hours = calculate_nonworkday_hours(start_dt, end_dt, calendar_df)
-    
-    # 转换为天数（保留2位小数）
-    return round(non_workday_hours / 24, 2)
-
-
-def calculate_completion_status(row: pd.Series, calendar_df: pd.DataFrame) -> Optional[str]:
-    """
-    计算CompletionStatus - 完成状态
-    
-    逻辑：直接比较已计算的PT（实际加工时间）和ST（理论加工时间）
-    - PT是已经计算好的实际加工时间（已排除停产期）
-    - ST是已经计算好的理论加工时间
-    - PT > ST + 8小时容差 + 换批/换型时间 + 非工作日时间 → Overdue
-    - PT <= ST + 8小时容差 + 换批/换型时间 + 非工作日时间 → OnTime
-    
-    换批/换型时间规则：
-    - 正常换批：固定0.5小时
-    - 换型情况：Setup="Yes"时，使用标准换型时间（Setup Time字段）
-    """
-    # 获取已计算的PT和ST
-    pt = row.get("PT(d)", None)
-    st = row.get("ST(d)", None)
-    tolerance_h = row.get("Tolerance(h)", 8.0)  # 默认8小时容差
-    nonworkday_d = row.get("NonWorkday(d)", 0.0)  # 非工作日天数
-    
-    if pd.isna(pt) or pd.isna(st):
-        return None
-    
-    # PT转换为小时
-    pt_hours = pt * 24
-    # ST转换为小时
-    st_hours = st * 24
-    # 非工作日转换为小时
-    nonworkday_hours = nonworkday_d * 24
-    
-    # 检查是否需要使用标准换型时间
-    changeover_time = 0.5  # 默认换批时间
-    if row.get("Setup") == "Yes" and pd.notna(row.get("Setup Time (h)")):
-        changeover_time = row.get("Setup Time (h)", 0.5) or 0.5  # 使用标准换型时间
-    
-    # 阈值 = ST + 容差 + 换批/换型时间 + 非工作日时间
-    threshold = st_hours + tolerance_h + changeover_time + nonworkday_hours
-    
-    # 比较：PT（小时） > 阈值 → Overdue
-    if pt_hours > threshold:
-        return "Overdue"
-    else:
-        return "OnTime"
-
-
-def calculate_tolerance_hours(row: pd.Series) -> Optional[float]:
-    """计算容差小时数（固定8小时，与SFC逻辑一致）"""
-    due = row.get("DueTime", None)
-    actual = row.get("TrackOutTime", None)
-    
-    if pd.isna(due) or pd.isna(actual):
-        return None
-    
-    # 固定容差为8小时
-    return 8.0
+    return WorkCalendar.load(calendar_file)
 
 
 def extract_machine_number(resource_code: Any) -> Optional[int]:
@@ -1516,37 +913,44 @@ def process_all_data(cfg: Dict[str, Any], force_full_refresh: bool = False) -> p
     
     # 处理通配符
     if "*" in mes_path or "?" in mes_path:
-        mes_files = glob.glob(mes_path)
+        # 按文件名排序，合并结果与读取完成顺序无关
+        mes_files = sorted(glob.glob(mes_path))
         if not mes_files:
             logging.error(f"未找到匹配的MES文件: {mes_path}")
             return pd.DataFrame()
         logging.info(f"找到 {len(mes_files)} 个MES文件")
-        # 读取所有文件并合并
+        # 多进程读取所有文件（子进程中完成字段映射和类型转换）并合并；同步未完成的文件推迟到最后重试
         mes_dfs = []
-        for file_path in mes_files:
-            try:
-                logging.info(f"读取MES文件: {file_path}")
-                df = read_sharepoint_excel(file_path, max_rows=max_rows)
-                mes_dfs.append(df)
-            except Exception as e:
-                logging.warning(f"读取文件失败 {file_path}: {e}")
+        workers = get_ingest_workers(cfg)
+        deferral = get_sync_deferral(cfg)
+        for file_path, df, error in parallel_ingest(ingest_mes_file, mes_files, (cfg, max_rows), workers, deferral):
+            if error is not None:
+                logging.warning(f"读取文件失败 {file_path}: {error}")
+                continue
+            logging.info(f"读取MES文件: {file_path}, {len(df)} 行")
+            mes_dfs.append(df)
         if not mes_dfs:
             logging.error("所有MES文件读取失败")
             return pd.DataFrame()
         mes_df = pd.concat(mes_dfs, ignore_index=True)
         logging.info(f"合并后MES数据行数: {len(mes_df)}")
         
-        # 在合并后立即去重（基于原始数据）
+        # 在合并后立即去重（字段映射后的标准字段名）
         mes_df = remove_duplicates(mes_df, cfg)
+        
+        # 按machine分组，计算TrackInTime和Setup（需要合并后的全部数据）
+        mes_df = calculate_trackin_time_and_setup(mes_df) if not mes_df.empty else mes_df
     else:
         if not os.path.exists(mes_path):
             logging.error(f"MES数据路径不存在: {mes_path}")
             return pd.DataFrame()
         logging.info(f"读取MES数据: {mes_path}")
-        mes_df = read_sharepoint_excel(mes_path, max_rows=max_rows)
-    
-    # 先做基础处理（字段映射和类型转换），以便增量过滤能识别标准字段名
-    mes_df = process_mes_data(mes_df, cfg)
+        read = lambda: read_mes_excel(mes_path, cfg, max_rows=max_rows, full_parse=force_full_refresh)
+        deferral = get_sync_deferral(cfg)
+        mes_df = deferral.call(mes_path, read) if deferral is not None else read()
+        
+        # 先做基础处理（字段映射和类型转换），以便增量过滤能识别标准字段名
+        mes_df = process_mes_data(mes_df, cfg)
     
     # 增量处理：在字段映射之后进行增量过滤
     incr_cfg = cfg.get("incremental", {})
@@ -1556,9 +960,7 @@ def process_all_data(cfg: Dict[str, Any], force_full_refresh: bool = False) -> p
     # 如果强制全量刷新，删除状态文件和历史文件
     if force_full_refresh:
         logging.info("执行全量刷新：清除状态文件和历史数据文件")
-        if os.path.exists(state_file):
-            os.remove(state_file)
-            logging.info(f"已删除状态文件: {state_file}")
+        remove_etl_state(state_file)
         
         history_file = incr_cfg.get("history_file", "publish/MES_batch_report_latest.parquet")
         history_file = os.path.join(BASE_DIR, history_file) if not os.path.isabs(history_file) else history_file
@@ -1567,12 +969,20 @@ def process_all_data(cfg: Dict[str, Any], force_full_refresh: bool = False) -> p
             logging.info(f"已删除历史数据文件: {history_file}")
     
     if incr_cfg.get("enabled", False) and not force_full_refresh:
+        # 旧版状态文件（逐行MD5）按历史数据重新计算记录指纹
+        history_file = incr_cfg.get("history_file", "publish/MES_batch_report_latest.parquet")
+        history_file = os.path.join(BASE_DIR, history_file) if not os.path.isabs(history_file) else history_file
+        key_fields = incr_cfg.get("unique_key_fields", ["BatchNumber", "Operation", "machine", "TrackOutTime"])
+        migrate_state_file(state_file, history_file, key_fields)
         if should_do_full_refresh(cfg, state_file):
             logging.info("执行全量刷新：清除状态文件")
-            if os.path.exists(state_file):
-                os.remove(state_file)
+            remove_etl_state(state_file)
         else:
             logging.info("执行增量处理：过滤新数据")
+            # 高水位增量：窗口尚未建立时按历史数据初始化
+            window = get_watermark_window(cfg, state_file)
+            if window is not None:
+                window.bootstrap(history_file, key_fields, load_fingerprint_store(state_file))
             mes_df = filter_incremental_data(mes_df, cfg, state_file)
             if mes_df.empty:
                 logging.info("MES数据没有新数据，跳过后续处理")
@@ -1591,57 +1001,41 @@ def process_all_data(cfg: Dict[str, Any], force_full_refresh: bool = False) -> p
     result = calculate_metrics(result, cfg)
     
     # 4. 增量处理：合并历史数据（如果启用）
+    new_rows = result
+    has_history = False
     if incr_cfg.get("enabled", False):
         history_file = incr_cfg.get("history_file", "publish/MES_batch_report_latest.parquet")
         history_file = os.path.join(BASE_DIR, history_file) if not os.path.isabs(history_file) else history_file
+        has_history = os.path.exists(history_file)
         result = merge_with_history(result, history_file, cfg)
     
-    # 5. 在最终保存前，对所有合并后的数据统一重新计算 PreviousBatchEndTime
-    # 确保基于完整、排序后的数据集进行准确计算
+    # 5. 在最终保存前重新计算 PreviousBatchEndTime
+    # 合并了历史数据时只重算新数据涉及machine的尾部，并只对输入变化的记录重算指标；否则对全部数据统一计算
     if not result.empty:
-        logging.info("对所有合并后的数据统一计算 PreviousBatchEndTime")
-        result = calculate_previous_batch_end_time(result)
+        if has_history and incr_cfg.get("incremental_previous_batch_end_time", True):
+            history_inputs = read_metric_inputs(history_file)
+            previous_end_before = result["PreviousBatchEndTime"].copy()
+            result = update_previous_batch_end_time(result, new_rows)
+            result = refresh_dependent_metrics(result, previous_end_before, history_inputs, cfg)
+        else:
+            logging.info("对所有合并后的数据统一计算 PreviousBatchEndTime")
+            result = calculate_previous_batch_end_time(result)
+            result.attrs[METRIC_INPUTS_ATTR] = get_metric_inputs(cfg, get_calendar_policy(cfg).calendar)
     
     # 返回MES结果
     return result
 
 
-def generate_record_hash(row: pd.Series, key_fields: List[str]) -> str:
-    """生成记录的唯一hash值"""
-    # 提取关键字段的值
-    values = []
-    for field in key_fields:
-        val = row.get(field)
-        if pd.isna(val):
-            val = None
-        else:
-            # 如果是datetime类型，转换为字符串
-            if isinstance(val, (pd.Timestamp, datetime)):
-                val = val.strftime('%Y-%m-%d %H:%M:%S')
-            else:
-                val = str(val)
-        values.append(val if val is not None else '')
-    
-    # 生成hash
-    key_str = '|'.join(values)
-    return hashlib.md5(key_str.encode('utf-8')).hexdigest()
-
-
 def load_etl_state(state_file: str) -> Dict[str, Any]:
     """加载ETL状态文件"""
     if os.path.exists(state_file):
         try:
             with open(state_file, 'r', encoding='utf-8') as f:
-                state = json.load(f)
-                # 确保processed_hashes是set类型
-                if "processed_hashes" in state and isinstance(state["processed_hashes"], list):
-                    state["processed_hashes"] = set(state["processed_hashes"])
-                return state
+                return json.load(f)
         except Exception as e:
             logging.warning(f"加载状态文件失败: {e}，将使用默认状态")
     return {
         "last_processed_time": None,
-        "processed_hashes": set(),
         "last_full_refresh_time": None
     }
 
@@ -1650,14 +1044,9 @@ def save_etl_state(state_file: str, state: Dict[str, Any]) -> None:
     """保存ETL状态文件"""
     os.makedirs(os.path.dirname(state_file), exist_ok=True)
     
-    # 转换set为list以便JSON序列化
-    state_copy = state.copy()
-    if "processed_hashes" in state_copy and isinstance(state_copy["processed_hashes"], set):
-        state_copy["processed_hashes"] = list(state_copy["processed_hashes"])
-    
     try:
         with open(state_file, 'w', encoding='utf-8') as f:
-            json.dump(state_copy, f, indent=2, ensure_ascii=False, default=str)
+            json.dump(state, f, indent=2, ensure_ascii=False, default=str)
     except Exception as e:
         logging.error(f"保存状态文件失败: {e}")
 
@@ -1667,8 +1056,9 @@ def filter_incremental_data(df: pd.DataFrame, cfg: Dict[str, Any], state_file: s
     增量过滤：只返回新数据（未处理过的记录）
     
     策略：
-    1. 使用复合唯一键（BatchNumber + Operation + machine + TrackOutTime）生成hash
-    2. 检查hash是否已处理过
+    1. 使用复合唯一键（BatchNumber + Operation + machine + TrackOutTime）生成记录指纹（见 record_fingerprints）
+    2. 检查指纹是否已处理过（incremental.strategy 为watermark时，早于 高水位-迟到窗口 的记录直接视为已处理，
+       只在窗口内比较指纹，见 WatermarkWindow）
     3. 可选：使用时间窗口筛选
     """
     if df.empty:
@@ -1681,7 +1071,7 @@ def filter_incremental_data(df: pd.DataFrame, cfg: Dict[str, Any], state_file: s
     
     # 加载状态
     state = load_etl_state(state_file)
-    processed_hashes = set(state.get("processed_hashes", []))
+    store = load_fingerprint_store(state_file)
     last_processed_time = state.get("last_processed_time")
     
     # 获取唯一键字段
@@ -1702,12 +1092,14 @@ def filter_incremental_data(df: pd.DataFrame, cfg: Dict[str, Any], state_file: s
             logging.info(f"时间窗口筛选：保留最近{time_window_days}天的数据，从{len(df)}行筛选到{len(df_time_filtered)}行")
             df = df_time_filtered
     
-    # 生成每条记录的hash并筛选新数据
-    df['_record_hash'] = df.apply(lambda row: generate_record_hash(row, key_fields), axis=1)
-    
-    # 筛选新数据（hash不在已处理集合中）
-    new_data = df[~df['_record_hash'].isin(processed_hashes)].copy()
-    new_data = new_data.drop(columns=['_record_hash'])
+    # 筛选新数据（指纹不在已处理集合中）
+    fingerprints = record_fingerprints(df, key_fields)
+    window = get_watermark_window(cfg, state_file)
+    if window is not None:
+        logging.info(f"高水位增量：高水位 {window.watermark}，窗口起点 {window.cutoff}")
+        new_data = df[window.new_mask(df, fingerprints, store)].copy()
+    else:
+        new_data = df[~store.contains(fingerprints)].copy()
     
     new_count = len(new_data)
     total_count = len(df)
@@ -1793,8 +1185,6 @@ def should_do_full_refresh(cfg: Dict[str, Any], state_file: str) -> bool:
     return False
 
 
-
-
 if __name__ == "__main__":
     cfg = load_config(CONFIG_PATH)
     setup_logging(cfg)
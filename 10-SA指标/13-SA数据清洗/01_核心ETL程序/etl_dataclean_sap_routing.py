@@ -18,6 +18,7 @@ from etl_utils import (
     get_base_dir,
     ensure_directory_exists
 )
+from etl_standard_time import StandardTimeLookup, lookup_artifact_path
 
 # 配置基础路径
 BASE_DIR = get_base_dir()
@@ -182,6 +183,11 @@ def convert_and_merge_standard_time(routing_csv: str, machining_csv: str, output
         save_to_parquet(merged_df, output_path, cfg)
         logging.info(f"已保存合并后的标准时间表Parquet文件: {output_path}, 行数: {len(merged_df)}")
         
+        # 9. 生成标准时间查找表（MES/SFC合并标准时间时内存映射加载，按整数键查找）
+        lookup_path = lookup_artifact_path(output_path)
+        StandardTimeLookup.from_dataframe(pd.read_parquet(output_path)).save(lookup_path)
+        logging.info(f"已保存标准时间查找表: {lookup_path}")
+        
     except Exception as e:
         logging.error(f"转换和合并标准时间表失败: {e}")
         raise
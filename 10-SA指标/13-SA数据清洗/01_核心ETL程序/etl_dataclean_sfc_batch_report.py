@@ -9,10 +9,10 @@ import time
 import logging
 import glob
 import json
-import hashlib
 import threading
-from datetime import datetime, timedelta
-from typing import Dict, Any, Optional, List, Set
+from datetime import datetime
+from typing import Dict, Any, Optional, List, Set, Tuple, Callable
+from zipfile import BadZipFile
 import re
 import warnings
 warnings.filterwarnings('ignore')
@@ -25,8 +25,18 @@ except ImportError:
     HAS_MSVCRT = False
 
 import pandas as pd
+import numpy as np
 import yaml
 
+from etl_utils import (ParseCache, get_parse_cache, get_ingest_workers, parallel_ingest, get_excel_engine,
+                       read_excel_sheet, required_source_columns, SyncNotReadyError, ensure_sync_ready,
+                       get_sync_deferral, record_fingerprints, migrate_state_file, FINGERPRINT_VERSION,
+                       FingerprintStore, load_fingerprint_store, remove_etl_state,
+                       WatermarkWindow, get_watermark_window, get_incremental_strategy, zip_content_fingerprint)
+from etl_metrics import FixedWeekendPolicy, compute_metrics
+from etl_sequencing import sort_by_machine, calculate_previous_end, parquet_sorting_kwargs
+from etl_standard_time import StandardTimeLookup, apply_standard_time
+
 try:
     import pyarrow as pa
     import pyarrow.parquet as pq
@@ -62,18 +72,60 @@ def load_config(config_path: str) -> Dict[str, Any]:
         return yaml.safe_load(f)
 
 
-def read_sharepoint_excel(file_path: str, max_rows: Optional[int] = None) -> pd.DataFrame:
-    """读取SharePoint同步的Excel文件（SFC处理不限制行数）"""
+def read_sharepoint_excel(file_path: str, max_rows: Optional[int] = None,
+                          cache: Optional[ParseCache] = None, engine: Optional[str] = "openpyxl",
+                          columns: Optional[List[str]] = None, required: Optional[List[str]] = None) -> pd.DataFrame:
+    """
+    读取SharePoint同步的Excel文件（SFC处理不限制行数；内容未变化的文件读取解析缓存；
+    engine为auto/calamine时使用calamine引擎，未安装时回退到openpyxl；
+    columns指定时只读取这些列，表头缺少required中的列时抛出 MissingColumnsError；
+    同步未完成或文件被占用时抛出 SyncNotReadyError，不等待）
+    """
+    ensure_sync_ready(file_path)
     try:
         # SFC处理不限制行数，读取所有数据
-        df = pd.read_excel(file_path, engine='openpyxl', sheet_name=0)
+        parse = lambda: read_excel_sheet(file_path, engine, columns, required=required)
+        if cache is not None:
+            df = cache.read(file_path, parse, variant=f"columns={columns}" if columns else "")
+        else:
+            df = parse()
         logging.info(f"读取SFC文件成功: {file_path}, 共 {len(df)} 行数据")
         return df
+    except (BadZipFile, PermissionError) as e:
+        logging.warning(f"Excel文件同步未完成或被占用，推迟读取: {file_path}")
+        raise SyncNotReadyError("同步未完成或文件被占用") from e
     except Exception as e:
         logging.error(f"读取Excel文件失败: {file_path}, 错误: {e}")
         raise
 
 
+# 清洗必需的标准字段（另加增量唯一键字段）
+SFC_REQUIRED_FIELDS = ["CFN", "BatchNumber", "Operation", "TrackOutTime", "machine"]
+
+
+def get_sfc_source_columns(cfg: Dict[str, Any]) -> Optional[List[str]]:
+    """
+    需要从SFC Excel读取的原始列：sfc_mapping中的源列
+    未启用按列读取或未配置字段映射时返回None（读取全部列）
+    """
+    if not cfg.get("source", {}).get("excel_streaming", True):
+        return None
+    columns = [k for k, v in cfg.get("sfc_mapping", {}).items() if v and not str(v).startswith('#')]
+    return columns or None
+
+
+def get_sfc_required_columns(cfg: Dict[str, Any]) -> List[str]:
+    """SFC Excel必需的原始列：SFC_REQUIRED_FIELDS和增量唯一键字段按sfc_mapping反查的源列"""
+    key_fields = cfg.get("incremental", {}).get("unique_key_fields", ["BatchNumber", "Operation", "TrackOutTime"])
+    return required_source_columns(cfg.get("sfc_mapping", {}), SFC_REQUIRED_FIELDS + list(key_fields))
+
+
+def read_sfc_excel(file_path: str, cfg: Dict[str, Any], cache: Optional[ParseCache] = None) -> pd.DataFrame:
+    """按配置读取SFC Excel（只读取映射的源列，先检查必需列）"""
+    return read_sharepoint_excel(file_path, cache=cache, engine=get_excel_engine(cfg),
+                                 columns=get_sfc_source_columns(cfg), required=get_sfc_required_columns(cfg))
+
+
 def extract_resource_code(resource_str: Any) -> Optional[str]:
     """
     从Resource字段提取资源代码
@@ -320,6 +372,76 @@ def process_sfc_data(df: pd.DataFrame, cfg: Dict[str, Any]) -> pd.DataFrame:
     return result
 
 
+def ingest_sfc_file(file_path: str, cfg: Dict[str, Any]) -> pd.DataFrame:
+    """读取单个SFC文件并处理SFC数据（parallel_ingest 子进程中执行）"""
+    df = read_sfc_excel(file_path, cfg, get_parse_cache(cfg))  # 不限制行数
+    return process_sfc_data(df, cfg) if not df.empty else df
+
+
+# 原始唯一键hash列（read_sfc_raw 添加，process_sfc_data 之前删除）
+RAW_KEY_HASH_COLUMN = "_raw_key_hash"
+
+
+def get_raw_key_columns(cfg: Dict[str, Any]) -> Optional[List[str]]:
+    """
+    增量唯一键字段对应的Excel原始列（按sfc_mapping反查），有字段无法对应时返回None
+    高水位增量时原始键指纹按原始时间列保留在窗口内，时间列无法对应时也返回None（不做清洗前去重叠）
+    """
+    key_fields = cfg.get("incremental", {}).get("unique_key_fields", ["BatchNumber", "Operation", "TrackOutTime"])
+    reverse_mapping = {v: k for k, v in cfg.get("sfc_mapping", {}).items() if v and not str(v).startswith('#')}
+    columns = [reverse_mapping.get(field) for field in key_fields]
+    if None in columns:
+        return None
+    if get_incremental_strategy(cfg) == "watermark" and get_raw_time_column(cfg) is None:
+        return None
+    return columns
+
+
+def get_raw_time_column(cfg: Dict[str, Any]) -> Optional[str]:
+    """高水位时间字段（incremental.watermark_field，默认TrackOutTime）对应的Excel原始列"""
+    field = cfg.get("incremental", {}).get("watermark_field", "TrackOutTime")
+    reverse_mapping = {v: k for k, v in cfg.get("sfc_mapping", {}).items() if v and not str(v).startswith('#')}
+    return reverse_mapping.get(field)
+
+
+def raw_key_hashes(df: pd.DataFrame, columns: List[str]) -> np.ndarray:
+    """原始唯一键列的行指纹（uint64；各列按字符串比较，见 record_fingerprints）"""
+    return record_fingerprints(df, columns)
+
+
+def read_sfc_raw(file_path: str, cfg: Dict[str, Any]) -> pd.DataFrame:
+    """
+    读取单个SFC文件（不做清洗），附带原始唯一键hash列，用于在清洗前去除与已处理文件重叠的行
+    （parallel_ingest 子进程中执行）；原始键列缺失时不附带hash列
+    """
+    df = read_sfc_excel(file_path, cfg, get_parse_cache(cfg))
+    columns = get_raw_key_columns(cfg)
+    if df.empty or columns is None or any(col not in df.columns for col in columns):
+        return df
+    df[RAW_KEY_HASH_COLUMN] = raw_key_hashes(df, columns)
+    return df
+
+
+def drop_seen_raw_rows(df: pd.DataFrame, seen: FingerprintStore,
+                       window: Optional[WatermarkWindow] = None) -> Tuple[pd.DataFrame, np.ndarray, Optional[pd.Series]]:
+    """
+    去除原始唯一键已在之前文件中出现过的行（清洗前去重叠），返回 (新行, 本文件全部原始键hash, 本文件全部原始时间)
+    window为原始键的增量窗口（高水位增量，见 get_raw_watermark_window）时按窗口判断，原始时间为空的行按seen判断；
+    否则按seen判断，原始时间为None。未附带hash列时返回原数据和空数组
+    """
+    if RAW_KEY_HASH_COLUMN not in df.columns:
+        return df, np.empty(0, dtype=np.uint64), None
+    hashes = df[RAW_KEY_HASH_COLUMN].to_numpy(dtype=np.uint64)
+    if window is not None and window.time_field in df.columns:
+        times = df[window.time_field]
+        new_mask = window.new_mask(df, hashes, seen)
+    else:
+        times = None
+        new_mask = ~seen.contains(hashes)
+    new_rows = df.loc[new_mask].drop(columns=[RAW_KEY_HASH_COLUMN])
+    return new_rows, hashes, times
+
+
 def merge_standard_time_sfc(sfc_df: pd.DataFrame, cfg: Dict[str, Any]) -> pd.DataFrame:
     """
     合并标准时间表到SFC数据（从合并后的parquet文件读取）
@@ -362,28 +484,21 @@ def merge_standard_time_sfc(sfc_df: pd.DataFrame, cfg: Dict[str, Any]) -> pd.Dat
                 sfc_df[col] = None
             return sfc_df
     
-    try:
-        std_time_df = pd.read_parquet(std_time_path)
-        logging.info(f"读取合并后的标准时间表: {len(std_time_df)} 行")
-    except Exception as e:
-        logging.warning(f"读取标准时间表失败: {e}，跳过合并")
+    # 读取标准时间查找表（优先使用SAP Routing ETL生成的 .lookup.arrow）
+    lookup = StandardTimeLookup.load(std_time_path)
+    if lookup is None:
+        logging.warning("读取标准时间表失败，跳过合并")
         for col in ["OEE", "Setup Time (h)", "Effective Time (h)"]:
             sfc_df[col] = None
         return sfc_df
     
     # 检查必要字段（至少需要CFN或Material Number之一）
-    required_cols = ["Operation"]
-    missing_cols = [col for col in required_cols if col not in std_time_df.columns]
-    if missing_cols:
-        logging.warning(f"标准时间表缺少必要字段: {missing_cols}，跳过合并")
+    if not lookup.has_keys(["Operation"]):
+        logging.warning("标准时间表缺少必要字段: Operation，跳过合并")
         for col in ["EH_machine(s)", "EH_labor(s)", "OEE", "Setup Time (h)"]:
             sfc_df[col] = None
         return sfc_df
-    
-    # 检查是否有CFN或Material Number字段
-    has_cfn = "CFN" in std_time_df.columns
-    has_material_number = "Material Number" in std_time_df.columns
-    if not has_cfn and not has_material_number:
+    if not lookup.has_keys(["CFN"]) and not lookup.has_keys(["Material Number"]):
         logging.warning("标准时间表缺少CFN和Material Number字段，无法进行匹配")
         for col in ["EH_machine(s)", "EH_labor(s)", "OEE", "Setup Time (h)"]:
             sfc_df[col] = None
@@ -396,171 +511,15 @@ def merge_standard_time_sfc(sfc_df: pd.DataFrame, cfg: Dict[str, Any]) -> pd.Dat
             sfc_df[col] = None
         return sfc_df
     
-    # 准备需要获取的字段：Machine、Labor、Quantity、OEE、Setup Time (h)
-    value_cols = []
-    if "Machine" in std_time_df.columns:
-        value_cols.append("Machine")
-    if "Labor" in std_time_df.columns:
-        value_cols.append("Labor")
-    if "Quantity" in std_time_df.columns:
-        value_cols.append("Quantity")
-    if "OEE" in std_time_df.columns:
-        value_cols.append("OEE")
-    if "Setup Time (h)" in std_time_df.columns:
-        value_cols.append("Setup Time (h)")
-    
-    if not value_cols:
-        logging.warning("标准时间表缺少有效字段，跳过合并")
-        for col in ["EH_machine(s)", "EH_labor(s)", "OEE", "Setup Time (h)"]:
-            sfc_df[col] = None
-        return sfc_df
-    
     # 确定是否使用Group字段（SFC可能没有Group字段）
-    use_group = "Group" in std_time_df.columns and "Group" in sfc_df.columns
-    
-    # 第一步：使用SFC的CFN匹配标准表的CFN
-    if "CFN" in sfc_df.columns and "CFN" in std_time_df.columns:
-        # 准备合并键：SFC的CFN对应标准表的CFN
-        if use_group:
-            merge_cols = ["CFN", "Operation", "Group"]
-        else:
-            merge_cols = ["CFN", "Operation"]
-        
-        # 合并前统一数据类型
-        for col in merge_cols:
-            if col in sfc_df.columns and col in std_time_df.columns:
-                # 统一转换为字符串类型
-                sfc_df[col] = sfc_df[col].astype(str)
-                std_time_df[col] = std_time_df[col].astype(str)
-                # 处理NaN值（转换为空字符串）
-                sfc_df[col] = sfc_df[col].replace('nan', '').replace('None', '')
-                std_time_df[col] = std_time_df[col].replace('nan', '').replace('None', '')
-        
-        # 第一步：使用SFC的CFN匹配标准表的CFN
-        result = sfc_df.merge(
-            std_time_df[merge_cols + value_cols],
-            on=merge_cols,
-            how="left"
-        )
-    else:
-        # 如果标准时间表没有CFN字段，直接使用SFC数据，后续用Material Number匹配
-        result = sfc_df.copy()
-        # 初始化标准时间字段为空
-        for col in value_cols:
-            result[col] = None
-    
-    # 计算单件时间（Machine和Labor除以Quantity，单位：秒）
-    # 重命名为EH_machine(s)和EH_labor(s)
-    if "Machine" in result.columns and "Quantity" in result.columns:
-        # 确保Quantity不为0或空
-        quantity = result["Quantity"].fillna(1).replace(0, 1)
-        # 计算单件Machine时间（秒）
-        result["EH_machine(s)"] = result["Machine"] / quantity
-        # 删除原始Machine字段
-        result = result.drop(columns=["Machine"])
-    else:
-        result["EH_machine(s)"] = None
-    
-    if "Labor" in result.columns and "Quantity" in result.columns:
-        # 确保Quantity不为0或空
-        quantity = result["Quantity"].fillna(1).replace(0, 1)
-        # 计算单件Labor时间（秒）
-        result["EH_labor(s)"] = result["Labor"] / quantity
-        # 删除原始Labor字段
-        result = result.drop(columns=["Labor"])
-    else:
-        result["EH_labor(s)"] = None
-    
-    # 删除Quantity字段（不再需要）
-    if "Quantity" in result.columns:
-        result = result.drop(columns=["Quantity"])
-    
-    # 第二步：对未匹配的记录，使用SFC的CFN匹配标准表的Material Number
-    # 检查是否有未匹配的记录（EH_machine(s)和EH_labor(s)都为空）
-    unmatched_mask = result["EH_machine(s)"].isna() & result["EH_labor(s)"].isna()
-    unmatched_count = unmatched_mask.sum()
-    
-    if unmatched_count > 0 and "CFN" in sfc_df.columns and "Material Number" in std_time_df.columns:
-        logging.info(f"第一步CFN匹配后，还有 {unmatched_count} 条记录未匹配，尝试使用Material Number匹配")
-        
-        # 获取未匹配的记录
-        unmatched_df = result[unmatched_mask].copy()
-        
-        # 准备Material Number匹配的合并键：SFC的CFN对应标准表的Material Number
-        if use_group:
-            material_merge_cols_sfc = ["CFN", "Operation", "Group"]
-            material_merge_cols_std = ["Material Number", "Operation", "Group"]
-        else:
-            material_merge_cols_sfc = ["CFN", "Operation"]
-            material_merge_cols_std = ["Material Number", "Operation"]
-        
-        # 统一数据类型
-        for i, sfc_col in enumerate(material_merge_cols_sfc):
-            std_col = material_merge_cols_std[i]
-            if sfc_col in unmatched_df.columns and std_col in std_time_df.columns:
-                unmatched_df[sfc_col] = unmatched_df[sfc_col].astype(str)
-                std_time_df[std_col] = std_time_df[std_col].astype(str)
-                unmatched_df[sfc_col] = unmatched_df[sfc_col].replace('nan', '').replace('None', '')
-                std_time_df[std_col] = std_time_df[std_col].replace('nan', '').replace('None', '')
-        
-        # 使用Material Number匹配
-        material_value_cols = []
-        if "Machine" in std_time_df.columns:
-            material_value_cols.append("Machine")
-        if "Labor" in std_time_df.columns:
-            material_value_cols.append("Labor")
-        if "Quantity" in std_time_df.columns:
-            material_value_cols.append("Quantity")
-        if "OEE" in std_time_df.columns:
-            material_value_cols.append("OEE")
-        if "Setup Time (h)" in std_time_df.columns:
-            material_value_cols.append("Setup Time (h)")
-        
-        if material_value_cols:
-            # 使用left_on和right_on避免列名冲突
-            material_matched = unmatched_df.merge(
-                std_time_df[material_merge_cols_std + material_value_cols],
-                left_on=material_merge_cols_sfc,
-                right_on=material_merge_cols_std,
-                how="left"
-            )
-            
-            # 计算单件时间
-            if "Machine" in material_matched.columns and "Quantity" in material_matched.columns:
-                quantity = material_matched["Quantity"].fillna(1).replace(0, 1)
-                material_matched["EH_machine(s)"] = material_matched["Machine"] / quantity
-                material_matched = material_matched.drop(columns=["Machine"])
-            else:
-                material_matched["EH_machine(s)"] = None
-            
-            if "Labor" in material_matched.columns and "Quantity" in material_matched.columns:
-                quantity = material_matched["Quantity"].fillna(1).replace(0, 1)
-                material_matched["EH_labor(s)"] = material_matched["Labor"] / quantity
-                material_matched = material_matched.drop(columns=["Labor"])
-            else:
-                material_matched["EH_labor(s)"] = None
-            
-            if "Quantity" in material_matched.columns:
-                material_matched = material_matched.drop(columns=["Quantity"])
-            
-            # 更新result中未匹配的记录
-            # 只更新那些在material_matched中匹配成功的记录
-            material_matched_mask = material_matched["EH_machine(s)"].notna() | material_matched["EH_labor(s)"].notna()
-            if material_matched_mask.any():
-                # 获取匹配成功的记录索引
-                matched_indices = material_matched[material_matched_mask].index
-                
-                # 更新result中对应索引的记录
-                for col in ["EH_machine(s)", "EH_labor(s)", "OEE", "Setup Time (h)"]:
-                    if col in material_matched.columns:
-                        result.loc[matched_indices, col] = material_matched.loc[matched_indices, col]
-                
-                material_matched_count = len(matched_indices)
-                logging.info(f"第二步Material Number匹配成功: {material_matched_count} 条记录")
+    key_cols = ["Operation", "Group"] if lookup.has_keys(["Group"]) and "Group" in sfc_df.columns else ["Operation"]
     
-    # 确保OEE有默认值
-    if "OEE" in result.columns:
-        result["OEE"] = result["OEE"].fillna(0.77).replace(0, 0.77)
+    # 第一步：SFC的CFN匹配标准表的CFN；
+    # 第二步：未匹配到单件时间的记录，SFC的CFN匹配标准表的Material Number
+    result = apply_standard_time(sfc_df, lookup, [
+        (["CFN"] + key_cols, ["CFN"] + key_cols),
+        (["CFN"] + key_cols, ["Material Number"] + key_cols),
+    ])
     
     # 统计匹配结果
     total_matched = (result["EH_machine(s)"].notna() | result["EH_labor(s)"].notna()).sum()
@@ -578,452 +537,6 @@ def merge_standard_time_sfc(sfc_df: pd.DataFrame, cfg: Dict[str, Any]) -> pd.Dat
     return result
 
 
-def calculate_sfc_lt(row: pd.Series) -> Optional[float]:
-    """
-    计算SFC的LT(d) - 实际加工时间，不扣除周末
-    
-    计算逻辑：
-    - 0010工序：优先使用Checkin_SFC，如果为空则使用EnterStepTime，再为空则使用TrackInTime
-    - 非0010工序：使用EnterStepTime
-    单位：天（不扣除周末）
-    """
-    operation = row.get("Operation", "")
-    trackout = row.get("TrackOutTime", None)
-    checkin_sfc = row.get("Checkin_SFC", None)
-    enter_step = row.get("EnterStepTime", None)
-    trackin = row.get("TrackInTime", None)
-    
-    if pd.isna(trackout):
-        return None
-    
-    # 确定开始时间
-    start_time = None
-    if operation == "0010":
-        # 0010工序：优先使用Checkin_SFC，如果为空则使用EnterStepTime，再为空则使用TrackInTime
-        if pd.notna(checkin_sfc):
-            start_time = checkin_sfc
-        elif pd.notna(enter_step):
-            start_time = enter_step
-        elif pd.notna(trackin):
-            start_time = trackin
-    else:
-        # 非0010工序：使用EnterStepTime
-        if pd.notna(enter_step):
-            start_time = enter_step
-    
-    if start_time is None:
-        # 如果开始时间为空，无法计算LT
-        return None
-    
-    trackout_dt = pd.to_datetime(trackout)
-    start_dt = pd.to_datetime(start_time)
-    
-    # 计算实际时间差（天），不扣除周末
-    total_seconds = (trackout_dt - start_dt).total_seconds()
-    total_hours = total_seconds / 3600
-    
-    # 转换为天数（不扣除周末）
-    return round(total_hours / 24, 2)
-
-
-def calculate_sfc_pt(row: pd.Series) -> Optional[float]:
-    """
-    计算SFC的PT(d) - 实际加工时间，与MES保持一致
-    
-    升级逻辑：避免将设备停产时间计入PT
-    - 正常情况：PT = TrackOutTime - PreviousBatchEndTime
-    - 特殊情况：如果EnterStepTime > PreviousBatchEndTime，说明中间有停产期
-    - 升级后：PT = TrackOutTime - TrackInTime（不包括停产等待时间）
-    
-    根据业务逻辑：
-    1. 如果EnterStepTime <= PreviousBatchEndTime：正常连续生产
-       PT(d) = (TrackOutTime - PreviousBatchEndTime) / 24
-    2. 如果EnterStepTime > PreviousBatchEndTime：中间有停产期
-       PT(d) = (TrackOutTime - TrackInTime) / 24
-    3. 如果PreviousBatchEndTime为空，使用TrackInTime，回退逻辑：TrackInTime → Checkin_SFC
-    单位：天（不扣除周末）
-    """
-    trackout = row.get("TrackOutTime", None)
-    previous_batch_end = row.get("PreviousBatchEndTime", None)
-    trackin = row.get("TrackInTime", None)
-    checkin_sfc = row.get("Checkin_SFC", None)
-    enter_step = row.get("EnterStepTime", None)
-    
-    if pd.isna(trackout):
-        return None
-    
-    # 升级逻辑：检查是否有停产期
-    start_time = None
-    
-    # 检查是否存在停产期
-    has_production_gap = False
-    if pd.notna(enter_step) and pd.notna(previous_batch_end):
-        enter_step_dt = pd.to_datetime(enter_step)
-        previous_end_dt = pd.to_datetime(previous_batch_end)
-        if enter_step_dt > previous_end_dt:
-            has_production_gap = True
-            logging.debug(f"检测到停产期: EnterStepTime {enter_step} > PreviousBatchEndTime {previous_batch_end}")
-    
-    # 根据是否有停产期选择开始时间
-    if has_production_gap:
-        # 有停产期：使用TrackInTime作为实际加工开始时间，与MES保持一致
-        if pd.notna(trackin):
-            start_time = trackin
-            logging.debug(f"使用TrackInTime计算PT: {trackin}")
-        elif pd.notna(checkin_sfc):
-            # 回退到Checkin_SFC
-            start_time = checkin_sfc
-            logging.debug(f"TrackInTime为空，回退到Checkin_SFC: {checkin_sfc}")
-        else:
-            # 如果都为空，回退到PreviousBatchEndTime
-            start_time = previous_batch_end
-            logging.debug(f"TrackInTime和Checkin_SFC都为空，回退到PreviousBatchEndTime: {previous_batch_end}")
-    else:
-        # 正常连续生产：使用PreviousBatchEndTime
-        if pd.notna(previous_batch_end):
-            start_time = previous_batch_end
-            logging.debug(f"正常生产，使用PreviousBatchEndTime: {previous_batch_end}")
-        elif pd.notna(checkin_sfc):
-            # 如果PreviousBatchEndTime为空，使用Checkin_SFC
-            start_time = checkin_sfc
-            logging.debug(f"PreviousBatchEndTime为空，使用Checkin_SFC: {checkin_sfc}")
-        else:
-            # 如果两者都为空，返回None
-            return None
-    
-    trackout_dt = pd.to_datetime(trackout)
-    start_dt = pd.to_datetime(start_time)
-    
-    # 确保结束时间大于开始时间
-    if trackout_dt <= start_dt:
-        return None
-    
-    # 计算实际时间差（天），不扣除周末
-    total_seconds = (trackout_dt - start_dt).total_seconds()
-    total_hours = total_seconds / 3600
-    
-    # 转换为天数（不扣除周末）
-    return round(total_hours / 24, 2)
-
-
-def get_weekend_period(date: datetime) -> tuple:
-    """
-    获取指定日期所在周的周末区间（周六8:00到周一8:00）
-    返回: (saturday_8am, monday_8am)
-    """
-    weekday = date.weekday()  # Monday=0, Sunday=6
-    
-    # 找到本周六8点
-    if weekday == 5:  # Saturday
-        if date.hour >= 8:
-            # 如果已经是周六8点之后，使用本周六8点
-            saturday_8am = date.replace(hour=8, minute=0, second=0, microsecond=0)
-        else:
-            # 周六8点之前，使用上周六8点
-            saturday_8am = date.replace(hour=8, minute=0, second=0, microsecond=0) - timedelta(days=7)
-    elif weekday == 6:  # Sunday
-        saturday_8am = date.replace(hour=8, minute=0, second=0, microsecond=0) - timedelta(days=1)
-    elif weekday == 0:  # Monday
-        if date.hour < 8:
-            saturday_8am = date.replace(hour=8, minute=0, second=0, microsecond=0) - timedelta(days=2)
-        else:
-            saturday_8am = date.replace(hour=8, minute=0, second=0, microsecond=0) + timedelta(days=5)
-    else:  # Tuesday to Friday
-        days_to_saturday = 5 - weekday
-        saturday_8am = date.replace(hour=8, minute=0, second=0, microsecond=0) + timedelta(days=days_to_saturday)
-        # 如果还没到本周六，使用上周六
-        if saturday_8am > date:
-            saturday_8am = saturday_8am - timedelta(days=7)
-    
-    monday_8am = saturday_8am + timedelta(days=2)
-    return saturday_8am, monday_8am
-
-
-def calculate_weekend_hours(start: datetime, end: datetime) -> float:
-    """
-    计算从start到end之间的周末小时数
-    周末定义：周六8:00到周一8:00之间的所有时间（48小时）
-    """
-    if end <= start:
-        return 0.0
-    
-    total_hours = 0.0
-    
-    # 找到start和end之间的所有周末区间
-    current_start = start
-    processed_weekends = set()  # 记录已处理的周末区间（用周六8点作为key）
-    
-    while current_start < end:
-        # 获取当前时间所在周的周末区间
-        saturday_8am, monday_8am = get_weekend_period(current_start)
-        
-        # 避免重复处理同一个周末区间
-        weekend_key = saturday_8am
-        if weekend_key in processed_weekends:
-            # 已经处理过这个周末，跳到下个周一8点
-            current_start = monday_8am
-            continue
-        
-        processed_weekends.add(weekend_key)
-        
-        # 计算周末区间与[start, end]的重叠部分
-        overlap_start = max(current_start, saturday_8am)
-        overlap_end = min(end, monday_8am)
-        
-        if overlap_start < overlap_end:
-            # 有重叠，计算重叠小时数
-            hours = (overlap_end - overlap_start).total_seconds() / 3600
-            total_hours += hours
-        
-        # 移动到下一个可能的周末区间
-        if current_start < monday_8am:
-            current_start = monday_8am
-        else:
-            # 找到下一个周末区间
-            next_saturday = saturday_8am + timedelta(days=7)
-            if next_saturday < end:
-                current_start = next_saturday
-            else:
-                break
-    
-    return round(total_hours, 2)
-
-
-def calculate_sfc_st(row: pd.Series) -> Optional[float]:
-    """
-    计算SFC的ST(d) - 理论加工时间，不考虑周末
-    
-    计算逻辑：
-    ST = (调试时间 + (合格数量 + 报废数量) × EH_machine或EH_labor / OEE + 0.5小时换批时间) / 24
-    单位：天
-    """
-    # 使用TrackOutQuantity + ScrapQuantity
-    trackout_qty = row.get("TrackOutQuantity", 0) or 0
-    scrap_qty = row.get("ScrapQuantity", 0) or 0
-    qty = trackout_qty + scrap_qty
-    
-    oee = row.get("OEE", 0.77) or 0.77
-    setup_time = 0  # 调试时间（小时）
-    
-    if row.get("Setup") == "Yes" and pd.notna(row.get("Setup Time (h)")):
-        setup_time = row.get("Setup Time (h)", 0) or 0
-    
-    # 获取单件时间（秒），优先使用EH_machine(s)，否则使用EH_labor(s)
-    machine_time_s = row.get("EH_machine(s)", None)
-    labor_time_s = row.get("EH_labor(s)", None)
-    
-    # 确定使用哪个时间
-    if pd.notna(machine_time_s) and machine_time_s > 0:
-        unit_time_s = machine_time_s
-    elif pd.notna(labor_time_s) and labor_time_s > 0:
-        unit_time_s = labor_time_s
-    else:
-        return None
-    
-    # 转换为小时
-    unit_time_h = unit_time_s / 3600
-    
-    # 计算基础工时（理论时间，不考虑周末）
-    # 公式：调试时间 + (数量 × 单件时间 / OEE) + 0.5小时换批时间
-    base_hours = setup_time + (qty * unit_time_h / oee) + 0.5
-    
-    if base_hours == 0:
-        return None
-    
-    # ST = 基础工时 / 24（不考虑周末）
-    return round(base_hours / 24, 2)
-
-
-def calculate_sfc_due_time(row: pd.Series) -> Optional[datetime]:
-    """计算SFC的DueTime（包含周末调整）"""
-    # SFC数据可能没有TrackInTime，使用Checkin_SFC作为开始时间
-    start_time = row.get("TrackInTime", None) or row.get("Checkin_SFC", None)
-    if pd.isna(start_time):
-        return None
-    
-    start_dt = pd.to_datetime(start_time)
-    
-    setup_time = 0
-    if row.get("Setup") == "Yes" and pd.notna(row.get("Setup Time (h)")):
-        setup_time = row.get("Setup Time (h)", 0) or 0
-    
-    # 获取单件时间（秒），优先使用EH_machine(s)，否则使用EH_labor(s)
-    machine_time_s = row.get("EH_machine(s)", None)
-    labor_time_s = row.get("EH_labor(s)", None)
-    
-    # 确定使用哪个时间
-    if pd.notna(machine_time_s) and machine_time_s > 0:
-        unit_time_s = machine_time_s
-    elif pd.notna(labor_time_s) and labor_time_s > 0:
-        unit_time_s = labor_time_s
-    else:
-        return None
-    
-    # 转换为小时
-    unit_time_h = unit_time_s / 3600
-    
-    # 使用TrackOutQuantity + ScrapQuantity
-    trackout_qty = row.get("TrackOutQuantity", 0) or 0
-    scrap_qty = row.get("ScrapQuantity", 0) or 0
-    qty = trackout_qty + scrap_qty
-    oee = row.get("OEE", 0.77) or 0.77
-    
-    total_hours = setup_time + unit_time_h * qty / oee
-    due0 = start_dt + timedelta(hours=total_hours + 0.5)
-    
-    # 调整周末（考虑周末小时数）
-    due_final = adjust_weekend_sfc(start_dt, due0)
-    
-    return due_final
-
-
-def adjust_weekend_sfc(start: datetime, due: datetime) -> datetime:
-    """
-    调整周末，顺延到工作日（SFC版本）
-    周末定义：周六8:00到周一8:00之间的所有时间
-    如果截止时间落在周末，顺延到周一8:00
-    """
-    if due <= start:
-        return due
-    
-    # 计算从start到due之间的周末小时数
-    weekend_hours = calculate_weekend_hours(start, due)
-    
-    # 检查due是否落在周末区间内
-    weekday = due.weekday()  # Monday=0, Sunday=6
-    due_hour = due.hour
-    
-    # 判断是否在周末区间：周六8点之后，或周日，或周一8点之前
-    is_in_weekend = False
-    if weekday == 5 and due_hour >= 8:  # 周六8点及以后
-        is_in_weekend = True
-    elif weekday == 6:  # 周日全天
-        is_in_weekend = True
-    elif weekday == 0 and due_hour < 8:  # 周一8点之前
-        is_in_weekend = True
-    
-    # 如果落在周末区间，顺延到周一8点
-    if is_in_weekend:
-        # 找到下一个周一8点
-        if weekday == 5:  # 周六
-            days_to_monday = 2
-        elif weekday == 6:  # 周日
-            days_to_monday = 1
-        else:  # 周一（但还没到8点）
-            days_to_monday = 7  # 下周一
-        
-        next_monday = (due.replace(hour=8, minute=0, second=0, microsecond=0) + 
-                      timedelta(days=days_to_monday))
-        return next_monday
-    
-    # 如果不在周末区间，直接加上周末小时数
-    return due + timedelta(hours=weekend_hours)
-
-
-def calculate_sfc_weekend_days(row: pd.Series) -> Optional[float]:
-    """
-    计算SFC的Weekend(d) - 周末扣除天数（单位：天）
-    先按小时计算周末时间（周六8:00到周一8:00），然后转换为天数
-    返回值：周末天数（保留2位小数）
-    """
-    start_time = row.get("TrackInTime", None) or row.get("Checkin_SFC", None)
-    if pd.isna(start_time):
-        return None
-    
-    start_dt = pd.to_datetime(start_time)
-    
-    setup_time = 0
-    if row.get("Setup") == "Yes" and pd.notna(row.get("Setup Time (h)")):
-        setup_time = row.get("Setup Time (h)", 0) or 0
-    
-    # 获取单件时间（秒），优先使用EH_machine(s)，否则使用EH_labor(s)
-    machine_time_s = row.get("EH_machine(s)", None)
-    labor_time_s = row.get("EH_labor(s)", None)
-    
-    # 确定使用哪个时间
-    if pd.notna(machine_time_s) and machine_time_s > 0:
-        unit_time_s = machine_time_s
-    elif pd.notna(labor_time_s) and labor_time_s > 0:
-        unit_time_s = labor_time_s
-    else:
-        return None
-    
-    # 转换为小时
-    unit_time_h = unit_time_s / 3600
-    
-    # 使用TrackOutQuantity + ScrapQuantity
-    trackout_qty = row.get("TrackOutQuantity", 0) or 0
-    scrap_qty = row.get("ScrapQuantity", 0) or 0
-    qty = trackout_qty + scrap_qty
-    oee = row.get("OEE", 0.77) or 0.77
-    
-    total_hours = setup_time + unit_time_h * qty / oee
-    due0 = start_dt + timedelta(hours=total_hours + 0.5)
-    
-    # 计算周末小时数
-    weekend_hours = calculate_weekend_hours(start_dt, due0)
-    
-    # 转换为天数（保留2位小数）
-    return round(weekend_hours / 24, 2)
-
-
-def calculate_sfc_completion_status(row: pd.Series) -> Optional[str]:
-    """
-    计算SFC的CompletionStatus（基于PT和ST比较，与MES保持一致）
-    
-    逻辑：直接比较已计算的PT（实际加工时间）和ST（理论加工时间）
-    - PT是已经计算好的实际加工时间（已排除停产期）
-    - ST是已经计算好的理论加工时间
-    - PT > ST + 8小时容差 + 换批/换型时间 + 非工作日时间 → Overdue
-    - PT <= ST + 8小时容差 + 换批/换型时间 + 非工作日时间 → OnTime
-    
-    换批/换型时间规则：
-    - 正常换批：固定0.5小时
-    - 换型情况：Setup="Yes"时，使用标准换型时间（Setup Time字段）
-    """
-    # 获取已计算的PT和ST
-    pt = row.get("PT(d)", None)
-    st = row.get("ST(d)", None)
-    tolerance_h = row.get("Tolerance(h)", 8.0)  # 默认8小时容差
-    weekend_d = row.get("Weekend(d)", 0.0)  # 周末天数
-    
-    if pd.isna(pt) or pd.isna(st):
-        return None
-    
-    # PT转换为小时
-    pt_hours = pt * 24
-    # ST转换为小时
-    st_hours = st * 24
-    # 周末转换为小时
-    weekend_hours = weekend_d * 24
-    
-    # 检查是否需要使用标准换型时间
-    changeover_time = 0.5  # 默认换批时间
-    if row.get("Setup") == "Yes" and pd.notna(row.get("Setup Time (h)")):
-        changeover_time = row.get("Setup Time (h)", 0.5) or 0.5  # 使用标准换型时间
-    
-    # 阈值 = ST + 容差 + 换批/换型时间 + 周末时间
-    threshold = st_hours + tolerance_h + changeover_time + weekend_hours
-    
-    # 比较：PT（小时） > 阈值 → Overdue
-    if pt_hours > threshold:
-        return "Overdue"
-    else:
-        return "OnTime"
-
-
-def calculate_sfc_tolerance_hours(row: pd.Series) -> Optional[float]:
-    """计算容差小时数（固定8小时）"""
-    due = row.get("DueTime", None)
-    actual = row.get("TrackOutTime", None)
-    
-    if pd.isna(due) or pd.isna(actual):
-        return None
-    
-    # 固定容差为8小时
-    return 8.0
-
-
 def extract_machine_number_sfc(machine: Any) -> Optional[int]:
     """
     从machine字段提取数字（SFC版本）
@@ -1069,47 +582,31 @@ def calculate_previous_batch_end_time(df: pd.DataFrame) -> pd.DataFrame:
         df["PreviousBatchEndTime"] = None
         return df
     
-    result = df.copy()
-    
     # 确保machine字段存在（如果不存在，创建为None）
-    if "machine" not in result.columns:
+    if "machine" not in df.columns:
         logging.warning("缺少machine字段，无法按machine分组计算 PreviousBatchEndTime")
+        result = df.copy()
         result["PreviousBatchEndTime"] = None
         return result
     
     # 检查machine字段是否有有效值
-    valid_machine_count = result["machine"].notna().sum()
+    valid_machine_count = df["machine"].notna().sum()
     if valid_machine_count == 0:
         logging.warning("machine字段全部为空，无法计算 PreviousBatchEndTime")
+        result = df.copy()
         result["PreviousBatchEndTime"] = None
         return result
     
-    logging.info(f"开始计算 PreviousBatchEndTime：有效machine记录 {valid_machine_count} 条，总计 {len(result)} 条")
+    logging.info(f"开始计算 PreviousBatchEndTime：有效machine记录 {valid_machine_count} 条，总计 {len(df)} 条")
     
-    # 按 machine 分组，按 TrackOutTime 升序排序（最早的在前）
-    # 对于 machine 为空或 TrackOutTime 为空的记录，先处理
-    result = result.sort_values(
-        ["machine", "TrackOutTime"],
-        na_position='last',  # 空值排在最后
-        ascending=[True, True]  # machine 和 TrackOutTime 都升序
-    )
+    # 按 machine 分组，按 TrackOutTime 升序排序（最早的在前，空值排在最后）
+    # 上一次计算已排好序时不再重复排序
+    result = sort_by_machine(df)
     
-    # 使用 shift(1) 获取上一批的 TrackOutTime
-    # 只对machine不为空的记录进行分组计算
-    result["PreviousBatchEndTime"] = None
-    
-    # 只对machine不为空的记录进行分组计算
+    # 同一machine上一批的TrackOutTime（整列shift），第一批使用EnterStepTime代替
+    # 只对machine和TrackOutTime都不为空的记录计算
     mask_valid = result["machine"].notna() & result["TrackOutTime"].notna()
-    if mask_valid.any():
-        # 对有效记录进行分组计算
-        result.loc[mask_valid, "PreviousBatchEndTime"] = (
-            result[mask_valid].groupby("machine")["TrackOutTime"].shift(1)
-        )
-        
-        # 对于第一批（PreviousBatchEndTime 为空），使用 EnterStepTime 代替
-        mask_first_batch = mask_valid & result["PreviousBatchEndTime"].isna()
-        if "EnterStepTime" in result.columns and mask_first_batch.any():
-            result.loc[mask_first_batch, "PreviousBatchEndTime"] = result.loc[mask_first_batch, "EnterStepTime"]
+    result["PreviousBatchEndTime"] = calculate_previous_end(result)
     
     # 将NaT转换为None（确保datetime类型的空值正确处理）
     # 对于datetime类型的列，NaT（Not a Time）需要转换为None才能正确保存为null
@@ -1148,34 +645,11 @@ def calculate_sfc_metrics(df: pd.DataFrame, cfg: Dict[str, Any]) -> pd.DataFrame
     # 这里先计算是为了后续可能使用该字段进行计算
     result = calculate_previous_batch_end_time(result)
     
-    # 1. 计算LT(d)
-    result["LT(d)"] = result.apply(calculate_sfc_lt, axis=1)
-    
-    # 2. 计算PT(d)
-    result["PT(d)"] = result.apply(calculate_sfc_pt, axis=1)
-    
-    # 3. 处理OEE默认值
-    if "OEE" in result.columns:
-        result["OEE"] = result["OEE"].fillna(0.77).replace(0, 0.77)
-    
-    # 4. 确保EH_machine(s)和EH_labor(s)字段存在
-    if "EH_machine(s)" not in result.columns:
-        result["EH_machine(s)"] = None
-    if "EH_labor(s)" not in result.columns:
-        result["EH_labor(s)"] = None
-    
-    # 5. 计算ST(d)
-    result["ST(d)"] = result.apply(calculate_sfc_st, axis=1)
-    
-    # 6. 计算DueTime和Weekend(d)
-    result["DueTime"] = result.apply(calculate_sfc_due_time, axis=1)
-    result["Weekend(d)"] = result.apply(calculate_sfc_weekend_days, axis=1)
-    
-    # 7. 计算CompletionStatus（基于PT和ST比较，不使用DueTime）
-    result["CompletionStatus"] = result.apply(calculate_sfc_completion_status, axis=1)
-    
-    # 8. 计算容差小时数（单独字段）
-    result["Tolerance(h)"] = result.apply(calculate_sfc_tolerance_hours, axis=1)
+    # 1-8. 计算LT/PT/ST/DueTime/Weekend(d)/CompletionStatus/Tolerance(h)
+    # （列式计算，逻辑同逐行参考实现 calculate_sfc_lt/calculate_sfc_pt/calculate_sfc_st/calculate_sfc_due_time 等，
+    #   见测试脚本 rowwise_oracles.py；
+    #   PT开始时间回退到Checkin_SFC，非工作时间为固定周末，CompletionStatus不使用DueTime）
+    result = compute_metrics(result, FixedWeekendPolicy(), checkin_fallback=True)
     
     # 9. 计算Machine(#)
     if "machine" in result.columns:
@@ -1265,8 +739,8 @@ def save_excel_for_validation(df: pd.DataFrame, parquet_path: str, cfg: Dict[str
         # 不抛出异常，因为Excel输出是可选的
 
 
-def save_to_parquet(df: pd.DataFrame, output_path: str, cfg: Dict[str, Any]) -> None:
-    """保存为Parquet格式"""
+def save_to_parquet(df: pd.DataFrame, output_path: str, cfg: Dict[str, Any], validation: bool = True) -> None:
+    """保存为Parquet格式（validation为False时不导出校验Excel）"""
     if df.empty:
         logging.warning("数据为空，不保存")
         return
@@ -1324,11 +798,14 @@ def save_to_parquet(df: pd.DataFrame, output_path: str, cfg: Dict[str, Any]) ->
     try:
         # 保存为Parquet时，PyArrow会自动将object类型的datetime值转换为timestamp类型
         # None值会被正确保存为null
-        df.to_parquet(output_path, index=False, engine='pyarrow', compression=compression)
+        # 已按machine、TrackOutTime排序的数据同时写入排序元数据
+        df.to_parquet(output_path, index=False, engine='pyarrow', compression=compression,
+                      **parquet_sorting_kwargs(df))
         logging.info(f"已保存Parquet文件: {output_path}, 行数: {len(df)}")
         
         # 同时保存Excel文件用于数据完整性检查
-        save_excel_for_validation(df, output_path, cfg)
+        if validation:
+            save_excel_for_validation(df, output_path, cfg)
         
         # 验证PreviousBatchEndTime字段的空值处理
         if "PreviousBatchEndTime" in df.columns:
@@ -1340,29 +817,18 @@ def save_to_parquet(df: pd.DataFrame, output_path: str, cfg: Dict[str, Any]) ->
         raise
 
 
-def generate_record_hash(row: pd.Series, key_fields: List[str]) -> str:
+def sfc_record_fingerprints(df: pd.DataFrame, cfg: Dict[str, Any]) -> Optional[np.ndarray]:
     """
-    生成记录的唯一hash值（基于业务字段，不含文件名）
-    因为相邻日期的文件中有90%的数据行是重复的，应该基于业务字段去重
+    记录指纹（基于业务唯一键字段，不含文件名；因为相邻日期的文件中有90%的数据行是重复的，应该基于业务字段去重）
+    缺少唯一键字段时返回None
     """
-    values = []
-    
-    # 提取关键字段的值
-    for field in key_fields:
-        val = row.get(field)
-        if pd.isna(val):
-            val = None
-        else:
-            # 如果是datetime类型，转换为字符串
-            if isinstance(val, (pd.Timestamp, datetime)):
-                val = val.strftime('%Y-%m-%d %H:%M:%S')
-            else:
-                val = str(val)
-        values.append(val if val is not None else '')
-    
-    # 生成hash（不含文件名）
-    key_str = '|'.join(values)
-    return hashlib.md5(key_str.encode('utf-8')).hexdigest()
+    # 默认值应该与配置文件保持一致
+    key_fields = cfg.get("incremental", {}).get("unique_key_fields", ["BatchNumber", "Operation", "TrackOutTime"])
+    missing_fields = [f for f in key_fields if f not in df.columns]
+    if missing_fields:
+        logging.warning(f"增量处理所需字段不存在: {missing_fields}")
+        return None
+    return record_fingerprints(df, key_fields)
 
 
 def load_etl_state(state_file: str) -> Dict[str, Any]:
@@ -1371,9 +837,6 @@ def load_etl_state(state_file: str) -> Dict[str, Any]:
         try:
             with open(state_file, 'r', encoding='utf-8') as f:
                 state = json.load(f)
-                # 确保processed_hashes是set类型
-                if "processed_hashes" in state and isinstance(state["processed_hashes"], list):
-                    state["processed_hashes"] = set(state["processed_hashes"])
                 # 确保processed_files是dict类型
                 if "processed_files" not in state:
                     state["processed_files"] = {}
@@ -1382,7 +845,7 @@ def load_etl_state(state_file: str) -> Dict[str, Any]:
             logging.warning(f"加载状态文件失败: {e}，将使用默认状态")
     return {
         "last_processed_time": None,
-        "processed_hashes": set(),
+        "fingerprint_version": FINGERPRINT_VERSION,
         "processed_files": {},  # 格式: {文件路径: {mtime: 修改时间, hash: 文件hash}}
         "last_full_refresh_time": None
     }
@@ -1392,22 +855,49 @@ def save_etl_state(state_file: str, state: Dict[str, Any]) -> None:
     """保存ETL状态文件"""
     os.makedirs(os.path.dirname(state_file), exist_ok=True)
     
-    # 转换set为list以便JSON序列化
-    state_copy = state.copy()
-    if "processed_hashes" in state_copy and isinstance(state_copy["processed_hashes"], set):
-        state_copy["processed_hashes"] = list(state_copy["processed_hashes"])
-    
     try:
         with open(state_file, 'w', encoding='utf-8') as f:
-            json.dump(state_copy, f, indent=2, ensure_ascii=False, default=str)
+            json.dump(state, f, indent=2, ensure_ascii=False, default=str)
     except Exception as e:
         logging.error(f"保存状态文件失败: {e}")
 
 
+def load_raw_hash_store(state_file: str) -> FingerprintStore:
+    """已处理的原始唯一键指纹（清洗前去重叠用；高水位增量时只保存原始时间为空的行）"""
+    return load_fingerprint_store(state_file, "raw", "processed_raw_hashes")
+
+
+def get_raw_watermark_window(cfg: Dict[str, Any], state_file: str) -> Optional[WatermarkWindow]:
+    """
+    高水位增量时原始唯一键指纹的窗口（状态文件名.raw_window.npy）：按高水位时间字段对应的原始列（如 报工时间）
+    只保留窗口内的原始键指纹，与记录的增量窗口使用相同的迟到窗口，原始键状态不随历史增长；
+    不是高水位增量或原始时间列无法对应时返回None
+    """
+    window = get_watermark_window(cfg, state_file)
+    column = get_raw_time_column(cfg)
+    if window is None or column is None:
+        return None
+    return WatermarkWindow(state_file, window.late_arrival / pd.Timedelta(days=1), column, name="raw_window")
+
+
+def reset_raw_hash_store(state_file: str, raw_window: Optional[WatermarkWindow]) -> None:
+    """
+    从fingerprint策略切换为watermark时（原始键窗口尚未建立）删除原始键指纹存储（包含全部历史的原始键）；
+    之后的运行由原始键窗口重新记录，首次运行多清洗的重叠行在增量窗口中按记录指纹去重
+    """
+    if raw_window is None or os.path.exists(raw_window.path):
+        return
+    for path in FingerprintStore(state_file, "raw").paths():
+        if os.path.exists(path):
+            os.remove(path)
+            logging.info(f"高水位增量：已删除原始键指纹存储 {path}")
+
+
 def is_file_processed(file_path: str, state: Dict[str, Any]) -> bool:
     """
     检查文件是否已处理过
-    基于文件路径和修改时间判断
+    基于文件路径判断：修改时间和大小都相同时直接认为已处理；修改时间变化时比较内容指纹（见 zip_content_fingerprint），
+    内容未变（如OneDrive重新同步只改变了修改时间）时仍认为已处理，并更新state中记录的修改时间
     """
     if "processed_files" not in state:
         return False
@@ -1420,18 +910,37 @@ def is_file_processed(file_path: str, state: Dict[str, Any]) -> bool:
     file_info = processed_files[file_path]
     stored_mtime = file_info.get("mtime")
     current_mtime = os.path.getmtime(file_path)
+    current_size = os.path.getsize(file_path)
+    stored_size = file_info.get("size", current_size)
     
-    # 如果文件修改时间相同，认为已处理过
-    if stored_mtime and abs(stored_mtime - current_mtime) < 1.0:  # 允许1秒误差
+    # 如果文件修改时间和大小相同，认为已处理过
+    if stored_mtime and abs(stored_mtime - current_mtime) < 1.0 and stored_size == current_size:  # 允许1秒误差
         return True
     
-    return False
+    # 修改时间变化：内容指纹相同时认为已处理过
+    stored_content = file_info.get("content_hash")
+    if not stored_content or stored_size != current_size:
+        return False
+    try:
+        same_content = zip_content_fingerprint(file_path) == stored_content
+    except OSError as e:
+        logging.warning(f"计算文件内容指纹失败 {file_path}: {e}")
+        return False
+    if same_content:
+        logging.info(f"文件内容未变化（仅修改时间变化），跳过: {os.path.basename(file_path)}")
+        file_info["mtime"] = current_mtime
+    return same_content
 
 
-def filter_incremental_sfc_data(df: pd.DataFrame, file_path: str, cfg: Dict[str, Any], state_file: str) -> pd.DataFrame:
+def filter_incremental_sfc_data(df: pd.DataFrame, file_path: str, cfg: Dict[str, Any], state_file: str,
+                                fingerprints: Optional[np.ndarray] = None,
+                                store: Optional[FingerprintStore] = None,
+                                window: Optional[WatermarkWindow] = None) -> pd.DataFrame:
     """
     增量过滤：只返回新数据（未处理过的记录）
-    基于业务字段进行hash匹配（不含文件名）
+    基于业务字段的记录指纹匹配（不含文件名）；fingerprints为已计算的记录指纹（见 sfc_record_fingerprints），
+    store/window为已打开的指纹存储和增量窗口（未传入时按状态文件打开）
+    incremental.strategy 为watermark时只在 高水位-迟到窗口 之后的记录中比较指纹（见 WatermarkWindow）
     """
     if df.empty:
         return df
@@ -1441,26 +950,21 @@ def filter_incremental_sfc_data(df: pd.DataFrame, file_path: str, cfg: Dict[str,
         logging.info("增量处理未启用，返回全部数据")
         return df
     
-    # 加载状态
-    state = load_etl_state(state_file)
-    processed_hashes = state.get("processed_hashes", set())
-    
-    # 获取唯一键字段（不含文件名）
-    # 默认值应该与配置文件保持一致
-    key_fields = incr_cfg.get("unique_key_fields", ["BatchNumber", "Operation", "TrackOutTime"])
-    
-    # 检查必需字段是否存在
-    missing_fields = [f for f in key_fields if f not in df.columns]
-    if missing_fields:
-        logging.warning(f"增量处理所需字段不存在: {missing_fields}，返回全部数据")
-        return df
-    
-    # 生成每条记录的hash并筛选新数据（不含文件名）
-    df['_record_hash'] = df.apply(lambda row: generate_record_hash(row, key_fields), axis=1)
-    
-    # 筛选新数据（hash不在已处理集合中）
-    new_data = df[~df['_record_hash'].isin(processed_hashes)].copy()
-    new_data = new_data.drop(columns=['_record_hash'])
+    if fingerprints is None:
+        fingerprints = sfc_record_fingerprints(df, cfg)
+        if fingerprints is None:
+            logging.warning("返回全部数据")
+            return df
+    
+    # 筛选新数据（指纹不在已处理集合中）
+    if store is None:
+        store = load_fingerprint_store(state_file)
+    if window is None:
+        window = get_watermark_window(cfg, state_file)
+    if window is not None:
+        new_data = df[window.new_mask(df, fingerprints, store)].copy()
+    else:
+        new_data = df[~store.contains(fingerprints)].copy()
     
     new_count = len(new_data)
     total_count = len(df)
@@ -1472,59 +976,107 @@ def filter_incremental_sfc_data(df: pd.DataFrame, file_path: str, cfg: Dict[str,
     return new_data
 
 
-def update_sfc_etl_state(df: pd.DataFrame, file_path: str, state_file: str, cfg: Dict[str, Any]) -> None:
-    """更新ETL状态：记录已处理的记录hash和文件信息"""
-    if df.empty:
-        return
-    
-    incr_cfg = cfg.get("incremental", {})
-    if not incr_cfg.get("enabled", False):
-        return
-    
-    # 加载当前状态
-    state = load_etl_state(state_file)
-    processed_hashes = state.get("processed_hashes", set())
-    
-    # 获取唯一键字段（不含文件名）
-    # 默认值应该与配置文件保持一致
-    key_fields = incr_cfg.get("unique_key_fields", ["BatchNumber", "Operation", "TrackOutTime"])
-    
-    # 检查必需字段是否存在
-    missing_fields = [f for f in key_fields if f not in df.columns]
-    if missing_fields:
-        logging.warning(f"更新状态所需字段不存在: {missing_fields}")
-        return
-    
-    # 生成所有记录的hash（不含文件名）
-    df['_record_hash'] = df.apply(lambda row: generate_record_hash(row, key_fields), axis=1)
-    new_hashes = set(df['_record_hash'].unique())
+def record_sfc_file(state: Dict[str, Any], df: pd.DataFrame, file_path: str, cfg: Dict[str, Any],
+                    store: FingerprintStore, raw_store: FingerprintStore, window: Optional[WatermarkWindow],
+                    raw_hashes: Optional[np.ndarray] = None,
+                    fingerprints: Optional[np.ndarray] = None,
+                    raw_window: Optional[WatermarkWindow] = None,
+                    raw_times: Optional[pd.Series] = None) -> bool:
+    """
+    在内存中记录一个已处理的文件：记录指纹（fingerprints，未传入时按df计算）、原始唯一键指纹（raw_hashes）
+    暂存到指纹存储或增量窗口（提交前不写入文件），更新state中的文件信息和高水位；
+    原始键窗口（raw_window）和原始时间（raw_times）都传入时原始键指纹记入窗口，否则记入raw_store
     
-    # 更新已处理的hash集合
-    processed_hashes.update(new_hashes)
-    state["processed_hashes"] = processed_hashes
+    Returns:
+        是否已记录（缺少唯一键字段时为False）
+    """
+    # 生成所有记录的指纹（不含文件名）；原始键去重叠后没有新行时只记录原始键指纹和文件信息
+    new_fingerprints = np.empty(0, dtype=np.uint64)
+    if not df.empty:
+        if fingerprints is None:
+            fingerprints = sfc_record_fingerprints(df, cfg)
+            if fingerprints is None:
+                return False
+        new_fingerprints = np.unique(fingerprints)
+    
+    # 更新已处理的指纹集合（高水位增量时写入增量窗口，只保留窗口内的指纹）
+    if window is None:
+        store.stage(new_fingerprints)
+    elif not df.empty:
+        window.record(df, fingerprints, store, commit=False)
+        state["watermark"] = str(window.watermark)
+    state["fingerprint_version"] = FINGERPRINT_VERSION
+    
+    # 更新已处理的原始唯一键指纹（下次读取时在清洗前去除重叠行）
+    if raw_hashes is not None and len(raw_hashes):
+        if raw_window is not None and raw_times is not None:
+            raw_keys = pd.DataFrame({raw_window.time_field: raw_times.to_numpy()})
+            raw_window.record(raw_keys, raw_hashes, raw_store, commit=False)
+        else:
+            raw_store.stage(raw_hashes)
     
-    # 更新文件处理信息（基于文件名和修改时间）
+    # 更新文件处理信息（修改时间、大小和内容指纹）
     if "processed_files" not in state:
         state["processed_files"] = {}
     
     file_name = os.path.basename(file_path)
     file_mtime = os.path.getmtime(file_path)
+    try:
+        content_hash = zip_content_fingerprint(file_path)
+    except OSError as e:
+        logging.warning(f"计算文件内容指纹失败 {file_path}: {e}")
+        content_hash = None
     
     state["processed_files"][file_path] = {
         "mtime": file_mtime,
+        "size": os.path.getsize(file_path),
+        "content_hash": content_hash,
         "file_name": file_name,
         "processed_time": datetime.now().isoformat(),
-        "record_count": len(df),
-        "new_record_count": len(new_hashes)
+        "record_count": len(raw_hashes) if raw_hashes is not None and len(raw_hashes) else len(df),
+        "new_record_count": len(new_fingerprints)
     }
     
     # 更新最后处理时间
     state["last_processed_time"] = datetime.now().isoformat()
     
-    # 保存状态
+    logging.info(f"已记录文件：{file_name}，新记录 {len(new_fingerprints)} 条，总记录数 {len(store) + (len(window) if window is not None else 0)} 条")
+    return True
+
+
+def commit_sfc_state(state_file: str, state: Dict[str, Any], store: FingerprintStore,
+                     raw_store: FingerprintStore, window: Optional[WatermarkWindow],
+                     raw_window: Optional[WatermarkWindow] = None) -> None:
+    """写入暂存的指纹、增量窗口和状态文件（状态文件最后写入）"""
+    store.commit()
+    raw_store.commit()
+    for w in (window, raw_window):
+        if w is not None:
+            w.save()
     save_etl_state(state_file, state)
+
+
+def update_sfc_etl_state(df: pd.DataFrame, file_path: str, state_file: str, cfg: Dict[str, Any],
+                         raw_hashes: Optional[np.ndarray] = None,
+                         fingerprints: Optional[np.ndarray] = None,
+                         raw_times: Optional[pd.Series] = None) -> None:
+    """
+    更新ETL状态：记录单个文件（见 record_sfc_file）并立即写入指纹存储、增量窗口和状态文件
+    多文件处理时使用 SfcRunTransaction 按检查点统一提交
+    """
+    if df.empty and (raw_hashes is None or not len(raw_hashes)):
+        return
     
-    logging.info(f"状态更新完成：文件 {file_name}，新记录 {len(new_hashes)} 条，总记录数 {len(processed_hashes)} 条")
+    incr_cfg = cfg.get("incremental", {})
+    if not incr_cfg.get("enabled", False):
+        return
+    
+    state = load_etl_state(state_file)
+    store, raw_store = load_fingerprint_store(state_file), load_raw_hash_store(state_file)
+    window, raw_window = get_watermark_window(cfg, state_file), get_raw_watermark_window(cfg, state_file)
+    if record_sfc_file(state, df, file_path, cfg, store, raw_store, window, raw_hashes, fingerprints,
+                       raw_window, raw_times):
+        commit_sfc_state(state_file, state, store, raw_store, window, raw_window)
 
 
 def merge_with_history(new_df: pd.DataFrame, history_file: str, cfg: Dict[str, Any]) -> pd.DataFrame:
@@ -1583,6 +1135,102 @@ def merge_with_history(new_df: pd.DataFrame, history_file: str, cfg: Dict[str, A
         return new_df
 
 
+def write_history_file(df: pd.DataFrame, history_file: str, cfg: Dict[str, Any]) -> None:
+    """写入历史数据文件（先写临时文件再替换，不导出校验Excel；校验Excel在最终发布时导出）"""
+    tmp_path = history_file + ".tmp"
+    save_to_parquet(df, tmp_path, cfg, validation=False)
+    if os.path.exists(tmp_path):
+        os.replace(tmp_path, history_file)
+
+
+def publish_sfc_result(df: pd.DataFrame, history_file: str, cfg: Dict[str, Any],
+                       write_history: bool = True) -> pd.DataFrame:
+    """
+    发布最终结果：对全部数据统一计算PreviousBatchEndTime，保存到latest文件（导出校验Excel）；
+    历史数据文件与latest文件不是同一路径时另外写入历史数据文件（write_history为False时不写入，
+    如没有新数据、历史文件已在检查点写入时）
+    
+    Returns:
+        发布的数据
+    """
+    # 在最终保存前，对所有合并后的数据统一重新计算 PreviousBatchEndTime
+    # 确保排序准确（方案A：最终统一计算）
+    logging.info("对所有合并后的数据统一计算 PreviousBatchEndTime")
+    df = calculate_previous_batch_end_time(df)
+    
+    output_dir = cfg.get("output", {}).get("base_dir", "publish")
+    output_dir = os.path.join(BASE_DIR, output_dir) if not os.path.isabs(output_dir) else output_dir
+    os.makedirs(output_dir, exist_ok=True)
+    
+    # 保存到latest文件（只保存latest，不保存每日记录）
+    sfc_latest_file = os.path.join(output_dir, "SFC_batch_report_latest.parquet")
+    save_to_parquet(df, sfc_latest_file, cfg)
+    logging.info(f"SFC数据已保存: {sfc_latest_file}")
+    same_file = os.path.normcase(os.path.abspath(history_file)) == os.path.normcase(os.path.abspath(sfc_latest_file))
+    if write_history and not same_file:
+        write_history_file(df, history_file, cfg)
+    return df
+
+
+class SfcRunTransaction:
+    """
+    SFC多文件增量处理的运行事务：新数据和状态在内存中累积，按检查点统一合并、写入历史文件和状态
+    
+    说明：
+    - 每个文件处理后只在内存中记录指纹和文件信息（见 record_sfc_file），不读写状态文件和历史文件
+    - 每处理 checkpoint_every 个文件（0表示不设中间检查点）以及运行结束时提交一次：
+      累积的新数据与历史数据合并一次，先写历史文件，再写指纹存储和状态文件；
+      运行结束时传入publish（见 publish_sfc_result）则由其发布结果代替写历史文件（历史文件通常即latest文件，只写一次）
+    - 运行中断后重新运行时，已提交的文件按状态跳过，从最后一个检查点继续；
+      历史文件已写入而状态未写入的文件会重新处理，合并历史数据时按唯一键去重
+    """
+    
+    def __init__(self, cfg: Dict[str, Any], state_file: str, history_file: str, checkpoint_every: int = 0):
+        self.cfg = cfg
+        self.state_file = state_file
+        self.history_file = history_file
+        self.checkpoint_every = checkpoint_every
+        self.state = load_etl_state(state_file)
+        self.store = load_fingerprint_store(state_file)
+        self.raw_store = load_raw_hash_store(state_file)
+        self.window = get_watermark_window(cfg, state_file)
+        self.raw_window = get_raw_watermark_window(cfg, state_file)
+        self.frames: List[pd.DataFrame] = []
+        self.pending_files = 0
+        self.result: Optional[pd.DataFrame] = None
+    
+    def record(self, file_path: str, processed_df: pd.DataFrame, new_df: pd.DataFrame,
+               raw_hashes: Optional[np.ndarray] = None, fingerprints: Optional[np.ndarray] = None,
+               raw_times: Optional[pd.Series] = None) -> None:
+        """记录一个已处理的文件（processed_df为清洗后全部行，new_df为增量过滤并计算指标后的新数据）"""
+        if processed_df.empty and (raw_hashes is None or not len(raw_hashes)):
+            return
+        if not record_sfc_file(self.state, processed_df, file_path, self.cfg, self.store, self.raw_store,
+                               self.window, raw_hashes, fingerprints, self.raw_window, raw_times):
+            return
+        if not new_df.empty:
+            self.frames.append(new_df)
+        self.pending_files += 1
+        if self.checkpoint_every and self.pending_files >= self.checkpoint_every:
+            self.commit()
+    
+    def commit(self, publish: Optional[Callable[[pd.DataFrame], pd.DataFrame]] = None) -> None:
+        """合并累积的新数据并写入历史文件（传入publish时由其发布），然后写入状态"""
+        if not self.pending_files:
+            return
+        if self.frames:
+            new_df = pd.concat(self.frames, ignore_index=True)
+            self.result = merge_with_history(new_df, self.history_file, self.cfg)
+            if publish is not None:
+                self.result = publish(self.result)
+            else:
+                write_history_file(self.result, self.history_file, self.cfg)
+            self.frames = []
+        commit_sfc_state(self.state_file, self.state, self.store, self.raw_store, self.window, self.raw_window)
+        logging.info(f"检查点已提交：{self.pending_files} 个文件")
+        self.pending_files = 0
+
+
 def prompt_refresh_mode(default_incremental: bool = True, countdown_seconds: int = None) -> bool:
     """
     提示用户选择刷新模式（增量/全量）
@@ -1664,14 +1312,24 @@ def should_do_full_refresh(cfg: Dict[str, Any], state_file: str) -> bool:
     return False
 
 
-def process_all_sfc_data(cfg: Dict[str, Any], force_full_refresh: bool = False) -> pd.DataFrame:
-    """处理所有SFC数据的主函数（增量处理）"""
+def process_all_sfc_data(cfg: Dict[str, Any], force_full_refresh: bool = False,
+                         publish: Optional[Callable[[pd.DataFrame], pd.DataFrame]] = None) -> pd.DataFrame:
+    """
+    处理所有SFC数据的主函数（增量处理）
+    
+    Args:
+        publish: 多文件处理有新数据时用于发布最终结果（见 publish_sfc_result），代替运行结束时写入历史文件，
+                 增量处理时状态在发布之后写入；未调用时由调用方发布返回的数据
+    """
     # 读取SFC数据（支持通配符）
     sfc_path = cfg.get("source", {}).get("sfc_path", "")
     if not sfc_path:
         logging.warning("SFC数据路径未配置")
         return pd.DataFrame()
     
+    # 源文件解析缓存（已处理过的每日导出文件不再重复解析）
+    parse_cache = get_parse_cache(cfg)
+    
     # 增量处理配置
     incr_cfg = cfg.get("incremental", {})
     state_file = incr_cfg.get("state_file", "publish/etl_sfc_state.json")
@@ -1680,9 +1338,7 @@ def process_all_sfc_data(cfg: Dict[str, Any], force_full_refresh: bool = False)
     # 如果强制全量刷新，删除状态文件和历史文件
     if force_full_refresh:
         logging.info("执行全量刷新：清除状态文件和历史数据文件")
-        if os.path.exists(state_file):
-            os.remove(state_file)
-            logging.info(f"已删除状态文件: {state_file}")
+        remove_etl_state(state_file)
         
         history_file = cfg.get("output", {}).get("history_file", "publish/SFC_batch_report_latest.parquet")
         history_file = os.path.join(BASE_DIR, history_file) if not os.path.isabs(history_file) else history_file
@@ -1694,8 +1350,18 @@ def process_all_sfc_data(cfg: Dict[str, Any], force_full_refresh: bool = False)
     if incr_cfg.get("enabled", False) and not force_full_refresh:
         if should_do_full_refresh(cfg, state_file):
             logging.info("执行全量刷新：清除状态文件")
-            if os.path.exists(state_file):
-                os.remove(state_file)
+            remove_etl_state(state_file)
+    
+    # 旧版状态文件（逐行MD5）按历史数据重新计算记录指纹；高水位增量的窗口尚未建立时按历史数据初始化
+    if incr_cfg.get("enabled", False):
+        history_file = cfg.get("output", {}).get("history_file", "publish/SFC_batch_report_latest.parquet")
+        history_file = os.path.join(BASE_DIR, history_file) if not os.path.isabs(history_file) else history_file
+        key_fields = incr_cfg.get("unique_key_fields", ["BatchNumber", "Operation", "TrackOutTime"])
+        migrate_state_file(state_file, history_file, key_fields)
+        window = get_watermark_window(cfg, state_file)
+        if window is not None:
+            window.bootstrap(history_file, key_fields, load_fingerprint_store(state_file))
+        reset_raw_hash_store(state_file, get_raw_watermark_window(cfg, state_file))
     
     # 处理通配符
     if "*" in sfc_path or "?" in sfc_path:
@@ -1704,8 +1370,8 @@ def process_all_sfc_data(cfg: Dict[str, Any], force_full_refresh: bool = False)
             logging.warning(f"未找到匹配的SFC文件: {sfc_path}")
             return pd.DataFrame()
         
-        # 按文件修改时间排序，最新的在前
-        sfc_files = sorted(sfc_files, key=lambda x: os.path.getmtime(x), reverse=True)
+        # 按文件修改时间排序，最新的在前（修改时间相同时按文件名）
+        sfc_files = sorted(sfc_files, key=lambda x: (os.path.getmtime(x), x), reverse=True)
         
         # 测试模式：限制文件数量
         test_cfg = cfg.get("test", {})
@@ -1724,6 +1390,8 @@ def process_all_sfc_data(cfg: Dict[str, Any], force_full_refresh: bool = False)
             skipped_count = original_count - len(sfc_files)
             if skipped_count > 0:
                 logging.info(f"跳过已处理的文件: {skipped_count} 个，剩余待处理: {len(sfc_files)} 个")
+                # 保存内容未变的文件更新后的修改时间（下次直接按修改时间跳过）
+                save_etl_state(state_file, state)
         
         if not sfc_files:
             logging.info("所有文件都已处理过，没有新数据")
@@ -1754,26 +1422,38 @@ def process_all_sfc_data(cfg: Dict[str, Any], force_full_refresh: bool = False)
         else:
             sfc_df = pd.DataFrame()
         
-        # 逐个文件处理，每处理完一个文件就与历史数据合并
-        for file_path in sfc_files:
+        # 多进程读取文件并处理SFC数据（字段映射、类型转换等），按文件顺序依次返回；
+        # 新数据在内存中累积，按检查点（每N个文件和运行结束时）与历史数据合并一次并写入历史文件和状态
+        # 增量处理时子进程只读取原始数据，清洗前先按原始唯一键去除与已处理文件重叠的行，只清洗新行
+        workers = get_ingest_workers(cfg)
+        incremental = incr_cfg.get("enabled", False)
+        # 指纹存储和状态在整个运行中只打开一次（见 SfcRunTransaction）
+        transaction = (SfcRunTransaction(cfg, state_file, history_file, int(incr_cfg.get("checkpoint_every_files", 20) or 0))
+                       if incremental else None)
+        new_frames = []
+        ingest = read_sfc_raw if incremental else ingest_sfc_file
+        # 同步未完成的文件推迟到其余文件之后重试
+        deferral = get_sync_deferral(cfg)
+        for file_path, df, error in parallel_ingest(ingest, sfc_files, (cfg,), workers, deferral):
             try:
-                logging.info(f"读取SFC文件: {file_path}")
-                df = read_sharepoint_excel(file_path)  # 不限制行数
+                if error is not None:
+                    raise error
+                logging.info(f"读取SFC文件: {file_path}, {len(df)} 行")
                 
                 if df.empty:
                     continue
                 
-                # 处理SFC数据（字段映射、类型转换等）
-                df = process_sfc_data(df, cfg)
-                
                 # 增量过滤：先做去重分析，只保留新数据
-                if incr_cfg.get("enabled", False):
-                    df_before_filter = df.copy()
-                    df = filter_incremental_sfc_data(df, file_path, cfg, state_file)
+                if incremental:
+                    df, raw_hashes, raw_times = drop_seen_raw_rows(df, transaction.raw_store, transaction.raw_window)
+                    if len(raw_hashes):
+                        logging.info(f"原始键去重叠: 已处理 {len(raw_hashes) - len(df)} 行，待清洗 {len(df)} 行")
+                    df = process_sfc_data(df, cfg) if not df.empty else df
                     
-                    # 更新状态（记录已处理的记录和文件信息）
-                    # 使用过滤前的数据更新状态，确保所有记录都被标记为已处理
-                    update_sfc_etl_state(df_before_filter, file_path, state_file, cfg)
+                    df_before_filter = df
+                    fingerprints = sfc_record_fingerprints(df, cfg) if not df.empty else None
+                    df = filter_incremental_sfc_data(df, file_path, cfg, state_file, fingerprints,
+                                                     transaction.store, transaction.window)
                     
                     # 只对新数据合并标准时间和计算指标（节约资源）
                     if not df.empty:
@@ -1782,14 +1462,12 @@ def process_all_sfc_data(cfg: Dict[str, Any], force_full_refresh: bool = False)
                         
                         # 计算指标（LT, PT, ST, DueTime等）
                         df = calculate_sfc_metrics(df, cfg)
-                        
-                        # 立即与历史数据合并
-                        sfc_df = merge_with_history(df, history_file, cfg)
-                        # 更新历史文件（用于下一个文件的合并）
-                        save_to_parquet(sfc_df, history_file, cfg)
-                        logging.info(f"文件处理完成并已合并到历史数据: {file_path}")
+                        logging.info(f"文件处理完成: {file_path}, 新数据 {len(df)} 行")
                     else:
                         logging.info(f"文件无新数据: {file_path}")
+                    
+                    # 记录已处理的记录和文件信息（使用过滤前的数据，确保所有记录都被标记为已处理）
+                    transaction.record(file_path, df_before_filter, df, raw_hashes, fingerprints, raw_times)
                 else:
                     # 如果不启用增量处理，直接处理全部数据
                     if not df.empty:
@@ -1798,14 +1476,23 @@ def process_all_sfc_data(cfg: Dict[str, Any], force_full_refresh: bool = False)
                         
                         # 计算指标（LT, PT, ST, DueTime等）
                         df = calculate_sfc_metrics(df, cfg)
-                        
-                        # 合并历史数据
-                        sfc_df = merge_with_history(df, history_file, cfg)
-                        save_to_parquet(sfc_df, history_file, cfg)
+                        new_frames.append(df)
                     
             except Exception as e:
                 logging.warning(f"读取SFC文件失败 {file_path}: {e}")
         
+        # 提交：与历史数据合并一次，写入历史文件或发布（增量处理时再写入状态）
+        if incremental:
+            transaction.commit(publish)
+            if transaction.result is not None:
+                sfc_df = transaction.result
+        elif new_frames:
+            sfc_df = merge_with_history(pd.concat(new_frames, ignore_index=True), history_file, cfg)
+            if publish is not None:
+                sfc_df = publish(sfc_df)
+            else:
+                write_history_file(sfc_df, history_file, cfg)
+        
         if sfc_df.empty:
             logging.info("处理完成后数据为空")
             return pd.DataFrame()
@@ -1823,6 +1510,7 @@ def process_all_sfc_data(cfg: Dict[str, Any], force_full_refresh: bool = False)
             state = load_etl_state(state_file)
             if is_file_processed(sfc_path, state):
                 logging.info(f"文件已处理过，跳过: {sfc_path}")
+                save_etl_state(state_file, state)
                 history_file = cfg.get("output", {}).get("history_file", "publish/SFC_batch_report_latest.parquet")
                 history_file = os.path.join(BASE_DIR, history_file) if not os.path.isabs(history_file) else history_file
                 if os.path.exists(history_file):
@@ -1833,7 +1521,9 @@ def process_all_sfc_data(cfg: Dict[str, Any], force_full_refresh: bool = False)
                 return pd.DataFrame()
         
         logging.info(f"读取SFC数据: {sfc_path}")
-        sfc_df = read_sharepoint_excel(sfc_path)
+        deferral = get_sync_deferral(cfg)
+        read = lambda: read_sfc_excel(sfc_path, cfg, parse_cache)
+        sfc_df = deferral.call(sfc_path, read) if deferral is not None else read()
         
         if sfc_df.empty:
             return pd.DataFrame()
@@ -1843,10 +1533,11 @@ def process_all_sfc_data(cfg: Dict[str, Any], force_full_refresh: bool = False)
         
         # 增量过滤：先做去重分析，只保留新数据
         if incr_cfg.get("enabled", False):
-            sfc_df_before_filter = sfc_df.copy()
-            sfc_df = filter_incremental_sfc_data(sfc_df, sfc_path, cfg, state_file)
+            sfc_df_before_filter = sfc_df
+            fingerprints = sfc_record_fingerprints(sfc_df, cfg)
+            sfc_df = filter_incremental_sfc_data(sfc_df, sfc_path, cfg, state_file, fingerprints)
             # 使用过滤前的数据更新状态，确保所有记录都被标记为已处理
-            update_sfc_etl_state(sfc_df_before_filter, sfc_path, state_file, cfg)
+            update_sfc_etl_state(sfc_df_before_filter, sfc_path, state_file, cfg, fingerprints=fingerprints)
             
             # 只对新数据合并标准时间和计算指标（节约资源）
             if not sfc_df.empty:
@@ -1895,31 +1586,21 @@ if __name__ == "__main__":
     
     t0 = time.time()
     try:
-        # 处理SFC数据
-        sfc_result_df = process_all_sfc_data(cfg, force_full_refresh=force_full_refresh)
+        history_file = cfg.get("output", {}).get("history_file", "publish/SFC_batch_report_latest.parquet")
+        history_file = os.path.join(BASE_DIR, history_file) if not os.path.isabs(history_file) else history_file
+        published = []
+        
+        def publish(df: pd.DataFrame) -> pd.DataFrame:
+            published.append(True)
+            return publish_sfc_result(df, history_file, cfg)
+        
+        # 处理SFC数据（有新数据时在运行结束提交时发布，历史文件不再另外写入）
+        sfc_result_df = process_all_sfc_data(cfg, force_full_refresh=force_full_refresh, publish=publish)
         
         if sfc_result_df.empty:
             logging.warning("SFC处理后的数据为空，跳过保存")
-        else:
-            # 在最终保存前，对所有合并后的数据统一重新计算 PreviousBatchEndTime
-            # 确保排序准确（方案A：最终统一计算）
-            logging.info("对所有合并后的数据统一计算 PreviousBatchEndTime")
-            sfc_result_df = calculate_previous_batch_end_time(sfc_result_df)
-            
-            # 增量处理：更新状态文件
-            incr_cfg = cfg.get("incremental", {})
-            if incr_cfg.get("enabled", False):
-                # 状态已在处理过程中更新，这里只需要确保保存了
-                logging.info("增量处理：状态已更新")
-            # 保存结果
-            output_dir = cfg.get("output", {}).get("base_dir", "publish")
-            output_dir = os.path.join(BASE_DIR, output_dir) if not os.path.isabs(output_dir) else output_dir
-            os.makedirs(output_dir, exist_ok=True)
-            
-            # 保存到latest文件（只保存latest，不保存每日记录）
-            sfc_latest_file = os.path.join(output_dir, "SFC_batch_report_latest.parquet")
-            save_to_parquet(sfc_result_df, sfc_latest_file, cfg)
-            logging.info(f"SFC数据已保存: {sfc_latest_file}")
+        elif not published:
+            publish_sfc_result(sfc_result_df, history_file, cfg, write_history=False)
         
         logging.info(f"处理完成，耗时: {time.time() - t0:.2f}秒")
         
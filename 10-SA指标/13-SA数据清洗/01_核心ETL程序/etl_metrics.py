@@ -0,0 +1,392 @@
+"""
+批次报工指标列式计算
+功能：LT/PT/ST/DueTime/非工作时间/CompletionStatus/Tolerance 按整列计算（numpy掩码 + np.select），MES和SFC共用
+说明：
+- 计算结果与原逐行计算函数（calculate_lt、calculate_sfc_pt 等）保持一致，逐行版本作为测试参考实现
+  保存在 02_测试验证脚本/rowwise_oracles.py
+- 非工作时间通过策略对象区分：MES使用日历表（CalendarPolicy），SFC使用固定周末（FixedWeekendPolicy）
+- 两个模块统一调用 compute_metrics
+- 增量运行时只对输入发生变化的记录重新计算（recompute_rows），指标输入（标准时间表、日历）记录在历史Parquet元数据中
+"""
+
+import os
+import json
+import logging
+from typing import Any, Dict, Optional
+
+import numpy as np
+import pandas as pd
+
+from etl_calendar import (
+    WorkCalendar,
+    calendar_day_ordinals,
+    calculate_due_times,
+    calculate_nonworkday_hours_between,
+    calculate_weekend_hours_between,
+    adjust_weekend_due_times,
+    round_values,
+)
+
+
+# OEE默认值
+DEFAULT_OEE = 0.77
+# 换批时间（小时）
+CHANGEOVER_HOURS = 0.5
+# 容差（小时）
+TOLERANCE_HOURS = 8.0
+
+# compute_metrics 写入的列（另加策略对应的非工作时间列）
+METRIC_COLUMNS = ["LT(d)", "PT(d)", "OEE", "ST(d)", "DueTime", "CompletionStatus", "Tolerance(h)"]
+# 标准时间表提供的输入列
+STANDARD_TIME_COLUMNS = ["EH_machine(s)", "EH_labor(s)", "OEE", "Setup Time (h)"]
+# DataFrame.attrs 中记录指标输入的键（随Parquet元数据保存）
+METRIC_INPUTS_ATTR = "metric_inputs"
+
+
+def numeric_column(df: pd.DataFrame, name: str) -> pd.Series:
+    """获取数值列（float64），不存在时为全空列"""
+    if name not in df.columns:
+        return pd.Series(np.nan, index=df.index, dtype="float64")
+    return pd.to_numeric(df[name], errors="coerce").astype("float64")
+
+
+def datetime_column(df: pd.DataFrame, name: str) -> pd.Series:
+    """获取时间列（保持原时间精度），不存在时为全空列"""
+    if name not in df.columns:
+        return pd.Series(pd.NaT, index=df.index, dtype="datetime64[ns]")
+    return pd.to_datetime(df[name], errors="coerce")
+
+
+def setup_mask(df: pd.DataFrame) -> pd.Series:
+    """是否换型（Setup == "Yes"）"""
+    if "Setup" not in df.columns:
+        return pd.Series(False, index=df.index)
+    return df["Setup"] == "Yes"
+
+
+def setup_hours(df: pd.DataFrame) -> pd.Series:
+    """调试时间（小时）：仅换型且有标准换型时间时计入，否则为0"""
+    setup_time = numeric_column(df, "Setup Time (h)")
+    return setup_time.where(setup_mask(df) & setup_time.notna(), 0.0)
+
+
+def unit_time_seconds(df: pd.DataFrame) -> pd.Series:
+    """单件时间（秒）：优先EH_machine(s)，为0或空时使用EH_labor(s)，都无效时为空"""
+    machine_time_s = numeric_column(df, "EH_machine(s)")
+    labor_time_s = numeric_column(df, "EH_labor(s)")
+    return machine_time_s.where(machine_time_s > 0, labor_time_s.where(labor_time_s > 0))
+
+
+def oee_values(df: pd.DataFrame) -> Any:
+    """OEE：空值或0使用默认值0.77"""
+    if "OEE" not in df.columns:
+        return DEFAULT_OEE
+    return numeric_column(df, "OEE").fillna(DEFAULT_OEE).replace(0, DEFAULT_OEE)
+
+
+def reported_quantity(df: pd.DataFrame) -> pd.Series:
+    """报工数量 = 合格数量 + 报废数量（空值按0）"""
+    return numeric_column(df, "TrackOutQuantity").fillna(0) + numeric_column(df, "ScrapQuantity").fillna(0)
+
+
+def days_between(end: pd.Series, start: Any) -> pd.Series:
+    """时间差（天，保留2位小数），与逐行 round(total_seconds / 3600 / 24, 2) 一致"""
+    total_hours = (end - start).dt.total_seconds() / 3600
+    return pd.Series(round_values(total_hours / 24, 2), index=end.index)
+
+
+def _select_time(conditions: list, choices: list, index: pd.Index) -> pd.Series:
+    """按条件依次选择时间列，都不满足时为NaT（保持各列共同的时间精度）"""
+    values = [c.to_numpy() for c in choices]
+    selected = np.select(
+        [np.asarray(c, dtype=bool) for c in conditions],
+        values,
+        default=np.array("NaT", dtype=np.result_type(*values)),
+    )
+    return pd.Series(selected, index=index)
+
+
+def lead_time_start(df: pd.DataFrame) -> pd.Series:
+    """
+    LT开始时间
+    - 0010工序：Checkin_SFC → EnterStepTime → TrackInTime
+    - 非0010工序：EnterStepTime
+    """
+    checkin_sfc = datetime_column(df, "Checkin_SFC")
+    enter_step = datetime_column(df, "EnterStepTime")
+    trackin = datetime_column(df, "TrackInTime")
+    is_first_op = (df["Operation"] == "0010") if "Operation" in df.columns else pd.Series(False, index=df.index)
+    return _select_time(
+        [is_first_op & checkin_sfc.notna(), is_first_op & enter_step.notna(), is_first_op, enter_step.notna()],
+        [checkin_sfc, enter_step, trackin, enter_step],
+        df.index,
+    )
+
+
+def calculate_lt_column(df: pd.DataFrame) -> pd.Series:
+    """LT(d) - 实际加工时间（不扣除周末），TrackOutTime或开始时间为空时为空"""
+    if df.empty:
+        return pd.Series(dtype="float64", index=df.index)
+    return days_between(datetime_column(df, "TrackOutTime"), lead_time_start(df))
+
+
+def calculate_pt_column(df: pd.DataFrame, checkin_fallback: bool = False) -> pd.Series:
+    """
+    PT(d) - 实际加工时间（排除设备停产期）
+
+    - EnterStepTime > PreviousBatchEndTime 视为中间有停产期
+    - MES：停产期 TrackInTime → PreviousBatchEndTime；连续生产 PreviousBatchEndTime → TrackInTime
+    - SFC（checkin_fallback=True）：停产期 TrackInTime → Checkin_SFC → PreviousBatchEndTime；
+      连续生产 PreviousBatchEndTime → Checkin_SFC
+    - 结束时间不晚于开始时间时为空
+    """
+    if df.empty:
+        return pd.Series(dtype="float64", index=df.index)
+
+    trackout = datetime_column(df, "TrackOutTime")
+    previous_end = datetime_column(df, "PreviousBatchEndTime")
+    trackin = datetime_column(df, "TrackInTime")
+    enter_step = datetime_column(df, "EnterStepTime")
+
+    has_gap = enter_step.notna() & previous_end.notna() & (enter_step > previous_end)
+    if checkin_fallback:
+        checkin_sfc = datetime_column(df, "Checkin_SFC")
+        start = _select_time(
+            [has_gap & trackin.notna(), has_gap & checkin_sfc.notna(), has_gap,
+             previous_end.notna(), checkin_sfc.notna()],
+            [trackin, checkin_sfc, previous_end, previous_end, checkin_sfc],
+            df.index,
+        )
+    else:
+        start = _select_time(
+            [has_gap & trackin.notna(), has_gap, previous_end.notna(), trackin.notna()],
+            [trackin, previous_end, previous_end, trackin],
+            df.index,
+        )
+
+    return days_between(trackout, start).where(trackout > start)
+
+
+def calculate_st_column(df: pd.DataFrame) -> pd.Series:
+    """
+    ST(d) - 理论加工时间（不考虑周末）
+    ST = (调试时间 + (合格数量 + 报废数量) × 单件时间 / OEE + 0.5小时换批时间) / 24
+    """
+    if df.empty:
+        return pd.Series(dtype="float64", index=df.index)
+
+    unit_time_h = unit_time_seconds(df) / 3600
+    base_hours = setup_hours(df) + (reported_quantity(df) * unit_time_h / oee_values(df)) + CHANGEOVER_HOURS
+    st = pd.Series(round_values(base_hours / 24, 2), index=df.index)
+    return st.where(base_hours != 0)
+
+
+def calculate_status_column(df: pd.DataFrame, nonworking_column: str) -> pd.Series:
+    """
+    CompletionStatus - PT > ST + 容差 + 换批/换型时间 + 非工作时间 → Overdue，否则 OnTime
+
+    Args:
+        nonworking_column: 非工作时间列（MES为 NonWorkday(d)，SFC为 Weekend(d)），列不存在时按0计算
+    """
+    if df.empty:
+        return pd.Series(dtype="object", index=df.index)
+
+    pt = numeric_column(df, "PT(d)")
+    st = numeric_column(df, "ST(d)")
+    # 与逐行计算一致：已有Tolerance(h)列时使用该列，否则为默认8小时
+    tolerance_h = numeric_column(df, "Tolerance(h)") if "Tolerance(h)" in df.columns else TOLERANCE_HOURS
+    nonworking_d = numeric_column(df, nonworking_column) if nonworking_column in df.columns else 0.0
+
+    setup_time = numeric_column(df, "Setup Time (h)")
+    changeover = setup_time.where(setup_mask(df) & setup_time.notna(), CHANGEOVER_HOURS).replace(0, CHANGEOVER_HOURS)
+
+    threshold = st * 24 + tolerance_h + changeover + nonworking_d * 24
+    status = np.where(pt * 24 > threshold, "Overdue", "OnTime")
+    return pd.Series(status, index=df.index, dtype="object").where(pt.notna() & st.notna(), None)
+
+
+def calculate_tolerance_column(df: pd.DataFrame) -> pd.Series:
+    """Tolerance(h) - 固定8小时，DueTime或TrackOutTime为空时为空"""
+    has_both = datetime_column(df, "DueTime").notna() & datetime_column(df, "TrackOutTime").notna()
+    return pd.Series(np.where(has_both, TOLERANCE_HOURS, np.nan), index=df.index)
+
+
+def hours_to_days(hours: Any, index: pd.Index) -> pd.Series:
+    """小时数转换为天数（保留2位小数）"""
+    return pd.Series(round_values(np.asarray(hours, dtype="float64") / 24, 2), index=index)
+
+
+class CalendarPolicy:
+    """
+    日历表非工作时间策略（MES）
+
+    - DueTime：开始时间（PreviousBatchEndTime → EnterStepTime）按工作日累计工时顺延
+    - NonWorkday(d)：LT开始时间到TrackOutTime之间的非工作日时长
+    """
+
+    nonworking_column = "NonWorkday(d)"
+
+    def __init__(self, calendar: Optional[WorkCalendar] = None, daily_working_hours: float = 8.0):
+        self.calendar = calendar if calendar is not None else WorkCalendar()
+        self.daily_working_hours = daily_working_hours
+
+    def due_times(self, df: pd.DataFrame) -> pd.Series:
+        """总工时 = 调试时间 + StepInQuantity × 单件时间 / OEE + 0.5小时换批时间"""
+        if df.empty:
+            return pd.Series(pd.NaT, index=df.index, dtype="datetime64[ns]")
+
+        start = datetime_column(df, "PreviousBatchEndTime").fillna(datetime_column(df, "EnterStepTime"))
+        qty = numeric_column(df, "StepInQuantity").fillna(0)
+        total_hours = setup_hours(df) + qty * unit_time_seconds(df) / oee_values(df) / 3600 + CHANGEOVER_HOURS
+
+        due = calculate_due_times(start, total_hours, self.calendar, self.daily_working_hours)
+        return pd.Series(due, index=df.index)
+
+    def nonworking_days(self, df: pd.DataFrame) -> pd.Series:
+        """结束时间不晚于开始时间时为空"""
+        if df.empty:
+            return pd.Series(dtype="float64", index=df.index)
+
+        trackout = datetime_column(df, "TrackOutTime")
+        start = lead_time_start(df)
+        hours = calculate_nonworkday_hours_between(start, trackout, self.calendar)
+        return hours_to_days(hours, df.index).where(trackout > start)
+
+
+class FixedWeekendPolicy:
+    """
+    固定周末非工作时间策略（SFC，周六8:00 ~ 周一8:00）
+
+    - due0 = 开始时间（TrackInTime → Checkin_SFC）+ 调试时间 + (合格数量 + 报废数量) × 单件时间 / OEE + 0.5小时
+    - DueTime：due0 按周末顺延
+    - Weekend(d)：开始时间到due0之间的周末时长
+    """
+
+    nonworking_column = "Weekend(d)"
+
+    def due_window(self, df: pd.DataFrame) -> tuple:
+        """返回 (start, due0)，无法计算的行为NaT"""
+        start = datetime_column(df, "TrackInTime").fillna(datetime_column(df, "Checkin_SFC"))
+
+        unit_time_h = unit_time_seconds(df) / 3600
+        total_hours = setup_hours(df) + unit_time_h * reported_quantity(df) / oee_values(df)
+        due0 = start + pd.to_timedelta(((total_hours + CHANGEOVER_HOURS) * 3600 * 10**6).round(), unit="us")
+        return start, due0
+
+    def due_times(self, df: pd.DataFrame) -> pd.Series:
+        if df.empty:
+            return pd.Series(pd.NaT, index=df.index, dtype="datetime64[ns]")
+
+        start, due0 = self.due_window(df)
+        return pd.Series(adjust_weekend_due_times(start, due0), index=df.index)
+
+    def nonworking_days(self, df: pd.DataFrame) -> pd.Series:
+        if df.empty:
+            return pd.Series(dtype="float64", index=df.index)
+
+        start, due0 = self.due_window(df)
+        return hours_to_days(calculate_weekend_hours_between(start, due0), df.index)
+
+
+def compute_metrics(df: pd.DataFrame, policy: Any, checkin_fallback: bool = False) -> pd.DataFrame:
+    """
+    计算LT/PT/ST/DueTime/非工作时间/CompletionStatus/Tolerance（原地写入df）
+
+    Args:
+        df: 已计算PreviousBatchEndTime的数据
+        policy: 非工作时间策略（CalendarPolicy 或 FixedWeekendPolicy）
+        checkin_fallback: PT开始时间是否回退到Checkin_SFC（SFC为True）
+    """
+    # 1-2. LT(d)、PT(d)
+    df["LT(d)"] = calculate_lt_column(df)
+    df["PT(d)"] = calculate_pt_column(df, checkin_fallback=checkin_fallback)
+
+    # 3. 处理OEE默认值
+    if "OEE" in df.columns:
+        df["OEE"] = df["OEE"].fillna(DEFAULT_OEE).replace(0, DEFAULT_OEE)
+
+    # 4. 确保EH_machine(s)和EH_labor(s)字段存在
+    for col in ("EH_machine(s)", "EH_labor(s)"):
+        if col not in df.columns:
+            df[col] = None
+
+    # 5. ST(d)
+    df["ST(d)"] = calculate_st_column(df)
+
+    # 6. DueTime和非工作时间（NonWorkday(d) / Weekend(d)）
+    df["DueTime"] = policy.due_times(df)
+    df[policy.nonworking_column] = policy.nonworking_days(df)
+
+    # 7-8. CompletionStatus、Tolerance(h)
+    df["CompletionStatus"] = calculate_status_column(df, policy.nonworking_column)
+    df["Tolerance(h)"] = calculate_tolerance_column(df)
+    return df
+
+
+def recompute_rows(df: pd.DataFrame, mask: pd.Series, policy: Any, checkin_fallback: bool = False) -> pd.DataFrame:
+    """
+    只对 mask 选中的记录重新计算指标并写回（原地写入df），其余记录保持不变
+
+    Args:
+        mask: 需要重新计算的记录（与df索引对齐的布尔Series）
+    """
+    if not mask.any():
+        return df
+    # 去掉已有的输出列（OEE为输入，保留）：CompletionStatus会使用已有的Tolerance(h)列，
+    # 旧值为空（原DueTime为空）时新的状态会被误判为OnTime
+    outputs = [col for col in METRIC_COLUMNS + [policy.nonworking_column] if col != "OEE"]
+    subset = df.loc[mask].drop(columns=outputs, errors="ignore")
+    subset = compute_metrics(subset, policy, checkin_fallback=checkin_fallback)
+    for col in METRIC_COLUMNS + [policy.nonworking_column]:
+        recomputed = subset[col].reindex(df.index)
+        df[col] = df[col].where(~mask, recomputed) if col in df.columns else recomputed
+    return df
+
+
+def changed_rows(before: Any, after: Any) -> pd.Series:
+    """逐行比较两组值（Series或DataFrame，空值视为相同），返回有变化的记录"""
+    before = pd.DataFrame(before)
+    after = pd.DataFrame(after)
+    different = (before != after) & ~(before.isna() & after.isna())
+    return different.any(axis=1)
+
+
+def rows_touching_days(df: pd.DataFrame, days: np.ndarray) -> pd.Series:
+    """
+    指标计算区间（开始时间 ~ max(TrackOutTime, DueTime)）覆盖指定日历日的记录
+
+    开始时间取 LT开始时间、PreviousBatchEndTime、EnterStepTime 中最早的一个；前后各放宽1天
+    """
+    if len(days) == 0 or df.empty:
+        return pd.Series(False, index=df.index)
+
+    starts = pd.concat([lead_time_start(df), datetime_column(df, "PreviousBatchEndTime"),
+                        datetime_column(df, "EnterStepTime")], axis=1).min(axis=1)
+    ends = pd.concat([datetime_column(df, "TrackOutTime"), datetime_column(df, "DueTime")], axis=1).max(axis=1)
+    first = calendar_day_ordinals(starts) - 1
+    last = calendar_day_ordinals(ends) + 1
+    valid = (first >= 0) & (last >= 0)
+
+    days = np.sort(np.asarray(days, dtype=np.int64))
+    touched = np.searchsorted(days, last, side="right") > np.searchsorted(days, first, side="left")
+    return pd.Series(valid & touched, index=df.index)
+
+
+def file_signature(path: str) -> Optional[str]:
+    """文件签名（大小 + 修改时间），文件不存在时为None"""
+    if not path or not os.path.exists(path):
+        return None
+    stat = os.stat(path)
+    return f"{stat.st_size}:{stat.st_mtime_ns}"
+
+
+def read_metric_inputs(parquet_file: str) -> Dict[str, Any]:
+    """读取历史Parquet元数据中记录的指标输入（只读文件尾部元数据），没有记录时返回空字典"""
+    try:
+        import pyarrow.parquet as pq
+        metadata = pq.read_schema(parquet_file).metadata or {}
+        attrs = json.loads(metadata.get(b"PANDAS_ATTRS", b"{}"))
+        return attrs.get(METRIC_INPUTS_ATTR, {}) or {}
+    except Exception as e:
+        logging.warning(f"读取指标输入记录失败: {e}")
+        return {}
@@ -0,0 +1,174 @@
+"""
+按设备排序的批次序列
+功能：按 machine、TrackOutTime 一次排序，基于排序结果计算 Setup、_prev_cfn、PreviousBatchEndTime
+说明：
+- 排序后在 DataFrame.attrs 中记录排序标记，后续阶段（重复计算PreviousBatchEndTime、写Parquet）可直接复用
+- 组内上一行通过整列 shift(1) + "与上一行属于同一machine" 掩码得到，不再逐组 groupby/apply/concat
+"""
+
+from typing import Any, Dict, Tuple
+
+import numpy as np
+import pandas as pd
+
+
+# 排序键：machine 升序（空值在后），组内 TrackOutTime 升序（空值在后）
+SEQUENCE_KEYS = ("machine", "TrackOutTime")
+# DataFrame.attrs 中的排序标记
+SEQUENCE_ATTR = "sequenced_by"
+
+
+def _trackout_key(df: pd.DataFrame) -> np.ndarray:
+    """TrackOutTime排序键（int64纳秒，空值为最大值，保证排在组内最后）"""
+    trackout = pd.to_datetime(df["TrackOutTime"], errors="coerce")
+    key = trackout.to_numpy(dtype="datetime64[ns]").view("int64").copy()
+    key[trackout.isna().to_numpy()] = np.iinfo(np.int64).max
+    return key
+
+
+def sequence_order(df: pd.DataFrame) -> np.ndarray:
+    """
+    计算按 machine、TrackOutTime 排序的行位置（稳定排序，空值在后）
+
+    Returns:
+        行位置数组，df.take(order) 即为排序结果
+    """
+    codes, _ = pd.factorize(df["machine"], sort=True)
+    codes = np.where(codes < 0, np.iinfo(np.int64).max, codes)
+    return np.lexsort((_trackout_key(df), codes))
+
+
+def is_sequenced(df: pd.DataFrame) -> bool:
+    """
+    是否已按 machine、TrackOutTime 排序
+
+    仅在存在排序标记时校验（O(n)，不重新排序）；排序后又被重排的数据会重新排序
+    """
+    # 标记随Parquet元数据保存后读回为list
+    if tuple(df.attrs.get(SEQUENCE_ATTR) or ()) != SEQUENCE_KEYS or not set(SEQUENCE_KEYS).issubset(df.columns):
+        return False
+    if len(df) < 2:
+        return True
+
+    machine = df["machine"]
+    has_machine = machine.notna().to_numpy()
+    valid_count = int(has_machine.sum())
+    # 空machine必须全部排在最后
+    if not has_machine[:valid_count].all():
+        return False
+    if not machine.iloc[:valid_count].is_monotonic_increasing:
+        return False
+
+    values = machine.to_numpy()
+    key = _trackout_key(df)
+    same_machine = values[1:] == values[:-1]
+    return bool(((key[1:] >= key[:-1]) | ~same_machine).all())
+
+
+def sort_by_machine(df: pd.DataFrame, reset_index: bool = False) -> pd.DataFrame:
+    """
+    按 machine、TrackOutTime 排序（已排序时不再排序），返回带排序标记的新DataFrame
+
+    Args:
+        reset_index: 是否重置索引
+    """
+    if is_sequenced(df):
+        result = df.copy()
+    else:
+        result = df.take(sequence_order(df))
+    if reset_index:
+        result = result.reset_index(drop=True)
+    result.attrs[SEQUENCE_ATTR] = SEQUENCE_KEYS
+    return result
+
+
+def same_machine_as_previous(df: pd.DataFrame) -> pd.Series:
+    """已排序数据中，当前行与上一行是否属于同一machine（空machine不成组）"""
+    machine = df["machine"]
+    return (machine == machine.shift(1)) & machine.notna()
+
+
+def previous_in_sequence(df: pd.DataFrame, column: str) -> pd.Series:
+    """已排序数据中，同一machine上一行的值（组内第一行为空）"""
+    return df[column].shift(1).where(same_machine_as_previous(df))
+
+
+def calculate_setup(df: pd.DataFrame) -> pd.Series:
+    """Setup：同一machine上一批CFN与当前CFN相同为"No"，否则为"Yes"（df需已排序）"""
+    prev_cfn = previous_in_sequence(df, "CFN")
+    is_same = prev_cfn.notna() & (prev_cfn == df["CFN"])
+    return pd.Series(np.where(is_same, "No", "Yes"), index=df.index, dtype="object")
+
+
+def calculate_previous_end(df: pd.DataFrame) -> pd.Series:
+    """
+    PreviousBatchEndTime：同一machine上一批的TrackOutTime，第一批使用EnterStepTime（df需已排序）
+    machine 或 TrackOutTime 为空的记录为空
+    """
+    trackout = pd.to_datetime(df["TrackOutTime"], errors="coerce")
+    valid = df["machine"].notna() & trackout.notna()
+    # TrackOutTime为空的记录排在组内最后，有效记录的上一行一定也是有效记录（或属于其他machine）
+    previous_end = trackout.shift(1).where(same_machine_as_previous(df) & valid)
+    if "EnterStepTime" in df.columns:
+        enter_step = pd.to_datetime(df["EnterStepTime"], errors="coerce")
+        previous_end = previous_end.fillna(enter_step.where(valid))
+    return previous_end
+
+
+def machine_tail_mask(df: pd.DataFrame, new_df: pd.DataFrame) -> pd.Series:
+    """
+    受新数据影响的记录：新数据涉及的machine中，TrackOutTime不早于该machine最早新TrackOutTime的记录
+
+    只有这些记录的"上一批"可能因新数据插入而变化，更早的记录保持不变
+    """
+    new_trackout = pd.to_datetime(new_df["TrackOutTime"], errors="coerce")
+    since = new_trackout.groupby(new_df["machine"]).min().dropna()
+    if since.empty:
+        return pd.Series(False, index=df.index)
+
+    trackout = pd.to_datetime(df["TrackOutTime"], errors="coerce")
+    threshold = pd.to_datetime(df["machine"].map(since))
+    return (trackout >= threshold).fillna(False).astype(bool)
+
+
+def recompute_previous_end_tail(df: pd.DataFrame, new_df: pd.DataFrame) -> Tuple[pd.Series, pd.Series]:
+    """
+    增量计算PreviousBatchEndTime：只对新数据涉及machine的尾部（最早新TrackOutTime之后）重新计算
+
+    每个machine取尾部记录 + 尾部之前的最后一批（作为尾部第一条记录的上一批），排序后整列shift
+
+    Args:
+        df: 合并后的全部数据（历史 + 新数据）
+        new_df: 本次新数据（提供machine和TrackOutTime）
+    Returns:
+        (affected, previous_end)：affected为需要更新的记录掩码（df索引），previous_end为这些记录的新值
+    """
+    affected = machine_tail_mask(df, new_df)
+    if not affected.any():
+        return affected, pd.Series(dtype="datetime64[ns]")
+
+    # 尾部之前的最后一批（同一machine中TrackOutTime最大的历史记录）
+    trackout = pd.to_datetime(df["TrackOutTime"], errors="coerce")
+    touched = df["machine"].isin(df.loc[affected, "machine"].unique())
+    before = touched & ~affected & trackout.notna()
+    predecessors = trackout[before].groupby(df.loc[before, "machine"]).idxmax()
+
+    window = df.loc[affected | df.index.isin(predecessors.values)]
+    window = sort_by_machine(window)
+    previous_end = calculate_previous_end(window)
+    return affected, previous_end[affected.loc[window.index].to_numpy()]
+
+
+def parquet_sorting_kwargs(df: pd.DataFrame) -> Dict[str, Any]:
+    """
+    已排序数据写Parquet时的排序元数据（pyarrow sorting_columns），未排序时为空
+    下游读取时可据此按machine做行组裁剪
+    """
+    if not is_sequenced(df):
+        return {}
+    try:
+        import pyarrow.parquet as pq
+        columns = list(df.columns)
+        return {"sorting_columns": [pq.SortingColumn(columns.index(col), nulls_first=False) for col in SEQUENCE_KEYS]}
+    except (ImportError, AttributeError):
+        return {}
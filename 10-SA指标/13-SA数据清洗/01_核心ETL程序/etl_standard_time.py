@@ -0,0 +1,209 @@
+"""
+标准时间查找表
+功能：由SAP Routing ETL生成可直接关联的查找表（Arrow IPC文件，可内存映射加载），
+      MES/SFC按 (CFN/Material Number, Operation, Group) 整数键一次查找标准时间
+说明：
+- 键字段统一规范化为字符串（空值为''），按字典编码保存
+- 单件时间 EH_machine(s)/EH_labor(s) = Machine/Labor ÷ Quantity（Quantity为空或0按1）已预先计算
+- 多级匹配（如先Material Number后CFN）时，只对仍未匹配到单件时间的记录使用下一级
+"""
+
+import os
+import logging
+from typing import Any, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.ipc
+except ImportError:
+    pa = None
+
+
+# 查找表提供的标准时间字段
+LOOKUP_VALUE_COLUMNS = ["EH_machine(s)", "EH_labor(s)", "OEE", "Setup Time (h)"]
+# 查找表的键字段
+LOOKUP_KEY_COLUMNS = ["CFN", "Material Number", "Operation", "Group"]
+# OEE默认值
+DEFAULT_OEE = 0.77
+
+
+def normalize_key(values: Any) -> pd.Series:
+    """键字段规范化：转换为字符串，空值（nan/None）为''（与原 astype(str).replace('nan', '') 一致）"""
+    # pandas 3 的 astype(str) 保留缺失值，需另外填充
+    return pd.Series(values).astype(str).replace('nan', '').replace('None', '').fillna('')
+
+
+def lookup_artifact_path(std_time_path: str) -> str:
+    """标准时间表Parquet对应的查找表路径（同目录同名 .lookup.arrow）"""
+    return os.path.splitext(std_time_path)[0] + ".lookup.arrow"
+
+
+def build_lookup_table(std_time_df: pd.DataFrame) -> pd.DataFrame:
+    """由标准时间表（SAP_Routing_latest.parquet 内容）构建查找表"""
+    lookup = pd.DataFrame(index=std_time_df.index)
+    for col in LOOKUP_KEY_COLUMNS:
+        if col in std_time_df.columns:
+            lookup[col] = normalize_key(std_time_df[col]).to_numpy()
+
+    quantity = pd.to_numeric(std_time_df["Quantity"], errors="coerce").fillna(1).replace(0, 1) \
+        if "Quantity" in std_time_df.columns else None
+    for source, target in (("Machine", "EH_machine(s)"), ("Labor", "EH_labor(s)")):
+        if source in std_time_df.columns and quantity is not None:
+            lookup[target] = pd.to_numeric(std_time_df[source], errors="coerce") / quantity
+        else:
+            lookup[target] = np.nan
+    for col in ("OEE", "Setup Time (h)"):
+        lookup[col] = pd.to_numeric(std_time_df[col], errors="coerce") if col in std_time_df.columns else np.nan
+    return lookup.reset_index(drop=True)
+
+
+class StandardTimeLookup:
+    """标准时间查找表：键字段为字典编码（categories + 整数codes），值字段为float64"""
+
+    def __init__(self, table: pd.DataFrame, source: str = ""):
+        self.source = source
+        self.keys = {}
+        for col in LOOKUP_KEY_COLUMNS:
+            if col in table.columns:
+                self.keys[col] = pd.Categorical(table[col])
+        self.values = {col: table[col].to_numpy(dtype="float64") for col in LOOKUP_VALUE_COLUMNS}
+
+    def __len__(self) -> int:
+        return len(self.values["EH_machine(s)"])
+
+    def __repr__(self) -> str:
+        return f"StandardTimeLookup({len(self)} 行, 键: {list(self.keys)})"
+
+    def has_keys(self, columns: Sequence[str]) -> bool:
+        return all(col in self.keys for col in columns)
+
+    @classmethod
+    def from_dataframe(cls, std_time_df: pd.DataFrame, source: str = "") -> "StandardTimeLookup":
+        return cls(build_lookup_table(std_time_df), source)
+
+    def save(self, artifact_file: str) -> None:
+        """保存为Arrow IPC文件（不压缩，键字段字典编码，可内存映射加载）"""
+        arrays = {col: pa.DictionaryArray.from_arrays(
+            pa.array(cat.codes.astype(np.int32), mask=cat.codes < 0), pa.array(cat.categories.astype(str)))
+            for col, cat in self.keys.items()}
+        arrays.update({col: pa.array(values) for col, values in self.values.items()})
+        table = pa.table(arrays)
+        tmp_file = artifact_file + ".tmp"
+        with pa.OSFile(tmp_file, "wb") as sink:
+            with pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+        os.replace(tmp_file, artifact_file)
+
+    @classmethod
+    def load(cls, std_time_path: str) -> Optional["StandardTimeLookup"]:
+        """
+        加载查找表：优先内存映射读取 SAP Routing ETL 生成的 .lookup.arrow，
+        不存在或比标准时间表Parquet旧时由Parquet构建；都不可用时返回None
+        """
+        artifact = lookup_artifact_path(std_time_path)
+        parquet_exists = os.path.exists(std_time_path)
+        try:
+            if pa is not None and os.path.exists(artifact) and \
+                    (not parquet_exists or os.path.getmtime(artifact) >= os.path.getmtime(std_time_path)):
+                with pa.memory_map(artifact, "r") as source:
+                    table = pa.ipc.open_file(source).read_all().to_pandas()
+                lookup = cls(table, artifact)
+            elif parquet_exists:
+                lookup = cls.from_dataframe(pd.read_parquet(std_time_path), std_time_path)
+            else:
+                return None
+        except Exception as e:
+            logging.warning(f"加载标准时间查找表失败: {e}")
+            return None
+        logging.info(f"读取标准时间查找表: {os.path.basename(lookup.source)}, {lookup}")
+        return lookup
+
+    def _composite_codes(self, key_columns: Sequence[str], target: Sequence[pd.Series]) -> Tuple[np.ndarray, np.ndarray]:
+        """查找表和目标数据的组合整数键（目标值不在字典中时为-1）"""
+        lookup_key = np.zeros(len(self), dtype=np.int64)
+        target_key = np.zeros(len(target[0]), dtype=np.int64)
+        target_missing = np.zeros(len(target[0]), dtype=bool)
+        for col, values in zip(key_columns, target):
+            cat = self.keys[col]
+            size = len(cat.categories) + 1
+            # 只对目标列的不同取值查字典
+            target_codes, uniques = pd.factorize(values)
+            codes = pd.Index(cat.categories).get_indexer(uniques)[target_codes]
+            target_missing |= codes < 0
+            lookup_key = lookup_key * size + cat.codes
+            target_key = target_key * size + codes
+        return lookup_key, np.where(target_missing, -1, target_key)
+
+    def positions(self, key_columns: Sequence[str], target: Sequence[pd.Series]) -> np.ndarray:
+        """
+        目标记录在查找表中的行位置（未匹配为-1）
+
+        Args:
+            key_columns: 查找表键字段（如 ["Material Number", "Operation", "Group"]）
+            target: 对应的目标键值（已规范化的字符串Series）
+        """
+        if len(self) == 0:
+            return np.full(len(target[0]), -1, dtype=np.int64)
+        lookup_key, target_key = self._composite_codes(key_columns, target)
+        # 重复键取第一条
+        index = pd.Index(lookup_key)
+        first = ~index.duplicated(keep="first")
+        unique_index = index[first]
+        rows = np.flatnonzero(first)
+        pos = unique_index.get_indexer(target_key)
+        return np.where((pos >= 0) & (target_key >= 0), rows[pos], -1)
+
+
+def apply_standard_time(df: pd.DataFrame, lookup: StandardTimeLookup,
+                        passes: List[Tuple[List[str], List[str]]],
+                        keep_keys: Sequence[str] = ()) -> pd.DataFrame:
+    """
+    按多级键查找标准时间，写入 EH_machine(s)、EH_labor(s)、OEE、Setup Time (h)
+
+    Args:
+        passes: [(数据键字段, 查找表键字段), ...]，第一级匹配到的记录直接取值；
+                后续各级只用于单件时间仍为空的记录，且仅在匹配到单件时间时覆盖
+        keep_keys: 写回结果的第一级查找表键字段（匹配到的记录为查找表的值，其余为空；
+                   与原merge保留的右表键列一致，数据中已有同名字段时不写回）
+    """
+    result = df.copy()
+    n = len(result)
+    values = {col: np.full(n, np.nan) for col in LOOKUP_VALUE_COLUMNS}
+
+    # 与原合并逻辑一致：键字段统一为规范化字符串
+    for col in dict.fromkeys(col for data_cols, _ in passes for col in data_cols):
+        if col in result.columns:
+            result[col] = normalize_key(result[col]).to_numpy()
+
+    for level, (data_cols, lookup_cols) in enumerate(passes):
+        if len(lookup) == 0 or not lookup.has_keys(lookup_cols) or \
+                not all(col in result.columns for col in data_cols):
+            continue
+        pos = lookup.positions(lookup_cols, [result[col] for col in data_cols])
+        found = pos >= 0
+        if level == 0:
+            update = found
+        else:
+            unmatched = np.isnan(values["EH_machine(s)"]) & np.isnan(values["EH_labor(s)"])
+            candidate = np.where(found, pos, 0)
+            has_time = ~np.isnan(lookup.values["EH_machine(s)"][candidate]) | \
+                ~np.isnan(lookup.values["EH_labor(s)"][candidate])
+            update = unmatched & found & has_time
+            if update.any():
+                logging.info(f"第{level + 1}级匹配（{data_cols[0]} → {lookup_cols[0]}）成功: {int(update.sum())} 条记录")
+        for col in LOOKUP_VALUE_COLUMNS:
+            values[col][update] = lookup.values[col][pos[update]]
+        if level == 0:
+            for col in keep_keys:
+                if col in lookup_cols and col not in df.columns:
+                    keys = pd.Series(lookup.keys[col].astype(object))
+                    result[col] = keys.reindex(pos).to_numpy()
+
+    for col in LOOKUP_VALUE_COLUMNS:
+        result[col] = values[col]
+    # 确保OEE有默认值
+    result["OEE"] = result["OEE"].fillna(DEFAULT_OEE).replace(0, DEFAULT_OEE)
+    return result
@@ -7,10 +7,21 @@ import os
 import sys
 import time
 import logging
+import json
+import glob
+import struct
+import hashlib
 import yaml
+import numpy as np
 import pandas as pd
-from typing import Dict, List, Any, Optional
-from zipfile import BadZipFile
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from functools import lru_cache
+from itertools import islice
+from typing import Dict, List, Any, Optional, Iterator, Callable, Tuple
+from zipfile import BadZipFile, ZipFile
+
+from etl_sequencing import parquet_sorting_kwargs
 
 
 def setup_logging(cfg: Dict[str, Any], base_dir: str = None) -> None:
@@ -47,8 +58,774 @@ def load_config(config_path: str) -> Dict[str, Any]:
         return yaml.safe_load(f)
 
 
-def read_sharepoint_excel(file_path: str, max_rows: Optional[int] = None, max_retries: int = 3) -> pd.DataFrame:
-    """读取SharePoint同步的Excel文件，增强错误处理和重试机制"""
+# Excel错误值（与pd.read_excel一致，读取为空值）
+EXCEL_ERROR_VALUES = {"#NULL!", "#DIV/0!", "#VALUE!", "#REF!", "#NAME?", "#NUM!", "#N/A"}
+# 流式读取Excel的默认分块行数
+EXCEL_CHUNK_SIZE = 50000
+
+
+def _excel_column(values: List[Any]) -> pd.Series:
+    """
+    一列单元格值转换为Series，与pd.read_excel(engine='openpyxl')一致：
+    空单元格和错误值为空，整数值的浮点数转换为int，再按列推断类型
+    """
+    values = [
+        None if v is None or v == "" or (isinstance(v, str) and v in EXCEL_ERROR_VALUES)
+        else int(v) if isinstance(v, float) and v.is_integer() else v
+        for v in values
+    ]
+    column = pd.Series(values, dtype=object).infer_objects()
+    if column.dtype == object:
+        column = column.fillna(np.nan)
+    return column
+
+
+def _trim_trailing_empty_rows(rows: Iterator[tuple]) -> Iterator[tuple]:
+    """去除末尾的空行（空行暂存，遇到非空行时再输出）"""
+    pending = []
+    for row in rows:
+        if any(v is not None and v != "" for v in row):
+            yield from pending
+            pending.clear()
+            yield row
+        else:
+            pending.append(row)
+
+
+class MissingColumnsError(ValueError):
+    """源文件缺少必需列（读取表头后立即报错，不再解析数据行）"""
+
+
+def check_required_columns(names: List[str], required: Optional[List[str]], file_path: str) -> None:
+    """检查表头包含全部必需列（按去除前后空格后的列名匹配），缺少时记录错误并抛出 MissingColumnsError"""
+    if not required:
+        return
+    missing = sorted({str(col).strip() for col in required} - {str(name).strip() for name in names})
+    if missing:
+        logging.error(f"Excel文件缺少必需列 {missing}: {file_path}")
+        raise MissingColumnsError(f"Excel文件缺少必需列 {missing}: {file_path}")
+
+
+def required_source_columns(mapping: Dict[str, Any], fields: List[str], extra: Optional[List[str]] = None) -> List[str]:
+    """
+    标准字段对应的Excel原始列（按字段映射反查，去重保持顺序）+ 额外的原始列
+    映射中没有的字段视为原始列名未改名，按字段名本身要求
+    """
+    reverse_mapping = {v: k for k, v in mapping.items() if v and not str(v).startswith('#')}
+    columns = [reverse_mapping.get(field, field) for field in fields] + list(extra or [])
+    return list(dict.fromkeys(columns))
+
+
+def read_excel_header(file_path: str) -> List[str]:
+    """只读取第一个工作表的表头行（openpyxl只读模式）"""
+    from openpyxl import load_workbook
+    
+    workbook = load_workbook(file_path, read_only=True, data_only=True)
+    try:
+        header = next(workbook.worksheets[0].iter_rows(max_row=1, values_only=True), ())
+        return ["" if v is None else str(v) for v in header]
+    finally:
+        workbook.close()
+
+
+def _column_positions(names: List[str], columns: Optional[List[str]]) -> List[int]:
+    """表头中需要读取的列位置（按去除前后空格后的列名匹配），None表示全部有列名的列"""
+    if columns is None:
+        return [i for i, name in enumerate(names) if name]
+    wanted = {str(col).strip() for col in columns}
+    positions = [i for i, name in enumerate(names) if name.strip() in wanted]
+    missing = wanted - {names[i].strip() for i in positions}
+    if missing:
+        logging.warning(f"Excel文件缺少列: {sorted(missing)}")
+    return positions
+
+
+def _rows_frame(chunk: List[tuple], names: List[str], positions: List[int]) -> pd.DataFrame:
+    """一块行值按列位置构造DataFrame"""
+    width = len(names)
+    return pd.DataFrame({
+        names[i]: _excel_column([row[i] if i < len(row) else None for row in chunk])
+        for i in positions if i < width
+    })
+
+
+def iter_excel_chunks(file_path: str, columns: Optional[List[str]] = None,
+                      chunk_size: int = EXCEL_CHUNK_SIZE, max_rows: Optional[int] = None,
+                      required: Optional[List[str]] = None) -> Iterator[pd.DataFrame]:
+    """
+    流式读取Excel第一个工作表（openpyxl只读模式逐行迭代），按固定行数分块返回DataFrame
+    
+    Args:
+        columns: 只读取的列（按去除前后空格后的表头匹配），None表示读取全部列
+        chunk_size: 每块行数
+        max_rows: 最多读取的数据行数（测试模式）
+        required: 必需列，表头缺少时抛出 MissingColumnsError
+    说明：
+        只为所需列构造值，不生成整表单元格对象，峰值内存只与块大小和所需列数有关；
+        末尾的空行去除，中间的空行保留为空记录，与pd.read_excel一致
+    """
+    from openpyxl import load_workbook
+    
+    workbook = load_workbook(file_path, read_only=True, data_only=True)
+    try:
+        rows = workbook.worksheets[0].iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            return
+        names = ["" if v is None else str(v) for v in header]
+        check_required_columns(names, required, file_path)
+        positions = _column_positions(names, columns)
+        
+        rows = _trim_trailing_empty_rows(rows)
+        if max_rows:
+            rows = islice(rows, max_rows)
+        while True:
+            chunk = list(islice(rows, chunk_size))
+            if not chunk:
+                break
+            yield _rows_frame(chunk, names, positions)
+    finally:
+        workbook.close()
+
+
+# 追加读取时校验的前缀末尾行数
+EXCEL_CHECKPOINT_SAMPLE_ROWS = 20
+
+# 跳过行解析使用的openpyxl内部接口（WorkSheetParser等）已验证的版本范围（见 requirements.txt）
+OPENPYXL_TESTED_VERSIONS = ((3, 1), (3, 2))
+
+# 内部接口变化时抛出的异常（此时改用公开接口全量读取）
+PRIVATE_READER_ERRORS = (ImportError, AttributeError, TypeError)
+
+
+@lru_cache(maxsize=None)
+def openpyxl_private_reader_available() -> bool:
+    """
+    检查一次openpyxl内部逐行解析接口是否可用（版本在已验证范围内且接口存在）
+    不可用时 _iter_sheet_rows 使用公开的 iter_rows 逐行读取（不能跳过检查点之前的行）
+    """
+    import openpyxl
+    version = tuple(int(part) for part in openpyxl.__version__.split(".")[:2] if part.isdigit())
+    low, high = OPENPYXL_TESTED_VERSIONS
+    if not low <= version < high:
+        logging.warning(f"openpyxl {openpyxl.__version__} 不在已验证的版本范围内，Excel追加读取改为全量读取")
+        return False
+    try:
+        from openpyxl.worksheet._reader import WorkSheetParser, ROW_TAG
+        from openpyxl.worksheet._read_only import ReadOnlyWorksheet
+        for owner, attr in ((WorkSheetParser, "parse_row"), (ReadOnlyWorksheet, "_get_source")):
+            if not hasattr(owner, attr):
+                raise AttributeError(f"{owner.__name__}.{attr}")
+    except PRIVATE_READER_ERRORS as e:
+        logging.warning(f"openpyxl内部解析接口不可用，Excel追加读取改为全量读取: {e}")
+        return False
+    return True
+
+
+def _iter_public_rows(file_path: str) -> Iterator[Tuple[int, tuple]]:
+    """逐行返回第一个工作表的 (行号, 值元组)（公开接口 iter_rows，缺失的行为空值）"""
+    from openpyxl import load_workbook
+    
+    workbook = load_workbook(file_path, read_only=True, data_only=True)
+    try:
+        for idx, values in enumerate(workbook.worksheets[0].iter_rows(values_only=True), 1):
+            yield idx, values
+    finally:
+        workbook.close()
+
+
+def _iter_sheet_rows(file_path: str, skip: Tuple[int, int] = (0, 0)) -> Iterator[Tuple[int, tuple]]:
+    """
+    逐行返回Excel第一个工作表的 (行号, 值元组)，缺失的行返回空元组
+    
+    skip=(start, stop) 范围内的行只推进行号、不解析单元格（不查共享字符串、不转换数字和日期），
+    也不返回；其余行的取值与 iter_rows(values_only=True) 相同
+    使用openpyxl内部接口（WorkSheetParser）；接口不可用时抛出 PRIVATE_READER_ERRORS 中的异常
+    """
+    if not openpyxl_private_reader_available():
+        raise ImportError("openpyxl内部解析接口不可用")
+    from openpyxl import load_workbook
+    from openpyxl.worksheet._reader import WorkSheetParser, ROW_TAG
+    from openpyxl.xml.functions import iterparse
+    
+    start, stop = skip
+    workbook = load_workbook(file_path, read_only=True, data_only=True)
+    try:
+        worksheet = workbook.worksheets[0]
+        with worksheet._get_source() as src:
+            parser = WorkSheetParser(src, worksheet._shared_strings, data_only=True, epoch=workbook.epoch,
+                                     date_formats=workbook._date_formats,
+                                     timedelta_formats=workbook._timedelta_formats)
+            expected = 1
+            for _, element in iterparse(src):
+                if element.tag != ROW_TAG:
+                    continue
+                r = element.get("r")
+                idx = int(float(r)) if r else parser.row_counter + 1
+                if start <= idx < stop:
+                    parser.row_counter = idx
+                    element.clear()
+                    expected = idx + 1
+                    continue
+                idx, cells = parser.parse_row(element)
+                element.clear()
+                for missing in range(max(expected, stop) if start <= expected < stop else expected, idx):
+                    yield missing, ()
+                values = [None] * max((cell["column"] for cell in cells), default=0)
+                for cell in cells:
+                    values[cell["column"] - 1] = cell["value"]
+                yield idx, tuple(values)
+                expected = idx + 1
+    finally:
+        workbook.close()
+
+
+def _row_key(values: tuple) -> str:
+    """行内容标识（去除末尾空单元格），用于前缀校验"""
+    values = list(values)
+    while values and (values[-1] is None or values[-1] == ""):
+        values.pop()
+    return repr(tuple(values))
+
+
+def _rows_digest(keys: List[str]) -> str:
+    return hashlib.blake2b("\n".join(keys).encode('utf-8'), digest_size=16).hexdigest()
+
+
+def _collect_rows(rows: Iterator[Tuple[int, tuple]], names: List[str], positions: List[int], chunk_size: int,
+                  sample_rows: int, last_row: int, recent: List[str]) -> Tuple[List[pd.DataFrame], int, List[str]]:
+    """
+    行值分块构造DataFrame（末尾空行去除），同时记录最后一个非空行号和末尾 sample_rows 行的内容标识
+    """
+    from collections import deque
+    
+    recent = deque(recent, maxlen=sample_rows)
+    frames, chunk, blank = [], [], 0
+    empty_key = _row_key(())
+    for idx, values in rows:
+        key = _row_key(values)
+        if key == empty_key:
+            blank += 1
+            continue
+        if blank:
+            chunk.extend([()] * blank)
+            recent.extend([empty_key] * min(blank, sample_rows))
+            blank = 0
+        chunk.append(values)
+        recent.append(key)
+        last_row = idx
+        if len(chunk) >= chunk_size:
+            frames.append(_rows_frame(chunk, names, positions))
+            chunk = []
+    if chunk:
+        frames.append(_rows_frame(chunk, names, positions))
+    return frames, last_row, list(recent)
+
+
+class ExcelTailCheckpoint:
+    """
+    持续追加的Excel工作簿（如MES财年导出文件）的读取检查点：只解析上次读取之后追加的行
+    
+    说明：
+    - 每个工作簿（按路径和读取的列）保存一个检查点：表头、最后数据行号、末尾若干行的内容摘要，
+      以及已解析的数据（Parquet）
+    - 再次读取时不解析检查点之前各行的单元格，只解析末尾校验行和新追加的行；
+      校验行摘要或表头不一致（前缀被修改、行被删除或插入）时全量解析
+    - 校验只覆盖前缀末尾的行，更早的行被修改时需删除检查点（或使用全量刷新）
+    """
+    
+    def __init__(self, checkpoint_dir: str, sample_rows: int = EXCEL_CHECKPOINT_SAMPLE_ROWS):
+        self.checkpoint_dir = checkpoint_dir
+        self.sample_rows = sample_rows
+    
+    def _paths(self, file_path: str, columns: Optional[List[str]]) -> Tuple[str, str]:
+        identity = f"{os.path.normcase(os.path.abspath(file_path))}|columns={columns}"
+        name = hashlib.blake2b(identity.encode('utf-8'), digest_size=10).hexdigest()
+        base = os.path.join(self.checkpoint_dir, name)
+        return base + ".json", base + ".parquet"
+    
+    def _load(self, file_path: str, columns: Optional[List[str]]) -> Tuple[Optional[Dict[str, Any]], Optional[pd.DataFrame]]:
+        """读取检查点和已解析数据（不存在、损坏或行数不一致时返回None）"""
+        meta_path, data_path = self._paths(file_path, columns)
+        if not (os.path.exists(meta_path) and os.path.exists(data_path)):
+            return None, None
+        try:
+            with open(meta_path, 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+            data = pd.read_parquet(data_path)
+        except Exception as e:
+            logging.warning(f"读取Excel检查点失败，全量解析: {e}")
+            return None, None
+        if len(data) != meta.get("rows") or meta.get("sample_rows") != self.sample_rows:
+            return None, None
+        return meta, data
+    
+    def _save(self, file_path: str, columns: Optional[List[str]], meta: Dict[str, Any], data: pd.DataFrame) -> None:
+        """先写数据再写检查点（写入失败只记录警告）"""
+        meta_path, data_path = self._paths(file_path, columns)
+        os.makedirs(self.checkpoint_dir, exist_ok=True)
+        try:
+            _parquet_safe(data).to_parquet(data_path + ".tmp", index=False, engine='pyarrow')
+            os.replace(data_path + ".tmp", data_path)
+            with open(meta_path + ".tmp", 'w', encoding='utf-8') as f:
+                json.dump(dict(meta, rows=len(data), file=file_path, columns=columns), f, ensure_ascii=False)
+            os.replace(meta_path + ".tmp", meta_path)
+        except Exception as e:
+            logging.warning(f"写入Excel检查点失败: {e}")
+    
+    def _parse(self, file_path: str, columns: Optional[List[str]], chunk_size: int,
+               meta: Optional[Dict[str, Any]] = None, required: Optional[List[str]] = None,
+               private: bool = True) -> Optional[Tuple[List[pd.DataFrame], Dict[str, Any]]]:
+        """
+        解析工作表；meta不为空时跳过检查点之前的行，只解析校验行和追加行（校验失败返回None）
+        private为False时使用公开接口逐行读取（只用于全量解析）
+        """
+        last_row, sample_keys = 1, []
+        skip = (0, 0)
+        if meta is not None:
+            last_row = meta["last_row"]
+            sample_start = max(2, last_row - self.sample_rows + 1)
+            skip = (2, sample_start)
+        
+        rows = _iter_sheet_rows(file_path, skip) if private else _iter_public_rows(file_path)
+        try:
+            first = next(rows, None)
+            names = [] if first is None else ["" if v is None else str(v) for v in first[1]]
+            if meta is not None:
+                if names != meta["header"]:
+                    return None
+                for idx, values in rows if last_row >= sample_start else ():
+                    sample_keys.append(_row_key(values))
+                    if idx >= last_row:
+                        break
+                if len(sample_keys) != last_row - sample_start + 1 or _rows_digest(sample_keys) != meta["sample_hash"]:
+                    return None
+            check_required_columns(names, required, file_path)
+            positions = _column_positions(names, columns)
+            frames, last_row, recent = _collect_rows(rows, names, positions, chunk_size, self.sample_rows,
+                                                     last_row, sample_keys)
+        finally:
+            rows.close()
+        return frames, {"header": names, "last_row": last_row, "sample_rows": self.sample_rows,
+                        "sample_hash": _rows_digest(recent)}
+    
+    def clear(self, file_path: str, columns: Optional[List[str]] = None) -> None:
+        """删除工作簿的检查点（下次读取时全量解析）"""
+        for path in self._paths(file_path, columns):
+            if os.path.exists(path):
+                os.remove(path)
+    
+    def read(self, file_path: str, columns: Optional[List[str]] = None, chunk_size: int = EXCEL_CHUNK_SIZE,
+             required: Optional[List[str]] = None) -> pd.DataFrame:
+        """
+        读取工作簿：前缀校验通过时只解析追加的行并与已解析数据合并，否则全量解析；读取后更新检查点
+        openpyxl内部解析接口不可用（版本变化）时使用公开接口全量解析
+        """
+        meta, prefix = self._load(file_path, columns)
+        try:
+            parsed = self._parse(file_path, columns, chunk_size, meta, required) if meta is not None else None
+            private = True
+        except PRIVATE_READER_ERRORS as e:
+            logging.warning(f"Excel追加读取失败（openpyxl内部接口不可用），使用公开接口全量解析: {e}")
+            parsed, private = None, False
+        if parsed is not None:
+            frames, new_meta = parsed
+            appended = sum(len(frame) for frame in frames)
+            logging.info(f"Excel追加读取: {os.path.basename(file_path)}, 已解析 {len(prefix)} 行, 追加 {appended} 行")
+            if not appended:
+                return prefix
+            # 追加行中全部为空的列按已解析数据的类型合并（避免日期列变为object）
+            for frame in frames:
+                for col in frame.columns:
+                    if col in prefix.columns and prefix[col].dtype != object and frame[col].isna().all():
+                        frame[col] = frame[col].astype(prefix[col].dtype)
+            result = pd.concat([prefix] + frames, ignore_index=True)
+        else:
+            if meta is not None:
+                logging.info(f"Excel前缀校验不一致，全量解析: {os.path.basename(file_path)}")
+            try:
+                frames, new_meta = self._parse(file_path, columns, chunk_size, required=required, private=private)
+            except PRIVATE_READER_ERRORS as e:
+                if not private:
+                    raise
+                logging.warning(f"Excel解析失败（openpyxl内部接口不可用），使用公开接口全量解析: {e}")
+                frames, new_meta = self._parse(file_path, columns, chunk_size, required=required, private=False)
+            result = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+            logging.info(f"Excel全量解析: {os.path.basename(file_path)}, {len(result)} 行")
+        self._save(file_path, columns, new_meta, result)
+        return result
+
+
+def file_fingerprint(file_path: str, block_size: int = 1 << 20) -> str:
+    """文件内容指纹（blake2b，与路径和修改时间无关）"""
+    digest = hashlib.blake2b(digest_size=20)
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def zip_content_fingerprint(file_path: str) -> str:
+    """
+    xlsx等ZIP文件的内容指纹：文件大小 + 各成员的名称、CRC32和解压后大小（只读取中央目录，不解压成员）
+    与修改时间无关；不是ZIP文件（或ZIP不完整）时按全部内容计算（见 file_fingerprint）
+    """
+    size = os.path.getsize(file_path)
+    try:
+        with ZipFile(file_path) as zf:
+            digest = hashlib.blake2b(digest_size=16)
+            for info in zf.infolist():
+                digest.update(f"{info.filename}|{info.CRC:08x}|{info.file_size}\n".encode('utf-8'))
+    except BadZipFile:
+        return f"file:{size}:{file_fingerprint(file_path)}"
+    return f"zip:{size}:{digest.hexdigest()}"
+
+
+class ParseCache:
+    """
+    源文件解析缓存：按文件内容指纹保存解析后的原始工作表（Parquet），内容不变的文件直接读取缓存
+    
+    说明：
+    - 缓存文件名为 内容指纹-解析参数摘要.parquet，文件移动/重新同步但内容不变时仍命中
+    - 读取命中时更新缓存文件修改时间，写入后按修改时间淘汰最旧的缓存，总大小不超过 max_bytes
+    - 无法直接保存为Parquet的混合类型列（如数字和文本混合的批次号）按字符串保存
+    """
+    
+    def __init__(self, cache_dir: str, max_bytes: int = 2 * 1024 ** 3):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+    
+    def key(self, file_path: str, variant: str = "") -> str:
+        """缓存键：文件内容指纹 + 解析参数（如读取的列、行数）摘要"""
+        variant_digest = hashlib.blake2b(variant.encode('utf-8'), digest_size=4).hexdigest()
+        return f"{file_fingerprint(file_path)}-{variant_digest}"
+    
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.parquet")
+    
+    def get(self, key: str) -> Optional[pd.DataFrame]:
+        """读取缓存（不存在或损坏时返回None）"""
+        path = self._path(key)
+        if not os.path.exists(path):
+            return None
+        try:
+            df = pd.read_parquet(path)
+        except Exception as e:
+            logging.warning(f"读取解析缓存失败，重新解析: {path}: {e}")
+            return None
+        os.utime(path)
+        return df
+    
+    def put(self, key: str, df: pd.DataFrame) -> None:
+        """写入缓存并按LRU淘汰（写入失败只记录警告）"""
+        if not all(isinstance(col, str) for col in df.columns):
+            logging.debug("列名不全是字符串，不写入解析缓存")
+            return
+        os.makedirs(self.cache_dir, exist_ok=True)
+        path = self._path(key)
+        tmp_path = path + ".tmp"
+        try:
+            _parquet_safe(df).to_parquet(tmp_path, index=False, engine='pyarrow')
+            os.replace(tmp_path, path)
+        except Exception as e:
+            logging.warning(f"写入解析缓存失败: {e}")
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return
+        self.evict()
+    
+    def evict(self) -> None:
+        """按最近使用时间淘汰缓存文件，直到总大小不超过上限"""
+        entries = []
+        for entry in os.scandir(self.cache_dir):
+            if entry.is_file() and entry.name.endswith(".parquet"):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+                total -= size
+                logging.info(f"淘汰解析缓存: {os.path.basename(path)}")
+            except OSError as e:
+                logging.warning(f"删除解析缓存失败: {path}: {e}")
+    
+    def read(self, file_path: str, parse: Callable[[], pd.DataFrame], variant: str = "") -> pd.DataFrame:
+        """读取文件：缓存命中时读取Parquet，否则调用 parse() 解析并写入缓存"""
+        key = self.key(file_path, variant)
+        df = self.get(key)
+        if df is not None:
+            logging.info(f"解析缓存命中: {os.path.basename(file_path)}, {len(df)} 行")
+            return df
+        df = parse()
+        self.put(key, df)
+        return df
+
+
+def _parquet_safe(df: pd.DataFrame) -> pd.DataFrame:
+    """无法转换为Arrow的混合类型object列转换为字符串（保留空值）"""
+    import pyarrow as pa
+    
+    result = df
+    for col in df.columns:
+        if df[col].dtype != object:
+            continue
+        try:
+            pa.array(df[col], from_pandas=True)
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            if result is df:
+                result = df.copy()
+            result[col] = df[col].map(lambda v: v if pd.isna(v) else str(v)).astype(object)
+    return result
+
+
+def get_parse_cache(cfg: Dict[str, Any], base_dir: str = None) -> Optional[ParseCache]:
+    """
+    按配置创建解析缓存（parse_cache.enabled 未启用时返回None）
+    
+    配置项：
+    - parse_cache.dir: 缓存目录（相对路径相对于base_dir）
+    - parse_cache.max_size_mb: 缓存总大小上限（MB）
+    """
+    cache_cfg = cfg.get("parse_cache", {}) or {}
+    if not cache_cfg.get("enabled", False):
+        return None
+    if base_dir is None:
+        base_dir = get_base_dir()
+    cache_dir = cache_cfg.get("dir", os.path.join("..", "08_临时文件", "parse_cache"))
+    if not os.path.isabs(cache_dir):
+        cache_dir = os.path.join(base_dir, cache_dir)
+    return ParseCache(cache_dir, int(cache_cfg.get("max_size_mb", 2048)) * 1024 * 1024)
+
+
+# Excel读取引擎：auto表示已安装python-calamine时使用calamine，否则使用openpyxl
+EXCEL_ENGINES = ("auto", "calamine", "openpyxl")
+
+
+@lru_cache(maxsize=None)
+def resolve_excel_engine(engine: Optional[str] = "auto") -> str:
+    """
+    解析Excel读取引擎名称
+    calamine（Rust实现，需要 python-calamine 和 pandas>=2.2）不可用时回退到openpyxl
+    """
+    engine = (engine or "auto").lower()
+    if engine not in EXCEL_ENGINES:
+        logging.warning(f"未知的Excel读取引擎 {engine}，使用openpyxl")
+        return "openpyxl"
+    if engine == "openpyxl":
+        return engine
+    import importlib.util
+    pandas_version = tuple(int(part) for part in pd.__version__.split(".")[:2] if part.isdigit())
+    available = importlib.util.find_spec("python_calamine") is not None and pandas_version >= (2, 2)
+    if available:
+        return "calamine"
+    if engine == "calamine":
+        logging.warning("未安装python-calamine，Excel读取引擎回退到openpyxl")
+    return "openpyxl"
+
+
+def get_excel_engine(cfg: Dict[str, Any]) -> str:
+    """按配置 source.excel_engine（auto/calamine/openpyxl）确定Excel读取引擎"""
+    return resolve_excel_engine(cfg.get("source", {}).get("excel_engine", "auto"))
+
+
+def read_excel_sheet(file_path: str, engine: Optional[str] = "auto", columns: Optional[List[str]] = None,
+                     nrows: Optional[int] = None, required: Optional[List[str]] = None) -> pd.DataFrame:
+    """
+    用指定引擎读取Excel第一个工作表（calamine与openpyxl读取的日期、整数、文本列类型和取值一致）
+    
+    Args:
+        columns: 只读取的列（按去除前后空格后的表头匹配），None表示全部列
+        nrows: 最多读取的数据行数
+        required: 必需列，先读取表头检查，缺少时抛出 MissingColumnsError（不解析数据行）
+    """
+    engine = resolve_excel_engine(engine)
+    if required:
+        check_required_columns(read_excel_header(file_path), required, file_path)
+    usecols = None
+    if columns is not None:
+        wanted = {str(col).strip() for col in columns}
+        usecols = lambda name: str(name).strip() in wanted
+    df = pd.read_excel(file_path, engine=engine, sheet_name=0, nrows=nrows, usecols=usecols)
+    if columns is not None:
+        missing = wanted - {str(col).strip() for col in df.columns}
+        if missing:
+            logging.warning(f"Excel文件缺少列: {sorted(missing)}")
+    return df
+
+
+def get_excel_checkpoint(cfg: Dict[str, Any], base_dir: str = None) -> Optional[ExcelTailCheckpoint]:
+    """
+    按配置创建追加读取检查点（source.excel_checkpoint.enabled 未启用时返回None）
+    
+    配置项：
+    - source.excel_checkpoint.dir: 检查点目录（相对路径相对于base_dir）
+    - source.excel_checkpoint.sample_rows: 校验的前缀末尾行数
+    """
+    checkpoint_cfg = cfg.get("source", {}).get("excel_checkpoint", {}) or {}
+    if not checkpoint_cfg.get("enabled", False):
+        return None
+    if base_dir is None:
+        base_dir = get_base_dir()
+    checkpoint_dir = checkpoint_cfg.get("dir", os.path.join("..", "08_临时文件", "excel_checkpoint"))
+    if not os.path.isabs(checkpoint_dir):
+        checkpoint_dir = os.path.join(base_dir, checkpoint_dir)
+    return ExcelTailCheckpoint(checkpoint_dir, int(checkpoint_cfg.get("sample_rows", EXCEL_CHECKPOINT_SAMPLE_ROWS)))
+
+
+class SyncNotReadyError(OSError):
+    """文件同步未完成或被占用（推迟到本次运行末尾重试，见 SyncDeferral；消息为原因，不含文件路径）"""
+
+
+# 同步中的临时文件（存在时文件未就绪）
+SYNC_SIBLING_NAMES = ("{name}.tmp", "{name}.lock")
+# Excel所有者文件（工作簿在Excel中打开时存在，长文件名时替换前两个字符）：只记录警告，
+# 文件确实被占用时由实际读取报告（PermissionError）
+EXCEL_OWNER_NAMES = ("~${name}", "~${name2}")
+# ZIP中央目录结束记录（固定22字节 + 最长65535字节注释）
+_ZIP_EOCD_SIGNATURE = b"PK\x05\x06"
+_ZIP_EOCD_STRUCT = struct.Struct("<4s4H2LH")
+
+
+def probe_sync_ready(file_path: str) -> Optional[str]:
+    """
+    不解析内容检查文件是否可读取：无同步临时文件（.tmp/.lock），且xlsx的ZIP中央目录完整
+    （只读取文件末尾和中央目录开头几个字节）；存在Excel所有者文件（~$）时只记录警告
+    
+    Returns:
+        未就绪的原因，就绪时返回None
+    """
+    directory, name = os.path.split(file_path)
+    for pattern in SYNC_SIBLING_NAMES:
+        sibling = pattern.format(name=name, name2=name[2:])
+        if os.path.exists(os.path.join(directory, sibling)):
+            return f"存在锁/临时文件 {sibling}"
+    for pattern in EXCEL_OWNER_NAMES:
+        owner = pattern.format(name=name, name2=name[2:])
+        if os.path.exists(os.path.join(directory, owner)):
+            logging.warning(f"工作簿可能在Excel中打开（存在 {owner}），继续读取: {file_path}")
+            break
+    if not file_path.lower().endswith((".xlsx", ".xlsm")):
+        return None
+    try:
+        with open(file_path, "rb") as f:
+            size = f.seek(0, os.SEEK_END)
+            tail_size = min(size, _ZIP_EOCD_STRUCT.size + 0xFFFF)
+            f.seek(size - tail_size)
+            tail = f.read(tail_size)
+            pos = tail.rfind(_ZIP_EOCD_SIGNATURE)
+            if pos < 0 or pos + _ZIP_EOCD_STRUCT.size > len(tail):
+                return "未找到ZIP中央目录（文件可能未同步完成）"
+            _, _, _, _, entries, cd_size, cd_offset, _ = _ZIP_EOCD_STRUCT.unpack_from(tail, pos)
+            if cd_offset == 0xFFFFFFFF or entries == 0xFFFF:
+                return None  # ZIP64，不再校验
+            eocd_offset = size - tail_size + pos
+            if entries == 0 or cd_offset + cd_size > eocd_offset:
+                return "ZIP中央目录不完整（文件可能未同步完成）"
+            f.seek(cd_offset)
+            if f.read(4) != b"PK\x01\x02":
+                return "ZIP中央目录位置无效（文件可能未同步完成）"
+    except PermissionError:
+        return "文件被占用"
+    except OSError as e:
+        return f"无法读取文件: {e}"
+    return None
+
+
+def ensure_sync_ready(file_path: str) -> None:
+    """文件未就绪时立即抛出 SyncNotReadyError（不等待）"""
+    reason = probe_sync_ready(file_path)
+    if reason:
+        logging.warning(f"Excel文件未就绪（{reason}），推迟读取: {file_path}")
+        raise SyncNotReadyError(reason)
+
+
+class SyncDeferral:
+    """
+    同步未就绪文件的推迟队列：先处理其他文件，本次运行末尾等待 retry_wait 秒后重试（最多 retries 轮），
+    deferred 记录推迟过的文件及原因，unresolved 为最终仍未就绪的文件
+    """
+    
+    def __init__(self, retry_wait: float = 30.0, retries: int = 1):
+        self.retry_wait = retry_wait
+        self.retries = retries
+        self.deferred: Dict[str, str] = {}
+        self.unresolved: List[str] = []
+    
+    def defer(self, file_path: str, reason: str) -> None:
+        self.deferred[file_path] = reason
+    
+    def split(self, file_paths: List[str]) -> Tuple[List[str], List[str]]:
+        """按就绪探测拆分为 (就绪, 推迟)"""
+        ready, deferred = [], []
+        for file_path in file_paths:
+            reason = probe_sync_ready(file_path)
+            if reason:
+                logging.warning(f"Excel文件未就绪（{reason}），推迟到最后读取: {file_path}")
+                self.defer(file_path, reason)
+                deferred.append(file_path)
+            else:
+                ready.append(file_path)
+        return ready, deferred
+    
+    def wait(self, round_no: int, count: int) -> None:
+        logging.info(f"等待 {self.retry_wait} 秒后重试 {count} 个推迟的文件（第{round_no}轮）")
+        time.sleep(self.retry_wait)
+    
+    def call(self, file_path: str, read: Callable[[], pd.DataFrame]) -> pd.DataFrame:
+        """单个文件读取：未就绪时等待后重试，仍未就绪时抛出 SyncNotReadyError"""
+        for round_no in range(self.retries + 1):
+            try:
+                return read()
+            except SyncNotReadyError as e:
+                self.defer(file_path, str(e))
+                if round_no == self.retries:
+                    self.unresolved.append(file_path)
+                    self.log_summary()
+                    raise
+                self.wait(round_no + 1, 1)
+    
+    def log_summary(self) -> None:
+        """记录推迟的文件：已在重试中读取的和最终仍未就绪的"""
+        if not self.deferred:
+            return
+        recovered = [path for path in self.deferred if path not in self.unresolved]
+        if recovered:
+            logging.info(f"推迟后读取成功的文件 {len(recovered)} 个: {recovered}")
+        for path in self.unresolved:
+            logging.error(f"文件同步未完成，本次未处理: {path}（{self.deferred[path]}）")
+        if self.unresolved:
+            logging.error("建议：等待SharePoint同步完成后重新运行；检查是否有 .tmp/.lock 文件或文件在Excel中打开")
+
+
+def get_sync_deferral(cfg: Dict[str, Any]) -> Optional[SyncDeferral]:
+    """按配置创建推迟队列（source.sync_deferral.enabled 为false时返回None）"""
+    deferral_cfg = cfg.get("source", {}).get("sync_deferral", {}) or {}
+    if not deferral_cfg.get("enabled", True):
+        return None
+    return SyncDeferral(float(deferral_cfg.get("retry_wait_seconds", 30)), int(deferral_cfg.get("retries", 1)))
+
+
+def read_sharepoint_excel(file_path: str, max_rows: Optional[int] = None, max_retries: int = 3,
+                          columns: Optional[List[str]] = None, chunk_size: int = EXCEL_CHUNK_SIZE,
+                          cache: Optional[ParseCache] = None,
+                          checkpoint: Optional[ExcelTailCheckpoint] = None,
+                          engine: Optional[str] = "openpyxl",
+                          required: Optional[List[str]] = None) -> pd.DataFrame:
+    """
+    读取SharePoint同步的Excel文件，增强错误处理和重试机制
+    同步未完成（锁/临时文件、ZIP不完整）或文件被占用时不等待，立即抛出 SyncNotReadyError，
+    由调用方推迟到运行末尾重试（见 SyncDeferral）
+    
+    Args:
+        columns: 指定时只读取这些列；openpyxl引擎逐行流式读取（见 iter_excel_chunks）
+        engine: Excel读取引擎（auto/calamine/openpyxl，见 resolve_excel_engine）
+        required: 必需列，表头缺少时立即抛出 MissingColumnsError（不重试）
+        cache: 解析缓存，内容未变化的文件直接读取缓存的Parquet
+        checkpoint: 追加读取检查点，内容变化的文件只解析上次读取后追加的行（测试模式不使用）
+    """
     if not os.path.exists(file_path):
         raise FileNotFoundError(f"Excel文件不存在: {file_path}")
     
@@ -59,44 +836,43 @@ def read_sharepoint_excel(file_path: str, max_rows: Optional[int] = None, max_re
     if file_size < 1024:  # 小于1KB可能是损坏文件
         logging.warning(f"Excel文件大小异常 ({file_size} bytes): {file_path}")
     
-    # 重试机制
+    # 检查文件是否被锁定或未同步完成（SharePoint同步时常见）
+    ensure_sync_ready(file_path)
+    
+    # 重试机制（未知错误）
     for attempt in range(max_retries):
         try:
-            # 检查文件是否被锁定（SharePoint同步时常见）
             if attempt > 0:
                 logging.info(f"重试读取Excel文件 (第{attempt + 1}次): {file_path}")
-                time.sleep(2 * attempt)  # 递增延迟
             
-            # 使用read_only模式避免锁定问题
-            df = pd.read_excel(file_path, engine='openpyxl', sheet_name=0, nrows=max_rows)
+            def parse() -> pd.DataFrame:
+                if checkpoint is not None and not max_rows:
+                    return checkpoint.read(file_path, columns, chunk_size, required)
+                if columns and resolve_excel_engine(engine) == "openpyxl":
+                    # 只读模式逐行流式读取所需列
+                    chunks = list(iter_excel_chunks(file_path, columns, chunk_size, max_rows, required))
+                    result = pd.concat(chunks, ignore_index=True) if chunks else pd.DataFrame()
+                    logging.info(f"流式读取Excel: {len(result)} 行, {len(result.columns)} 列")
+                    return result
+                return read_excel_sheet(file_path, engine, columns or None, max_rows, required)
+            
+            if cache is not None:
+                df = cache.read(file_path, parse, variant=f"columns={columns}|max_rows={max_rows}")
+            else:
+                df = parse()
             
             if max_rows and len(df) > 0:
                 logging.info(f"测试模式：仅读取前 {len(df)} 行数据")
             return df
             
-        except BadZipFile as e:
-            if attempt < max_retries - 1:
-                logging.warning(f"Excel文件可能正在同步中，等待后重试: {file_path}")
-                continue
-            else:
-                # 提供具体的恢复建议
-                logging.error(f"Excel文件损坏或同步未完成: {file_path}")
-                logging.error("建议解决方案:")
-                logging.error("1. 等待SharePoint同步完成（通常需要几分钟）")
-                logging.error("2. 检查文件是否有.tmp或.lock文件")
-                logging.error("3. 尝试手动打开文件确认是否正常")
-                logging.error("4. 如果持续失败，联系IT检查SharePoint同步状态")
-                raise ValueError(f"Excel文件损坏，请检查SharePoint同步状态: {file_path}") from e
+        except (BadZipFile, PermissionError) as e:
+            # 探测后仍在同步或被占用：不在此等待，推迟到运行末尾重试
+            logging.warning(f"Excel文件同步未完成或被占用，推迟读取: {file_path}")
+            raise SyncNotReadyError("同步未完成或文件被占用") from e
                 
-        except PermissionError as e:
-            if attempt < max_retries - 1:
-                logging.warning(f"Excel文件被占用，等待后重试: {file_path}")
-                time.sleep(3 * attempt)
-                continue
-            else:
-                logging.error(f"Excel文件被其他程序占用: {file_path}")
-                logging.error("请关闭正在使用该文件的程序（如Excel）")
-                raise PermissionError(f"文件被占用，请关闭Excel或其他程序: {file_path}") from e
+        except MissingColumnsError:
+            # 文件结构问题，重试无效
+            raise
                 
         except Exception as e:
             logging.error(f"读取Excel文件失败: {file_path}, 错误: {e}")
@@ -107,6 +883,96 @@ def read_sharepoint_excel(file_path: str, max_rows: Optional[int] = None, max_re
                 raise
 
 
+def get_ingest_workers(cfg: Dict[str, Any]) -> int:
+    """并行读取源文件的进程数（runtime.ingest_workers，未配置时为CPU核数，最多8）"""
+    workers = cfg.get("runtime", {}).get("ingest_workers")
+    if not workers:
+        workers = min(8, os.cpu_count() or 1)
+    return max(1, int(workers))
+
+
+def _to_arrow(df: pd.DataFrame) -> Any:
+    """DataFrame转换为Arrow表传回主进程（无法转换时原样返回）"""
+    try:
+        import pyarrow as pa
+        return pa.Table.from_pandas(df, preserve_index=False)
+    except Exception:
+        return df
+
+
+def _from_arrow(payload: Any) -> pd.DataFrame:
+    """Arrow表转换回DataFrame（含空值的整数object列保持为int/None，不转换为float）"""
+    if isinstance(payload, pd.DataFrame):
+        return payload
+    return payload.to_pandas(integer_object_nulls=True, date_as_object=True)
+
+
+def _ingest_task(worker: Callable[..., pd.DataFrame], file_path: str, args: tuple) -> Any:
+    return _to_arrow(worker(file_path, *args))
+
+
+def _ingest_files(worker: Callable[..., pd.DataFrame], file_paths: List[str], args: tuple,
+                  max_workers: int) -> Iterator[Tuple[str, Optional[pd.DataFrame], Optional[Exception]]]:
+    """按 file_paths 顺序返回各文件的读取结果（见 parallel_ingest）"""
+    if max_workers <= 1 or len(file_paths) <= 1:
+        for file_path in file_paths:
+            try:
+                yield file_path, _from_arrow(_ingest_task(worker, file_path, args)), None
+            except Exception as e:
+                yield file_path, None, e
+        return
+    
+    workers = min(max_workers, len(file_paths))
+    logging.info(f"并行读取 {len(file_paths)} 个文件，进程数: {workers}")
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(_ingest_task, worker, file_path, args) for file_path in file_paths]
+        for file_path, future in zip(file_paths, futures):
+            try:
+                yield file_path, _from_arrow(future.result()), None
+            except Exception as e:
+                yield file_path, None, e
+
+
+def parallel_ingest(worker: Callable[..., pd.DataFrame], file_paths: List[str], args: tuple = (),
+                    max_workers: int = 1, deferral: Optional[SyncDeferral] = None
+                    ) -> Iterator[Tuple[str, Optional[pd.DataFrame], Optional[Exception]]]:
+    """
+    多进程读取源文件：每个文件在子进程中执行 worker(file_path, *args)（读取 + 字段映射等逐行处理），
+    结果以Arrow表传回主进程
+    
+    Args:
+        worker: 模块级函数（需可被子进程导入）
+        max_workers: 进程数，1时在当前进程中依次执行
+        deferral: 推迟队列；同步未就绪的文件（读取前探测或读取时抛出 SyncNotReadyError）
+                  不阻塞其他文件，在其余文件之后等待重试，最终仍未就绪的返回 SyncNotReadyError
+    Returns:
+        按 file_paths 顺序依次返回 (file_path, DataFrame, None)，失败的文件返回 (file_path, None, 异常)；
+        返回顺序与子进程完成顺序无关，结果与进程数无关（推迟的文件在最后返回）
+    """
+    if deferral is None:
+        yield from _ingest_files(worker, file_paths, args, max_workers)
+        return
+    
+    pending = list(file_paths)
+    for round_no in range(deferral.retries + 1):
+        if round_no > 0:
+            deferral.wait(round_no, len(pending))
+        ready, pending = deferral.split(pending)
+        for file_path, df, error in _ingest_files(worker, ready, args, max_workers):
+            if isinstance(error, SyncNotReadyError):
+                deferral.defer(file_path, str(error))
+                pending.append(file_path)
+                continue
+            yield file_path, df, error
+        if not pending:
+            break
+    
+    deferral.unresolved = list(pending)
+    for file_path in pending:
+        yield file_path, None, SyncNotReadyError(f"重试后仍未就绪（{deferral.deferred[file_path]}）")
+    deferral.log_summary()
+
+
 def save_to_parquet(df: pd.DataFrame, output_path: str, cfg: Dict[str, Any] = None) -> None:
     """保存DataFrame为Parquet格式"""
     if cfg is None:
@@ -154,7 +1020,9 @@ def save_to_parquet(df: pd.DataFrame, output_path: str, cfg: Dict[str, Any] = No
             df[col] = df[col].replace('', None)
     
     try:
-        df.to_parquet(output_path, index=False, engine='pyarrow', compression=compression)
+        # 已按machine、TrackOutTime排序的数据同时写入排序元数据
+        df.to_parquet(output_path, index=False, engine='pyarrow', compression=compression,
+                      **parquet_sorting_kwargs(df))
         logging.info(f"已保存Parquet文件: {output_path}, 行数: {len(df)}")
         
         # 同时保存Excel文件用于数据完整性检查
@@ -289,9 +1157,438 @@ def prompt_refresh_mode(default_incremental: bool = True, countdown_seconds: int
             return default_incremental
 
 
+# 记录指纹算法版本（写入状态文件；与状态文件中的版本不一致时迁移，见 migrate_state_file）
+FINGERPRINT_VERSION = "fnv1a64-v1"
+_FNV64_OFFSET = np.uint64(0xCBF29CE484222325)
+_FNV64_PRIME = np.uint64(0x100000001B3)
+# 键字段之间的分隔符（不会出现在业务字段中）
+_KEY_SEPARATOR = "\x1f"
+
+
+def key_text(values: pd.Series) -> pd.Series:
+    """键列按列转换为字符串：日期时间统一为 yyyy-mm-dd HH:MM:SS（与单元格类型无关），其他取str()，空值为空字符串"""
+    if pd.api.types.is_datetime64_any_dtype(values):
+        text = values.dt.strftime('%Y-%m-%d %H:%M:%S')
+    else:
+        text = values.map(lambda v: v.strftime('%Y-%m-%d %H:%M:%S') if isinstance(v, datetime) and v is not pd.NaT
+                          else str(v))
+    return text.where(values.notna(), '').astype(object)
+
+
+def fnv1a_64(texts: pd.Series) -> np.ndarray:
+    """
+    字符串的FNV-1a 64位hash（UTF-8字节，按字节位置逐列向量化计算）
+    算法固定，结果与pandas/numpy版本和运行环境无关
+    """
+    if len(texts) == 0:
+        return np.empty(0, dtype=np.uint64)
+    data = np.asarray(pd.Series(texts).str.encode('utf-8').to_numpy(), dtype=bytes)
+    lengths = np.char.str_len(data)
+    matrix = data.view(np.uint8).reshape(len(data), data.dtype.itemsize)
+    hashes = np.full(len(data), _FNV64_OFFSET, dtype=np.uint64)
+    for j in range(int(lengths.max())):
+        active = lengths > j
+        hashes[active] = (hashes[active] ^ matrix[active, j]) * _FNV64_PRIME
+    return hashes
+
+
+def record_fingerprints(df: pd.DataFrame, key_fields: List[str]) -> np.ndarray:
+    """
+    记录指纹（uint64数组）：键字段按列规范化（见 key_text）后以分隔符连接，计算FNV-1a 64位hash
+    同一键值在不同运行、不同pandas版本下指纹相同
+    """
+    text = key_text(df[key_fields[0]])
+    for field in key_fields[1:]:
+        text = text + _KEY_SEPARATOR + key_text(df[field])
+    return fnv1a_64(text)
+
+
+def load_fingerprints(state: Dict[str, Any], key: str = "processed_fingerprints") -> np.ndarray:
+    """状态中的指纹（uint64有序数组）"""
+    return np.unique(np.asarray(state.get(key, []), dtype=np.uint64))
+
+
+def _sorted_member(sorted_values: np.ndarray, values: np.ndarray) -> np.ndarray:
+    """values中每个元素是否在有序数组sorted_values中（二分查找）"""
+    if not len(sorted_values):
+        return np.zeros(len(values), dtype=bool)
+    idx = np.searchsorted(sorted_values, values)
+    idx[idx == len(sorted_values)] = 0
+    return sorted_values[idx] == values
+
+
+class FingerprintStore:
+    """
+    记录指纹的二进制存储：与状态文件放在一起的有序uint64数组（.npy）和追加日志（.log，小端uint64）
+    
+    说明：
+    - 文件名为 状态文件名（去掉扩展名）.{name}.npy / .{name}.log
+    - add() 只把新指纹追加到日志，不重写已有集合；日志条数超过 max(compact_min, 基础数组 × compact_ratio) 时合并为新的有序数组
+    - stage() 只在内存中记录（contains() 已包含），commit() 时才写入日志，用于一次运行统一提交
+    - contains() 对有序数组二分查找（向量化）
+    - 数组整体读入内存（不使用内存映射，避免Windows下映射中的文件无法替换）
+    - 合并时上一次的有序数组和日志保留为 .{name}.prev.npy / .prev.log（两者合起来等于新的有序数组），
+      有序数组缺失或损坏时据此恢复，不会因此重新处理全部记录
+    """
+    
+    def __init__(self, state_file: str, name: str = "processed",
+                 compact_min: int = 100000, compact_ratio: float = 0.25):
+        base = os.path.splitext(state_file)[0]
+        self.base_path = f"{base}.{name}.npy"
+        self.log_path = f"{base}.{name}.log"
+        self.prev_base_path = f"{base}.{name}.prev.npy"
+        self.prev_log_path = f"{base}.{name}.prev.log"
+        self.compact_min = compact_min
+        self.compact_ratio = compact_ratio
+        self._base = np.empty(0, dtype=np.uint64)
+        self._log = np.empty(0, dtype=np.uint64)
+        self._staged = np.empty(0, dtype=np.uint64)
+        self._base_from_file = False
+        self._load()
+    
+    @staticmethod
+    def _read_array(path: str) -> Optional[np.ndarray]:
+        """读取有序数组，文件不存在或损坏时返回None"""
+        if not os.path.exists(path):
+            return None
+        try:
+            return np.load(path).astype(np.uint64, copy=False)
+        except Exception as e:
+            logging.warning(f"读取指纹文件失败: {path}: {e}")
+            return None
+    
+    @staticmethod
+    def _read_log(path: str) -> np.ndarray:
+        """读取追加日志（截断的末尾记录忽略）"""
+        if not os.path.exists(path):
+            return np.empty(0, dtype=np.uint64)
+        with open(path, 'rb') as f:
+            data = f.read()
+        data = data[:len(data) // 8 * 8]
+        return np.unique(np.frombuffer(data, dtype='<u8').astype(np.uint64))
+    
+    def _load(self) -> None:
+        base = self._read_array(self.base_path)
+        self._base_from_file = base is not None
+        if base is None and (os.path.exists(self.prev_base_path) or os.path.exists(self.prev_log_path)):
+            prev = self._read_array(self.prev_base_path)
+            base = np.union1d(prev if prev is not None else np.empty(0, dtype=np.uint64),
+                              self._read_log(self.prev_log_path))
+            logging.warning(f"指纹文件缺失或损坏，已从上一次合并前的文件恢复 {len(base)} 条: {self.base_path}")
+        elif base is None and os.path.exists(self.base_path):
+            logging.warning(f"指纹文件损坏且没有可恢复的文件，其中的记录将被重新处理: {self.base_path}")
+        if base is not None:
+            self._base = base
+        self._log = self._read_log(self.log_path)
+    
+    def __len__(self) -> int:
+        return len(self._base) + len(self._log) + len(self._staged)
+    
+    def contains(self, fingerprints: np.ndarray) -> np.ndarray:
+        """每个指纹是否已记录（布尔数组，包括暂存未提交的指纹）"""
+        fingerprints = np.asarray(fingerprints, dtype=np.uint64)
+        return (_sorted_member(self._base, fingerprints) | _sorted_member(self._log, fingerprints)
+                | _sorted_member(self._staged, fingerprints))
+    
+    def values(self) -> np.ndarray:
+        """全部指纹（uint64有序数组）"""
+        return np.union1d(np.union1d(self._base, self._log), self._staged)
+    
+    def stage(self, fingerprints: np.ndarray) -> int:
+        """在内存中记录指纹（commit() 时写入），返回新增条数"""
+        fingerprints = np.unique(np.asarray(fingerprints, dtype=np.uint64))
+        new = fingerprints[~self.contains(fingerprints)]
+        if len(new):
+            self._staged = np.union1d(self._staged, new)
+        return len(new)
+    
+    def commit(self) -> None:
+        """暂存的指纹追加到日志，日志过大时合并"""
+        if not len(self._staged):
+            return
+        os.makedirs(os.path.dirname(os.path.abspath(self.log_path)), exist_ok=True)
+        with open(self.log_path, 'ab') as f:
+            f.write(self._staged.astype('<u8').tobytes())
+        self._log = np.union1d(self._log, self._staged)
+        self._staged = np.empty(0, dtype=np.uint64)
+        if len(self._log) > max(self.compact_min, len(self._base) * self.compact_ratio):
+            self.compact()
+    
+    def add(self, fingerprints: np.ndarray) -> int:
+        """记录指纹并立即写入（只追加未记录过的），返回新增条数"""
+        new_count = self.stage(fingerprints)
+        self.commit()
+        return new_count
+    
+    def compact(self) -> None:
+        """
+        日志合并到有序数组（暂存的指纹先提交）
+        
+        新数组先写入临时文件并读回校验；原有序数组和日志改名为 .prev 保留后再替换，
+        恢复时 .prev.npy ∪ .prev.log 即为新的有序数组
+        """
+        self.commit()
+        merged = self.values()
+        tmp_path = self.base_path + ".tmp.npy"
+        np.save(tmp_path, merged)
+        if not np.array_equal(self._read_array(tmp_path), merged):
+            raise IOError(f"指纹文件写入校验失败: {tmp_path}")
+        if self._base_from_file:
+            os.replace(self.base_path, self.prev_base_path)
+        else:
+            # 原有序数组不存在或已从 .prev 恢复：保存内存中的数组
+            np.save(self.prev_base_path, self._base)
+        if os.path.exists(self.log_path):
+            os.replace(self.log_path, self.prev_log_path)
+        elif os.path.exists(self.prev_log_path):
+            os.remove(self.prev_log_path)
+        os.replace(tmp_path, self.base_path)
+        self._base, self._log = merged, np.empty(0, dtype=np.uint64)
+        self._base_from_file = True
+        logging.info(f"指纹文件已合并: {os.path.basename(self.base_path)}, {len(merged)} 条")
+    
+    def paths(self) -> List[str]:
+        return [self.base_path, self.log_path, self.prev_base_path, self.prev_log_path]
+
+
+def load_fingerprint_store(state_file: str, name: str = "processed",
+                           key: str = "processed_fingerprints") -> FingerprintStore:
+    """
+    打开状态文件对应的指纹存储
+    状态JSON中仍有指纹列表（旧格式）时，首次打开导入存储并从JSON中删除该列表
+    """
+    store = FingerprintStore(state_file, name)
+    if not os.path.exists(state_file):
+        return store
+    try:
+        with open(state_file, 'r', encoding='utf-8') as f:
+            state = json.load(f)
+    except Exception as e:
+        logging.warning(f"读取状态文件失败，跳过指纹导入: {e}")
+        return store
+    if key not in state:
+        return store
+    imported = store.add(load_fingerprints(state, key))
+    store.compact()
+    del state[key]
+    with open(state_file, 'w', encoding='utf-8') as f:
+        json.dump(state, f, indent=2, ensure_ascii=False, default=str)
+    logging.info(f"状态文件中的指纹列表已导入 {os.path.basename(store.base_path)}: {imported} 条")
+    return store
+
+
+def remove_etl_state(state_file: str) -> None:
+    """删除状态文件及其指纹存储文件（全量刷新）"""
+    base = os.path.splitext(state_file)[0]
+    for path in [state_file] + glob.glob(glob.escape(base) + ".*.npy") + glob.glob(glob.escape(base) + ".*.log"):
+        if os.path.exists(path):
+            os.remove(path)
+            logging.info(f"已删除状态文件: {path}")
+
+
+# 增量过滤策略：fingerprint 与全部已处理记录的指纹比较；watermark 只在 高水位-迟到窗口 之后的记录中按指纹去重
+INCREMENTAL_STRATEGIES = ("fingerprint", "watermark")
+
+
+def get_incremental_strategy(cfg: Dict[str, Any]) -> str:
+    """增量过滤策略（incremental.strategy，未知策略按fingerprint处理）"""
+    strategy = cfg.get("incremental", {}).get("strategy", "fingerprint")
+    if strategy not in INCREMENTAL_STRATEGIES:
+        logging.warning(f"未知的增量过滤策略 {strategy}，使用 fingerprint")
+        return "fingerprint"
+    return strategy
+
+
+def _time_values(times: pd.Series) -> Tuple[np.ndarray, np.ndarray]:
+    """时间列转换为纳秒整数，返回 (整数数组, 是否为空)"""
+    values = pd.to_datetime(pd.Series(times), errors='coerce').to_numpy(dtype='datetime64[ns]')
+    return values.view(np.int64), np.isnat(values)
+
+
+class WatermarkWindow:
+    """
+    高水位 + 迟到窗口的增量状态：只保存时间不早于（高水位 - 迟到窗口）的记录指纹和时间（状态文件名.window.npy）
+    
+    说明：
+    - 高水位为已处理记录的最大时间；早于 高水位-迟到窗口 的记录视为已处理，不再比较指纹
+    - 窗口内的记录按指纹去重；时间为空的记录无法按时间判断，按指纹存储（见 FingerprintStore）去重
+    - 记录后删除窗口之外的指纹，状态大小和过滤开销只与窗口内的记录数有关
+    - 迟到超过窗口的记录（时间早于窗口起点才补录）会被忽略，窗口应大于源数据可能的最大补录延迟
+    - name 区分同一状态文件的多个窗口（文件名为 状态文件名.{name}.npy，如SFC原始唯一键的 raw_window）
+    """
+    
+    DTYPE = np.dtype([("fingerprint", "<u8"), ("time", "<i8")])
+    
+    def __init__(self, state_file: str, late_arrival_days: float, time_field: str = "TrackOutTime",
+                 name: str = "window"):
+        self.state_file = state_file
+        self.path = f"{os.path.splitext(state_file)[0]}.{name}.npy"
+        self.late_arrival = pd.Timedelta(days=late_arrival_days)
+        self.time_field = time_field
+        self._entries = np.empty(0, dtype=self.DTYPE)
+        if os.path.exists(self.path):
+            try:
+                self._entries = np.load(self.path).astype(self.DTYPE, copy=False)
+            except Exception as e:
+                logging.warning(f"读取增量窗口失败，重新建立: {self.path}: {e}")
+        self._fingerprints = np.unique(self._entries["fingerprint"])
+    
+    def __len__(self) -> int:
+        return len(self._entries)
+    
+    @property
+    def watermark(self) -> Optional[pd.Timestamp]:
+        """高水位（已处理记录的最大时间，无记录时为None）"""
+        if not len(self._entries):
+            return None
+        return pd.Timestamp(int(self._entries["time"].max()))
+    
+    @property
+    def cutoff(self) -> Optional[pd.Timestamp]:
+        """窗口起点：高水位 - 迟到窗口"""
+        watermark = self.watermark
+        return None if watermark is None else watermark - self.late_arrival
+    
+    def new_mask(self, df: pd.DataFrame, fingerprints: np.ndarray, store: FingerprintStore) -> np.ndarray:
+        """每行是否为新记录：早于窗口起点为已处理，窗口内按窗口指纹判断，时间为空按指纹存储判断"""
+        times, missing = _time_values(df[self.time_field])
+        cutoff = self.cutoff
+        in_window = ~missing if cutoff is None else ~missing & (times >= cutoff.value)
+        mask = np.zeros(len(df), dtype=bool)
+        mask[in_window] = ~_sorted_member(self._fingerprints, fingerprints[in_window])
+        mask[missing] = ~store.contains(fingerprints[missing])
+        return mask
+    
+    def record(self, df: pd.DataFrame, fingerprints: np.ndarray, store: FingerprintStore,
+               commit: bool = True) -> int:
+        """
+        记录已处理的记录：更新高水位，只保留窗口内的指纹；时间为空的记录写入指纹存储
+        commit为False时只更新内存（之后调用 save() 和 store.commit() 写入）
+        
+        Returns:
+            新记录条数
+        """
+        times, missing = _time_values(df[self.time_field])
+        new_count = store.stage(fingerprints[missing])
+        entries = np.empty(int((~missing).sum()), dtype=self.DTYPE)
+        entries["fingerprint"], entries["time"] = fingerprints[~missing], times[~missing]
+        new_count += int((~_sorted_member(self._fingerprints, np.unique(entries["fingerprint"]))).sum())
+        entries = np.concatenate([self._entries, entries])
+        if len(entries):
+            cutoff = entries["time"].max() - self.late_arrival.value
+            entries = entries[entries["time"] >= cutoff]
+            _, first = np.unique(entries["fingerprint"], return_index=True)
+            entries = entries[np.sort(first)]
+        self._entries = entries
+        self._fingerprints = np.unique(entries["fingerprint"])
+        if commit:
+            self.save()
+            store.commit()
+        return new_count
+    
+    def save(self) -> None:
+        """写入窗口文件（先写临时文件再替换）"""
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        tmp_path = self.path + ".tmp.npy"
+        np.save(tmp_path, self._entries)
+        os.replace(tmp_path, self.path)
+    
+    def bootstrap(self, history_file: str, key_fields: List[str], store: FingerprintStore) -> bool:
+        """
+        已有状态文件但窗口尚未建立时按历史数据文件初始化（从fingerprint策略切换时，避免已处理的记录重新作为新数据；
+        状态文件不存在即全量处理时不初始化）
+        
+        Returns:
+            是否进行了初始化
+        """
+        if os.path.exists(self.path) or not os.path.exists(self.state_file):
+            return False
+        if not history_file or not os.path.exists(history_file):
+            return False
+        history = pd.read_parquet(history_file)
+        missing = [field for field in key_fields + [self.time_field] if field not in history.columns]
+        if missing:
+            logging.warning(f"历史数据缺少字段 {missing}，增量窗口从空开始")
+            return False
+        self.record(history, record_fingerprints(history, key_fields), store)
+        logging.info(f"按历史数据建立增量窗口: 高水位 {self.watermark}，窗口内 {len(self)} 条")
+        return True
+
+
+def get_watermark_window(cfg: Dict[str, Any], state_file: str) -> Optional[WatermarkWindow]:
+    """
+    按配置创建增量窗口（incremental.strategy 不是watermark时返回None）
+    
+    配置项：
+    - incremental.watermark_field: 高水位时间字段（默认TrackOutTime）
+    - incremental.late_arrival_days: 迟到窗口（天）
+    """
+    if get_incremental_strategy(cfg) != "watermark":
+        return None
+    incr_cfg = cfg.get("incremental", {})
+    return WatermarkWindow(state_file, float(incr_cfg.get("late_arrival_days", 7)),
+                           incr_cfg.get("watermark_field", "TrackOutTime"))
+
+
+# 旧版本状态文件中的记录标识（MD5 hex、'|'连接的字符串、pandas内部hash）
+LEGACY_STATE_KEYS = ("processed_hashes", "processed_records", "processed_raw_hashes")
+
+
+def migrate_state_file(state_file: str, history_file: str, key_fields: List[str]) -> bool:
+    """
+    一次性迁移旧版本状态文件的记录标识为记录指纹：
+    MD5等旧标识无法直接转换，按历史数据文件（已处理记录的合并结果）的键字段重新计算指纹，写入指纹存储（见 FingerprintStore）；
+    原始键hash（清洗前去重叠用）直接丢弃，下次运行重新记录
+    
+    Returns:
+        是否进行了迁移
+    """
+    if not os.path.exists(state_file):
+        return False
+    try:
+        with open(state_file, 'r', encoding='utf-8') as f:
+            state = json.load(f)
+    except Exception as e:
+        logging.warning(f"读取状态文件失败，跳过迁移: {e}")
+        return False
+    if state.get("fingerprint_version") == FINGERPRINT_VERSION:
+        return False
+    
+    fingerprints = np.empty(0, dtype=np.uint64)
+    if any(state.get(key) for key in LEGACY_STATE_KEYS[:2]):
+        if history_file and os.path.exists(history_file):
+            history = pd.read_parquet(history_file)
+            missing = [field for field in key_fields if field not in history.columns]
+            if missing:
+                logging.warning(f"历史数据缺少唯一键字段 {missing}，已处理记录从空开始")
+            elif not history.empty:
+                fingerprints = np.unique(record_fingerprints(history, key_fields))
+        else:
+            logging.warning(f"历史数据文件不存在，已处理记录从空开始: {history_file}")
+    
+    # 旧版本的指纹存储文件一并替换
+    for name in ("processed", "raw"):
+        for path in FingerprintStore(state_file, name).paths():
+            if os.path.exists(path):
+                os.remove(path)
+    store = FingerprintStore(state_file)
+    store.add(fingerprints)
+    store.compact()
+    
+    for key in LEGACY_STATE_KEYS + ("processed_fingerprints",):
+        state.pop(key, None)
+    state["fingerprint_version"] = FINGERPRINT_VERSION
+    os.makedirs(os.path.dirname(state_file), exist_ok=True)
+    with open(state_file, 'w', encoding='utf-8') as f:
+        json.dump(state, f, indent=2, ensure_ascii=False, default=str)
+    logging.info(f"状态文件已迁移为记录指纹（{FINGERPRINT_VERSION}）: {len(fingerprints)} 条已处理记录")
+    return True
+
+
 def update_etl_state(df: pd.DataFrame, state_file: str, cfg: Dict[str, Any]) -> None:
-    """更新ETL状态文件"""
-    import json
+    """
+    更新ETL状态：已处理记录的指纹（见 record_fingerprints）追加到指纹存储（见 FingerprintStore），保留状态文件中的其他字段
+    """
     from datetime import datetime
     
     if df.empty:
@@ -310,39 +1607,42 @@ def update_etl_state(df: pd.DataFrame, state_file: str, cfg: Dict[str, Any]) ->
         logging.warning(f"缺少必要字段用于状态更新: {missing_fields}")
         return
     
-    # 生成记录标识
     try:
-        # 将关键字段组合为字符串标识
-        df_records = df[unique_key_fields].astype(str)
-        record_ids = df_records.apply(lambda row: '|'.join(row.values), axis=1)
+        fingerprints = record_fingerprints(df, unique_key_fields)
         
-        # 读取现有状态
-        existing_ids = set()
+        # 读取现有状态（指纹列表首次使用时导入二进制存储）
+        store = load_fingerprint_store(state_file)
+        state_data = {}
         if os.path.exists(state_file):
             try:
                 with open(state_file, 'r', encoding='utf-8') as f:
                     state_data = json.load(f)
-                    existing_ids = set(state_data.get('processed_records', []))
             except Exception as e:
                 logging.warning(f"读取状态文件失败，将创建新状态: {e}")
         
-        # 更新状态
-        new_ids = set(record_ids) - existing_ids
-        all_ids = existing_ids.union(set(record_ids))
-        
-        # 保存状态
-        state_data = {
+        # 更新状态（指纹追加到存储或增量窗口，JSON只保存汇总信息）
+        window = get_watermark_window(cfg, state_file)
+        if window is not None:
+            new_count = window.record(df, fingerprints, store)
+            state_data['watermark'] = str(window.watermark) if window.watermark is not None else None
+            total_records = len(window) + len(store)
+        else:
+            new_count = store.add(fingerprints)
+            total_records = len(store)
+        for key in LEGACY_STATE_KEYS[:2]:
+            state_data.pop(key, None)
+        state_data.update({
             'last_update': datetime.now().isoformat(),
-            'total_records': len(all_ids),
-            'processed_records': list(all_ids),
-            'new_records_count': len(new_ids)
-        }
+            'total_records': total_records,
+            'fingerprint_version': FINGERPRINT_VERSION,
+            'new_records_count': new_count
+        })
         
         os.makedirs(os.path.dirname(state_file), exist_ok=True)
         with open(state_file, 'w', encoding='utf-8') as f:
-            json.dump(state_data, f, ensure_ascii=False, indent=2)
+            json.dump(state_data, f, ensure_ascii=False, indent=2, default=str)
         
-        logging.info(f"ETL状态已更新: 总记录 {len(all_ids)}, 新增 {len(new_ids)} 条")
+        logging.info(f"ETL状态已更新: 总记录 {total_records}, 新增 {new_count} 条")
         
     except Exception as e:
         logging.warning(f"更新ETL状态失败: {e}")
@@ -1,12 +1,15 @@
 """
 生成中国节假日日历表
 包含2024-2026年的法定节假日、调休安排和工作日标记
+输出CSV及同名.npz工作日位图（供ETL通过 WorkCalendar.load 快速加载）
 """
 
 import pandas as pd
 from datetime import datetime, timedelta
 import os
 
+from etl_calendar import WorkCalendar
+
 # 定义法定节假日（包含调休）
 # 格式：{年份: {节假日名称: [日期列表], '调休工作日': [日期列表]}}
 HOLIDAYS = {
@@ -148,6 +151,11 @@ def main():
     calendar_df.to_csv(output_file, index=False, encoding='utf-8-sig')
     
     print(f"日历表已生成: {output_file}")
+    
+    # 同时保存二进制工作日位图，供ETL快速加载（WorkCalendar.load 优先读取）
+    artifact_file = WorkCalendar.artifact_path(output_file)
+    WorkCalendar.from_dataframe(calendar_df).save(artifact_file)
+    print(f"工作日位图已生成: {artifact_file}")
     print(f"总天数: {len(calendar_df)}")
     print(f"工作日数: {calendar_df['是否工作日'].sum()}")
     print(f"节假日数: {calendar_df['是否节假日'].sum()}")
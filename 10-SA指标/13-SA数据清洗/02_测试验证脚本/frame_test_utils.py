@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+"""
+测试公用函数
+生成测试用Excel工作簿、逐列比较DataFrame（各测试脚本共用，文件名不以test_开头，pytest不会收集）
+"""
+
+import os
+from typing import Iterable, List, Optional
+
+import pandas as pd
+from openpyxl import Workbook
+
+
+def write_workbook(path: str, header: List[str], rows: Iterable[list], mtime: Optional[float] = None) -> str:
+    """
+    按表头和数据行生成Excel（只写模式）
+
+    Args:
+        rows: 数据行（空行用 [None] * 列数 表示）
+        mtime: 指定文件修改时间（时间戳），为空时不修改
+    """
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet()
+    ws.append(header)
+    for row in rows:
+        ws.append(row)
+    wb.save(path)
+    if mtime is not None:
+        os.utime(path, (mtime, mtime))
+    return path
+
+
+def assert_frame_same(actual: pd.DataFrame, expected: pd.DataFrame, name: str,
+                      as_text: bool = False, check_dtypes: bool = False) -> None:
+    """
+    逐列比较（忽略索引，空值视为相同，按值比较不区分等价的dtype）
+
+    Args:
+        as_text: 文本列按字符串比较（数字与文本混合的列，如 20250000 与 "20250000"）
+        check_dtypes: 同时要求各列类型一致
+    """
+    assert list(actual.columns) == list(expected.columns), f"{name}: {list(actual.columns)}"
+    assert len(actual) == len(expected), f"{name}: {len(actual)} vs {len(expected)}"
+    if check_dtypes:
+        assert list(actual.dtypes) == list(expected.dtypes), f"{name}: {list(actual.dtypes)} vs {list(expected.dtypes)}"
+    for col in expected.columns:
+        a, e = actual[col].reset_index(drop=True), expected[col].reset_index(drop=True)
+        if as_text and (a.dtype == object or e.dtype == object):
+            a, e = a.map(lambda v: v if pd.isna(v) else str(v)), e.map(lambda v: v if pd.isna(v) else str(v))
+        same = (a.astype(object) == e.astype(object)) | (a.isna() & e.isna())
+        assert same.all(), f"{name}: {col} 不一致 {int((~same).sum())} 条"
+    checked = "类型和取值" if check_dtypes else ""
+    print(f"{name}: {len(actual)} 行 × {len(actual.columns)} 列{checked}一致")
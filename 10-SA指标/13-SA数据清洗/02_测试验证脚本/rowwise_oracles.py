@@ -0,0 +1,999 @@
+#!/usr/bin/env python3
+"""
+指标逐行计算参考实现（测试用）
+原MES/SFC模块中的逐行计算函数，生产代码已改为列式计算（etl_metrics / etl_calendar），
+此处保留原逐行版本作为比对基准（文件名不以test_开头，pytest不会收集）
+"""
+
+import sys
+import os
+import logging
+from datetime import datetime, timedelta
+from typing import Optional
+
+import pandas as pd
+
+# 添加核心ETL程序目录到路径
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '01_核心ETL程序'))
+
+from etl_calendar import WorkCalendar
+
+
+# ============================================================
+# MES：日历表非工作日
+# ============================================================
+
+def calculate_lt(row: pd.Series) -> Optional[float]:
+    """计算LT(d) - 实际加工时间，不扣除周末"""
+    operation = row.get("Operation", "")
+    trackout = row.get("TrackOutTime", None)
+    checkin_sfc = row.get("Checkin_SFC", None)
+    enter_step = row.get("EnterStepTime", None)
+    trackin = row.get("TrackInTime", None)
+    
+    if pd.isna(trackout):
+        return None
+    
+    # 确定开始时间
+    start_time = None
+    if operation == "0010":
+        # 0010工序：优先使用Checkin_SFC，如果为空则使用EnterStepTime，再为空则使用TrackInTime
+        if pd.notna(checkin_sfc):
+            start_time = checkin_sfc
+        elif pd.notna(enter_step):
+            start_time = enter_step
+        elif pd.notna(trackin):
+            start_time = trackin
+    else:
+        # 非0010工序：使用EnterStepTime
+        if pd.notna(enter_step):
+            start_time = enter_step
+    
+    if start_time is None:
+        return None
+    
+    trackout_dt = pd.to_datetime(trackout)
+    start_dt = pd.to_datetime(start_time)
+    
+    # 计算实际时间差（天），不扣除周末
+    total_seconds = (trackout_dt - start_dt).total_seconds()
+    total_hours = total_seconds / 3600
+    
+    # 转换为天数（不扣除周末）
+    return round(total_hours / 24, 2)
+
+
+def calculate_pt(row: pd.Series) -> Optional[float]:
+    """
+    计算PT(d) - 实际加工时间
+    
+    升级逻辑：避免将设备停产时间计入PT
+    - 正常情况：PT = TrackOutTime - PreviousBatchEndTime
+    - 特殊情况：如果EnterStepTime > PreviousBatchEndTime，说明中间有停产期
+    - 升级后：PT = TrackOutTime - TrackInTime（不包括停产等待时间）
+    
+    根据业务逻辑：
+    1. 如果EnterStepTime <= PreviousBatchEndTime：正常连续生产
+       PT(d) = (TrackOutTime - PreviousBatchEndTime) / 24
+    2. 如果EnterStepTime > PreviousBatchEndTime：中间有停产期
+       PT(d) = (TrackOutTime - TrackInTime) / 24
+    3. 如果PreviousBatchEndTime为空，使用TrackInTime
+    """
+    trackout = row.get("TrackOutTime", None)
+    previous_batch_end = row.get("PreviousBatchEndTime", None)
+    trackin = row.get("TrackInTime", None)
+    enter_step = row.get("EnterStepTime", None)
+    
+    if pd.isna(trackout):
+        return None
+    
+    # 升级逻辑：检查是否有停产期
+    start_time = None
+    
+    # 检查是否存在停产期
+    has_production_gap = False
+    if pd.notna(enter_step) and pd.notna(previous_batch_end):
+        enter_step_dt = pd.to_datetime(enter_step)
+        previous_end_dt = pd.to_datetime(previous_batch_end)
+        if enter_step_dt > previous_end_dt:
+            has_production_gap = True
+            logging.debug(f"检测到停产期: EnterStepTime {enter_step} > PreviousBatchEndTime {previous_batch_end}")
+    
+    # 根据是否有停产期选择开始时间
+    if has_production_gap:
+        # 有停产期：使用TrackInTime作为实际加工开始时间
+        if pd.notna(trackin):
+            start_time = trackin
+            logging.debug(f"使用TrackInTime计算PT: {trackin}")
+        else:
+            # 如果TrackInTime为空，回退到PreviousBatchEndTime
+            start_time = previous_batch_end
+            logging.debug(f"TrackInTime为空，回退到PreviousBatchEndTime: {previous_batch_end}")
+    else:
+        # 正常连续生产：使用PreviousBatchEndTime
+        if pd.notna(previous_batch_end):
+            start_time = previous_batch_end
+            logging.debug(f"正常生产，使用PreviousBatchEndTime: {previous_batch_end}")
+        elif pd.notna(trackin):
+            # 如果PreviousBatchEndTime为空，使用TrackInTime
+            start_time = trackin
+            logging.debug(f"PreviousBatchEndTime为空，使用TrackInTime: {trackin}")
+        else:
+            # 如果两者都为空，返回None
+            return None
+    
+    trackout_dt = pd.to_datetime(trackout)
+    start_dt = pd.to_datetime(start_time)
+    
+    # 确保结束时间大于开始时间
+    if trackout_dt <= start_dt:
+        return None
+    
+    # 计算实际时间差（秒）
+    total_seconds = (trackout_dt - start_dt).total_seconds()
+    
+    # 转换为小时
+    total_hours = total_seconds / 3600.0
+    
+    # 转换为天数（保留2位小数）
+    return round(total_hours / 24.0, 2)
+
+
+def calculate_st(row: pd.Series) -> Optional[float]:
+    """
+    计算ST(d) - 理论加工时间，不考虑周末
+    
+    计算逻辑（与SFC保持一致）：
+    ST = (调试时间 + (合格数量 + 报废数量) × EH_machine或EH_labor / OEE + 0.5小时换批时间) / 24
+    单位：天
+    """
+    # 使用TrackOutQuantity + ScrapQuantity（与SFC保持一致）
+    trackout_qty = row.get("TrackOutQuantity", 0) or 0
+    scrap_qty = row.get("ScrapQuantity", 0) or 0
+    qty = trackout_qty + scrap_qty
+    
+    oee = row.get("OEE", 0.77) or 0.77
+    setup_time = 0  # 调试时间（小时）
+    
+    if row.get("Setup") == "Yes" and pd.notna(row.get("Setup Time (h)")):
+        setup_time = row.get("Setup Time (h)", 0) or 0
+    
+    # 获取单件时间（秒），优先使用EH_machine(s)，否则使用EH_labor(s)
+    machine_time_s = row.get("EH_machine(s)", None)
+    labor_time_s = row.get("EH_labor(s)", None)
+    
+    # 确定使用哪个时间
+    if pd.notna(machine_time_s) and machine_time_s > 0:
+        unit_time_s = machine_time_s
+    elif pd.notna(labor_time_s) and labor_time_s > 0:
+        unit_time_s = labor_time_s
+    else:
+        return None
+    
+    # 转换为小时
+    unit_time_h = unit_time_s / 3600
+    
+    # 计算基础工时（理论时间，不考虑周末）
+    # 公式：调试时间 + (数量 × 单件时间 / OEE) + 0.5小时换批时间
+    base_hours = setup_time + (qty * unit_time_h / oee) + 0.5
+    
+    if base_hours == 0:
+        return None
+    
+    # ST = 基础工时 / 24（不考虑周末）
+    return round(base_hours / 24, 2)
+
+
+def is_workday(date: datetime, calendar_df: pd.DataFrame) -> bool:
+    """
+    判断指定日期是否为工作日（基于日历表）
+    如果日历表未加载或日期不在范围内，返回默认判断（周一到周五）
+    calendar_df 可以是 WorkCalendar 或日历表DataFrame
+    """
+    if isinstance(calendar_df, WorkCalendar):
+        return calendar_df.is_workday(date)
+    
+    if calendar_df.empty:
+        # 如果日历表未加载，使用默认逻辑（周一到周五为工作日）
+        weekday = date.weekday()  # Monday=0, Sunday=6
+        logging.debug(f"日历表未加载，使用默认逻辑判断 {date.date()}: 工作日={weekday < 5}")
+        return weekday < 5
+    
+    # 获取日期部分（去除时间）
+    date_only = date.date()
+    date_key = pd.Timestamp(date_only)
+    
+    if date_key in calendar_df.index:
+        is_work = calendar_df.loc[date_key, '是否工作日']
+        # 确保返回布尔值
+        is_work = bool(is_work)
+        return is_work
+    else:
+        # 如果日期不在日历表中，使用默认逻辑
+        weekday = date.weekday()
+        logging.debug(f"日期 {date.date()} 不在日历表中，使用默认逻辑: 工作日={weekday < 5}")
+        return weekday < 5
+
+
+def get_next_workday_8am(date: datetime, calendar_df: pd.DataFrame) -> datetime:
+    """
+    获取下一个工作日的8:00（基于日历表）
+    """
+    current_date = date.date()
+    current_datetime_8am = date.replace(hour=8, minute=0, second=0, microsecond=0)
+    
+    # 如果当前时间已经超过当天8:00，从下一天开始查找
+    if date.hour >= 8:
+        current_date = current_date + timedelta(days=1)
+        current_datetime_8am = current_datetime_8am + timedelta(days=1)
+    
+    # 最多查找30天（防止无限循环）
+    for _ in range(30):
+        test_datetime = datetime.combine(current_date, datetime.min.time()).replace(hour=8)
+        if is_workday(test_datetime, calendar_df):
+            return test_datetime
+        current_date = current_date + timedelta(days=1)
+    
+    # 如果30天内找不到工作日，返回30天后的8:00
+    logging.warning(f"在30天内未找到工作日，返回默认值: {current_datetime_8am}")
+    return current_datetime_8am
+
+
+def calculate_due_time(row: pd.Series, calendar_df: pd.DataFrame, daily_working_hours: float = 8.0) -> Optional[datetime]:
+    """
+    计算DueTime - 理论完成时间（用于参考，不作为状态判断）
+    
+    逻辑：从 PreviousBatchEndTime 开始到理论完成的时间
+    - 如果 PreviousBatchEndTime 为空，使用 EnterStepTime
+    - 按工作日逐天累加工作时间，跳过非工作日
+    - 工作日按24小时连续生产
+    """
+    # 使用 PreviousBatchEndTime 作为开始时间
+    start_time = row.get("PreviousBatchEndTime", None)
+    
+    # 如果 PreviousBatchEndTime 为空，使用 EnterStepTime
+    if pd.isna(start_time):
+        start_time = row.get("EnterStepTime", None)
+    if pd.isna(start_time):
+        return None
+    
+    start_dt = pd.to_datetime(start_time)
+    
+    setup_time = 0
+    if row.get("Setup") == "Yes" and pd.notna(row.get("Setup Time (h)")):
+        setup_time = row.get("Setup Time (h)", 0) or 0
+    
+    # 获取单件时间（秒）
+    # 优先使用Machine，如果Machine为0或空，则使用Labor
+    machine_time_s = row.get("EH_machine(s)", None)
+    labor_time_s = row.get("EH_labor(s)", None)
+    
+    # 确定使用哪个时间
+    if pd.notna(machine_time_s) and machine_time_s > 0:
+        unit_time_s = machine_time_s
+    elif pd.notna(labor_time_s) and labor_time_s > 0:
+        unit_time_s = labor_time_s
+    else:
+        return None
+    
+    qty = row.get("StepInQuantity", 0) or 0
+    oee = row.get("OEE", 0.77) or 0.77
+    
+    # 计算总时间（秒）= 数量 × 单件时间（秒）/ OEE
+    total_time_s = qty * unit_time_s / oee
+    
+    # 转换为小时
+    total_time_h = total_time_s / 3600
+    
+    # 总工时 = 调试时间 + 加工时间 + 0.5小时换批时间
+    total_hours = setup_time + total_time_h + 0.5
+    
+    # 使用新算法：按工作日逐天累加工作时间
+    due_final = calculate_due_time_by_workdays(start_dt, total_hours, calendar_df, daily_working_hours)
+    
+    return due_final
+
+
+def calculate_due_time_by_workdays(start: datetime, required_hours: float, calendar_df: pd.DataFrame, daily_working_hours: float = 8.0) -> datetime:
+    """
+    更直观的算法：按工作日逐天累加工作时间，跳过非工作日
+    直到累加的工作时间达到理论工时，那一天就是完成时间
+    
+    Args:
+        start: 开始时间
+        required_hours: 需要的理论工时（小时）
+        calendar_df: 日历表
+        daily_working_hours: 每日工作时间（小时），默认8小时
+    
+    Returns:
+        理论完成时间（工作日的8:00）
+    """
+    if required_hours <= 0:
+        return start
+    
+    # 从开始时间开始
+    current_time = start
+    remaining_hours = required_hours
+    
+    # 如果开始时间在当天8:00之后，先计算当天剩余的工作时间
+    start_date_8am = current_time.replace(hour=8, minute=0, second=0, microsecond=0)
+    
+    if current_time >= start_date_8am:
+        # 检查当天是否为工作日
+        if is_workday(start_date_8am, calendar_df):
+            # 当天是工作日，计算当天剩余时间（工作日按24小时连续生产）
+            # 计算到第二天8:00的剩余小时数
+            next_day_8am = start_date_8am + timedelta(days=1)
+            hours_until_next_day = (next_day_8am - current_time).total_seconds() / 3600
+            
+            if hours_until_next_day > 0:
+                if remaining_hours <= hours_until_next_day:
+                    # 当天就能完成
+                    return current_time + timedelta(hours=remaining_hours)
+                else:
+                    # 当天完成不了，减去当天剩余时间
+                    remaining_hours -= hours_until_next_day
+                    # 移动到下一天的8:00
+                    current_time = next_day_8am
+            else:
+                # 移动到下一天的8:00
+                current_time = next_day_8am
+        else:
+            # 当天不是工作日，移动到下一天
+            current_time = start_date_8am + timedelta(days=1)
+    else:
+        # 开始时间在当天8:00之前，从当天8:00开始
+        current_time = start_date_8am
+    
+    # 按天遍历，累加工作日的工作时间
+    max_days = 365  # 防止无限循环
+    days_checked = 0
+    
+    while remaining_hours > 0 and days_checked < max_days:
+        current_date_8am = current_time.replace(hour=8, minute=0, second=0, microsecond=0)
+        
+        if is_workday(current_date_8am, calendar_df):
+            # 工作日，累加工作时间（24小时连续生产）
+            if remaining_hours <= daily_working_hours:
+                # 今天就能完成（从当天8:00开始计算）
+                return current_date_8am + timedelta(hours=remaining_hours)
+            else:
+                # 今天完成不了，减去今天的工作时间，继续下一天
+                remaining_hours -= daily_working_hours
+        
+        # 移动到下一天的8:00
+        current_time = current_date_8am + timedelta(days=1)
+        days_checked += 1
+    
+    # 如果超过最大天数，返回最后计算的时间
+    if days_checked >= max_days:
+        logging.warning(f"计算完成时间超过{max_days}天，返回估算值")
+    
+    return current_time
+
+
+def calculate_nonworkday_hours(start: datetime, end: datetime, calendar_df: pd.DataFrame) -> float:
+    """
+    计算从start到end之间的非工作日小时数（基于日历表）
+    用于NonWorkday(d)字段的计算
+    """
+    if end <= start:
+        return 0.0
+    
+    total_hours = 0.0
+    
+    # 按天遍历时间区间，统计非工作日小时数
+    current_date = start.date()
+    end_date = end.date()
+    current_time = start
+    
+    while current_date <= end_date:
+        # 获取当天的开始时间（8:00）和结束时间（次日8:00）
+        day_start_8am = datetime.combine(current_date, datetime.min.time()).replace(hour=8)
+        day_end_8am = day_start_8am + timedelta(days=1)
+        
+        # 判断当天是否为工作日
+        if not is_workday(day_start_8am, calendar_df):
+            # 非工作日，计算与[current_time, end]重叠的部分
+            overlap_start = max(current_time, day_start_8am)
+            overlap_end = min(end, day_end_8am)
+            
+            if overlap_start < overlap_end:
+                hours = (overlap_end - overlap_start).total_seconds() / 3600
+                total_hours += hours
+        
+        # 移动到下一天
+        current_date = current_date + timedelta(days=1)
+        # 更新current_time为下一天的开始时间（8:00），但不要超过end
+        if current_date <= end_date:
+            current_time = max(current_time, day_end_8am)
+        else:
+            break
+    
+    return round(total_hours, 2)
+
+
+def adjust_weekend(start: datetime, due: datetime, calendar_df: pd.DataFrame) -> datetime:
+    """
+    调整非工作日，顺延到工作日（基于日历表）
+    如果截止时间落在非工作日，顺延到下一个工作日的8:00
+    （保留此函数用于兼容，但推荐使用calculate_due_time_by_workdays）
+    """
+    if due <= start:
+        return due
+    
+    # 检查due是否落在非工作日
+    due_date_8am = due.replace(hour=8, minute=0, second=0, microsecond=0)
+    
+    # 如果due在当天8:00之后，检查当天是否为工作日
+    if due.hour >= 8:
+        if not is_workday(due_date_8am, calendar_df):
+            # 当天是非工作日，顺延到下一个工作日8:00
+            return get_next_workday_8am(due, calendar_df)
+    else:
+        # due在当天8:00之前，检查前一天是否为工作日
+        prev_day = due_date_8am - timedelta(days=1)
+        if not is_workday(prev_day, calendar_df):
+            # 前一天是非工作日，顺延到下一个工作日8:00
+            return get_next_workday_8am(due, calendar_df)
+    
+    # 如果due落在工作日，计算从start到due之间的非工作日小时数并加上
+    non_workday_hours = calculate_nonworkday_hours(start, due, calendar_df)
+    return due + timedelta(hours=non_workday_hours)
+
+
+def calculate_nonworkday_days(row: pd.Series, calendar_df: pd.DataFrame) -> Optional[float]:
+    """
+    计算NonWorkday(d) - 非工作日天数（单位：天）
+    
+    逻辑：计算LT的周期范围内的非工作日天数
+    - 开始时间：和LT计算一致（0010工序用Checkin_SFC，其他工序用EnterStepTime）
+    - 结束时间：TrackOutTime
+    - 统计非工作日小时数后转换为天数
+    """
+    # 获取开始时间：和LT计算逻辑一致
+    operation = row.get("Operation", "")
+    trackout = row.get("TrackOutTime", None)
+    checkin_sfc = row.get("Checkin_SFC", None)
+    enter_step = row.get("EnterStepTime", None)
+    trackin = row.get("TrackInTime", None)
+    
+    if pd.isna(trackout):
+        return None
+    
+    # 确定开始时间（和calculate_lt逻辑一致）
+    start_time = None
+    if operation == "0010":
+        # 0010工序：优先使用Checkin_SFC，如果为空则使用EnterStepTime，再为空则使用TrackInTime
+        if pd.notna(checkin_sfc):
+            start_time = checkin_sfc
+        elif pd.notna(enter_step):
+            start_time = enter_step
+        elif pd.notna(trackin):
+            start_time = trackin
+    else:
+        # 非0010工序：使用EnterStepTime
+        if pd.notna(enter_step):
+            start_time = enter_step
+    
+    if pd.isna(start_time):
+        return None
+    
+    start_dt = pd.to_datetime(start_time)
+    end_dt = pd.to_datetime(trackout)
+    
+    if end_dt <= start_dt:
+        return None
+    
+    # 计算从开始时间到结束时间之间的非工作日小时数（基于日历表）
+    non_workday_hours = calculate_nonworkday_hours(start_dt, end_dt, calendar_df)
+    
+    # 转换为天数（保留2位小数）
+    return round(non_workday_hours / 24, 2)
+
+
+def calculate_completion_status(row: pd.Series, calendar_df: pd.DataFrame) -> Optional[str]:
+    """
+    计算CompletionStatus - 完成状态
+    
+    逻辑：直接比较已计算的PT（实际加工时间）和ST（理论加工时间）
+    - PT是已经计算好的实际加工时间（已排除停产期）
+    - ST是已经计算好的理论加工时间
+    - PT > ST + 8小时容差 + 换批/换型时间 + 非工作日时间 → Overdue
+    - PT <= ST + 8小时容差 + 换批/换型时间 + 非工作日时间 → OnTime
+    
+    换批/换型时间规则：
+    - 正常换批：固定0.5小时
+    - 换型情况：Setup="Yes"时，使用标准换型时间（Setup Time字段）
+    """
+    # 获取已计算的PT和ST
+    pt = row.get("PT(d)", None)
+    st = row.get("ST(d)", None)
+    tolerance_h = row.get("Tolerance(h)", 8.0)  # 默认8小时容差
+    nonworkday_d = row.get("NonWorkday(d)", 0.0)  # 非工作日天数
+    
+    if pd.isna(pt) or pd.isna(st):
+        return None
+    
+    # PT转换为小时
+    pt_hours = pt * 24
+    # ST转换为小时
+    st_hours = st * 24
+    # 非工作日转换为小时
+    nonworkday_hours = nonworkday_d * 24
+    
+    # 检查是否需要使用标准换型时间
+    changeover_time = 0.5  # 默认换批时间
+    if row.get("Setup") == "Yes" and pd.notna(row.get("Setup Time (h)")):
+        changeover_time = row.get("Setup Time (h)", 0.5) or 0.5  # 使用标准换型时间
+    
+    # 阈值 = ST + 容差 + 换批/换型时间 + 非工作日时间
+    threshold = st_hours + tolerance_h + changeover_time + nonworkday_hours
+    
+    # 比较：PT（小时） > 阈值 → Overdue
+    if pt_hours > threshold:
+        return "Overdue"
+    else:
+        return "OnTime"
+
+
+def calculate_tolerance_hours(row: pd.Series) -> Optional[float]:
+    """计算容差小时数（固定8小时，与SFC逻辑一致）"""
+    due = row.get("DueTime", None)
+    actual = row.get("TrackOutTime", None)
+    
+    if pd.isna(due) or pd.isna(actual):
+        return None
+    
+    # 固定容差为8小时
+    return 8.0
+
+
+# ============================================================
+# SFC：固定周末（周六8:00到周一8:00）
+# ============================================================
+
+def calculate_sfc_lt(row: pd.Series) -> Optional[float]:
+    """
+    计算SFC的LT(d) - 实际加工时间，不扣除周末
+    
+    计算逻辑：
+    - 0010工序：优先使用Checkin_SFC，如果为空则使用EnterStepTime，再为空则使用TrackInTime
+    - 非0010工序：使用EnterStepTime
+    单位：天（不扣除周末）
+    """
+    operation = row.get("Operation", "")
+    trackout = row.get("TrackOutTime", None)
+    checkin_sfc = row.get("Checkin_SFC", None)
+    enter_step = row.get("EnterStepTime", None)
+    trackin = row.get("TrackInTime", None)
+    
+    if pd.isna(trackout):
+        return None
+    
+    # 确定开始时间
+    start_time = None
+    if operation == "0010":
+        # 0010工序：优先使用Checkin_SFC，如果为空则使用EnterStepTime，再为空则使用TrackInTime
+        if pd.notna(checkin_sfc):
+            start_time = checkin_sfc
+        elif pd.notna(enter_step):
+            start_time = enter_step
+        elif pd.notna(trackin):
+            start_time = trackin
+    else:
+        # 非0010工序：使用EnterStepTime
+        if pd.notna(enter_step):
+            start_time = enter_step
+    
+    if start_time is None:
+        # 如果开始时间为空，无法计算LT
+        return None
+    
+    trackout_dt = pd.to_datetime(trackout)
+    start_dt = pd.to_datetime(start_time)
+    
+    # 计算实际时间差（天），不扣除周末
+    total_seconds = (trackout_dt - start_dt).total_seconds()
+    total_hours = total_seconds / 3600
+    
+    # 转换为天数（不扣除周末）
+    return round(total_hours / 24, 2)
+
+
+def calculate_sfc_pt(row: pd.Series) -> Optional[float]:
+    """
+    计算SFC的PT(d) - 实际加工时间，与MES保持一致
+    
+    升级逻辑：避免将设备停产时间计入PT
+    - 正常情况：PT = TrackOutTime - PreviousBatchEndTime
+    - 特殊情况：如果EnterStepTime > PreviousBatchEndTime，说明中间有停产期
+    - 升级后：PT = TrackOutTime - TrackInTime（不包括停产等待时间）
+    
+    根据业务逻辑：
+    1. 如果EnterStepTime <= PreviousBatchEndTime：正常连续生产
+       PT(d) = (TrackOutTime - PreviousBatchEndTime) / 24
+    2. 如果EnterStepTime > PreviousBatchEndTime：中间有停产期
+       PT(d) = (TrackOutTime - TrackInTime) / 24
+    3. 如果PreviousBatchEndTime为空，使用TrackInTime，回退逻辑：TrackInTime → Checkin_SFC
+    单位：天（不扣除周末）
+    """
+    trackout = row.get("TrackOutTime", None)
+    previous_batch_end = row.get("PreviousBatchEndTime", None)
+    trackin = row.get("TrackInTime", None)
+    checkin_sfc = row.get("Checkin_SFC", None)
+    enter_step = row.get("EnterStepTime", None)
+    
+    if pd.isna(trackout):
+        return None
+    
+    # 升级逻辑：检查是否有停产期
+    start_time = None
+    
+    # 检查是否存在停产期
+    has_production_gap = False
+    if pd.notna(enter_step) and pd.notna(previous_batch_end):
+        enter_step_dt = pd.to_datetime(enter_step)
+        previous_end_dt = pd.to_datetime(previous_batch_end)
+        if enter_step_dt > previous_end_dt:
+            has_production_gap = True
+            logging.debug(f"检测到停产期: EnterStepTime {enter_step} > PreviousBatchEndTime {previous_batch_end}")
+    
+    # 根据是否有停产期选择开始时间
+    if has_production_gap:
+        # 有停产期：使用TrackInTime作为实际加工开始时间，与MES保持一致
+        if pd.notna(trackin):
+            start_time = trackin
+            logging.debug(f"使用TrackInTime计算PT: {trackin}")
+        elif pd.notna(checkin_sfc):
+            # 回退到Checkin_SFC
+            start_time = checkin_sfc
+            logging.debug(f"TrackInTime为空，回退到Checkin_SFC: {checkin_sfc}")
+        else:
+            # 如果都为空，回退到PreviousBatchEndTime
+            start_time = previous_batch_end
+            logging.debug(f"TrackInTime和Checkin_SFC都为空，回退到PreviousBatchEndTime: {previous_batch_end}")
+    else:
+        # 正常连续生产：使用PreviousBatchEndTime
+        if pd.notna(previous_batch_end):
+            start_time = previous_batch_end
+            logging.debug(f"正常生产，使用PreviousBatchEndTime: {previous_batch_end}")
+        elif pd.notna(checkin_sfc):
+            # 如果PreviousBatchEndTime为空，使用Checkin_SFC
+            start_time = checkin_sfc
+            logging.debug(f"PreviousBatchEndTime为空，使用Checkin_SFC: {checkin_sfc}")
+        else:
+            # 如果两者都为空，返回None
+            return None
+    
+    trackout_dt = pd.to_datetime(trackout)
+    start_dt = pd.to_datetime(start_time)
+    
+    # 确保结束时间大于开始时间
+    if trackout_dt <= start_dt:
+        return None
+    
+    # 计算实际时间差（天），不扣除周末
+    total_seconds = (trackout_dt - start_dt).total_seconds()
+    total_hours = total_seconds / 3600
+    
+    # 转换为天数（不扣除周末）
+    return round(total_hours / 24, 2)
+
+
+def get_weekend_period(date: datetime) -> tuple:
+    """
+    获取指定日期所在周的周末区间（周六8:00到周一8:00）
+    返回: (saturday_8am, monday_8am)
+    """
+    weekday = date.weekday()  # Monday=0, Sunday=6
+    
+    # 找到本周六8点
+    if weekday == 5:  # Saturday
+        if date.hour >= 8:
+            # 如果已经是周六8点之后，使用本周六8点
+            saturday_8am = date.replace(hour=8, minute=0, second=0, microsecond=0)
+        else:
+            # 周六8点之前，使用上周六8点
+            saturday_8am = date.replace(hour=8, minute=0, second=0, microsecond=0) - timedelta(days=7)
+    elif weekday == 6:  # Sunday
+        saturday_8am = date.replace(hour=8, minute=0, second=0, microsecond=0) - timedelta(days=1)
+    elif weekday == 0:  # Monday
+        if date.hour < 8:
+            saturday_8am = date.replace(hour=8, minute=0, second=0, microsecond=0) - timedelta(days=2)
+        else:
+            saturday_8am = date.replace(hour=8, minute=0, second=0, microsecond=0) + timedelta(days=5)
+    else:  # Tuesday to Friday
+        days_to_saturday = 5 - weekday
+        saturday_8am = date.replace(hour=8, minute=0, second=0, microsecond=0) + timedelta(days=days_to_saturday)
+        # 如果还没到本周六，使用上周六
+        if saturday_8am > date:
+            saturday_8am = saturday_8am - timedelta(days=7)
+    
+    monday_8am = saturday_8am + timedelta(days=2)
+    return saturday_8am, monday_8am
+
+
+def calculate_weekend_hours(start: datetime, end: datetime) -> float:
+    """
+    计算从start到end之间的周末小时数
+    周末定义：周六8:00到周一8:00之间的所有时间（48小时）
+    """
+    if end <= start:
+        return 0.0
+    
+    total_hours = 0.0
+    
+    # 找到start和end之间的所有周末区间
+    current_start = start
+    processed_weekends = set()  # 记录已处理的周末区间（用周六8点作为key）
+    
+    while current_start < end:
+        # 获取当前时间所在周的周末区间
+        saturday_8am, monday_8am = get_weekend_period(current_start)
+        
+        # 避免重复处理同一个周末区间
+        weekend_key = saturday_8am
+        if weekend_key in processed_weekends:
+            # 已经处理过这个周末，跳到下个周一8点
+            current_start = monday_8am
+            continue
+        
+        processed_weekends.add(weekend_key)
+        
+        # 计算周末区间与[start, end]的重叠部分
+        overlap_start = max(current_start, saturday_8am)
+        overlap_end = min(end, monday_8am)
+        
+        if overlap_start < overlap_end:
+            # 有重叠，计算重叠小时数
+            hours = (overlap_end - overlap_start).total_seconds() / 3600
+            total_hours += hours
+        
+        # 移动到下一个可能的周末区间
+        if current_start < monday_8am:
+            current_start = monday_8am
+        else:
+            # 找到下一个周末区间
+            next_saturday = saturday_8am + timedelta(days=7)
+            if next_saturday < end:
+                current_start = next_saturday
+            else:
+                break
+    
+    return round(total_hours, 2)
+
+
+def calculate_sfc_st(row: pd.Series) -> Optional[float]:
+    """
+    计算SFC的ST(d) - 理论加工时间，不考虑周末
+    
+    计算逻辑：
+    ST = (调试时间 + (合格数量 + 报废数量) × EH_machine或EH_labor / OEE + 0.5小时换批时间) / 24
+    单位：天
+    """
+    # 使用TrackOutQuantity + ScrapQuantity
+    trackout_qty = row.get("TrackOutQuantity", 0) or 0
+    scrap_qty = row.get("ScrapQuantity", 0) or 0
+    qty = trackout_qty + scrap_qty
+    
+    oee = row.get("OEE", 0.77) or 0.77
+    setup_time = 0  # 调试时间（小时）
+    
+    if row.get("Setup") == "Yes" and pd.notna(row.get("Setup Time (h)")):
+        setup_time = row.get("Setup Time (h)", 0) or 0
+    
+    # 获取单件时间（秒），优先使用EH_machine(s)，否则使用EH_labor(s)
+    machine_time_s = row.get("EH_machine(s)", None)
+    labor_time_s = row.get("EH_labor(s)", None)
+    
+    # 确定使用哪个时间
+    if pd.notna(machine_time_s) and machine_time_s > 0:
+        unit_time_s = machine_time_s
+    elif pd.notna(labor_time_s) and labor_time_s > 0:
+        unit_time_s = labor_time_s
+    else:
+        return None
+    
+    # 转换为小时
+    unit_time_h = unit_time_s / 3600
+    
+    # 计算基础工时（理论时间，不考虑周末）
+    # 公式：调试时间 + (数量 × 单件时间 / OEE) + 0.5小时换批时间
+    base_hours = setup_time + (qty * unit_time_h / oee) + 0.5
+    
+    if base_hours == 0:
+        return None
+    
+    # ST = 基础工时 / 24（不考虑周末）
+    return round(base_hours / 24, 2)
+
+
+def calculate_sfc_due_time(row: pd.Series) -> Optional[datetime]:
+    """计算SFC的DueTime（包含周末调整）"""
+    # SFC数据可能没有TrackInTime，使用Checkin_SFC作为开始时间
+    start_time = row.get("TrackInTime", None) or row.get("Checkin_SFC", None)
+    if pd.isna(start_time):
+        return None
+    
+    start_dt = pd.to_datetime(start_time)
+    
+    setup_time = 0
+    if row.get("Setup") == "Yes" and pd.notna(row.get("Setup Time (h)")):
+        setup_time = row.get("Setup Time (h)", 0) or 0
+    
+    # 获取单件时间（秒），优先使用EH_machine(s)，否则使用EH_labor(s)
+    machine_time_s = row.get("EH_machine(s)", None)
+    labor_time_s = row.get("EH_labor(s)", None)
+    
+    # 确定使用哪个时间
+    if pd.notna(machine_time_s) and machine_time_s > 0:
+        unit_time_s = machine_time_s
+    elif pd.notna(labor_time_s) and labor_time_s > 0:
+        unit_time_s = labor_time_s
+    else:
+        return None
+    
+    # 转换为小时
+    unit_time_h = unit_time_s / 3600
+    
+    # 使用TrackOutQuantity + ScrapQuantity
+    trackout_qty = row.get("TrackOutQuantity", 0) or 0
+    scrap_qty = row.get("ScrapQuantity", 0) or 0
+    qty = trackout_qty + scrap_qty
+    oee = row.get("OEE", 0.77) or 0.77
+    
+    total_hours = setup_time + unit_time_h * qty / oee
+    due0 = start_dt + timedelta(hours=total_hours + 0.5)
+    
+    # 调整周末（考虑周末小时数）
+    due_final = adjust_weekend_sfc(start_dt, due0)
+    
+    return due_final
+
+
+def adjust_weekend_sfc(start: datetime, due: datetime) -> datetime:
+    """
+    调整周末，顺延到工作日（SFC版本）
+    周末定义：周六8:00到周一8:00之间的所有时间
+    如果截止时间落在周末，顺延到周一8:00
+    """
+    if due <= start:
+        return due
+    
+    # 计算从start到due之间的周末小时数
+    weekend_hours = calculate_weekend_hours(start, due)
+    
+    # 检查due是否落在周末区间内
+    weekday = due.weekday()  # Monday=0, Sunday=6
+    due_hour = due.hour
+    
+    # 判断是否在周末区间：周六8点之后，或周日，或周一8点之前
+    is_in_weekend = False
+    if weekday == 5 and due_hour >= 8:  # 周六8点及以后
+        is_in_weekend = True
+    elif weekday == 6:  # 周日全天
+        is_in_weekend = True
+    elif weekday == 0 and due_hour < 8:  # 周一8点之前
+        is_in_weekend = True
+    
+    # 如果落在周末区间，顺延到周一8点
+    if is_in_weekend:
+        # 找到下一个周一8点
+        if weekday == 5:  # 周六
+            days_to_monday = 2
+        elif weekday == 6:  # 周日
+            days_to_monday = 1
+        else:  # 周一（但还没到8点）
+            days_to_monday = 7  # 下周一
+        
+        next_monday = (due.replace(hour=8, minute=0, second=0, microsecond=0) + 
+                      timedelta(days=days_to_monday))
+        return next_monday
+    
+    # 如果不在周末区间，直接加上周末小时数
+    return due + timedelta(hours=weekend_hours)
+
+
+def calculate_sfc_weekend_days(row: pd.Series) -> Optional[float]:
+    """
+    计算SFC的Weekend(d) - 周末扣除天数（单位：天）
+    先按小时计算周末时间（周六8:00到周一8:00），然后转换为天数
+    返回值：周末天数（保留2位小数）
+    """
+    start_time = row.get("TrackInTime", None) or row.get("Checkin_SFC", None)
+    if pd.isna(start_time):
+        return None
+    
+    start_dt = pd.to_datetime(start_time)
+    
+    setup_time = 0
+    if row.get("Setup") == "Yes" and pd.notna(row.get("Setup Time (h)")):
+        setup_time = row.get("Setup Time (h)", 0) or 0
+    
+    # 获取单件时间（秒），优先使用EH_machine(s)，否则使用EH_labor(s)
+    machine_time_s = row.get("EH_machine(s)", None)
+    labor_time_s = row.get("EH_labor(s)", None)
+    
+    # 确定使用哪个时间
+    if pd.notna(machine_time_s) and machine_time_s > 0:
+        unit_time_s = machine_time_s
+    elif pd.notna(labor_time_s) and labor_time_s > 0:
+        unit_time_s = labor_time_s
+    else:
+        return None
+    
+    # 转换为小时
+    unit_time_h = unit_time_s / 3600
+    
+    # 使用TrackOutQuantity + ScrapQuantity
+    trackout_qty = row.get("TrackOutQuantity", 0) or 0
+    scrap_qty = row.get("ScrapQuantity", 0) or 0
+    qty = trackout_qty + scrap_qty
+    oee = row.get("OEE", 0.77) or 0.77
+    
+    total_hours = setup_time + unit_time_h * qty / oee
+    due0 = start_dt + timedelta(hours=total_hours + 0.5)
+    
+    # 计算周末小时数
+    weekend_hours = calculate_weekend_hours(start_dt, due0)
+    
+    # 转换为天数（保留2位小数）
+    return round(weekend_hours / 24, 2)
+
+
+def calculate_sfc_completion_status(row: pd.Series) -> Optional[str]:
+    """
+    计算SFC的CompletionStatus（基于PT和ST比较，与MES保持一致）
+    
+    逻辑：直接比较已计算的PT（实际加工时间）和ST（理论加工时间）
+    - PT是已经计算好的实际加工时间（已排除停产期）
+    - ST是已经计算好的理论加工时间
+    - PT > ST + 8小时容差 + 换批/换型时间 + 非工作日时间 → Overdue
+    - PT <= ST + 8小时容差 + 换批/换型时间 + 非工作日时间 → OnTime
+    
+    换批/换型时间规则：
+    - 正常换批：固定0.5小时
+    - 换型情况：Setup="Yes"时，使用标准换型时间（Setup Time字段）
+    """
+    # 获取已计算的PT和ST
+    pt = row.get("PT(d)", None)
+    st = row.get("ST(d)", None)
+    tolerance_h = row.get("Tolerance(h)", 8.0)  # 默认8小时容差
+    weekend_d = row.get("Weekend(d)", 0.0)  # 周末天数
+    
+    if pd.isna(pt) or pd.isna(st):
+        return None
+    
+    # PT转换为小时
+    pt_hours = pt * 24
+    # ST转换为小时
+    st_hours = st * 24
+    # 周末转换为小时
+    weekend_hours = weekend_d * 24
+    
+    # 检查是否需要使用标准换型时间
+    changeover_time = 0.5  # 默认换批时间
+    if row.get("Setup") == "Yes" and pd.notna(row.get("Setup Time (h)")):
+        changeover_time = row.get("Setup Time (h)", 0.5) or 0.5  # 使用标准换型时间
+    
+    # 阈值 = ST + 容差 + 换批/换型时间 + 周末时间
+    threshold = st_hours + tolerance_h + changeover_time + weekend_hours
+    
+    # 比较：PT（小时） > 阈值 → Overdue
+    if pt_hours > threshold:
+        return "Overdue"
+    else:
+        return "OnTime"
+
+
+def calculate_sfc_tolerance_hours(row: pd.Series) -> Optional[float]:
+    """计算容差小时数（固定8小时）"""
+    due = row.get("DueTime", None)
+    actual = row.get("TrackOutTime", None)
+    
+    if pd.isna(due) or pd.isna(actual):
+        return None
+    
+    # 固定容差为8小时
+    return 8.0
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""
+测试按配置读取源列
+验证MES/SFC只读取字段映射中的源列，表头缺少必需列时读取表头后立即报错（不解析数据行、不重试）
+"""
+
+import sys
+import os
+import time
+import tempfile
+from datetime import datetime, timedelta
+
+
+# 添加核心ETL程序目录到路径
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '01_核心ETL程序'))
+
+import etl_utils
+from etl_utils import MissingColumnsError, required_source_columns
+import etl_dataclean_mes_batch_report as mes
+import etl_dataclean_sfc_batch_report as sfc
+from frame_test_utils import write_workbook
+
+MES_CFG = {
+    "mes_mapping": {"Material_Name": "BatchNumber", "Product_Name": "CFN", "ERPOperation": "Operation",
+                    "TrackOutDate": "TrackOutTime", "TrackOut_PrimaryQuantity": "TrackOutQuantity"},
+    "mes_types": {"TrackOutTime": "datetime", "TrackOutQuantity": "float"},
+}
+SFC_CFG = {
+    "sfc_mapping": {"产品号": "CFN", "批次": "BatchNumber", "工序号": "Operation", "机台号": "machine",
+                    "报工时间": "TrackOutTime", "合格数量": "TrackOutQuantity"},
+    "incremental": {"unique_key_fields": ["BatchNumber", "Operation", "TrackOutTime"]},
+}
+
+
+def write_header_workbook(path: str, header: list, n: int = 50) -> None:
+    """按表头生成Excel（日期列为报工时间，其余为文本/数字）"""
+    base = datetime(2025, 6, 1, 8)
+    rows = ([base + timedelta(hours=i) if name in ("TrackOutDate", "报工时间") else
+             f"CZM {101 + i % 3} 纵切车" if name == "Resource" else
+             10 * (1 + i % 3) if name in ("ERPOperation", "工序号") else f"{name}-{i}"
+             for name in header] for i in range(n))
+    write_workbook(path, header, rows)
+
+
+def test_required_source_columns():
+    """必需列按字段映射反查，未映射的字段按原名要求"""
+    assert mes.get_mes_required_columns(MES_CFG) == [
+        "Material_Name", "Product_Name", "ERPOperation", "TrackOutDate", "Resource"]
+    assert sfc.get_sfc_required_columns(SFC_CFG) == ["产品号", "批次", "工序号", "报工时间", "机台号"]
+    assert required_source_columns({"a": "A"}, ["A", "B"], ["C"]) == ["a", "B", "C"]
+    assert sfc.get_sfc_source_columns(SFC_CFG) == list(SFC_CFG["sfc_mapping"])
+    assert sfc.get_sfc_source_columns(dict(SFC_CFG, source={"excel_streaming": False})) is None
+
+
+def test_projection():
+    """MES/SFC只读取映射的源列（两种引擎）"""
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        mes_path = os.path.join(tmp_dir, "Product Output.xlsx")
+        write_header_workbook(mes_path, list(MES_CFG["mes_mapping"]) + ["Resource", "Comment", "TrackOut_User"])
+        sfc_path = os.path.join(tmp_dir, "LC-20250601.xlsx")
+        write_header_workbook(sfc_path, list(SFC_CFG["sfc_mapping"]) + ["备注", "报工人"])
+        for engine in ("openpyxl", "calamine"):
+            df = mes.read_mes_excel(mes_path, dict(MES_CFG, source={"excel_engine": engine}))
+            assert list(df.columns) == list(MES_CFG["mes_mapping"]) + ["Resource"], list(df.columns)
+            df = sfc.read_sfc_excel(sfc_path, dict(SFC_CFG, source={"excel_engine": engine}))
+            assert list(df.columns) == list(SFC_CFG["sfc_mapping"]), list(df.columns)
+            assert len(df) == 50
+        print("MES/SFC只读取映射的源列")
+
+
+def test_missing_required_fails_fast():
+    """缺少必需列时不解析数据行、不重试，直接抛出 MissingColumnsError"""
+    parsed = []
+    original_frame, original_read = etl_utils._rows_frame, etl_utils.pd.read_excel
+    etl_utils._rows_frame = lambda *args: parsed.append(args) or original_frame(*args)
+    etl_utils.pd.read_excel = lambda *args, **kwargs: parsed.append(args) or original_read(*args, **kwargs)
+    try:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            mes_path = os.path.join(tmp_dir, "Product Output.xlsx")
+            write_header_workbook(mes_path, ["Material_Name", "Product_Name", "ERPOperation", "TrackOutDate", "Comment"])
+            sfc_path = os.path.join(tmp_dir, "LC-20250601.xlsx")
+            write_header_workbook(sfc_path, ["产品号", "批次", "工序号", "机台号", "合格数量"])
+            for engine in ("openpyxl", "calamine"):
+                start = time.perf_counter()
+                try:
+                    mes.read_mes_excel(mes_path, dict(MES_CFG, source={"excel_engine": engine}))
+                    raise AssertionError("MES缺少Resource未报错")
+                except MissingColumnsError as e:
+                    assert "Resource" in str(e)
+                assert time.perf_counter() - start < 1, "缺少必需列时不应重试"
+                try:
+                    sfc.read_sfc_excel(sfc_path, dict(SFC_CFG, source={"excel_engine": engine}))
+                    raise AssertionError("SFC缺少报工时间未报错")
+                except MissingColumnsError as e:
+                    assert "报工时间" in str(e)
+    finally:
+        etl_utils._rows_frame, etl_utils.pd.read_excel = original_frame, original_read
+    assert not parsed, "缺少必需列时不应解析数据行"
+    print("缺少必需列时读取表头后立即报错")
+
+
+if __name__ == "__main__":
+    print("=" * 60)
+    print("测试按配置读取源列")
+    print("=" * 60)
+    test_required_source_columns()
+    test_projection()
+    test_missing_required_fails_fast()
+    print("✅ 所有测试通过")
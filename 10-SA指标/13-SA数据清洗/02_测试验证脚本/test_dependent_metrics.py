@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+"""
+测试增量指标重算
+验证合并历史数据后只对输入变化的记录（PreviousBatchEndTime、标准时间、日历）重算指标，结果与全量计算一致
+"""
+
+import sys
+import os
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+# 添加核心ETL程序目录到路径
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '01_核心ETL程序'))
+
+from etl_calendar import WorkCalendar
+from etl_metrics import METRIC_INPUTS_ATTR
+from generate_calendar import generate_calendar
+import etl_dataclean_mes_batch_report as mes
+
+METRIC_COLUMNS = ["PreviousBatchEndTime", "LT(d)", "PT(d)", "ST(d)", "DueTime", "NonWorkday(d)",
+                  "CompletionStatus", "Tolerance(h)", "EH_machine(s)", "OEE"]
+
+
+def write_inputs(tmp_dir: str, holiday: str = None, machine_seconds: float = 600.0,
+                 with_cfn_d: bool = False) -> dict:
+    """生成日历CSV（可额外设置一天假期）和标准时间表（可增加CFN-D），返回配置"""
+    calendar_df = generate_calendar('2024-01-01', '2024-12-31')
+    if holiday:
+        calendar_df.loc[pd.to_datetime(calendar_df['日期']) == pd.Timestamp(holiday), '是否工作日'] = False
+    calendar_file = os.path.join(tmp_dir, "日历工作日表.csv")
+    calendar_df.to_csv(calendar_file, index=False, encoding='utf-8-sig')
+
+    routing = pd.DataFrame({
+        "Material Number": ["CFN-A", "CFN-B", "CFN-C"],
+        "Operation": ["0010", "0010", "0010"],
+        "Group": ["101", "101", "101"],
+        "Machine": [machine_seconds, 300.0, 120.0],
+        "Labor": [60.0, 60.0, 60.0],
+        "Quantity": [1, 1, 1],
+        "OEE": [0.8, 0.77, 0.9],
+        "Setup Time (h)": [1.0, 2.0, 0.5],
+    })
+    if with_cfn_d:
+        routing.loc[len(routing)] = ["CFN-D", "0010", "101", 60.0, 60.0, 1, 0.8, 0.5]
+    routing_file = os.path.join(tmp_dir, "SAP_Routing_latest.parquet")
+    routing.to_parquet(routing_file, index=False)
+    return {"source": {"calendar_file": calendar_file, "standard_time_path": routing_file, "daily_working_hours": 8.0}}
+
+
+def build_rows(n: int = 1500, seed: int = 4) -> pd.DataFrame:
+    """构造MES批次数据（各machine时间线交错）"""
+    rng = np.random.default_rng(seed)
+    trackout = pd.Timestamp("2024-03-01") + pd.to_timedelta(rng.integers(0, 200 * 86400, n), unit="s")
+    return pd.DataFrame({
+        "BatchNumber": [f"B{i:05d}" for i in range(n)],
+        "CFN": rng.choice(["CFN-A", "CFN-B", "CFN-C"], n),
+        "Operation": "0010",
+        "Group": "101",
+        "machine": rng.choice(["769", "M022", "Q002", "O015"], n),
+        "StepInQuantity": rng.integers(1, 200, n),
+        "TrackOutQuantity": rng.integers(1, 200, n),
+        "EnterStepTime": trackout - pd.to_timedelta(rng.integers(3600, 20 * 86400, n), unit="s"),
+        "TrackInTime": trackout - pd.to_timedelta(rng.integers(600, 86400, n), unit="s"),
+        "TrackOutTime": trackout,
+        "Setup": rng.choice(["Yes", "No"], n),
+    })
+
+
+def full_compute(df: pd.DataFrame, cfg: dict) -> pd.DataFrame:
+    """全量计算（标准时间合并 + 指标）"""
+    return mes.calculate_metrics(mes.merge_standard_time(df.copy(), cfg), cfg)
+
+
+def incremental_compute(history: pd.DataFrame, new_df: pd.DataFrame, history_inputs: dict, cfg: dict) -> pd.DataFrame:
+    """模拟 process_all_data 的增量路径：新数据计算指标 → 与历史合并 → 增量PreviousBatchEndTime → 依赖重算"""
+    new_rows = full_compute(new_df, cfg)
+    combined = pd.concat([history, new_rows], ignore_index=True)
+    combined = combined.sort_values("TrackOutTime", na_position='last').reset_index(drop=True)
+    previous_end_before = combined["PreviousBatchEndTime"].copy()
+    combined = mes.update_previous_batch_end_time(combined, new_rows)
+    return mes.refresh_dependent_metrics(combined, previous_end_before, history_inputs, cfg)
+
+
+def assert_matches_full(actual: pd.DataFrame, expected: pd.DataFrame, name: str) -> None:
+    """按BatchNumber对齐后逐列比较"""
+    actual = actual.set_index("BatchNumber").sort_index()
+    expected = expected.set_index("BatchNumber").sort_index()
+    assert len(actual) == len(expected)
+    for col in METRIC_COLUMNS:
+        a, e = actual[col], expected[col]
+        if pd.api.types.is_datetime64_any_dtype(e):
+            a = pd.to_datetime(a)
+        same = (a == e) | (a.isna() & e.isna())
+        assert same.all(), f"{name}: {col} 不一致 {int((~same).sum())} 条"
+    print(f"{name}: {len(actual)} 条与全量计算一致")
+
+
+def test_inserted_batches_recompute_successors():
+    """新批次插入历史批次之间：后续批次的PreviousBatchEndTime及PT/DueTime等被重算"""
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        cfg = write_inputs(tmp_dir)
+        df = build_rows()
+        is_new = df.index % 25 == 0
+
+        history = full_compute(df[~is_new], cfg)
+        history_inputs = mes.get_metric_inputs(cfg, mes.get_calendar_policy(cfg).calendar)
+        actual = incremental_compute(history, df[is_new], history_inputs, cfg)
+        assert_matches_full(actual, full_compute(df, cfg), "插入新批次")
+        assert actual.attrs[METRIC_INPUTS_ATTR] == history_inputs
+
+
+def test_calendar_change_recomputes_affected_rows():
+    """日历变化：只重算计算区间覆盖变化日期的记录"""
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        cfg = write_inputs(tmp_dir)
+        df = build_rows(seed=6)
+        history = full_compute(df, cfg)
+        history_inputs = mes.get_metric_inputs(cfg, mes.get_calendar_policy(cfg).calendar)
+
+        cfg = write_inputs(tmp_dir, holiday="2024-06-12")
+        calendar = mes.get_calendar_policy(cfg).calendar
+        days = calendar.changed_days(WorkCalendar.from_state(history_inputs["calendar"]))
+        assert list(days) == [int(np.datetime64("2024-06-12", "D").astype(np.int64))]
+
+        combined = history.copy()
+        previous_end_before = combined["PreviousBatchEndTime"].copy()
+        actual = mes.refresh_dependent_metrics(combined, previous_end_before, history_inputs, cfg)
+        assert_matches_full(actual, full_compute(df, cfg), "日历变化")
+        changed = (actual["DueTime"] != history["DueTime"]).sum()
+        print(f"日历变化后DueTime变化: {int(changed)} 条")
+        assert 0 < changed < len(df)
+
+
+def test_standard_time_change_recomputes_affected_rows():
+    """标准时间表变化：标准时间输入变化的记录被重算"""
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        cfg = write_inputs(tmp_dir)
+        df = build_rows(seed=7)
+        history = full_compute(df, cfg)
+        history_inputs = mes.get_metric_inputs(cfg, mes.get_calendar_policy(cfg).calendar)
+
+        cfg = write_inputs(tmp_dir, machine_seconds=900.0)
+        # 重写的文件大小可能不变、修改时间精度有限，直接使用过期签名
+        history_inputs = dict(history_inputs, standard_time="stale")
+
+        combined = history.copy()
+        previous_end_before = combined["PreviousBatchEndTime"].copy()
+        actual = mes.refresh_dependent_metrics(combined, previous_end_before, history_inputs, cfg)
+        assert_matches_full(actual, full_compute(df, cfg), "标准时间变化")
+
+
+def test_standard_time_added_recomputes_status():
+    """标准时间表新增物料：原EH为空（ST、DueTime、Tolerance(h)为空）的记录重算后按新的容差判断为Overdue"""
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        cfg = write_inputs(tmp_dir)
+        df = build_rows(seed=8)
+        df.loc[df.index % 5 == 0, "CFN"] = "CFN-D"
+        history = full_compute(df, cfg)
+        history_inputs = mes.get_metric_inputs(cfg, mes.get_calendar_policy(cfg).calendar)
+        cfn_d = (history["CFN"] == "CFN-D").to_numpy()
+        assert history.loc[cfn_d, "Tolerance(h)"].isna().all()
+
+        cfg = write_inputs(tmp_dir, with_cfn_d=True)
+        combined = history.copy()
+        previous_end_before = combined["PreviousBatchEndTime"].copy()
+        actual = mes.refresh_dependent_metrics(combined, previous_end_before, history_inputs, cfg)
+        expected = full_compute(df, cfg)
+        assert (expected.loc[expected["CFN"] == "CFN-D", "CompletionStatus"] == "Overdue").any()
+        assert_matches_full(actual, expected, "标准时间新增物料")
+
+
+if __name__ == "__main__":
+    print("=" * 60)
+    print("测试增量指标重算")
+    print("=" * 60)
+    test_inserted_batches_recompute_successors()
+    test_calendar_change_recomputes_affected_rows()
+    test_standard_time_change_recomputes_affected_rows()
+    test_standard_time_added_recomputes_status()
+    print("✅ 所有测试通过")
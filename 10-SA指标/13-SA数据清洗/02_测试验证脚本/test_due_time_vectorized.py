@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""
+测试DueTime向量化计算
+验证累计工作时间索引（etl_metrics.CalendarPolicy）的结果与逐行参考实现 calculate_due_time 完全一致
+"""
+
+import sys
+import os
+
+import numpy as np
+import pandas as pd
+
+# 添加核心ETL程序目录到路径
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '01_核心ETL程序'))
+
+from etl_metrics import CalendarPolicy
+from rowwise_oracles import calculate_due_time
+
+
+def build_calendar() -> pd.DataFrame:
+    """构造测试用日历表：国庆长假 + 调休工作日"""
+    dates = pd.date_range("2024-09-01", "2024-11-30", freq="D")
+    calendar = pd.DataFrame({"日期": dates, "是否工作日": dates.weekday < 5})
+    holidays = pd.date_range("2024-10-01", "2024-10-07", freq="D")
+    calendar.loc[calendar["日期"].isin(holidays), "是否工作日"] = False
+    # 调休：周日上班
+    calendar.loc[calendar["日期"].isin(pd.to_datetime(["2024-09-29", "2024-10-12"])), "是否工作日"] = True
+    return calendar.set_index("日期")
+
+
+def build_rows(n: int = 400, seed: int = 7) -> pd.DataFrame:
+    """构造随机测试数据（覆盖8:00前后、节假日、日历表范围外）"""
+    rng = np.random.default_rng(seed)
+    base = pd.Timestamp("2024-08-20")
+    start = base + pd.to_timedelta(rng.integers(0, 120 * 24 * 60, n), unit="min")
+    df = pd.DataFrame({
+        "PreviousBatchEndTime": start,
+        "EnterStepTime": start - pd.to_timedelta(rng.integers(0, 600, n), unit="min"),
+        "StepInQuantity": rng.integers(0, 3000, n),
+        "EH_machine(s)": rng.choice([0.0, np.nan, 30.0, 95.5, 400.0], n),
+        "EH_labor(s)": rng.choice([0.0, np.nan, 60.0, 120.0], n),
+        "OEE": rng.choice([0.77, 0.85, 0.6], n),
+        "Setup": rng.choice(["Yes", "No"], n),
+        "Setup Time (h)": rng.choice([np.nan, 1.5, 4.0], n),
+    })
+    # 部分记录没有上批结束时间，回退到EnterStepTime
+    df.loc[df.index % 5 == 0, "PreviousBatchEndTime"] = pd.NaT
+    # 8:00整点边界
+    df.loc[1, "PreviousBatchEndTime"] = pd.Timestamp("2024-10-08 08:00:00")
+    df.loc[2, "PreviousBatchEndTime"] = pd.Timestamp("2024-09-30 07:59:59")
+    return df
+
+
+def compare(df: pd.DataFrame, calendar_df: pd.DataFrame, daily_working_hours: float) -> int:
+    """逐行结果与向量化结果比较，返回不一致数量"""
+    expected = df.apply(lambda row: calculate_due_time(row, calendar_df, daily_working_hours), axis=1)
+    expected = pd.to_datetime(expected)
+    actual = CalendarPolicy(calendar_df, daily_working_hours).due_times(df)
+
+    both_na = expected.isna() & actual.isna()
+    diff = (actual - expected).abs() <= pd.Timedelta(milliseconds=1)
+    mismatch = ~(both_na | diff)
+    if mismatch.any():
+        print(pd.DataFrame({"expected": expected[mismatch], "actual": actual[mismatch]}).head())
+    return int(mismatch.sum())
+
+
+def test_due_time_vectorized_with_calendar():
+    """日历表 + 24小时连续生产"""
+    calendar_df = build_calendar()
+    df = build_rows()
+    for hours in (24.0, 8.0):
+        mismatch = compare(df, calendar_df, hours)
+        print(f"daily_working_hours={hours}: 不一致 {mismatch} 条")
+        assert mismatch == 0
+
+
+def test_due_time_vectorized_without_calendar():
+    """日历表为空时按周一到周五为工作日"""
+    df = build_rows(seed=11)
+    mismatch = compare(df, pd.DataFrame(), 24.0)
+    print(f"空日历表: 不一致 {mismatch} 条")
+    assert mismatch == 0
+
+
+if __name__ == "__main__":
+    print("=" * 60)
+    print("测试DueTime向量化计算")
+    print("=" * 60)
+    test_due_time_vectorized_with_calendar()
+    test_due_time_vectorized_without_calendar()
+    print("✅ 所有测试通过")
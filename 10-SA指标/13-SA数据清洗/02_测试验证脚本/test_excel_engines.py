@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""
+测试Excel读取引擎选择
+验证calamine不可用时回退到openpyxl，以及calamine与openpyxl读取的日期、整数、文本列类型和取值一致
+（未安装python-calamine时只验证回退）
+"""
+
+import sys
+import os
+import tempfile
+import importlib.util
+from datetime import datetime, timedelta
+
+import pandas as pd
+
+# 添加核心ETL程序目录到路径
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '01_核心ETL程序'))
+
+from etl_utils import resolve_excel_engine, get_excel_engine, read_excel_sheet
+import etl_dataclean_mes_batch_report as mes
+import etl_dataclean_sfc_batch_report as sfc
+from frame_test_utils import assert_frame_same, write_workbook
+
+HAS_CALAMINE = resolve_excel_engine("calamine") == "calamine"
+
+
+def write_mixed_workbook(path: str, n: int = 400) -> None:
+    """生成Excel（日期含秒、整数、整数值浮点数、数字与文本混合、N/A、空值、中间空行）"""
+    base = datetime(2025, 6, 1, 8, 0, 0)
+    rows = []
+    for i in range(n):
+        if i % 97 == 60:
+            rows.append([None] * 9)
+            continue
+        rows.append([
+            f"K{i:05d}" if i % 5 else 20250000 + i,
+            f"CFN-{i % 7}",
+            10 * (1 + i % 3) if i % 2 else float(10 * (1 + i % 3)),
+            f"CZM {['769', 'M022', 'Q002'][i % 3]} 纵切车",
+            None if i % 31 == 0 else base + timedelta(seconds=4243 * i),
+            float(i % 300) + (0.5 if i % 11 == 0 else 0.0),
+            "N/A" if i % 11 == 0 else 101 + i % 3,
+            "N/A" if i % 5 == 0 else base + timedelta(minutes=17 * i),
+            None if i % 3 else "返工",
+        ])
+    write_workbook(path, ["Material_Name", "Product_Name", "ERPOperation", "Resource", "TrackOutDate",
+                          "TrackOut_PrimaryQuantity", "机台号", "Check In 时间", "Comment"], rows)
+
+
+def test_engine_fallback():
+    """未安装calamine或配置未知引擎时使用openpyxl"""
+    assert resolve_excel_engine("openpyxl") == "openpyxl"
+    assert resolve_excel_engine("xlrd") == "openpyxl"
+    assert get_excel_engine({"source": {"excel_engine": "openpyxl"}}) == "openpyxl"
+
+    original = importlib.util.find_spec
+    importlib.util.find_spec = lambda name, *args: None if name == "python_calamine" else original(name, *args)
+    resolve_excel_engine.cache_clear()
+    try:
+        assert resolve_excel_engine("calamine") == "openpyxl"
+        assert resolve_excel_engine("auto") == "openpyxl"
+        assert get_excel_engine({}) == "openpyxl"
+    finally:
+        importlib.util.find_spec = original
+        resolve_excel_engine.cache_clear()
+    print(f"引擎回退: 当前环境 auto -> {resolve_excel_engine('auto')}")
+
+
+def test_engines_read_identically():
+    """calamine与openpyxl读取全部列/指定列的结果一致"""
+    if not HAS_CALAMINE:
+        print("未安装python-calamine，跳过引擎一致性测试")
+        return
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, "Product Output.xlsx")
+        write_mixed_workbook(path)
+        assert_frame_same(read_excel_sheet(path, "calamine"), read_excel_sheet(path, "openpyxl"), "全部列",
+                          check_dtypes=True)
+        columns = ["Material_Name", "TrackOutDate", "机台号"]
+        assert_frame_same(read_excel_sheet(path, "calamine", columns, nrows=100),
+                          read_excel_sheet(path, "openpyxl", columns, nrows=100), "指定列", check_dtypes=True)
+
+
+def test_mes_sfc_engine_results_match():
+    """MES/SFC：calamine读取后前处理结果与openpyxl流式读取一致"""
+    if not HAS_CALAMINE:
+        print("未安装python-calamine，跳过MES/SFC引擎测试")
+        return
+    cfg = {
+        "mes_mapping": {"Material_Name": "BatchNumber", "Product_Name": "CFN", "ERPOperation": "Operation",
+                        "TrackOutDate": "TrackOutTime", "TrackOut_PrimaryQuantity": "TrackOutQuantity"},
+        "mes_types": {"TrackOutTime": "datetime", "TrackOutQuantity": "float"},
+    }
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, "Product Output.xlsx")
+        write_mixed_workbook(path)
+        results = {}
+        for engine in ("openpyxl", "calamine"):
+            engine_cfg = dict(cfg, source={"excel_engine": engine})
+            results[engine] = mes.process_mes_data(mes.read_mes_excel(path, engine_cfg), engine_cfg)
+        assert_frame_same(results["calamine"], results["openpyxl"], "MES前处理", check_dtypes=True)
+        assert_frame_same(sfc.read_sharepoint_excel(path, engine="calamine"),
+                          sfc.read_sharepoint_excel(path, engine="openpyxl"), "SFC读取", check_dtypes=True)
+
+
+if __name__ == "__main__":
+    print("=" * 60)
+    print("测试Excel读取引擎选择")
+    print("=" * 60)
+    test_engine_fallback()
+    test_engines_read_identically()
+    test_mes_sfc_engine_results_match()
+    print("✅ 所有测试通过")
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""
+测试流式读取Excel
+验证按列投影的分块读取结果与pd.read_excel一致（空值、整数型浮点数、日期、空行、错误值），
+以及MES按mes_mapping只读取需要的列
+直接运行时额外输出与pd.read_excel的耗时对比
+"""
+
+import sys
+import os
+import time
+import tempfile
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+# 添加核心ETL程序目录到路径
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '01_核心ETL程序'))
+
+from etl_utils import iter_excel_chunks, read_sharepoint_excel
+import etl_dataclean_mes_batch_report as mes
+from frame_test_utils import assert_frame_same, write_workbook
+
+
+def write_mes_export(path: str, n: int = 500, seed: int = 3) -> None:
+    """生成MES导出格式的Excel（包含不需要的列、空单元格、空行、错误值）"""
+    rng = np.random.default_rng(seed)
+    base = datetime(2025, 5, 1, 8, 0)
+    rows = []
+    for i in range(n):
+        if i % 97 == 50:
+            rows.append([None] * 8)
+            continue
+        rows.append([
+            f"K{i:05d}" if i % 5 else 20250000 + i,
+            None if i % 23 == 0 else f"CFN-{i % 7}",
+            float(10 * (1 + i % 3)) if i % 2 else 10 * (1 + i % 3),
+            f"CZM {rng.choice(['769', 'M022', 'Q002'])} 线切割 WEDM",
+            None if i % 31 == 0 else base + timedelta(minutes=int(rng.integers(0, 90 * 1440))),
+            "#N/A" if i % 41 == 0 else float(rng.integers(1, 500)) + (0.5 if i % 11 == 0 else 0.0),
+            "x" * 20,
+            float(i),
+        ])
+    write_workbook(path, ["Material_Name", "Product_Name ", "ERPOperation", "Resource", "TrackOutDate",
+                          "TrackOut_PrimaryQuantity", "Unused Text", "Unused Number"], rows)
+
+
+def test_projected_read_matches_read_excel():
+    """分块读取指定列 vs pd.read_excel后选列"""
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, "Product Output.xlsx")
+        write_mes_export(path)
+        columns = ["Material_Name", "Product_Name", "ERPOperation", "Resource", "TrackOutDate",
+                   "TrackOut_PrimaryQuantity"]
+        expected = pd.read_excel(path, engine='openpyxl', sheet_name=0)
+        expected = expected[[c for c in expected.columns if c.strip() in columns]]
+
+        chunks = list(iter_excel_chunks(path, columns, chunk_size=128))
+        assert len(chunks) > 1 and all(len(chunk) <= 128 for chunk in chunks)
+        actual = read_sharepoint_excel(path, columns=columns, chunk_size=128)
+        assert_frame_same(actual, expected, "按列分块读取")
+        assert pd.api.types.is_datetime64_any_dtype(actual["TrackOutDate"])
+
+        limited = read_sharepoint_excel(path, max_rows=100, columns=columns)
+        assert len(limited) == 100
+
+
+def test_mes_reads_mapped_columns():
+    """MES：只读取mes_mapping源列和Resource，处理结果与读取全部列一致"""
+    cfg = {
+        "mes_mapping": {"Material_Name": "BatchNumber", "Product_Name": "CFN", "ERPOperation": "Operation",
+                        "TrackOutDate": "TrackOutTime", "TrackOut_PrimaryQuantity": "TrackOutQuantity"},
+        "mes_types": {"TrackOutTime": "datetime", "TrackOutQuantity": "float"},
+    }
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, "Product Output.xlsx")
+        write_mes_export(path, n=300)
+        raw = mes.read_mes_excel(path, cfg)
+        assert "Unused Text" not in raw.columns and "Resource" in raw.columns
+
+        full = mes.read_mes_excel(path, dict(cfg, source={"excel_streaming": False}))
+        assert "Unused Text" in full.columns
+        actual = mes.process_mes_data(raw, cfg)
+        expected = mes.process_mes_data(full, cfg)[list(actual.columns)]
+        assert_frame_same(actual, expected, "MES前处理")
+
+
+def benchmark(n: int = 50000) -> None:
+    """pd.read_excel全部列 vs 流式读取所需列耗时对比"""
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, "Product Output.xlsx")
+        write_mes_export(path, n=n)
+        start = time.perf_counter()
+        pd.read_excel(path, engine='openpyxl', sheet_name=0)
+        full_seconds = time.perf_counter() - start
+        start = time.perf_counter()
+        read_sharepoint_excel(path, columns=["Material_Name", "Product_Name", "TrackOutDate", "Resource"])
+        stream_seconds = time.perf_counter() - start
+    print(f"{n} 行: pd.read_excel {full_seconds:.2f}s, 流式读取 {stream_seconds:.2f}s")
+
+
+if __name__ == "__main__":
+    print("=" * 60)
+    print("测试流式读取Excel")
+    print("=" * 60)
+    test_projected_read_matches_read_excel()
+    test_mes_reads_mapped_columns()
+    benchmark()
+    print("✅ 所有测试通过")
@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+"""
+测试Excel追加读取检查点
+验证财年导出文件追加行后只解析追加的行（跳过前缀行的单元格解析），结果与全量读取一致；
+前缀末尾行被修改、行被删除或表头变化时全量解析
+"""
+
+import sys
+import os
+import tempfile
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+import pandas as pd
+from openpyxl.worksheet import _reader as reader_module
+from openpyxl.worksheet._reader import WorkSheetParser
+
+# 添加核心ETL程序目录到路径
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '01_核心ETL程序'))
+
+import etl_utils
+from etl_utils import ExcelTailCheckpoint, get_excel_checkpoint, read_sharepoint_excel
+import etl_dataclean_mes_batch_report as mes
+from frame_test_utils import assert_frame_same, write_workbook
+
+HEADER = ["Material_Name", "Product_Name", "ERPOperation", "Resource", "TrackOutDate",
+          "TrackOut_PrimaryQuantity", "Unused Text"]
+COLUMNS = ["Material_Name", "Product_Name", "ERPOperation", "Resource", "TrackOutDate", "TrackOut_PrimaryQuantity"]
+
+
+def mes_row(i: int, edited: bool = False) -> list:
+    """第i行数据（批次号数字与文本混合，含空值、空行、错误值）"""
+    if i % 97 == 50:
+        return [None] * len(HEADER)
+    return [
+        f"K{i:05d}" if i % 5 else 20250000 + i,
+        None if i % 23 == 0 else f"CFN-{i % 7}",
+        10 * (1 + i % 3),
+        f"CZM {['769', 'M022', 'Q002'][i % 3]} 纵切车",
+        None if i % 31 == 0 else datetime(2025, 5, 1, 8) + timedelta(minutes=37 * i),
+        "#N/A" if i % 41 == 0 else float(i % 300) + (99.5 if edited else 0.0),
+        "x" * 10,
+    ]
+
+
+def write_first_rows(path: str, n: int, edited_rows: tuple = (), header: list = HEADER) -> None:
+    """生成前n行数据的工作簿（同样的行号内容相同，模拟财年文件逐日追加）"""
+    write_workbook(path, header, (mes_row(i, edited=i in edited_rows) for i in range(n)))
+
+
+@contextmanager
+def count_parsed_cells(counter: list):
+    """统计解析的单元格数"""
+    original = WorkSheetParser.parse_cell
+
+    def parse_cell(self, element):
+        counter.append(1)
+        return original(self, element)
+
+    WorkSheetParser.parse_cell = parse_cell
+    try:
+        yield
+    finally:
+        WorkSheetParser.parse_cell = original
+
+
+def test_append_parses_only_tail():
+    """追加行后只解析末尾校验行和追加行，结果与全量读取一致"""
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, "Product Output -CZM -FY26.xlsx")
+        checkpoint = ExcelTailCheckpoint(os.path.join(tmp_dir, "checkpoint"), sample_rows=10)
+        write_first_rows(path, 2000)
+        first = checkpoint.read(path, COLUMNS, chunk_size=256)
+        assert_frame_same(first, read_sharepoint_excel(path, columns=COLUMNS), "首次读取", as_text=True)
+
+        for n in (2150, 2151, 2400):
+            write_first_rows(path, n)
+            cells = []
+            with count_parsed_cells(cells):
+                actual = checkpoint.read(path, COLUMNS, chunk_size=256)
+            # 只解析表头、10行校验行和追加行
+            assert len(cells) <= (1 + 10 + 250) * len(HEADER), len(cells)
+            assert_frame_same(actual, read_sharepoint_excel(path, columns=COLUMNS), f"追加到 {n} 行", as_text=True)
+        assert pd.api.types.is_datetime64_any_dtype(actual["TrackOutDate"])
+
+        # 文件未追加时直接返回已解析数据
+        unchanged = checkpoint.read(path, COLUMNS)
+        assert len(unchanged) == len(actual)
+
+
+def test_prefix_change_falls_back_to_full_parse():
+    """前缀末尾行被修改、行被删除、表头变化时全量解析"""
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, "Product Output -CZM -FY26.xlsx")
+        checkpoint = ExcelTailCheckpoint(os.path.join(tmp_dir, "checkpoint"), sample_rows=10)
+        write_first_rows(path, 1000)
+        checkpoint.read(path, COLUMNS)
+
+        cases = [
+            ("修改末尾行", dict(n=1100, edited_rows=(995,))),
+            ("删除行", dict(n=900)),
+            ("表头变化", dict(n=1200, header=HEADER[:-1] + ["Comment"])),
+        ]
+        for name, kwargs in cases:
+            write_first_rows(path, **kwargs)
+            cells = []
+            with count_parsed_cells(cells):
+                actual = checkpoint.read(path, COLUMNS)
+            assert len(cells) > kwargs["n"] * 5, f"{name}: 未全量解析"
+            assert_frame_same(actual, read_sharepoint_excel(path, columns=COLUMNS), name, as_text=True)
+
+
+def test_mes_read_with_checkpoint():
+    """MES：启用检查点读取追加后的文件，前处理结果与不使用检查点一致；全量刷新时重建检查点"""
+    cfg = {
+        "source": {"excel_checkpoint": {"enabled": True, "sample_rows": 5}},
+        "mes_mapping": {"Material_Name": "BatchNumber", "Product_Name": "CFN", "ERPOperation": "Operation",
+                        "TrackOutDate": "TrackOutTime", "TrackOut_PrimaryQuantity": "TrackOutQuantity"},
+        "mes_types": {"TrackOutTime": "datetime", "TrackOutQuantity": "float"},
+    }
+    assert get_excel_checkpoint({}) is None
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        cfg["source"]["excel_checkpoint"]["dir"] = os.path.join(tmp_dir, "checkpoint")
+        path = os.path.join(tmp_dir, "Product Output -CZM -FY26.xlsx")
+        write_first_rows(path, 600)
+        mes.read_mes_excel(path, cfg)
+        write_first_rows(path, 700)
+        actual = mes.process_mes_data(mes.read_mes_excel(path, cfg), cfg)
+        expected = mes.process_mes_data(mes.read_mes_excel(path, {k: v for k, v in cfg.items() if k != "source"}), cfg)
+        assert_frame_same(actual, expected, "MES 追加读取前处理", as_text=True)
+
+        cells = []
+        with count_parsed_cells(cells):
+            mes.read_mes_excel(path, cfg, full_parse=True)
+        assert len(cells) > 700 * 5
+
+
+def test_private_reader_unavailable_falls_back():
+    """openpyxl内部解析接口变化（方法缺失或签名不同）时使用公开接口全量读取，结果一致且检查点仍可用"""
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, "Product Output -CZM -FY26.xlsx")
+        checkpoint = ExcelTailCheckpoint(os.path.join(tmp_dir, "checkpoint"), sample_rows=10)
+        write_first_rows(path, 500)
+        checkpoint.read(path, COLUMNS)
+
+        class ChangedParser(WorkSheetParser):
+            """构造参数变化的解析器"""
+            def __init__(self, src, shared_strings):
+                super().__init__(src, shared_strings)
+
+        # 替换 _reader 模块中的绑定（openpyxl公开接口使用 _read_only 模块自己导入的解析器，不受影响）
+        for name, changed in (("类缺失", None), ("构造参数变化", ChangedParser)):
+            write_first_rows(path, 600 if changed is None else 700)
+            if changed is None:
+                del reader_module.WorkSheetParser
+            else:
+                reader_module.WorkSheetParser = changed
+            try:
+                actual = checkpoint.read(path, COLUMNS)
+            finally:
+                reader_module.WorkSheetParser = WorkSheetParser
+            assert_frame_same(actual, read_sharepoint_excel(path, columns=COLUMNS), name, as_text=True)
+
+        # 版本检查不通过时不使用内部接口
+        etl_utils.openpyxl_private_reader_available.cache_clear()
+        version = etl_utils.OPENPYXL_TESTED_VERSIONS
+        etl_utils.OPENPYXL_TESTED_VERSIONS = ((9, 0), (10, 0))
+        try:
+            assert not etl_utils.openpyxl_private_reader_available()
+            write_first_rows(path, 800)
+            actual = checkpoint.read(path, COLUMNS)
+        finally:
+            etl_utils.OPENPYXL_TESTED_VERSIONS = version
+            etl_utils.openpyxl_private_reader_available.cache_clear()
+        assert_frame_same(actual, read_sharepoint_excel(path, columns=COLUMNS), "版本不在验证范围", as_text=True)
+
+        # 恢复后检查点（公开接口写入）可继续追加读取
+        write_first_rows(path, 900)
+        cells = []
+        with count_parsed_cells(cells):
+            actual = checkpoint.read(path, COLUMNS)
+        assert len(cells) <= (1 + 10 + 100) * len(HEADER), len(cells)
+        assert_frame_same(actual, read_sharepoint_excel(path, columns=COLUMNS), "恢复后追加读取", as_text=True)
+
+
+if __name__ == "__main__":
+    print("=" * 60)
+    print("测试Excel追加读取检查点")
+    print("=" * 60)
+    test_append_parses_only_tail()
+    test_prefix_change_falls_back_to_full_parse()
+    test_mes_read_with_checkpoint()
+    test_private_reader_unavailable_falls_back()
+    print("✅ 所有测试通过")
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""
+测试记录指纹的二进制存储
+验证追加日志、合并、重新打开后的成员判断一致，有序数组损坏或缺失时从合并前保留的文件恢复，
+状态JSON中的指纹列表首次使用时导入，以及全量刷新时一并删除指纹文件
+"""
+
+import sys
+import os
+import json
+import tempfile
+
+import numpy as np
+
+# 添加核心ETL程序目录到路径
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '01_核心ETL程序'))
+
+from etl_utils import FingerprintStore, load_fingerprint_store, remove_etl_state
+
+
+def test_append_and_compact():
+    """新指纹追加到日志，超过阈值时合并；重新打开后成员判断不变"""
+    rng = np.random.default_rng(0)
+    values = rng.integers(0, 2 ** 63, 5000, dtype=np.uint64) * np.uint64(2)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        state_file = os.path.join(tmp_dir, "etl_state.json")
+        store = FingerprintStore(state_file, compact_min=1500, compact_ratio=0.5)
+        assert store.add(values[:1000]) == 1000
+        assert store.add(values[500:1200]) == 200
+        assert os.path.exists(store.log_path) and not os.path.exists(store.base_path)
+        assert store.add(values[1200:2000]) == 800
+        # 日志超过1500条：合并为有序数组并删除日志
+        assert os.path.exists(store.base_path) and not os.path.exists(store.log_path)
+        assert store.add(values[2000:2500]) == 500 and os.path.exists(store.log_path)
+
+        reopened = FingerprintStore(state_file)
+        assert len(reopened) == 2500
+        probe = np.concatenate([values[:3000], values[:10] + np.uint64(1)])
+        np.testing.assert_array_equal(reopened.contains(probe), np.isin(probe, values[:2500]))
+        np.testing.assert_array_equal(reopened.values(), np.unique(values[:2500]))
+
+        # 写入中断的日志末尾（不足8字节）忽略
+        with open(reopened.log_path, 'ab') as f:
+            f.write(b"\x01\x02\x03")
+        assert len(FingerprintStore(state_file)) == 2500
+    print("追加日志、合并、重新打开后成员判断一致")
+
+
+def test_recover_corrupt_base():
+    """有序数组损坏（如同步中断）或合并中途缺失时，从 .prev 文件恢复全部指纹；恢复后再次合并仍可恢复"""
+    rng = np.random.default_rng(1)
+    values = rng.integers(0, 2 ** 63, 3000, dtype=np.uint64)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        state_file = os.path.join(tmp_dir, "etl_state.json")
+        store = FingerprintStore(state_file, compact_min=500, compact_ratio=0.5)
+        for start in range(0, 2000, 400):
+            store.add(values[start:start + 400])
+        store.add(values[2000:2100])
+        assert os.path.exists(store.prev_base_path) and os.path.exists(store.log_path)
+        expected = np.unique(values[:2100])
+
+        with open(store.base_path, 'wb') as f:
+            f.write(b"\x93NUMPY corrupted")
+        recovered = FingerprintStore(state_file, compact_min=500, compact_ratio=0.5)
+        np.testing.assert_array_equal(recovered.values(), expected)
+
+        # 恢复后合并：损坏的文件不会被保留为 .prev
+        recovered.compact()
+        os.remove(recovered.base_path)
+        np.testing.assert_array_equal(FingerprintStore(state_file).values(), expected)
+    print("有序数组损坏或缺失时从合并前的文件恢复")
+
+
+def test_import_json_and_remove():
+    """状态JSON中的指纹列表导入存储后从JSON删除；remove_etl_state删除状态文件和指纹文件"""
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        state_file = os.path.join(tmp_dir, "etl_sfc_state.json")
+        with open(state_file, 'w', encoding='utf-8') as f:
+            json.dump({"processed_fingerprints": [3, 1, 2, 3], "processed_raw_hashes": [7, 9],
+                       "processed_files": {"a.xlsx": {"mtime": 1.0}}}, f)
+        store = load_fingerprint_store(state_file)
+        raw_store = load_fingerprint_store(state_file, "raw", "processed_raw_hashes")
+        assert store.values().tolist() == [1, 2, 3] and raw_store.values().tolist() == [7, 9]
+        with open(state_file, 'r', encoding='utf-8') as f:
+            state = json.load(f)
+        assert state == {"processed_files": {"a.xlsx": {"mtime": 1.0}}}
+        assert load_fingerprint_store(state_file).contains(np.array([2, 4], dtype=np.uint64)).tolist() == [True, False]
+
+        other = os.path.join(tmp_dir, "etl_mes_state.processed.npy")
+        np.save(other, np.array([1], dtype=np.uint64))
+        remove_etl_state(state_file)
+        assert sorted(os.listdir(tmp_dir)) == ["etl_mes_state.processed.npy"]
+    print("JSON指纹列表已导入，全量刷新时删除指纹文件")
+
+
+if __name__ == "__main__":
+    print("=" * 60)
+    print("测试记录指纹存储")
+    print("=" * 60)
+    test_append_and_compact()
+    test_recover_corrupt_base()
+    test_import_json_and_remove()
+    print("✅ 所有测试通过")
@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+"""
+测试列式指标计算
+验证LT/PT/ST/CompletionStatus/Tolerance的列式结果与MES、SFC逐行参考实现（rowwise_oracles）完全一致，
+以及 compute_metrics 在日历表/固定周末两种非工作时间策略下的结果
+直接运行时额外输出与逐行apply的耗时对比
+"""
+
+import sys
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+# 添加核心ETL程序目录到路径
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '01_核心ETL程序'))
+
+from etl_metrics import (
+    calculate_lt_column,
+    calculate_pt_column,
+    calculate_st_column,
+    calculate_status_column,
+    calculate_tolerance_column,
+    compute_metrics,
+    CalendarPolicy,
+    FixedWeekendPolicy,
+)
+import rowwise_oracles as oracle
+
+
+def build_rows(n: int = 2000, seed: int = 42) -> pd.DataFrame:
+    """构造随机批次数据（覆盖停产期、空值回退、0010工序、长周期）"""
+    rng = np.random.default_rng(seed)
+    base = pd.Timestamp("2024-01-01")
+    enter = base + pd.to_timedelta(rng.integers(0, 300 * 86400, n), unit="s")
+    previous_end = enter + pd.to_timedelta(rng.integers(-3 * 86400, 3 * 86400, n), unit="s")
+    trackin = previous_end + pd.to_timedelta(rng.integers(-3600, 8 * 3600, n), unit="s")
+    trackout = trackin + pd.to_timedelta(rng.integers(-3600, 200 * 86400, n), unit="s")
+    df = pd.DataFrame({
+        "Operation": rng.choice(["0010", "0020", "0030"], n),
+        "EnterStepTime": enter,
+        "PreviousBatchEndTime": previous_end,
+        "TrackInTime": trackin,
+        "Checkin_SFC": enter - pd.to_timedelta(rng.integers(0, 86400, n), unit="s"),
+        "TrackOutTime": trackout,
+        "TrackOutQuantity": rng.integers(0, 3000, n),
+        "ScrapQuantity": rng.integers(0, 10, n),
+        "EH_machine(s)": rng.choice([0.0, np.nan, 12.5, 95.0, 600.0], n),
+        "EH_labor(s)": rng.choice([0.0, np.nan, 40.0], n),
+        "OEE": rng.choice([0.77, 0.9, 0.55], n),
+        "Setup": rng.choice(["Yes", "No"], n),
+        "Setup Time (h)": rng.choice([np.nan, 0.0, 1.5, 4.0], n),
+        "DueTime": trackout + pd.Timedelta(hours=5),
+    })
+    for col, step in [("EnterStepTime", 7), ("PreviousBatchEndTime", 5), ("TrackInTime", 6),
+                      ("Checkin_SFC", 4), ("TrackOutTime", 13), ("DueTime", 17)]:
+        df.loc[df.index % step == 0, col] = pd.NaT
+    return df
+
+
+def assert_same(expected: pd.Series, actual: pd.Series, name: str) -> None:
+    """逐值比较（空值视为相同）"""
+    expected = expected.astype(actual.dtype) if actual.dtype != object else expected
+    same = (expected == actual) | (expected.isna() & actual.isna())
+    mismatch = int((~same).sum())
+    print(f"{name}: 有效 {int(actual.notna().sum())} 条, 不一致 {mismatch} 条")
+    assert mismatch == 0
+
+
+def test_mes_metrics_columnar():
+    """MES：列式 vs 逐行"""
+    df = build_rows()
+    assert_same(df.apply(oracle.calculate_lt, axis=1), calculate_lt_column(df), "MES LT(d)")
+    assert_same(df.apply(oracle.calculate_pt, axis=1), calculate_pt_column(df), "MES PT(d)")
+    assert_same(df.apply(oracle.calculate_st, axis=1), calculate_st_column(df), "MES ST(d)")
+
+    df["PT(d)"] = calculate_pt_column(df)
+    df["ST(d)"] = calculate_st_column(df)
+    df["NonWorkday(d)"] = np.where(df.index % 9 == 0, np.nan, (df.index % 4) * 0.5)
+    assert_same(df.apply(lambda row: oracle.calculate_completion_status(row, pd.DataFrame()), axis=1),
+                calculate_status_column(df, "NonWorkday(d)"), "MES CompletionStatus")
+    assert_same(df.apply(oracle.calculate_tolerance_hours, axis=1), calculate_tolerance_column(df), "MES Tolerance(h)")
+
+
+def test_sfc_metrics_columnar():
+    """SFC：列式 vs 逐行（PT回退到Checkin_SFC，无TrackInTime列）"""
+    df = build_rows(seed=7).drop(columns=["TrackInTime"])
+    assert_same(df.apply(oracle.calculate_sfc_lt, axis=1), calculate_lt_column(df), "SFC LT(d)")
+    assert_same(df.apply(oracle.calculate_sfc_pt, axis=1), calculate_pt_column(df, checkin_fallback=True), "SFC PT(d)")
+    assert_same(df.apply(oracle.calculate_sfc_st, axis=1), calculate_st_column(df), "SFC ST(d)")
+
+    df["PT(d)"] = calculate_pt_column(df, checkin_fallback=True)
+    df["ST(d)"] = calculate_st_column(df)
+    df["Weekend(d)"] = (df.index % 3) * 1.0
+    assert_same(df.apply(oracle.calculate_sfc_completion_status, axis=1),
+                calculate_status_column(df, "Weekend(d)"), "SFC CompletionStatus")
+    assert_same(df.apply(oracle.calculate_sfc_tolerance_hours, axis=1), calculate_tolerance_column(df), "SFC Tolerance(h)")
+
+
+def test_compute_metrics_policies():
+    """compute_metrics：两种策略下的DueTime/非工作时间与逐行计算一致"""
+    df = build_rows(n=500, seed=11)
+    df["StepInQuantity"] = df["TrackOutQuantity"] + df["ScrapQuantity"]
+
+    mes_result = compute_metrics(df.copy(), CalendarPolicy())
+    expected_due = pd.to_datetime(df.apply(lambda row: oracle.calculate_due_time(row, pd.DataFrame()), axis=1))
+    assert_same(expected_due, mes_result["DueTime"], "CalendarPolicy DueTime")
+    assert_same(df.apply(lambda row: oracle.calculate_nonworkday_days(row, pd.DataFrame()), axis=1),
+                mes_result["NonWorkday(d)"], "CalendarPolicy NonWorkday(d)")
+    assert "Weekend(d)" not in mes_result.columns
+
+    sfc_df = df.drop(columns=["TrackInTime"])
+    sfc_result = compute_metrics(sfc_df.copy(), FixedWeekendPolicy(), checkin_fallback=True)
+    expected_due = pd.to_datetime(sfc_df.apply(oracle.calculate_sfc_due_time, axis=1))
+    same = (expected_due.isna() & sfc_result["DueTime"].isna()) | \
+        ((sfc_result["DueTime"] - expected_due).abs() <= pd.Timedelta(milliseconds=1))
+    print(f"FixedWeekendPolicy DueTime: 不一致 {int((~same).sum())} 条")
+    assert same.all()
+    assert_same(sfc_df.apply(oracle.calculate_sfc_weekend_days, axis=1),
+                sfc_result["Weekend(d)"], "FixedWeekendPolicy Weekend(d)")
+    assert_same(sfc_df.apply(oracle.calculate_sfc_pt, axis=1), sfc_result["PT(d)"], "FixedWeekendPolicy PT(d)")
+
+
+def benchmark(n: int = 200000) -> None:
+    """逐行apply与列式计算耗时对比"""
+    df = build_rows(n)
+    start = time.perf_counter()
+    for fn in (oracle.calculate_lt, oracle.calculate_pt, oracle.calculate_st):
+        df.apply(fn, axis=1)
+    row_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    calculate_lt_column(df)
+    calculate_pt_column(df)
+    calculate_st_column(df)
+    column_seconds = time.perf_counter() - start
+    print(f"{n} 行: 逐行 {row_seconds:.2f}s, 列式 {column_seconds:.3f}s, 加速 {row_seconds / column_seconds:.0f}x")
+
+
+if __name__ == "__main__":
+    print("=" * 60)
+    print("测试列式指标计算")
+    print("=" * 60)
+    test_mes_metrics_columnar()
+    test_sfc_metrics_columnar()
+    test_compute_metrics_policies()
+    benchmark(20000)
+    print("✅ 所有测试通过")
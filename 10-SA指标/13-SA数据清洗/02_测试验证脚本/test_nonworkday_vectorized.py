@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""
+测试非工作时间前缀和算法
+验证 NonWorkday(d)（MES日历表）和 Weekend(d)（SFC周末）的向量化结果与逐行计算完全一致
+"""
+
+import sys
+import os
+
+import numpy as np
+import pandas as pd
+
+# 添加核心ETL程序目录到路径
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '01_核心ETL程序'))
+
+from etl_calendar import calculate_nonworkday_hours_between
+from etl_metrics import CalendarPolicy, FixedWeekendPolicy
+from rowwise_oracles import (
+    calculate_nonworkday_hours,
+    calculate_nonworkday_days,
+    calculate_weekend_hours,
+    calculate_sfc_weekend_days,
+)
+
+
+def build_calendar() -> pd.DataFrame:
+    """构造测试用日历表：国庆长假 + 调休工作日"""
+    dates = pd.date_range("2024-09-01", "2024-11-30", freq="D")
+    calendar = pd.DataFrame({"日期": dates, "是否工作日": dates.weekday < 5})
+    holidays = pd.date_range("2024-10-01", "2024-10-07", freq="D")
+    calendar.loc[calendar["日期"].isin(holidays), "是否工作日"] = False
+    calendar.loc[calendar["日期"].isin(pd.to_datetime(["2024-09-29", "2024-10-12"])), "是否工作日"] = True
+    return calendar.set_index("日期")
+
+
+def random_intervals(n: int = 500, seed: int = 3):
+    """随机时间区间（秒级精度，覆盖跨多周、8:00前开始、结束早于开始）"""
+    rng = np.random.default_rng(seed)
+    start = pd.Timestamp("2024-08-25") + pd.to_timedelta(rng.integers(0, 100 * 86400, n), unit="s")
+    end = start + pd.to_timedelta(rng.integers(-3600, 30 * 86400, n), unit="s")
+    return pd.Series(start), pd.Series(end)
+
+
+def test_nonworkday_hours_kernel():
+    """前缀和内核 vs calculate_nonworkday_hours"""
+    calendar_df = build_calendar()
+    start, end = random_intervals()
+    expected = np.array([calculate_nonworkday_hours(s, e, calendar_df) for s, e in zip(start, end)])
+    actual = calculate_nonworkday_hours_between(start, end, calendar_df)
+    mismatch = int((expected != actual).sum())
+    print(f"非工作日小时数: 不一致 {mismatch} 条")
+    assert mismatch == 0
+
+
+def test_weekend_hours_kernel():
+    """前缀和内核（空日历表）vs calculate_weekend_hours"""
+    start, end = random_intervals(seed=5)
+    expected = np.array([calculate_weekend_hours(s, e) for s, e in zip(start, end)])
+    actual = calculate_nonworkday_hours_between(start, end, pd.DataFrame(), skip_before_day_start=False)
+    mismatch = int((expected != actual).sum())
+    print(f"周末小时数: 不一致 {mismatch} 条")
+    assert mismatch == 0
+
+
+def test_nonworkday_days_vectorized():
+    """NonWorkday(d)：向量化 vs 逐行"""
+    calendar_df = build_calendar()
+    start, end = random_intervals(seed=9)
+    n = len(start)
+    df = pd.DataFrame({
+        "Operation": np.where(np.arange(n) % 3 == 0, "0010", "0020"),
+        "Checkin_SFC": start.where(np.arange(n) % 2 == 0),
+        "EnterStepTime": start - pd.Timedelta(hours=5),
+        "TrackInTime": start + pd.Timedelta(hours=1),
+        "TrackOutTime": end,
+    })
+    df.loc[df.index % 7 == 0, "EnterStepTime"] = pd.NaT
+    expected = df.apply(lambda row: calculate_nonworkday_days(row, calendar_df), axis=1).astype(float)
+    actual = CalendarPolicy(calendar_df).nonworking_days(df)
+    mismatch = int((~((expected == actual) | (expected.isna() & actual.isna()))).sum())
+    print(f"NonWorkday(d): 不一致 {mismatch} 条")
+    assert mismatch == 0
+
+
+def test_sfc_weekend_days_vectorized():
+    """Weekend(d)：向量化 vs 逐行"""
+    rng = np.random.default_rng(21)
+    start, _ = random_intervals(n=300, seed=13)
+    n = len(start)
+    df = pd.DataFrame({
+        "Checkin_SFC": start.astype(object).where(np.arange(n) % 9 != 0, None),
+        "TrackOutQuantity": rng.integers(0, 5000, n),
+        "ScrapQuantity": rng.integers(0, 20, n),
+        "EH_machine(s)": rng.choice([0.0, np.nan, 45.0, 300.0], n),
+        "EH_labor(s)": rng.choice([0.0, np.nan, 90.0], n),
+        "OEE": rng.choice([0.77, 0.5], n),
+        "Setup": rng.choice(["Yes", "No"], n),
+        "Setup Time (h)": rng.choice([np.nan, 2.0, 6.0], n),
+    })
+    expected = df.apply(calculate_sfc_weekend_days, axis=1).astype(float)
+    actual = FixedWeekendPolicy().nonworking_days(df)
+    mismatch = int((~((expected == actual) | (expected.isna() & actual.isna()))).sum())
+    print(f"Weekend(d): 不一致 {mismatch} 条")
+    assert mismatch == 0
+
+
+if __name__ == "__main__":
+    print("=" * 60)
+    print("测试非工作时间前缀和算法")
+    print("=" * 60)
+    test_nonworkday_hours_kernel()
+    test_weekend_hours_kernel()
+    test_nonworkday_days_vectorized()
+    test_sfc_weekend_days_vectorized()
+    print("✅ 所有测试通过")
@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+"""
+测试多进程读取源文件
+验证MES/SFC多文件并行读取（子进程中字段映射）的结果与逐个读取后统一处理一致，
+且与进程数、完成顺序无关；读取失败的文件按顺序返回异常
+"""
+
+import sys
+import os
+import tempfile
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+import yaml
+
+# 添加核心ETL程序目录到路径
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '01_核心ETL程序'))
+
+from etl_utils import parallel_ingest
+import etl_dataclean_mes_batch_report as mes
+import etl_dataclean_sfc_batch_report as sfc
+from frame_test_utils import assert_frame_same, write_workbook
+
+CONFIG_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '03_配置文件', 'config')
+
+
+def load_cfg(name: str) -> dict:
+    """读取正式配置中的字段映射和类型定义"""
+    with open(os.path.join(CONFIG_DIR, name), 'r', encoding='utf-8') as f:
+        cfg = yaml.safe_load(f)
+    return {key: cfg[key] for key in cfg if key.endswith("_mapping") or key.endswith("_types")}
+
+
+def write_mes_workbook(path: str, n: int, seed: int) -> None:
+    """生成MES导出格式的Excel（各文件的machine时间线交错）"""
+    rng = np.random.default_rng(seed)
+    base = datetime(2025, 6, 1, 8)
+    rows = []
+    for i in range(n):
+        trackout = base + timedelta(minutes=int(rng.integers(0, 30 * 1440)))
+        rows.append([
+            f"K{seed}{i:04d}" if i % 9 else f"K{seed}{i:04d}-1",
+            f"CFN-{rng.integers(0, 4)}",
+            f"CZM 50210978/{10 * (1 + i % 3):04d} CZM 纵切车",
+            10 * (1 + i % 3),
+            "CZM 纵切车（可外协）",
+            f"CZM {rng.choice(['769', 'M022', 'Q002'])} 纵切车",
+            trackout - timedelta(hours=30),
+            None if i % 7 == 0 else trackout - timedelta(hours=2),
+            trackout,
+            int(rng.integers(1, 300)),
+            int(rng.integers(1, 300)),
+        ])
+    write_workbook(path, ["Material_Name", "Product_Name", "LogicalFlowPath", "ERPOperation", "Step_Name",
+                          "Resource", "DateEnteredStep", "First_TrackIn_Date", "TrackOutDate",
+                          "Step_In_PrimaryQuantity", "TrackOut_PrimaryQuantity"], rows)
+
+
+def write_sfc_workbook(path: str, n: int, seed: int) -> None:
+    """生成SFC每日导出格式的Excel（机台号/Check In时间含N/A）"""
+    rng = np.random.default_rng(seed)
+    base = datetime(2025, 6, 1, 8)
+    rows = []
+    for i in range(n):
+        trackout = base + timedelta(minutes=int(rng.integers(0, 30 * 1440)))
+        rows.append([
+            f"CFN-{rng.integers(0, 4)}",
+            f"S{seed}{i:04d}",
+            "N/A" if i % 13 == 0 else str(10 * (1 + i % 3)),
+            "数控车",
+            "N/A" if i % 5 == 0 else trackout - timedelta(hours=4),
+            "N/A" if i % 11 == 0 else int(rng.choice([101, 102, 205])),
+            trackout,
+            trackout - timedelta(hours=20),
+            int(rng.integers(1, 300)),
+            int(rng.integers(0, 3)),
+        ])
+    write_workbook(path, ["产品号", "批次", "工序号", "工序名称", "Check In 时间", "机台号", "报工时间",
+                          "上道工序报工时间", "合格数量", "报废数量"], rows)
+
+
+def test_mes_parallel_matches_sequential():
+    """MES：并行读取 + 字段映射后统一计算Setup vs 逐个读取合并后整体前处理"""
+    cfg = load_cfg("config_mes_batch_report.yaml")
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        files = []
+        for i in range(4):
+            path = os.path.join(tmp_dir, f"Product Output -CZM -FY26-{i}.xlsx")
+            write_mes_workbook(path, n=150 + 20 * i, seed=i + 1)
+            files.append(path)
+
+        expected = mes.process_mes_data(
+            pd.concat([mes.read_mes_excel(path, cfg) for path in files], ignore_index=True), cfg)
+
+        results = {}
+        for workers in (1, 3):
+            frames = [df for _, df, error in parallel_ingest(mes.ingest_mes_file, files, (cfg, None), workers)]
+            results[workers] = mes.calculate_trackin_time_and_setup(pd.concat(frames, ignore_index=True))
+        assert_frame_same(results[3], results[1], "MES 3进程 vs 1进程")
+        assert_frame_same(results[3], expected, "MES 并行 vs 逐个读取")
+        assert list(results[3].dtypes) == list(expected.dtypes)
+
+
+def test_sfc_parallel_matches_sequential():
+    """SFC：并行读取的每个文件与直接读取+process_sfc_data一致，按文件顺序返回，失败文件返回异常"""
+    cfg = load_cfg("config_sfc_batch_report.yaml")
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        files = []
+        for i in range(5):
+            path = os.path.join(tmp_dir, f"SFC-2025060{i}.xlsx")
+            write_sfc_workbook(path, n=80 + 10 * i, seed=i + 11)
+            files.append(path)
+        broken = os.path.join(tmp_dir, "SFC-broken.xlsx")
+        with open(broken, 'wb') as f:
+            f.write(b"not a zip file" * 200)
+        files.insert(2, broken)
+
+        results = list(parallel_ingest(sfc.ingest_sfc_file, files, (cfg,), 4))
+        assert [path for path, _, _ in results] == files
+        assert results[2][1] is None and results[2][2] is not None
+        for path, df, error in results:
+            if path == broken:
+                continue
+            assert error is None
+            expected = sfc.process_sfc_data(sfc.read_sharepoint_excel(path), cfg)
+            assert_frame_same(df, expected, f"SFC {os.path.basename(path)}")
+            assert list(df.dtypes) == list(expected.dtypes)
+
+
+if __name__ == "__main__":
+    print("=" * 60)
+    print("测试多进程读取源文件")
+    print("=" * 60)
+    test_mes_parallel_matches_sequential()
+    test_sfc_parallel_matches_sequential()
+    print("✅ 所有测试通过")
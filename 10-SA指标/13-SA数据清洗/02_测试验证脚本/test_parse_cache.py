@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""
+测试源文件解析缓存
+验证按内容指纹命中（改名/移动后仍命中、内容变化后重新解析）、LRU淘汰，
+以及缓存读取结果与直接解析一致（包括数字与文本混合的列）
+"""
+
+import sys
+import os
+import shutil
+import tempfile
+from datetime import datetime, timedelta
+
+import pandas as pd
+
+# 添加核心ETL程序目录到路径
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '01_核心ETL程序'))
+
+from etl_utils import ParseCache, get_parse_cache, read_sharepoint_excel
+from frame_test_utils import write_workbook
+
+
+def write_output(path: str, n: int = 200, offset: int = 0) -> None:
+    """生成Excel（批次号数字与文本混合）"""
+    write_workbook(path, ["Material_Name", "Product_Name", "TrackOutDate", "Qty"],
+                   ([20250000 + i if i % 4 == 0 else f"K{i + offset:05d}", f"CFN-{i % 5}",
+                     datetime(2025, 6, 1) + timedelta(hours=i), float(i % 9)] for i in range(n)))
+
+
+def counting_parser(path: str, calls: list):
+    """记录解析次数的解析函数"""
+    def parse() -> pd.DataFrame:
+        calls.append(path)
+        return pd.read_excel(path, engine='openpyxl')
+    return parse
+
+
+def test_cache_hit_by_content():
+    """同内容文件（含改名/移动）只解析一次，内容变化后重新解析"""
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        cache = ParseCache(os.path.join(tmp_dir, "cache"))
+        path = os.path.join(tmp_dir, "SFC-20250601.xlsx")
+        write_output(path)
+        calls = []
+
+        first = cache.read(path, counting_parser(path, calls))
+        second = cache.read(path, counting_parser(path, calls))
+        moved = os.path.join(tmp_dir, "archive", "SFC-20250601 (1).xlsx")
+        os.makedirs(os.path.dirname(moved))
+        shutil.copy(path, moved)
+        third = cache.read(moved, counting_parser(moved, calls))
+        assert len(calls) == 1
+
+        expected = pd.read_excel(path, engine='openpyxl')
+        for cached in (second, third):
+            assert list(cached.columns) == list(expected.columns) and len(cached) == len(expected)
+            assert list(cached["Material_Name"].astype(str)) == list(expected["Material_Name"].astype(str))
+            assert cached["TrackOutDate"].equals(expected["TrackOutDate"])
+            assert cached["Qty"].equals(expected["Qty"])
+        assert first["Material_Name"].iloc[0] == 20250000
+
+        write_output(path, offset=1)
+        cache.read(path, counting_parser(path, calls))
+        assert len(calls) == 2
+        print(f"解析缓存: 读取4次, 解析 {len(calls)} 次")
+
+
+def test_cache_lru_eviction():
+    """超过大小上限时淘汰最久未使用的缓存"""
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        cache_dir = os.path.join(tmp_dir, "cache")
+        paths = []
+        for i in range(3):
+            path = os.path.join(tmp_dir, f"SFC-2025060{i}.xlsx")
+            write_output(path, offset=i * 1000)
+            paths.append(path)
+        probe = ParseCache(cache_dir)
+        probe.read(paths[0], counting_parser(paths[0], []))
+        entry_size = os.path.getsize(os.path.join(cache_dir, os.listdir(cache_dir)[0]))
+
+        cache = ParseCache(cache_dir, max_bytes=int(entry_size * 2.5))
+        cache.read(paths[1], counting_parser(paths[1], []))
+        # 最早写入的缓存被访问后变为最近使用
+        os.utime(os.path.join(cache_dir, f"{cache.key(paths[1])}.parquet"), (1, 1))
+        cache.read(paths[0], counting_parser(paths[0], []))
+        cache.read(paths[2], counting_parser(paths[2], []))
+        remaining = sorted(os.listdir(cache_dir))
+        assert len(remaining) == 2
+        assert f"{cache.key(paths[1])}.parquet" not in remaining
+        print(f"LRU淘汰: 保留 {len(remaining)} 个缓存文件")
+
+
+def test_read_sharepoint_excel_with_cache():
+    """read_sharepoint_excel：缓存结果与直接读取一致，读取参数不同时分别缓存"""
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, "Product Output.xlsx")
+        write_output(path, n=3000)
+        cfg = {"parse_cache": {"enabled": True, "dir": os.path.join(tmp_dir, "cache")}}
+        cache = get_parse_cache(cfg)
+        assert get_parse_cache({}) is None
+
+        columns = ["Material_Name", "TrackOutDate"]
+        expected = read_sharepoint_excel(path, columns=columns)
+        read_sharepoint_excel(path, columns=columns, cache=cache)
+        actual = read_sharepoint_excel(path, columns=columns, cache=cache)
+        assert list(actual.columns) == columns
+        assert list(actual["Material_Name"].astype(str)) == list(expected["Material_Name"].astype(str))
+        assert actual["TrackOutDate"].equals(expected["TrackOutDate"])
+
+        full = read_sharepoint_excel(path, cache=cache)
+        assert "Qty" in full.columns
+        assert len(os.listdir(cache.cache_dir)) == 2
+
+
+if __name__ == "__main__":
+    print("=" * 60)
+    print("测试源文件解析缓存")
+    print("=" * 60)
+    test_cache_hit_by_content()
+    test_cache_lru_eviction()
+    test_read_sharepoint_excel_with_cache()
+    print("✅ 所有测试通过")
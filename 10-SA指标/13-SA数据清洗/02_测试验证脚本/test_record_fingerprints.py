@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""
+测试记录指纹
+验证FNV-1a 64位hash与参考实现一致、同一键值在不同列类型下指纹相同，
+以及旧版状态文件（逐行MD5）按历史数据迁移为记录指纹后增量过滤结果不变
+"""
+
+import sys
+import os
+import json
+import hashlib
+import tempfile
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+# 添加核心ETL程序目录到路径
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '01_核心ETL程序'))
+
+from etl_utils import (fnv1a_64, record_fingerprints, migrate_state_file, update_etl_state, FingerprintStore,
+                       FINGERPRINT_VERSION)
+import etl_dataclean_mes_batch_report as mes
+
+KEY_FIELDS = ["BatchNumber", "Operation", "machine", "TrackOutTime"]
+
+
+def reference_fnv1a_64(text: str) -> int:
+    """逐字节的FNV-1a 64位参考实现"""
+    h = 0xCBF29CE484222325
+    for byte in text.encode('utf-8'):
+        h = ((h ^ byte) * 0x100000001B3) & 0xFFFFFFFFFFFFFFFF
+    return h
+
+
+def legacy_md5(row: pd.Series) -> str:
+    """旧版本状态文件中的记录hash"""
+    values = []
+    for field in KEY_FIELDS:
+        val = row[field]
+        if pd.isna(val):
+            values.append('')
+        elif isinstance(val, (pd.Timestamp, datetime)):
+            values.append(val.strftime('%Y-%m-%d %H:%M:%S'))
+        else:
+            values.append(str(val))
+    return hashlib.md5('|'.join(values).encode('utf-8')).hexdigest()
+
+
+def make_records(n: int = 300) -> pd.DataFrame:
+    base = datetime(2025, 6, 1, 8)
+    return pd.DataFrame({
+        "BatchNumber": [f"K{i:05d}" for i in range(n)],
+        "Operation": [str(10 * (1 + i % 3)) for i in range(n)],
+        "machine": [None if i % 17 == 0 else f"CZM {101 + i % 3}" for i in range(n)],
+        "TrackOutTime": [base + timedelta(minutes=37 * i) for i in range(n)],
+        "TrackOutQuantity": [float(i % 50) for i in range(n)],
+    })
+
+
+def test_fnv_reference():
+    """向量化结果与逐字节参考实现一致（含中文、空字符串、不同长度）"""
+    texts = ["", "a", "foobar", "批次\x1f10\x1f2025-06-01 08:00:00", "K00001" * 40]
+    actual = fnv1a_64(pd.Series(texts))
+    assert actual.dtype == np.uint64
+    assert [int(v) for v in actual] == [reference_fnv1a_64(t) for t in texts]
+    assert int(actual[1]) == 0xAF63DC4C8601EC8C
+    print("FNV-1a 64位hash与参考实现一致")
+
+
+def test_fingerprints_stable_across_dtypes():
+    """日期列为datetime64或Timestamp对象、空值为None或NaN时指纹相同；不同键值指纹不同"""
+    df = make_records()
+    variant = df.copy()
+    variant["TrackOutTime"] = variant["TrackOutTime"].astype(object)
+    variant["machine"] = variant["machine"].fillna(np.nan)
+    variant["BatchNumber"] = variant["BatchNumber"].astype("string")
+    np.testing.assert_array_equal(record_fingerprints(df, KEY_FIELDS), record_fingerprints(variant, KEY_FIELDS))
+    assert len(np.unique(record_fingerprints(df, KEY_FIELDS))) == len(df)
+    # 分隔符避免字段拼接歧义
+    a = pd.DataFrame({"x": ["ab"], "y": ["c"]})
+    b = pd.DataFrame({"x": ["a"], "y": ["bc"]})
+    assert record_fingerprints(a, ["x", "y"])[0] != record_fingerprints(b, ["x", "y"])[0]
+    print("不同列类型下指纹一致")
+
+
+def test_migrate_legacy_state():
+    """旧版MD5状态按历史数据迁移后，增量过滤结果与迁移前相同；其他状态字段保留"""
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        history = make_records()
+        history_file = os.path.join(tmp_dir, "MES_batch_report_latest.parquet")
+        history.to_parquet(history_file, index=False)
+        state_file = os.path.join(tmp_dir, "state.json")
+        with open(state_file, 'w', encoding='utf-8') as f:
+            json.dump({"processed_hashes": [legacy_md5(row) for _, row in history.iterrows()],
+                       "last_full_refresh_time": "2025-06-01T00:00:00"}, f)
+
+        assert migrate_state_file(state_file, history_file, KEY_FIELDS)
+        assert not migrate_state_file(state_file, history_file, KEY_FIELDS)
+        with open(state_file, 'r', encoding='utf-8') as f:
+            state = json.load(f)
+        assert "processed_hashes" not in state and state["fingerprint_version"] == FINGERPRINT_VERSION
+        assert state["last_full_refresh_time"] == "2025-06-01T00:00:00"
+        assert len(FingerprintStore(state_file)) == len(history)
+
+        incoming = pd.concat([history.iloc[-50:], make_records(320).iloc[300:]], ignore_index=True)
+        cfg = {"incremental": {"enabled": True, "unique_key_fields": KEY_FIELDS}}
+        new_data = mes.filter_incremental_data(incoming, cfg, state_file)
+        assert list(new_data["BatchNumber"]) == [f"K{i:05d}" for i in range(300, 320)]
+
+        # 更新状态：新增20条，保留其他字段
+        update_etl_state(incoming, state_file, cfg)
+        with open(state_file, 'r', encoding='utf-8') as f:
+            state = json.load(f)
+        assert state["new_records_count"] == 20 and state["total_records"] == 320
+        assert len(FingerprintStore(state_file)) == 320
+        assert state["last_full_refresh_time"] == "2025-06-01T00:00:00"
+    print("旧版状态迁移后增量过滤结果一致")
+
+
+if __name__ == "__main__":
+    print("=" * 60)
+    print("测试记录指纹")
+    print("=" * 60)
+    test_fnv_reference()
+    test_fingerprints_stable_across_dtypes()
+    test_migrate_legacy_state()
+    print("✅ 所有测试通过")
@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+"""
+测试按设备排序的批次序列
+验证一次排序得到的Setup、PreviousBatchEndTime与原逐组计算一致，排序标记可被后续阶段复用，
+以及只重算新数据涉及machine尾部的增量PreviousBatchEndTime与全量计算一致
+"""
+
+import sys
+import os
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+# 添加核心ETL程序目录到路径
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '01_核心ETL程序'))
+
+import etl_sequencing
+from etl_sequencing import is_sequenced, sort_by_machine, parquet_sorting_kwargs
+import etl_dataclean_mes_batch_report as mes
+import etl_dataclean_sfc_batch_report as sfc
+
+
+def build_rows(n: int = 3000, seed: int = 5) -> pd.DataFrame:
+    """构造随机批次数据（包含空machine、空TrackOutTime、空CFN）"""
+    rng = np.random.default_rng(seed)
+    trackout = pd.Timestamp("2024-01-01") + pd.to_timedelta(rng.integers(0, 90 * 86400, n), unit="s")
+    df = pd.DataFrame({
+        "BatchNumber": [f"B{i:05d}" for i in range(n)],
+        "machine": rng.choice(["769", "M022", "Q002", "O015", "101", None], n),
+        "CFN": rng.choice(["CFN-A", "CFN-B", "CFN-C", None], n, p=[0.45, 0.3, 0.2, 0.05]),
+        "TrackOutTime": trackout,
+        "EnterStepTime": trackout - pd.to_timedelta(rng.integers(3600, 5 * 86400, n), unit="s"),
+    })
+    df.loc[df.index % 17 == 0, "TrackOutTime"] = pd.NaT
+    df.loc[df.index % 13 == 0, "EnterStepTime"] = pd.NaT
+    return df
+
+
+def legacy_setup(df: pd.DataFrame) -> pd.DataFrame:
+    """原逐组实现：groupby + sort + apply + concat"""
+    result_list = []
+    for _, group in df.groupby("machine"):
+        group_sorted = group.sort_values("TrackOutTime", na_position='last', kind='stable').reset_index(drop=True)
+        group_sorted['_prev_cfn'] = group_sorted['CFN'].shift(1)
+        group_sorted['Setup'] = group_sorted.apply(
+            lambda row: "No" if pd.notna(row['_prev_cfn']) and row['_prev_cfn'] == row.get('CFN', None) else "Yes",
+            axis=1
+        )
+        result_list.append(group_sorted.drop(columns=['_prev_cfn']))
+    return pd.concat(result_list, ignore_index=True)
+
+
+def legacy_previous_end(df: pd.DataFrame) -> pd.Series:
+    """原实现：整表排序 + 有效记录分组shift + 第一批使用EnterStepTime"""
+    result = df.sort_values(["machine", "TrackOutTime"], na_position='last')
+    result["PreviousBatchEndTime"] = None
+    mask_valid = result["machine"].notna() & result["TrackOutTime"].notna()
+    result.loc[mask_valid, "PreviousBatchEndTime"] = result[mask_valid].groupby("machine")["TrackOutTime"].shift(1)
+    result["PreviousBatchEndTime"] = pd.to_datetime(result["PreviousBatchEndTime"], errors='coerce')
+    mask_first = mask_valid & result["PreviousBatchEndTime"].isna()
+    result.loc[mask_first, "PreviousBatchEndTime"] = result.loc[mask_first, "EnterStepTime"]
+    return result["PreviousBatchEndTime"]
+
+
+def test_setup_matches_legacy():
+    """Setup：一次排序 vs 逐组计算（machine为空的记录同样被排除）"""
+    df = build_rows()
+    expected = legacy_setup(df)
+    actual = mes.calculate_trackin_time_and_setup(df)
+    assert list(actual["BatchNumber"]) == list(expected["BatchNumber"])
+    mismatch = int((actual["Setup"] != expected["Setup"]).sum())
+    print(f"Setup: {len(actual)} 条, 不一致 {mismatch} 条")
+    assert mismatch == 0
+    assert "_prev_cfn" not in actual.columns
+    assert is_sequenced(actual)
+
+
+def test_previous_end_matches_legacy():
+    """PreviousBatchEndTime：MES、SFC vs 原实现（顺序与索引一致）"""
+    df = build_rows(seed=8)
+    expected = legacy_previous_end(df)
+
+    for name, module in (("MES", mes), ("SFC", sfc)):
+        actual = module.calculate_previous_batch_end_time(df.copy())["PreviousBatchEndTime"]
+        assert list(actual.index) == list(expected.index)
+        actual = pd.to_datetime(actual)
+        same = (actual == expected) | (actual.isna() & expected.isna())
+        print(f"{name} PreviousBatchEndTime: 有效 {int(actual.notna().sum())} 条, 不一致 {int((~same).sum())} 条")
+        assert same.all()
+
+
+def test_sorted_order_is_reused():
+    """已排序数据不再重复排序；被重排后重新排序"""
+    df = build_rows(seed=9)
+    calls = []
+    original = etl_sequencing.sequence_order
+
+    def counting_order(frame):
+        calls.append(len(frame))
+        return original(frame)
+
+    etl_sequencing.sequence_order = counting_order
+    try:
+        first = mes.calculate_previous_batch_end_time(df)
+        second = mes.calculate_previous_batch_end_time(first[["machine", "CFN", "TrackOutTime", "EnterStepTime"]])
+        assert len(calls) == 1
+        assert second["PreviousBatchEndTime"].equals(first["PreviousBatchEndTime"])
+
+        shuffled = first.sample(frac=1, random_state=1)
+        assert not is_sequenced(shuffled)
+        sort_by_machine(shuffled)
+        assert len(calls) == 2
+    finally:
+        etl_sequencing.sequence_order = original
+
+
+def test_incremental_previous_end():
+    """增量PreviousBatchEndTime：历史 + 新数据（部分插入历史中间）vs 全量计算"""
+    df = build_rows(n=4000, seed=12)
+    rng = np.random.default_rng(12)
+    is_new = pd.Series(rng.random(len(df)) < 0.03, index=df.index)
+    # 只涉及部分machine
+    is_new &= df["machine"].isin(["769", "Q002"]) | df["machine"].isna()
+
+    history = mes.calculate_previous_batch_end_time(df[~is_new].copy())
+    new_rows = mes.calculate_previous_batch_end_time(df[is_new].copy())
+    combined = pd.concat([history, new_rows], ignore_index=True).sort_values("TrackOutTime").reset_index(drop=True)
+
+    expected = mes.calculate_previous_batch_end_time(combined.copy())["PreviousBatchEndTime"].sort_index()
+    actual = mes.update_previous_batch_end_time(combined, new_rows)["PreviousBatchEndTime"]
+    same = (actual == expected) | (actual.isna() & expected.isna())
+    recomputed = int(etl_sequencing.machine_tail_mask(combined, new_rows).sum())
+    print(f"增量PreviousBatchEndTime: 总计 {len(combined)} 条, 重算 {recomputed} 条, 不一致 {int((~same).sum())} 条")
+    assert same.all()
+    assert 0 < recomputed < len(combined)
+
+
+def test_parquet_sorting_metadata():
+    """已排序数据写Parquet时带排序元数据"""
+    import pyarrow.parquet as pq
+
+    df = sort_by_machine(build_rows(n=200, seed=3))
+    assert parquet_sorting_kwargs(build_rows(n=10)) == {}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, "sequenced.parquet")
+        df.to_parquet(path, index=False, **parquet_sorting_kwargs(df))
+        sorting = pq.ParquetFile(path).metadata.row_group(0).sorting_columns
+        print(f"排序元数据: {sorting}")
+        assert [c.column_index for c in sorting] == [list(df.columns).index("machine"), list(df.columns).index("TrackOutTime")]
+
+
+if __name__ == "__main__":
+    print("=" * 60)
+    print("测试按设备排序的批次序列")
+    print("=" * 60)
+    test_setup_matches_legacy()
+    test_previous_end_matches_legacy()
+    test_sorted_order_is_reused()
+    test_incremental_previous_end()
+    test_parquet_sorting_metadata()
+    print("✅ 所有测试通过")
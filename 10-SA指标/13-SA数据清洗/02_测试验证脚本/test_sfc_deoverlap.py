@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+"""
+测试SFC每日导出文件清洗前去重叠
+相邻日期的导出文件大部分行重复：验证按原始唯一键去除已处理行后只清洗新行，
+且最终结果与先清洗全部行再按标准字段增量过滤一致（包括跨运行从状态文件加载原始键hash）
+"""
+
+import sys
+import os
+import tempfile
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+import yaml
+
+# 添加核心ETL程序目录到路径
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '01_核心ETL程序'))
+
+from etl_utils import FingerprintStore
+import etl_dataclean_sfc_batch_report as sfc
+from frame_test_utils import assert_frame_same, write_workbook
+
+CONFIG_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '03_配置文件', 'config')
+
+
+def load_cfg(tmp_dir: str) -> dict:
+    """正式配置的字段映射和增量设置，路径指向临时目录"""
+    with open(os.path.join(CONFIG_DIR, "config_sfc_batch_report.yaml"), 'r', encoding='utf-8') as f:
+        cfg = yaml.safe_load(f)
+    cfg = {key: cfg[key] for key in cfg if key.endswith("_mapping") or key.endswith("_types")}
+    cfg["source"] = {"sfc_path": os.path.join(tmp_dir, "LC-*.xlsx"),
+                     "standard_time_path": os.path.join(tmp_dir, "missing.parquet")}
+    cfg["incremental"] = {"enabled": True, "state_file": os.path.join(tmp_dir, "state.json"),
+                          "unique_key_fields": ["BatchNumber", "Operation", "TrackOutTime"],
+                          "full_refresh_threshold_days": 365}
+    cfg["output"] = {"history_file": os.path.join(tmp_dir, "SFC_batch_report_latest.parquet"),
+                     "excel": {"enabled": False}}
+    cfg["runtime"] = {"ingest_workers": 1}
+    return cfg
+
+
+def snapshot_row(i: int) -> list:
+    """第i个批次（每日导出文件中同一批次的内容相同）"""
+    trackout = datetime(2025, 6, 1, 8) + timedelta(minutes=53 * i)
+    return [f"CFN-{i % 5}", f"S{i:05d}", "N/A" if i % 13 == 0 else 10 * (1 + i % 3), "数控车",
+            "N/A" if i % 5 == 0 else trackout - timedelta(hours=4), "N/A" if i % 11 == 0 else 101 + i % 3,
+            trackout, trackout - timedelta(hours=20), 1 + i % 200, i % 3]
+
+
+def write_snapshot(tmp_dir: str, day: int, window: int = 200, step: int = 20) -> str:
+    """第day天的导出文件：批次 [day*step, day*step+window)，与前一天重叠 90%"""
+    path = os.path.join(tmp_dir, f"LC-202506{day + 1:02d}.xlsx")
+    return write_workbook(path, ["产品号", "批次", "工序号", "工序名称", "Check In 时间", "机台号", "报工时间",
+                                 "上道工序报工时间", "合格数量", "报废数量"],
+                          (snapshot_row(i) for i in range(day * step, day * step + window)),
+                          mtime=datetime(2025, 6, day + 1, 20).timestamp())
+
+
+def run(cfg: dict, deoverlap: bool = True) -> tuple:
+    """运行SFC处理，返回 (结果, 清洗的行数)"""
+    cleaned = []
+    original_process, original_columns = sfc.process_sfc_data, sfc.get_raw_key_columns
+
+    def counting_process(df, cfg):
+        cleaned.append(len(df))
+        return original_process(df, cfg)
+
+    sfc.process_sfc_data = counting_process
+    if not deoverlap:
+        sfc.get_raw_key_columns = lambda cfg: None
+    try:
+        result = sfc.process_all_sfc_data(cfg)
+    finally:
+        sfc.process_sfc_data, sfc.get_raw_key_columns = original_process, original_columns
+    result = result.sort_values(["BatchNumber", "Operation"], na_position="first").reset_index(drop=True)
+    return result, sum(cleaned)
+
+
+def test_raw_key_hashes():
+    """原始键hash：不同类型的相同取值一致，空值一致"""
+    columns = ["批次", "工序号", "报工时间"]
+    a = pd.DataFrame({"批次": ["S1", "S2", None], "工序号": [10, "N/A", 20],
+                      "报工时间": pd.to_datetime(["2025-06-01 08:00", "2025-06-02 00:00", None])})
+    b = pd.DataFrame({"批次": ["S1", "S2", np.nan], "工序号": ["10", "N/A", 20],
+                      "报工时间": [pd.Timestamp("2025-06-01 08:00"), pd.Timestamp("2025-06-02"), None]})
+    np.testing.assert_array_equal(sfc.raw_key_hashes(a, columns), sfc.raw_key_hashes(b, columns))
+    assert len(set(sfc.raw_key_hashes(a, columns))) == 3
+    assert sfc.get_raw_key_columns({"sfc_mapping": {"批次": "BatchNumber"}}) is None
+
+
+def test_deoverlap_matches_full_cleaning():
+    """去重叠后只清洗新行，结果与清洗全部行后增量过滤一致；下次运行从状态加载原始键hash"""
+    results = {}
+    for deoverlap in (True, False):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            cfg = load_cfg(tmp_dir)
+            for day in range(4):
+                write_snapshot(tmp_dir, day)
+            first, first_cleaned = run(cfg, deoverlap)
+            write_snapshot(tmp_dir, 4)
+            second, second_cleaned = run(cfg, deoverlap)
+        results[deoverlap] = (first, first_cleaned, second, second_cleaned)
+        print(f"去重叠={'是' if deoverlap else '否'}: 首次清洗 {first_cleaned} 行, 追加一天清洗 {second_cleaned} 行")
+
+    first, first_cleaned, second, second_cleaned = results[True]
+    assert_frame_same(first, results[False][0], "首次运行")
+    assert_frame_same(second, results[False][2], "追加一天")
+    # 4个文件共 200 + 3*20 个批次；追加一天只有20个新批次
+    assert first_cleaned == 260 and results[False][1] == 800
+    assert second_cleaned == 20
+    assert len(second) == 280
+
+
+def test_watermark_bounds_raw_state():
+    """高水位增量：原始键指纹只保留在迟到窗口内（从fingerprint切换时删除原始键指纹存储），结果与fingerprint策略一致"""
+    results = {}
+    for strategy in ("fingerprint", "watermark"):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            cfg = load_cfg(tmp_dir)
+            for day in range(4):
+                write_snapshot(tmp_dir, day)
+            run(cfg)
+            cfg["incremental"].update(strategy=strategy, late_arrival_days=2)
+            for day in range(4, 8):
+                write_snapshot(tmp_dir, day)
+            run(cfg)
+            write_snapshot(tmp_dir, 8)
+            result, cleaned = run(cfg)
+            state_file = cfg["incremental"]["state_file"]
+            raw_window = sfc.get_raw_watermark_window(cfg, state_file)
+            results[strategy] = (result, cleaned, len(FingerprintStore(state_file, "raw")),
+                                 len(raw_window) if raw_window is not None else 0)
+        print(f"{strategy}: 追加一天清洗 {cleaned} 行, 原始键指纹 {results[strategy][2]} 条, "
+              f"原始键窗口 {results[strategy][3]} 条")
+
+    assert_frame_same(results["watermark"][0], results["fingerprint"][0], "高水位增量")
+    assert results["watermark"][1] == results["fingerprint"][1] == 20
+    # fingerprint：全部 200 + 8*20 个批次；watermark：报工时间都不为空，只保留2天内（约55个批次）的原始键
+    assert results["fingerprint"][2] == 360 and results["fingerprint"][3] == 0
+    assert results["watermark"][2] == 0 and 0 < results["watermark"][3] <= 60
+
+
+if __name__ == "__main__":
+    print("=" * 60)
+    print("测试SFC清洗前去重叠")
+    print("=" * 60)
+    test_raw_key_hashes()
+    test_deoverlap_matches_full_cleaning()
+    test_watermark_bounds_raw_state()
+    print("✅ 所有测试通过")
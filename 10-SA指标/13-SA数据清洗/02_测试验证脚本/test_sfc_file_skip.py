@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""
+测试SFC文件级跳过的内容指纹
+验证修改时间变化但内容不变（OneDrive重新同步）的文件仍被跳过，内容变化的文件重新处理，
+以及内容指纹只依赖ZIP成员的CRC和大小、与修改时间无关
+"""
+
+import sys
+import os
+import shutil
+import tempfile
+from datetime import datetime
+
+import pandas as pd
+
+# 添加核心ETL程序目录到路径
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '01_核心ETL程序'))
+
+from etl_utils import zip_content_fingerprint
+import etl_dataclean_sfc_batch_report as sfc
+from frame_test_utils import write_workbook
+
+CFG = {"incremental": {"enabled": True, "unique_key_fields": ["BatchNumber", "Operation", "TrackOutTime"]}}
+
+
+def write_export(path: str, n: int = 100) -> None:
+    write_workbook(path, ["批次", "工序号", "报工时间"],
+                   ([f"S{i:05d}", 10, datetime(2025, 6, 1, 8, i % 60)] for i in range(n)))
+
+
+def touch(path: str, timestamp: float) -> None:
+    os.utime(path, (timestamp, timestamp))
+
+
+def test_zip_content_fingerprint():
+    """复制文件（修改时间不同）指纹相同；内容不同指纹不同；非ZIP文件按全部内容计算"""
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        a, b, c = (os.path.join(tmp_dir, name) for name in ("a.xlsx", "b.xlsx", "c.xlsx"))
+        write_export(a)
+        shutil.copyfile(a, b)
+        touch(b, datetime(2025, 1, 1).timestamp())
+        write_export(c, 101)
+        assert zip_content_fingerprint(a) == zip_content_fingerprint(b)
+        assert zip_content_fingerprint(a) != zip_content_fingerprint(c)
+        assert zip_content_fingerprint(a).startswith("zip:")
+
+        partial = os.path.join(tmp_dir, "partial.xlsx")
+        with open(a, "rb") as src, open(partial, "wb") as dst:
+            dst.write(src.read()[:1000])
+        assert zip_content_fingerprint(partial).startswith("file:1000:")
+    print("内容指纹与修改时间无关")
+
+
+def test_skip_by_content():
+    """修改时间变化、内容不变时跳过并更新记录的修改时间；内容变化或旧状态（无内容指纹）时重新处理"""
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        state_file = os.path.join(tmp_dir, "state.json")
+        path = os.path.join(tmp_dir, "LC-20250601.xlsx")
+        write_export(path)
+        touch(path, datetime(2025, 6, 1, 20).timestamp())
+        df = pd.DataFrame({"BatchNumber": ["S1"], "Operation": ["10"], "TrackOutTime": [pd.Timestamp("2025-06-01")]})
+        sfc.update_sfc_etl_state(df, path, state_file, CFG)
+        state = sfc.load_etl_state(state_file)
+        assert sfc.is_file_processed(path, state)
+
+        # OneDrive重新同步：内容不变，修改时间变化
+        resynced = datetime(2025, 6, 3, 9).timestamp()
+        touch(path, resynced)
+        assert sfc.is_file_processed(path, state)
+        assert state["processed_files"][path]["mtime"] == resynced
+
+        # 内容变化
+        write_export(path, 120)
+        touch(path, resynced)
+        assert not sfc.is_file_processed(path, state)
+
+        # 旧版本状态（只有修改时间）：修改时间变化时重新处理
+        legacy = {"processed_files": {path: {"mtime": datetime(2025, 6, 1).timestamp()}}}
+        assert not sfc.is_file_processed(path, legacy)
+        legacy["processed_files"][path]["mtime"] = os.path.getmtime(path)
+        assert sfc.is_file_processed(path, legacy)
+    print("内容未变的文件跳过，内容变化的文件重新处理")
+
+
+if __name__ == "__main__":
+    print("=" * 60)
+    print("测试SFC文件内容指纹跳过")
+    print("=" * 60)
+    test_zip_content_fingerprint()
+    test_skip_by_content()
+    print("✅ 所有测试通过")
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+"""
+测试SFC多文件处理的运行事务
+验证一次运行只合并历史数据、写入历史文件和状态各一次（不再逐个文件读写），运行结束时发布结果代替写历史文件，
+按检查点提交后中断的运行重新运行时从最后一个检查点继续，结果与不中断时一致
+"""
+
+import sys
+import os
+import tempfile
+
+import pandas as pd
+
+# 添加核心ETL程序目录到路径
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '01_核心ETL程序'))
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import etl_dataclean_sfc_batch_report as sfc
+from frame_test_utils import assert_frame_same
+from test_sfc_deoverlap import load_cfg, write_snapshot
+
+
+class SimulatedCrash(BaseException):
+    """模拟进程中断（不被逐文件的异常处理捕获）"""
+
+
+def run(cfg: dict, crash_after: int = None) -> tuple:
+    """运行SFC处理，返回 (结果, 调用次数统计)；crash_after为处理第几个文件时中断"""
+    calls = {"merge": 0, "write": 0, "state": 0, "files": 0}
+    originals = (sfc.merge_with_history, sfc.write_history_file, sfc.save_etl_state, sfc.process_sfc_data)
+
+    def counting(name, func):
+        def wrapper(*args, **kwargs):
+            calls[name] += 1
+            return func(*args, **kwargs)
+        return wrapper
+
+    def process(df, cfg):
+        calls["files"] += 1
+        if crash_after is not None and calls["files"] > crash_after:
+            raise SimulatedCrash()
+        return originals[3](df, cfg)
+
+    sfc.merge_with_history = counting("merge", originals[0])
+    sfc.write_history_file = counting("write", originals[1])
+    sfc.save_etl_state = counting("state", originals[2])
+    sfc.process_sfc_data = process
+    try:
+        result = sfc.process_all_sfc_data(cfg)
+    finally:
+        sfc.merge_with_history, sfc.write_history_file, sfc.save_etl_state, sfc.process_sfc_data = originals
+    if result is not None and not result.empty:
+        result = result.sort_values(["BatchNumber", "Operation"], na_position="first").reset_index(drop=True)
+    return result, calls
+
+
+def test_single_commit_per_run():
+    """6个文件：历史数据合并、历史文件写入、状态写入各一次"""
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        cfg = load_cfg(tmp_dir)
+        cfg["incremental"]["checkpoint_every_files"] = 0
+        for day in range(6):
+            write_snapshot(tmp_dir, day)
+        result, calls = run(cfg)
+        assert calls == {"merge": 1, "write": 1, "state": 1, "files": 6}, calls
+        assert len(result) == 300
+        assert not os.path.exists(cfg["output"]["history_file"] + ".tmp")
+    print(f"一次运行的调用次数: {calls}")
+
+
+def test_publish_writes_history_once():
+    """历史文件即latest文件：运行结束时只由发布写入一次（不再先写历史文件），状态在发布之后写入"""
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        cfg = load_cfg(tmp_dir)
+        cfg["output"]["base_dir"] = tmp_dir
+        cfg["incremental"]["checkpoint_every_files"] = 0
+        for day in range(3):
+            write_snapshot(tmp_dir, day)
+        writes = []
+        originals = (sfc.save_to_parquet, sfc.save_etl_state)
+
+        def save_to_parquet(df, output_path, cfg, validation=True):
+            writes.append(os.path.basename(output_path))
+            return originals[0](df, output_path, cfg, validation)
+
+        def save_etl_state(state_file, state):
+            writes.append("state")
+            return originals[1](state_file, state)
+
+        sfc.save_to_parquet, sfc.save_etl_state = save_to_parquet, save_etl_state
+        try:
+            history_file = cfg["output"]["history_file"]
+            result = sfc.process_all_sfc_data(cfg, publish=lambda df: sfc.publish_sfc_result(df, history_file, cfg))
+        finally:
+            sfc.save_to_parquet, sfc.save_etl_state = originals
+        assert writes == ["SFC_batch_report_latest.parquet", "state"], writes
+        assert len(result) == 240 and "PreviousBatchEndTime" in result.columns
+        assert_frame_same(pd.read_parquet(history_file), result, "发布的历史文件")
+
+
+def test_resume_from_checkpoint():
+    """每2个文件提交一次；第5个文件时中断，重新运行只处理未提交的文件，结果与不中断时一致"""
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        cfg = load_cfg(tmp_dir)
+        for day in range(6):
+            write_snapshot(tmp_dir, day)
+        expected, _ = run(cfg)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        cfg = load_cfg(tmp_dir)
+        cfg["incremental"]["checkpoint_every_files"] = 2
+        for day in range(6):
+            write_snapshot(tmp_dir, day)
+        try:
+            run(cfg, crash_after=4)
+            raise AssertionError("未模拟中断")
+        except SimulatedCrash:
+            pass
+        state = sfc.load_etl_state(cfg["incremental"]["state_file"])
+        assert len(state["processed_files"]) == 4
+        resumed, calls = run(cfg)
+        assert calls["files"] == 2 and calls["write"] == 1, calls
+        assert_frame_same(resumed, expected, "中断后继续")
+
+
+if __name__ == "__main__":
+    print("=" * 60)
+    print("测试SFC运行事务")
+    print("=" * 60)
+    test_single_commit_per_run()
+    test_publish_writes_history_once()
+    test_resume_from_checkpoint()
+    print("✅ 所有测试通过")
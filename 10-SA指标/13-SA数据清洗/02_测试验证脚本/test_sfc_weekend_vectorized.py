@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""
+测试SFC周末周期公式
+验证周末小时数、周末顺延和DueTime的向量化结果与逐行计算完全一致
+"""
+
+import sys
+import os
+
+import numpy as np
+import pandas as pd
+
+# 添加核心ETL程序目录到路径
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '01_核心ETL程序'))
+
+from etl_calendar import calculate_weekend_hours_between, adjust_weekend_due_times, is_weekend
+from etl_metrics import FixedWeekendPolicy
+from rowwise_oracles import calculate_weekend_hours, adjust_weekend_sfc, calculate_sfc_due_time
+
+
+def random_intervals(n: int = 800, seed: int = 17):
+    """随机时间区间（秒级精度，最长约半年，包含周末边界时刻）"""
+    rng = np.random.default_rng(seed)
+    start = pd.Timestamp("2024-01-01") + pd.to_timedelta(rng.integers(0, 365 * 86400, n), unit="s")
+    end = start + pd.to_timedelta(rng.integers(-7200, 180 * 86400, n), unit="s")
+    start = pd.Series(start)
+    end = pd.Series(end)
+    # 周六8:00、周一8:00整点边界
+    start.iloc[0] = pd.Timestamp("2024-06-01 08:00:00")
+    end.iloc[0] = pd.Timestamp("2024-06-03 08:00:00")
+    start.iloc[1] = pd.Timestamp("2024-06-03 07:59:59")
+    end.iloc[1] = pd.Timestamp("2024-06-08 08:00:01")
+    return start, end
+
+
+def test_weekend_hours_closed_form():
+    """周期公式 vs calculate_weekend_hours"""
+    start, end = random_intervals()
+    expected = np.array([calculate_weekend_hours(s, e) for s, e in zip(start, end)])
+    actual = calculate_weekend_hours_between(start, end)
+    mismatch = int((expected != actual).sum())
+    print(f"周末小时数: 不一致 {mismatch} 条")
+    assert mismatch == 0
+
+
+def test_is_weekend_boundaries():
+    """周末区间边界：周六8:00（含）~ 周一8:00（不含）"""
+    times = pd.to_datetime([
+        "2024-06-01 07:59:59", "2024-06-01 08:00:00", "2024-06-02 23:00:00",
+        "2024-06-03 07:59:59", "2024-06-03 08:00:00",
+    ])
+    assert list(is_weekend(times)) == [False, True, True, True, False]
+
+
+def test_adjust_weekend_vectorized():
+    """周末顺延 vs adjust_weekend_sfc"""
+    start, end = random_intervals(seed=23)
+    end = start + (end - start) / 20
+    expected = pd.to_datetime([adjust_weekend_sfc(s, e) for s, e in zip(start, end)])
+    actual = adjust_weekend_due_times(start, end)
+    mismatch = int((np.abs(expected.values - actual) > np.timedelta64(1, "ms")).sum())
+    print(f"周末顺延: 不一致 {mismatch} 条")
+    assert mismatch == 0
+
+
+def test_sfc_due_time_vectorized():
+    """SFC DueTime：向量化 vs 逐行"""
+    rng = np.random.default_rng(29)
+    start, _ = random_intervals(n=400, seed=31)
+    n = len(start)
+    df = pd.DataFrame({
+        "Checkin_SFC": start.astype(object).where(np.arange(n) % 11 != 0, None),
+        "TrackOutQuantity": rng.integers(0, 5000, n),
+        "ScrapQuantity": rng.integers(0, 20, n),
+        "EH_machine(s)": rng.choice([0.0, np.nan, 45.0, 300.0], n),
+        "EH_labor(s)": rng.choice([0.0, np.nan, 90.0], n),
+        "OEE": rng.choice([0.77, 0.5], n),
+        "Setup": rng.choice(["Yes", "No"], n),
+        "Setup Time (h)": rng.choice([np.nan, 2.0, 6.0], n),
+    })
+    expected = pd.to_datetime(df.apply(calculate_sfc_due_time, axis=1))
+    actual = FixedWeekendPolicy().due_times(df)
+    same = (expected.isna() & actual.isna()) | ((actual - expected).abs() <= pd.Timedelta(milliseconds=1))
+    mismatch = int((~same).sum())
+    print(f"SFC DueTime: 有效 {int(actual.notna().sum())} 条, 不一致 {mismatch} 条")
+    assert mismatch == 0
+
+
+if __name__ == "__main__":
+    print("=" * 60)
+    print("测试SFC周末周期公式")
+    print("=" * 60)
+    test_weekend_hours_closed_form()
+    test_is_weekend_boundaries()
+    test_adjust_weekend_vectorized()
+    test_sfc_due_time_vectorized()
+    print("✅ 所有测试通过")
@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+"""
+测试标准时间查找表
+验证SAP Routing ETL生成的 .lookup.arrow 可内存映射加载，
+MES/SFC按整数键查找的结果与按字段merge的两步匹配一致
+"""
+
+import sys
+import os
+import time
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+# 添加核心ETL程序目录到路径
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '01_核心ETL程序'))
+
+from etl_standard_time import StandardTimeLookup, lookup_artifact_path, normalize_key
+import etl_dataclean_mes_batch_report as mes
+import etl_dataclean_sfc_batch_report as sfc
+
+VALUE_COLUMNS = ["EH_machine(s)", "EH_labor(s)", "OEE", "Setup Time (h)"]
+
+
+def build_routing(n: int = 400, seed: int = 1) -> pd.DataFrame:
+    """构造标准时间表（CFN与Material Number部分重叠，含空值、Quantity为0/空）"""
+    rng = np.random.default_rng(seed)
+    routing = pd.DataFrame({
+        "CFN": [f"CFN-{i % 120:03d}" for i in range(n)],
+        "Material Number": [f"MAT-{i % 150:03d}" if i % 3 else f"CFN-{(i + 7) % 120:03d}" for i in range(n)],
+        "Operation": [f"{10 * (1 + i % 4):04d}" for i in range(n)],
+        "Group": rng.choice(["101", "102", None], n),
+        "Machine": rng.choice([np.nan, 0.0, 120.0, 600.0, 3600.0], n),
+        "Labor": rng.choice([np.nan, 30.0, 60.0], n),
+        "Quantity": rng.choice([np.nan, 0, 1, 10], n),
+        "OEE": rng.choice([np.nan, 0.0, 0.8, 0.9], n),
+        "Setup Time (h)": rng.choice([np.nan, 0.5, 2.0], n),
+    })
+    # 标准时间表按键唯一
+    routing = routing.drop_duplicates(["Material Number", "Operation", "Group"])
+    return routing.drop_duplicates(["CFN", "Operation", "Group"]).reset_index(drop=True)
+
+
+def build_batches(n: int = 3000, seed: int = 2) -> pd.DataFrame:
+    """构造批次数据（CFN可能匹配Material Number、CFN或都不匹配）"""
+    rng = np.random.default_rng(seed)
+    cfn = np.where(rng.random(n) < 0.5, [f"CFN-{i:03d}" for i in rng.integers(0, 130, n)],
+                   [f"MAT-{i:03d}" for i in rng.integers(0, 160, n)])
+    df = pd.DataFrame({
+        "BatchNumber": [f"B{i:05d}" for i in range(n)],
+        "CFN": cfn,
+        "Operation": [f"{10 * i:04d}" for i in rng.integers(1, 6, n)],
+        "Group": rng.choice(["101", "102", None], n),
+    })
+    df.loc[df.index % 41 == 0, "CFN"] = None
+    return df
+
+
+def reference_merge(df: pd.DataFrame, routing: pd.DataFrame, passes: list) -> pd.DataFrame:
+    """按字段merge的两步匹配（第二步只更新第一步未匹配到单件时间的记录；保留第一步右表的Material Number键列）"""
+    std = routing.copy()
+    quantity = std["Quantity"].fillna(1).replace(0, 1)
+    std["EH_machine(s)"] = std["Machine"] / quantity
+    std["EH_labor(s)"] = std["Labor"] / quantity
+    result = df.copy()
+    for col in ["CFN", "Operation", "Group"]:
+        result[col] = normalize_key(result[col]).to_numpy()
+    for col in ["CFN", "Material Number", "Operation", "Group"]:
+        std[col] = normalize_key(std[col]).to_numpy()
+
+    values = pd.DataFrame(np.nan, index=result.index, columns=VALUE_COLUMNS)
+    for level, (data_cols, std_cols) in enumerate(passes):
+        matched = result[data_cols].merge(std[std_cols + VALUE_COLUMNS], left_on=data_cols, right_on=std_cols,
+                                          how="left")
+        matched.index = result.index
+        if level == 0:
+            values = matched[VALUE_COLUMNS]
+            if "Material Number" in std_cols:
+                result["Material Number"] = matched["Material Number"].to_numpy()
+        else:
+            unmatched = values["EH_machine(s)"].isna() & values["EH_labor(s)"].isna()
+            update = unmatched & (matched["EH_machine(s)"].notna() | matched["EH_labor(s)"].notna())
+            values = values.where(~update, matched[VALUE_COLUMNS])
+    for col in VALUE_COLUMNS:
+        result[col] = values[col].to_numpy()
+    result["OEE"] = result["OEE"].fillna(0.77).replace(0, 0.77)
+    return result
+
+
+def assert_same_values(actual: pd.DataFrame, expected: pd.DataFrame, name: str) -> None:
+    """逐列比较标准时间字段（空值视为相同）"""
+    assert len(actual) == len(expected)
+    for col in VALUE_COLUMNS:
+        a, e = actual[col].astype(float).to_numpy(), expected[col].astype(float).to_numpy()
+        same = (a == e) | (np.isnan(a) & np.isnan(e))
+        assert same.all(), f"{name}: {col} 不一致 {int((~same).sum())} 条"
+    print(f"{name}: {len(actual)} 条一致, 匹配到单件时间 {int(actual['EH_machine(s)'].notna().sum())} 条")
+
+
+def write_routing(tmp_dir: str, routing: pd.DataFrame, with_lookup: bool = True) -> dict:
+    """保存标准时间表Parquet（和查找表），返回配置"""
+    routing_file = os.path.join(tmp_dir, "SAP_Routing_latest.parquet")
+    routing.to_parquet(routing_file, index=False)
+    if with_lookup:
+        StandardTimeLookup.from_dataframe(pd.read_parquet(routing_file)).save(lookup_artifact_path(routing_file))
+    return {"source": {"standard_time_path": routing_file}}
+
+
+def test_lookup_artifact_roundtrip():
+    """查找表保存后内存映射加载，与由Parquet直接构建的一致"""
+    routing = build_routing()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        cfg = write_routing(tmp_dir, routing)
+        routing_file = cfg["source"]["standard_time_path"]
+        loaded = StandardTimeLookup.load(routing_file)
+        built = StandardTimeLookup.from_dataframe(pd.read_parquet(routing_file))
+        assert loaded.source == lookup_artifact_path(routing_file)
+        assert list(loaded.keys) == list(built.keys)
+        for col in loaded.keys:
+            assert list(loaded.keys[col].astype(str)) == list(built.keys[col].astype(str))
+        for col in VALUE_COLUMNS:
+            np.testing.assert_array_equal(loaded.values[col], built.values[col])
+
+        # 查找表比Parquet旧时改为由Parquet构建
+        stale = os.path.getmtime(routing_file) - 60
+        os.utime(lookup_artifact_path(routing_file), (stale, stale))
+        assert StandardTimeLookup.load(routing_file).source == routing_file
+        print(f"查找表加载: {loaded}")
+
+
+def test_mes_lookup_matches_merge():
+    """MES：先Material Number后CFN"""
+    routing = build_routing()
+    df = build_batches()
+    expected = reference_merge(df, routing, [
+        (["CFN", "Operation", "Group"], ["Material Number", "Operation", "Group"]),
+        (["CFN", "Operation", "Group"], ["CFN", "Operation", "Group"]),
+    ])
+    for with_lookup in (True, False):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            cfg = write_routing(tmp_dir, routing, with_lookup)
+            actual = mes.merge_standard_time(df.copy(), cfg)
+        assert list(actual["BatchNumber"]) == list(df["BatchNumber"])
+        assert_same_values(actual, expected, f"MES 查找表={'有' if with_lookup else '无'}")
+        # 字段与原merge结果一致（保留第一步匹配到的Material Number）
+        assert list(actual.columns) == list(expected.columns), list(actual.columns)
+        a, e = actual["Material Number"], expected["Material Number"]
+        assert ((a == e) | (a.isna() & e.isna())).all()
+        assert a.notna().any() and a.isna().any()
+
+
+def test_sfc_lookup_matches_merge():
+    """SFC：先CFN后Material Number（无Group字段时按CFN、Operation匹配）"""
+    routing = build_routing(seed=3)
+    df = build_batches(seed=4)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        cfg = write_routing(tmp_dir, routing)
+        actual = sfc.merge_standard_time_sfc(df.copy(), cfg)
+        expected = reference_merge(df, routing, [
+            (["CFN", "Operation", "Group"], ["CFN", "Operation", "Group"]),
+            (["CFN", "Operation", "Group"], ["Material Number", "Operation", "Group"]),
+        ])
+        assert_same_values(actual, expected, "SFC")
+
+        no_group = df.drop(columns=["Group"])
+        actual = sfc.merge_standard_time_sfc(no_group.copy(), cfg)
+        std = routing.drop_duplicates(["CFN", "Operation"])
+        expected_cfn = reference_merge(no_group.assign(Group=""), std.assign(Group=""), [
+            (["CFN", "Operation"], ["CFN", "Operation"]),
+        ])
+        # 重复键取第一条；第二步Material Number同样按第一条
+        std_material = routing.drop_duplicates(["Material Number", "Operation"])
+        expected_material = reference_merge(no_group.assign(Group=""), std_material.assign(Group=""), [
+            (["CFN", "Operation"], ["Material Number", "Operation"]),
+        ])
+        first_missing = expected_cfn["EH_machine(s)"].isna() & expected_cfn["EH_labor(s)"].isna()
+        use_material = first_missing & (expected_material["EH_machine(s)"].notna() |
+                                        expected_material["EH_labor(s)"].notna())
+        expected = expected_cfn[VALUE_COLUMNS].where(~use_material, expected_material[VALUE_COLUMNS])
+        expected["OEE"] = expected["OEE"].fillna(0.77).replace(0, 0.77)
+        assert_same_values(actual, expected, "SFC 无Group")
+
+
+def benchmark(n: int = 200000) -> None:
+    """按字段merge与整数键查找耗时对比"""
+    routing = build_routing(n=20000)
+    df = build_batches(n)
+    passes = [(["CFN", "Operation", "Group"], ["Material Number", "Operation", "Group"]),
+              (["CFN", "Operation", "Group"], ["CFN", "Operation", "Group"])]
+    start = time.perf_counter()
+    reference_merge(df, routing, passes)
+    merge_seconds = time.perf_counter() - start
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        cfg = write_routing(tmp_dir, routing)
+        start = time.perf_counter()
+        mes.merge_standard_time(df.copy(), cfg)
+        lookup_seconds = time.perf_counter() - start
+    print(f"{n} 行: merge {merge_seconds:.2f}s, 查找表 {lookup_seconds:.2f}s")
+
+
+if __name__ == "__main__":
+    print("=" * 60)
+    print("测试标准时间查找表")
+    print("=" * 60)
+    test_lookup_artifact_roundtrip()
+    test_mes_lookup_matches_merge()
+    test_sfc_lookup_matches_merge()
+    benchmark()
+    print("✅ 所有测试通过")
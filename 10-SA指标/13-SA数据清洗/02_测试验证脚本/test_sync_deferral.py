@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+"""
+测试SharePoint同步就绪探测和推迟队列
+验证未同步完成的文件（ZIP不完整、存在锁文件）不解析即被识别，推迟到其余文件之后重试，
+读取时不等待；结果记录推迟过的文件和最终仍未就绪的文件
+"""
+
+import sys
+import os
+import time
+import shutil
+import tempfile
+
+import pandas as pd
+
+# 添加核心ETL程序目录到路径
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '01_核心ETL程序'))
+
+from etl_utils import (SyncDeferral, SyncNotReadyError, probe_sync_ready, parallel_ingest,
+                       read_sharepoint_excel, get_sync_deferral)
+from frame_test_utils import write_workbook
+
+
+def write_batches(path: str, n: int = 200) -> None:
+    write_workbook(path, ["批次", "数量"], ([f"S{i:05d}", i] for i in range(n)))
+
+
+def write_partial(path: str, source: str) -> None:
+    """模拟同步中的文件：只有前半部分内容"""
+    with open(source, "rb") as f:
+        data = f.read()
+    with open(path, "wb") as f:
+        f.write(data[:len(data) // 2])
+
+
+def read_worker(file_path: str) -> pd.DataFrame:
+    return read_sharepoint_excel(file_path)
+
+
+def test_probe():
+    """完整文件就绪；内容不完整、存在锁/临时文件时返回原因；Excel所有者文件（~$）不影响就绪"""
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, "LC-20250601.xlsx")
+        write_batches(path)
+        assert probe_sync_ready(path) is None
+        partial = os.path.join(tmp_dir, "LC-20250602.xlsx")
+        write_partial(partial, path)
+        assert "ZIP" in probe_sync_ready(partial)
+        for sibling in ("LC-20250601.xlsx.tmp", "LC-20250601.xlsx.lock"):
+            open(os.path.join(tmp_dir, sibling), "w").close()
+            assert sibling in probe_sync_ready(path), sibling
+            os.remove(os.path.join(tmp_dir, sibling))
+        assert probe_sync_ready(path) is None
+
+        # 工作簿在Excel中打开：只记录警告，照常读取
+        for owner in ("~$LC-20250601.xlsx", "~$-20250601.xlsx"):
+            open(os.path.join(tmp_dir, owner), "w").close()
+            assert probe_sync_ready(path) is None, owner
+            assert len(SyncDeferral(retry_wait=0).call(path, lambda: read_sharepoint_excel(path))) == 200
+            os.remove(os.path.join(tmp_dir, owner))
+
+        start = time.perf_counter()
+        try:
+            read_sharepoint_excel(partial)
+            raise AssertionError("未同步完成的文件未报错")
+        except SyncNotReadyError:
+            pass
+        assert time.perf_counter() - start < 1, "未就绪时不应等待"
+    print("就绪探测: 完整/不完整/锁文件识别正确，~$所有者文件不推迟，读取未就绪文件不等待")
+
+
+def test_deferred_files_processed_last():
+    """未就绪文件不阻塞其他文件，末尾重试时已同步完成则读取成功"""
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        complete = os.path.join(tmp_dir, "complete.xlsx")
+        write_batches(complete)
+        paths = [os.path.join(tmp_dir, f"LC-2025060{i}.xlsx") for i in range(1, 4)]
+        for path in paths:
+            shutil.copy(complete, path)
+        write_partial(paths[0], complete)
+
+        events = []
+        deferral = SyncDeferral(retry_wait=0, retries=1)
+        original_wait = deferral.wait
+
+        def finish_sync(round_no, count):
+            events.append("wait")
+            shutil.copy(complete, paths[0])
+            original_wait(round_no, count)
+
+        deferral.wait = finish_sync
+        for file_path, df, error in parallel_ingest(read_worker, paths, (), 1, deferral):
+            assert error is None, error
+            events.append(os.path.basename(file_path))
+            assert len(df) == 200
+        assert events == ["LC-20250602.xlsx", "LC-20250603.xlsx", "wait", "LC-20250601.xlsx"], events
+        assert list(deferral.deferred) == [paths[0]] and deferral.unresolved == []
+    print(f"推迟队列: {events}")
+
+
+def test_unresolved_files_reported():
+    """重试后仍未就绪的文件返回 SyncNotReadyError，并记录在 unresolved 中"""
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        complete = os.path.join(tmp_dir, "complete.xlsx")
+        write_batches(complete)
+        ready, locked = os.path.join(tmp_dir, "a.xlsx"), os.path.join(tmp_dir, "b.xlsx")
+        shutil.copy(complete, ready)
+        shutil.copy(complete, locked)
+        open(os.path.join(tmp_dir, "b.xlsx.lock"), "w").close()
+
+        deferral = SyncDeferral(retry_wait=0, retries=2)
+        results = list(parallel_ingest(read_worker, [locked, ready], (), 1, deferral))
+        assert [r[0] for r in results] == [ready, locked]
+        assert results[0][2] is None and isinstance(results[1][2], SyncNotReadyError)
+        assert deferral.unresolved == [locked] and "b.xlsx.lock" in deferral.deferred[locked]
+
+        # 单个文件：等待后仍未就绪时抛出
+        try:
+            SyncDeferral(retry_wait=0, retries=1).call(locked, lambda: read_sharepoint_excel(locked))
+            raise AssertionError("仍未就绪的文件未报错")
+        except SyncNotReadyError:
+            pass
+    assert get_sync_deferral({"source": {"sync_deferral": {"enabled": False}}}) is None
+    assert get_sync_deferral({}).retry_wait == 30
+    print("仍未就绪的文件已记录")
+
+
+if __name__ == "__main__":
+    print("=" * 60)
+    print("测试同步就绪探测和推迟队列")
+    print("=" * 60)
+    test_probe()
+    test_deferred_files_processed_last()
+    test_unresolved_files_reported()
+    print("✅ 所有测试通过")
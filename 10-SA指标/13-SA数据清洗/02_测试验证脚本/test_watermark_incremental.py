@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""
+测试高水位 + 迟到窗口增量过滤
+验证窗口外的记录直接视为已处理、窗口内按指纹去重、时间为空的记录按指纹存储去重，
+状态只保留窗口内的指纹，以及持续追加的MES文件在两种策略下得到相同的新数据
+"""
+
+import sys
+import os
+import json
+import tempfile
+from datetime import datetime, timedelta
+
+import pandas as pd
+
+# 添加核心ETL程序目录到路径
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '01_核心ETL程序'))
+
+from etl_utils import (WatermarkWindow, FingerprintStore, record_fingerprints, update_etl_state,
+                       get_watermark_window, get_incremental_strategy)
+import etl_dataclean_mes_batch_report as mes
+
+KEY_FIELDS = ["BatchNumber", "Operation", "machine", "TrackOutTime"]
+
+
+def make_records(start: int, stop: int) -> pd.DataFrame:
+    """第i条记录的报工时间为 2025-06-01 + i 小时（每17条一条时间为空）"""
+    base = datetime(2025, 6, 1)
+    rows = range(start, stop)
+    return pd.DataFrame({
+        "BatchNumber": [f"K{i:05d}" for i in rows],
+        "Operation": ["10"] * len(rows),
+        "machine": [f"CZM {101 + i % 3}" for i in rows],
+        "TrackOutTime": pd.to_datetime([None if i % 17 == 5 else base + timedelta(hours=i) for i in rows]),
+    })
+
+
+def cfg_for(state_file: str, strategy: str) -> dict:
+    return {"incremental": {"enabled": True, "state_file": state_file, "unique_key_fields": KEY_FIELDS,
+                            "strategy": strategy, "late_arrival_days": 2}}
+
+
+def test_window():
+    """窗口外视为已处理，窗口内按指纹去重，时间为空按指纹存储去重；记录后只保留窗口内的指纹"""
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        state_file = os.path.join(tmp_dir, "state.json")
+        store = FingerprintStore(state_file)
+        window = WatermarkWindow(state_file, late_arrival_days=2)
+        first = make_records(0, 240)
+        assert window.record(first, record_fingerprints(first, KEY_FIELDS), store) == 240
+        assert window.watermark == pd.Timestamp("2025-06-10 23:00")
+        assert window.cutoff == pd.Timestamp("2025-06-08 23:00")
+        # 窗口内49小时的记录（去掉时间为空的3条），时间为空的14条在指纹存储中
+        assert len(window) == 46 and len(store) == 14
+
+        reopened = WatermarkWindow(state_file, late_arrival_days=2)
+        incoming = pd.concat([make_records(0, 240), make_records(240, 260)], ignore_index=True)
+        # 迟到记录：时间在窗口内但未处理过
+        late = make_records(1000, 1001).assign(TrackOutTime=pd.Timestamp("2025-06-09 12:30"))
+        # 过旧的记录：早于窗口起点，视为已处理
+        stale = make_records(2000, 2001).assign(TrackOutTime=pd.Timestamp("2025-06-01 12:30"))
+        incoming = pd.concat([incoming, late, stale], ignore_index=True)
+        mask = reopened.new_mask(incoming, record_fingerprints(incoming, KEY_FIELDS), store)
+        new_batches = list(incoming.loc[mask, "BatchNumber"])
+        assert new_batches == [f"K{i:05d}" for i in range(240, 260)] + ["K01000"], new_batches
+    print("窗口外视为已处理，窗口内和时间为空的记录按指纹去重")
+
+
+def test_strategies_match_on_growing_file():
+    """持续追加（含迟到记录）的MES文件：两种策略每次过滤得到的新数据相同；高水位策略状态不随历史增长"""
+    results = {}
+    for strategy in ("fingerprint", "watermark"):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            state_file = os.path.join(tmp_dir, "etl_mes_state.json")
+            cfg = cfg_for(state_file, strategy)
+            snapshot = pd.DataFrame(columns=KEY_FIELDS)
+            new_rows = []
+            for day in range(10):
+                snapshot = pd.concat([snapshot, make_records(day * 48, day * 48 + 48)], ignore_index=True)
+                if day == 6:
+                    # 前一天补录的记录（迟到1天，在迟到窗口内）
+                    late = make_records(5000, 5003).assign(TrackOutTime=pd.Timestamp("2025-06-12 06:00"))
+                    snapshot = pd.concat([snapshot, late], ignore_index=True)
+                new_data = mes.filter_incremental_data(snapshot, cfg, state_file)
+                new_rows.append(sorted(new_data["BatchNumber"]))
+                update_etl_state(snapshot, state_file, cfg)
+            with open(state_file, 'r', encoding='utf-8') as f:
+                state = json.load(f)
+            results[strategy] = (new_rows, state, len(FingerprintStore(state_file)))
+    assert results["watermark"][0] == results["fingerprint"][0]
+    assert [len(rows) for rows in results["watermark"][0]] == [48] * 6 + [51] + [48] * 3
+    # 高水位策略只保存窗口内的指纹（2天，约48条）和时间为空的记录
+    assert results["fingerprint"][2] == 483
+    assert results["watermark"][2] == 28 and results["watermark"][1]["watermark"] == "2025-06-20 23:00:00"
+    print(f"两种策略新数据一致；fingerprint状态 {results['fingerprint'][2]} 条，"
+          f"watermark状态 {results['watermark'][1]['total_records']} 条")
+
+
+def test_bootstrap_from_history():
+    """从fingerprint策略切换为watermark时按历史数据建立窗口；没有状态文件时不建立"""
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        state_file = os.path.join(tmp_dir, "etl_mes_state.json")
+        history_file = os.path.join(tmp_dir, "MES_batch_report_latest.parquet")
+        history = make_records(0, 100)
+        history.to_parquet(history_file, index=False)
+        window = get_watermark_window(cfg_for(state_file, "watermark"), state_file)
+        assert not window.bootstrap(history_file, KEY_FIELDS, FingerprintStore(state_file))
+
+        update_etl_state(history, state_file, cfg_for(state_file, "fingerprint"))
+        assert window.bootstrap(history_file, KEY_FIELDS, FingerprintStore(state_file))
+        assert window.watermark == pd.Timestamp("2025-06-05 03:00")
+        new_data = mes.filter_incremental_data(make_records(0, 110), cfg_for(state_file, "watermark"), state_file)
+        assert list(new_data["BatchNumber"]) == [f"K{i:05d}" for i in range(100, 110)]
+    assert get_watermark_window({}, state_file) is None
+    assert get_incremental_strategy({"incremental": {"strategy": "unknown"}}) == "fingerprint"
+    print("切换策略时按历史数据建立窗口")
+
+
+if __name__ == "__main__":
+    print("=" * 60)
+    print("测试高水位增量过滤")
+    print("=" * 60)
+    test_window()
+    test_strategies_match_on_growing_file()
+    test_bootstrap_from_history()
+    print("✅ 所有测试通过")
@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""
+测试WorkCalendar工作日位图
+验证CSV/二进制位图加载、向量化工作日判断和下一工作日与原日历表逻辑一致
+"""
+
+import sys
+import os
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+# 添加核心ETL程序目录到路径
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '01_核心ETL程序'))
+
+from etl_calendar import WorkCalendar
+from generate_calendar import generate_calendar
+from rowwise_oracles import is_workday, get_next_workday_8am
+
+
+def build_calendar_files(tmp_dir: str) -> str:
+    """生成日历CSV和二进制位图，返回CSV路径"""
+    calendar_df = generate_calendar('2024-01-01', '2025-12-31')
+    csv_file = os.path.join(tmp_dir, "日历工作日表.csv")
+    calendar_df.to_csv(csv_file, index=False, encoding='utf-8-sig')
+    WorkCalendar.from_dataframe(calendar_df).save(WorkCalendar.artifact_path(csv_file))
+    return csv_file
+
+
+def legacy_calendar_df(csv_file: str) -> pd.DataFrame:
+    """原 load_calendar_table 的DataFrame格式"""
+    df = pd.read_csv(csv_file, encoding='utf-8-sig')
+    df['日期'] = pd.to_datetime(df['日期'])
+    return df.set_index('日期')
+
+
+def test_artifact_roundtrip():
+    """二进制位图与CSV加载结果一致"""
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        csv_file = build_calendar_files(tmp_dir)
+        from_artifact = WorkCalendar.load(csv_file)
+        from_csv = WorkCalendar.from_csv(csv_file)
+        print(f"位图: {from_artifact}, 来源: {os.path.basename(from_artifact.source)}")
+        assert from_artifact.source.endswith(".npz")
+        assert from_artifact.first_day == from_csv.first_day
+        assert np.array_equal(from_artifact.workdays, from_csv.workdays)
+
+        # CSV比位图新时回退读取CSV
+        os.utime(csv_file, (os.path.getmtime(csv_file) + 10, os.path.getmtime(csv_file) + 10))
+        assert WorkCalendar.load(csv_file).source == csv_file
+
+
+def test_is_workday_matches_legacy():
+    """向量化工作日判断 vs 原逐日判断（含日历表范围外日期）"""
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        csv_file = build_calendar_files(tmp_dir)
+        calendar = WorkCalendar.load(csv_file)
+        calendar_df = legacy_calendar_df(csv_file)
+
+    dates = pd.Series(pd.date_range("2023-12-01 09:30", "2026-02-01 09:30", freq="D"))
+    expected = np.array([is_workday(d, calendar_df) for d in dates])
+    actual = calendar.is_workday(dates)
+    mismatch = int((expected != actual).sum())
+    print(f"工作日判断: {len(dates)} 天, 不一致 {mismatch} 天")
+    assert mismatch == 0
+    assert calendar.is_workday(pd.Timestamp("2024-10-01 10:00")) is False
+    assert calendar.is_workday(pd.Timestamp("2024-10-12 10:00")) is True  # 国庆调休
+
+
+def test_next_workday_matches_legacy():
+    """向量化下一工作日8:00 vs get_next_workday_8am"""
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        csv_file = build_calendar_files(tmp_dir)
+        calendar = WorkCalendar.load(csv_file)
+        calendar_df = legacy_calendar_df(csv_file)
+
+    rng = np.random.default_rng(1)
+    times = pd.Series(pd.Timestamp("2024-01-01") + pd.to_timedelta(rng.integers(0, 700 * 24 * 60, 300), unit="min"))
+    expected = pd.to_datetime([get_next_workday_8am(t.to_pydatetime(), calendar_df) for t in times])
+    actual = calendar.next_workday(times)
+    mismatch = int((expected.values != actual).sum())
+    print(f"下一工作日: 不一致 {mismatch} 条")
+    assert mismatch == 0
+
+
+if __name__ == "__main__":
+    print("=" * 60)
+    print("测试WorkCalendar工作日位图")
+    print("=" * 60)
+    test_artifact_roundtrip()
+    test_is_workday_matches_legacy()
+    test_next_workday_matches_legacy()
+    print("✅ 所有测试通过")
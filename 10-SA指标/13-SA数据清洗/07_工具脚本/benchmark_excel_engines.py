@@ -0,0 +1,164 @@
+"""
+Excel读取引擎基准测试
+对MES/SFC源文件分别用openpyxl（整表读取、MES按列流式读取）和calamine读取，
+比较耗时并校验两种引擎读取结果的列类型和取值一致
+
+用法：
+    python benchmark_excel_engines.py                      # 使用配置文件中的MES文件和最新的SFC文件
+    python benchmark_excel_engines.py 文件1.xlsx 文件2.xlsx  # 指定文件
+    python benchmark_excel_engines.py --synthetic 100000   # 生成MES/SFC格式的模拟文件（无源文件时）
+"""
+
+import os
+import sys
+import glob
+import time
+import argparse
+import tempfile
+from datetime import datetime, timedelta
+from typing import Dict, Any, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+from openpyxl import Workbook
+
+# 添加ETL工具函数
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '01_核心ETL程序'))
+from etl_utils import load_config, resolve_excel_engine, read_excel_sheet, read_sharepoint_excel
+
+CONFIG_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '03_配置文件', 'config')
+
+
+def configured_files(sfc_count: int = 3) -> List[Tuple[str, Optional[List[str]]]]:
+    """配置中的MES文件（附带按mes_mapping流式读取的列）和最新的几个SFC文件"""
+    files = []
+    mes_cfg = load_config(os.path.join(CONFIG_DIR, "config_mes_batch_report.yaml"))
+    columns = [k for k, v in mes_cfg.get("mes_mapping", {}).items() if v and not str(v).startswith('#')]
+    for path in sorted(glob.glob(mes_cfg.get("source", {}).get("mes_path", ""))):
+        files.append((path, columns + ["Resource"]))
+    sfc_cfg = load_config(os.path.join(CONFIG_DIR, "config_sfc_batch_report.yaml"))
+    sfc_files = sorted(glob.glob(sfc_cfg.get("source", {}).get("sfc_path", "")), key=os.path.getmtime, reverse=True)
+    files.extend((path, None) for path in sfc_files[:sfc_count])
+    return files
+
+
+def write_synthetic(tmp_dir: str, n: int) -> List[Tuple[str, Optional[List[str]]]]:
+    """生成MES财年导出和SFC每日导出格式的模拟文件（日期、整数、文本、空值、N/A混合）"""
+    rng = np.random.default_rng(0)
+    base = datetime(2025, 5, 1, 8)
+    mes_path = os.path.join(tmp_dir, "Product Output -CZM -FY26.xlsx")
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet()
+    header = ["Material_Name", "Product_Name", "LogicalFlowPath", "ERPOperation", "Step_Name", "ProductionOrder",
+              "Area_Name", "Resource", "DateEnteredStep", "First_TrackIn_Date", "TrackOutDate",
+              "Step_In_PrimaryQuantity", "TrackOut_PrimaryQuantity", "TrackOut_User", "Comment"]
+    ws.append(header)
+    for i in range(n):
+        trackout = base + timedelta(minutes=int(rng.integers(0, 300 * 1440)))
+        ws.append([f"K{i:07d}" if i % 9 else 20250000 + i, f"CFN-{i % 800:04d}",
+                   f"CZM 50210978/{10 * (1 + i % 6):04d} CZM 纵切车", 10 * (1 + i % 6), "CZM 纵切车（可外协）",
+                   100000000 + i // 3, "CZM", f"CZM {['769', 'M022', 'Q002', 'O015'][i % 4]} 纵切车",
+                   trackout - timedelta(hours=30), None if i % 7 == 0 else trackout - timedelta(hours=2), trackout,
+                   int(rng.integers(1, 300)), float(rng.integers(1, 300)) + (0.5 if i % 11 == 0 else 0.0),
+                   f"U{i % 50:03d}", None if i % 3 else "返工"])
+    wb.save(mes_path)
+
+    sfc_path = os.path.join(tmp_dir, "LC-20250601.xlsx")
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet()
+    ws.append(["产品号", "批次", "工序号", "工序名称", "Check In 时间", "机台号", "报工时间", "上道工序报工时间",
+               "合格数量", "报废数量"])
+    for i in range(max(n // 10, 1)):
+        trackout = base + timedelta(minutes=int(rng.integers(0, 1440)))
+        ws.append([f"CFN-{i % 800:04d}", f"S{i:07d}", "N/A" if i % 13 == 0 else str(10 * (1 + i % 6)), "数控车",
+                   "N/A" if i % 5 == 0 else trackout - timedelta(hours=4),
+                   "N/A" if i % 11 == 0 else int(rng.choice([101, 102, 205])), trackout,
+                   trackout - timedelta(hours=20), int(rng.integers(1, 300)), int(rng.integers(0, 3))])
+    wb.save(sfc_path)
+    return [(mes_path, header[:13] + ["Resource"]), (sfc_path, None)]
+
+
+def frame_differences(actual: pd.DataFrame, expected: pd.DataFrame) -> List[str]:
+    """两个DataFrame的列、类型和取值差异（空值视为相同）"""
+    if list(actual.columns) != list(expected.columns):
+        return [f"列不一致: {list(actual.columns)} vs {list(expected.columns)}"]
+    if len(actual) != len(expected):
+        return [f"行数不一致: {len(actual)} vs {len(expected)}"]
+    differences = []
+    for col in expected.columns:
+        if actual[col].dtype != expected[col].dtype:
+            differences.append(f"{col}: 类型 {actual[col].dtype} vs {expected[col].dtype}")
+            continue
+        a, e = actual[col].astype(object), expected[col].astype(object)
+        same = (a == e) | (actual[col].isna() & expected[col].isna())
+        if not same.all():
+            differences.append(f"{col}: {int((~same).sum())} 个值不一致")
+    return differences
+
+
+def timed(func, repeat: int) -> Tuple[float, Any]:
+    """最短耗时（秒）和结果"""
+    best, result = float("inf"), None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def benchmark_file(path: str, columns: Optional[List[str]], repeat: int, has_calamine: bool) -> bool:
+    """单个文件的基准测试，返回两种引擎结果是否一致"""
+    print(f"\n{os.path.basename(path)} ({os.path.getsize(path) / 1024 / 1024:.1f} MB)")
+    seconds, expected = timed(lambda: read_excel_sheet(path, "openpyxl"), repeat)
+    print(f"  openpyxl 整表读取:   {seconds:7.2f}s  {len(expected)} 行 × {len(expected.columns)} 列")
+    if columns:
+        seconds, _ = timed(lambda: read_sharepoint_excel(path, columns=columns, engine="openpyxl"), repeat)
+        print(f"  openpyxl 按列流式:   {seconds:7.2f}s  {len(columns)} 列")
+    if not has_calamine:
+        return True
+
+    seconds, actual = timed(lambda: read_excel_sheet(path, "calamine"), repeat)
+    print(f"  calamine 整表读取:   {seconds:7.2f}s")
+    differences = frame_differences(actual, expected)
+    if columns:
+        seconds, selected = timed(lambda: read_excel_sheet(path, "calamine", columns), repeat)
+        print(f"  calamine 读取后选列: {seconds:7.2f}s")
+        expected_selected = expected[[c for c in expected.columns if str(c).strip() in set(columns)]]
+        differences += frame_differences(selected, expected_selected)
+    for difference in differences:
+        print(f"  ❌ {difference}")
+    if not differences:
+        print("  ✅ 两种引擎读取结果一致")
+    return not differences
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Excel读取引擎（openpyxl/calamine）基准测试")
+    parser.add_argument("files", nargs="*", help="Excel文件（默认使用配置中的MES文件和最新的SFC文件）")
+    parser.add_argument("--synthetic", type=int, default=0, metavar="N", help="生成N行MES格式的模拟文件")
+    parser.add_argument("--repeat", type=int, default=1, help="每种读取方式重复次数（取最短耗时）")
+    args = parser.parse_args()
+
+    has_calamine = resolve_excel_engine("calamine") == "calamine"
+    print("=" * 60)
+    print("Excel读取引擎基准测试")
+    print("=" * 60)
+    if not has_calamine:
+        print("未安装python-calamine（pip install python-calamine），只测试openpyxl")
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        if args.synthetic:
+            files = write_synthetic(tmp_dir, args.synthetic)
+        elif args.files:
+            files = [(path, None) for path in args.files]
+        else:
+            files = configured_files()
+        if not files:
+            print("未找到源文件，请指定文件或使用 --synthetic")
+            sys.exit(1)
+        results = [benchmark_file(path, columns, args.repeat, has_calamine) for path, columns in files]
+    sys.exit(0 if all(results) else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -2,9 +2,11 @@ import os
 import sys
 import time
 import glob
+import fnmatch
 import logging
 import shutil
 import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from typing import Dict, List, Any
 import re
@@ -42,6 +44,17 @@ def coerce_object_columns_to_string(df: pd.DataFrame) -> pd.DataFrame:
 CONFIG_PATH = os.path.join(os.path.dirname(__file__), "config", "config.yaml")
 BASE_DIR = os.path.dirname(__file__)
 
+# Content-addressed parse cache and Excel engine selection shared with the 10-SA指标 ETL tools;
+# parse directly with openpyxl if unavailable
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "10-SA指标", "13-SA数据清洗", "01_核心ETL程序"))
+try:
+    from etl_utils import get_parse_cache, get_excel_engine, read_excel_sheet, read_excel_header
+except Exception:  # pragma: no cover
+    get_parse_cache = None
+    get_excel_engine = lambda cfg: "openpyxl"
+    read_excel_sheet = lambda path, engine="openpyxl", columns=None: pd.read_excel(path, engine="openpyxl", usecols=columns)
+    read_excel_header = lambda path: [str(c) for c in pd.read_excel(path, engine="openpyxl", nrows=0).columns]
+
 
 def load_config(path: str) -> Dict[str, Any]:
     with open(path, "r", encoding="utf-8") as f:
@@ -134,41 +147,101 @@ def write_manifest(cfg: Dict[str, Any], df: pd.DataFrame) -> None:
     df.to_csv(manifest_path, index=False, encoding="utf-8")
 
 
+def compile_name_patterns(patterns: List[str], ignore_case: bool = True) -> Any:
+    """Compile fnmatch-style file name patterns once into a single regex (None if no patterns)."""
+    if not patterns:
+        return None
+    return re.compile("|".join(f"(?:{fnmatch.translate(pat)})" for pat in patterns),
+                      re.IGNORECASE if ignore_case else 0)
+
+
+def scan_directory(path: str) -> Dict[str, Any]:
+    """
+    List one directory: {"files": [[name, size, mtime]], "dirs": [name]}.
+    Sizes and mtimes always come from the fresh scandir entries (free on Windows), since editing a file
+    in place does not change its folder's mtime. Hidden entries (leading ".") are skipped, like glob.
+    """
+    files, dirs = [], []
+    with os.scandir(path) as entries:
+        for entry in entries:
+            if entry.name.startswith("."):
+                continue
+            try:
+                if entry.is_dir():
+                    dirs.append(entry.name)
+                elif entry.is_file():
+                    stat = entry.stat()
+                    files.append([entry.name, int(stat.st_size), stat.st_mtime])
+            except OSError as e:
+                logging.warning(f"Stat failed: {entry.path}: {e}")
+    return {"files": files, "dirs": dirs}
+
+
+def scan_source_tree(root: str, recursive: bool, workers: int) -> Dict[str, Any]:
+    """Scan root (and subfolders if recursive) level by level, listing each level's folders concurrently."""
+    listings: Dict[str, Any] = {}
+    level = [root]
+    with ThreadPoolExecutor(max_workers=max(workers, 1)) as executor:
+        while level:
+            futures = {d: executor.submit(scan_directory, d) for d in level}
+            next_level = []
+            for d, future in futures.items():
+                try:
+                    listings[d] = future.result()
+                except OSError as e:
+                    logging.warning(f"Scan failed: {d}: {e}")
+                    continue
+                if recursive:
+                    next_level.extend(os.path.join(d, name) for name in listings[d]["dirs"])
+            level = next_level
+    return listings
+
+
 def list_source_files(cfg: Dict[str, Any]) -> List[Dict[str, Any]]:
-    src_root = cfg.get("source", {}).get("root_path", "").strip().strip('"')
-    include_glob = cfg.get("source", {}).get("include_glob", "**/*.xlsx")
-    exclude_patterns = cfg.get("source", {}).get("exclude_patterns", [])
+    source_cfg = cfg.get("source", {})
+    src_root = source_cfg.get("root_path", "").strip().strip('"')
+    include_glob = source_cfg.get("include_glob", "**/*.xlsx")
+    exclude_patterns = source_cfg.get("exclude_patterns", [])
 
     if not src_root:
         raise ValueError("source.root_path is empty. Please set it in config/config.yaml")
     if not os.path.isdir(src_root):
         raise FileNotFoundError(f"Source root does not exist: {src_root}")
 
-    pattern = os.path.join(src_root, include_glob)
-    candidates = glob.glob(pattern, recursive=True)
+    excluded = compile_name_patterns(exclude_patterns)
+    *dir_parts, name_pattern = include_glob.replace("\\", "/").split("/")
 
-    def excluded(path: str) -> bool:
-        name = os.path.basename(path)
-        return any(pd.Series(name).str.match(pat.replace("*", ".*").replace("?", "."), case=False).iloc[0]
-                   for pat in exclude_patterns) if exclude_patterns else False
+    def file_record(path: str, size: int, mtime: float) -> Dict[str, Any]:
+        return {
+            "full_path": os.path.normpath(path),
+            "size": int(size),
+            "last_write_time": datetime.fromtimestamp(mtime).isoformat(timespec="seconds"),
+            "rel_dir": os.path.relpath(os.path.dirname(path), src_root),
+            "base": os.path.basename(path),
+        }
 
     files = []
-    for p in candidates:
-        if os.path.isdir(p) or excluded(p):
-            continue
-        try:
-            stat = os.stat(p)
-            rel_dir = os.path.relpath(os.path.dirname(p), src_root)
-            base = os.path.basename(p)
-            files.append({
-                "full_path": os.path.normpath(p),
-                "size": int(stat.st_size),
-                "last_write_time": datetime.fromtimestamp(stat.st_mtime).isoformat(timespec="seconds"),
-                "rel_dir": rel_dir,
-                "base": base,
-            })
-        except Exception as e:
-            logging.warning(f"Stat failed: {p}: {e}")
+    if dir_parts not in ([], ["**"]):
+        # Patterns with fixed subfolders: fall back to glob
+        for p in glob.glob(os.path.join(src_root, include_glob), recursive=True):
+            if os.path.isdir(p) or (excluded and excluded.match(os.path.basename(p))):
+                continue
+            try:
+                stat = os.stat(p)
+                files.append(file_record(p, stat.st_size, stat.st_mtime))
+            except Exception as e:
+                logging.warning(f"Stat failed: {p}: {e}")
+        return files
+
+    included = compile_name_patterns([name_pattern], ignore_case=os.path.normcase("A") == "a")
+    listings = scan_source_tree(src_root, dir_parts == ["**"], int(source_cfg.get("scan_workers", 8) or 8))
+    logging.info(f"Scanned {len(listings)} folders")
+
+    for d in sorted(listings):
+        for name, size, mtime in listings[d]["files"]:
+            if not included.match(name) or (excluded and excluded.match(name)):
+                continue
+            files.append(file_record(os.path.join(d, name), size, mtime))
     return files
 
 _PREFIX_RE = re.compile(r"^(?P<prefix>[A-Z]+-)(?P<ym>\d{6})")
@@ -187,10 +260,56 @@ def parse_prefix_and_ym(filename: str) -> Dict[str, Any]:
     return {"prefix": "EM-", "year": None, "month": None}
 
 
+def normalize_column_name(name: Any) -> Any:
+    return str(name).strip().lower().replace(" ", "_").replace("-", "_") if name is not None else name
+
+
+def select_source_columns(header: List[str], cfg: Dict[str, Any]) -> Any:
+    """
+    Resolve which raw header columns to parse, before any data rows are read.
+    Raises ValueError if a deduplication key column cannot be found in the header.
+    Returns None (parse all columns) unless schema.prune_columns is enabled.
+    """
+    schema_cfg = cfg.get("schema", {})
+    dedup_cfg = cfg.get("deduplication", {})
+    normalize = normalize_column_name if schema_cfg.get("normalize_column_names", True) else (lambda c: c)
+    mappings: Dict[str, List[str]] = schema_cfg.get("mappings", {}) or {}
+    names = {raw: normalize(raw) for raw in header}
+
+    # Canonical names the header will have after normalize_columns
+    resolved = set(names.values())
+    resolved |= {canonical for canonical, aliases in mappings.items() if resolved & set(aliases or [])}
+    required = list(dedup_cfg.get("primary_key", []) or [])
+    if dedup_cfg.get("order_by_timestamp"):
+        required.append(dedup_cfg["order_by_timestamp"])
+    missing = [col for col in required if col not in resolved]
+    if missing:
+        logging.error(f"Missing required columns {missing}; header: {list(header)}")
+        raise ValueError(f"Missing required columns: {missing}")
+
+    if not schema_cfg.get("prune_columns", False):
+        return None
+    wanted = set(required) | set(mappings) | set(schema_cfg.get("dtypes", {}) or {})
+    wanted |= set((schema_cfg.get("datetime", {}) or {}).get("columns", []) or [])
+    for aliases in mappings.values():
+        wanted |= set(aliases or [])
+    columns = [raw for raw, name in names.items() if name in wanted]
+    if not columns:
+        logging.warning("schema.prune_columns is enabled but no configured column matched; reading all columns")
+        return None
+    return columns
+
+
+def needs_header(cfg: Dict[str, Any]) -> bool:
+    dedup_cfg = cfg.get("deduplication", {})
+    return bool(cfg.get("schema", {}).get("prune_columns", False) or dedup_cfg.get("primary_key")
+                or dedup_cfg.get("order_by_timestamp"))
+
+
 def normalize_columns(df: pd.DataFrame, cfg: Dict[str, Any]) -> pd.DataFrame:
     schema_cfg = cfg.get("schema", {})
     if schema_cfg.get("normalize_column_names", True):
-        df = df.rename(columns=lambda c: str(c).strip().lower().replace(" ", "_").replace("-", "_") if c is not None else c)
+        df = df.rename(columns=normalize_column_name)
 
     # Apply mappings: canonical: [alias1, alias2]
     mappings: Dict[str, List[str]] = schema_cfg.get("mappings", {})
@@ -390,6 +509,9 @@ def process_files(cfg: Dict[str, Any]) -> None:
                 logging.warning(f"Failed to read existing yearly file for short-circuit: {out_path}: {e}")
         existing_sources_by_key[(prefix, y)] = s
 
+    parse_cache = get_parse_cache(cfg, BASE_DIR) if get_parse_cache is not None else None
+    engine = get_excel_engine(cfg)
+
     # Group files by subfolder first, then process each subfolder independently
     subfolder_groups = {}
     for _, row in need.iterrows():
@@ -418,7 +540,13 @@ def process_files(cfg: Dict[str, Any]) -> None:
 
             logging.info(f"Processing: {fpath}")
             try:
-                df = pd.read_excel(fpath, engine="openpyxl")
+                # Check key columns and resolve the projection from the header only
+                columns = select_source_columns(read_excel_header(fpath), cfg) if needs_header(cfg) else None
+                parse = lambda: read_excel_sheet(fpath, engine, columns)
+                if parse_cache is not None:
+                    df = parse_cache.read(fpath, parse, variant=f"columns={columns}" if columns else "")
+                else:
+                    df = parse()
                 df = normalize_columns(df, cfg)
                 df = deduplicate(df, cfg)
                 mtime = datetime.fromisoformat(row["last_write_time"]) if isinstance(row["last_write_time"], str) else datetime.now()
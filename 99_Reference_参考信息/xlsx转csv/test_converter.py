@@ -6,8 +6,11 @@ XLSX转CSV工具测试脚本
 """
 
 import pandas as pd
+import numpy as np
 import os
+import shutil
 import tempfile
+from datetime import datetime
 from pathlib import Path
 
 def create_test_excel():
@@ -29,6 +32,14 @@ def create_test_excel():
         '总价': [5050, 11280, 9600]
     }
     
+    # 日期时间（含0点）、空单元格、中间空行、默认空值文本
+    data3 = {
+        '批次': ['K001', None, 'K003', None, 'K005'],
+        '开始时间': [datetime(2025, 1, 2, 8, 30), pd.NaT, datetime(2025, 1, 3), pd.NaT, datetime(2025, 2, 1, 23, 59, 59)],
+        '数量': [10, np.nan, 3.5, np.nan, 7],
+        '备注': ['正常', None, None, None, 'N/A']
+    }
+    
     # 创建临时目录
     temp_dir = tempfile.mkdtemp()
     test_file = os.path.join(temp_dir, 'test_data.xlsx')
@@ -40,6 +51,7 @@ def create_test_excel():
         
         df1.to_excel(writer, sheet_name='员工信息', index=False)
         df2.to_excel(writer, sheet_name='销售数据', index=False)
+        pd.DataFrame(data3).to_excel(writer, sheet_name='生产记录', index=False)
     
     print(f"测试文件已创建: {test_file}")
     return test_file, temp_dir
@@ -88,6 +100,114 @@ def test_conversion(test_file, output_dir):
         print(f"转换测试失败: {str(e)}")
         return False
 
+def expected_text(value):
+    """pd.read_excel读取的值转换为CSV中的文本（空值为空，整数值不带.0，日期时间为 yyyy-mm-dd HH:MM:SS）"""
+    if pd.isna(value):
+        return ''
+    if isinstance(value, pd.Timestamp):
+        return value.strftime('%Y-%m-%d %H:%M:%S')
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+def csv_matches_excel(output_file, input_file, sheet_name):
+    """逐个单元格比较CSV与pd.read_excel读取的工作表（列名、行数和取值），返回不一致说明，一致时返回None"""
+    df_check = pd.read_csv(output_file, encoding='utf-8-sig', dtype=str, keep_default_na=False)
+    df_expected = pd.read_excel(input_file, sheet_name=sheet_name)
+    if list(df_check.columns) != list(df_expected.columns):
+        return f"列名不一致 {list(df_check.columns)}"
+    if len(df_check) != len(df_expected):
+        return f"行数不一致 {len(df_check)} vs {len(df_expected)}"
+    for col in df_expected.columns:
+        expected = [expected_text(v) for v in df_expected[col]]
+        actual = list(df_check[col])
+        if actual != expected:
+            return f"{col} 不一致: {actual} vs {expected}"
+    return None
+
+def test_batch_conversion(test_file, output_dir):
+    """测试命令行批量转换（流式写入、多进程），结果与pandas读取的值逐个单元格一致（含日期和空单元格）"""
+    print("\n开始测试命令行批量转换...")
+    
+    try:
+        from xlsx_to_csv_converter import run_batch, parse_args, output_name
+        
+        # 复制一份，两个文件并行转换
+        second_file = os.path.join(os.path.dirname(test_file), 'test_data_2.xlsx')
+        shutil.copy(test_file, second_file)
+        batch_dir = os.path.join(output_dir, 'batch')
+        if run_batch(parse_args([test_file, second_file, '-o', batch_dir, '-j', '2', '--chunk-rows', '2'])) != 0:
+            print("批量转换失败")
+            return False
+        
+        sheet_names = pd.ExcelFile(test_file).sheet_names
+        for input_file in (test_file, second_file):
+            for sheet_name in sheet_names:
+                output_file = os.path.join(batch_dir, output_name(input_file, sheet_name, len(sheet_names)))
+                error = csv_matches_excel(output_file, input_file, sheet_name)
+                if error:
+                    print(f"批量转换结果不一致: {output_file} {error}")
+                    return False
+                print(f"验证成功: {os.path.basename(output_file)} 与Excel取值一致")
+        return True
+        
+    except Exception as e:
+        print(f"批量转换测试失败: {str(e)}")
+        return False
+
+def test_streaming_conversion(test_file, output_dir):
+    """测试单次打开的流式转换：各读取引擎下工作簿只打开一次，逐块写入的CSV与pandas读取的值一致"""
+    print("\n开始测试流式转换...")
+    
+    try:
+        import importlib.util
+        import openpyxl
+        from xlsx_to_csv_converter import iter_sheets, write_sheet_csv, output_name
+        
+        engines = ['openpyxl']
+        if importlib.util.find_spec('python_calamine') is not None:
+            engines.append('calamine')
+        
+        sheet_names = pd.ExcelFile(test_file).sheet_names
+        original_load = openpyxl.load_workbook
+        for engine in engines:
+            engine_dir = os.path.join(output_dir, f'stream_{engine}')
+            os.makedirs(engine_dir, exist_ok=True)
+            opened = []
+            
+            def counting_load(*args, **kwargs):
+                opened.append(args[0])
+                return original_load(*args, **kwargs)
+            
+            openpyxl.load_workbook = counting_load
+            try:
+                written = []
+                for sheet_name, width, rows, total in iter_sheets(test_file, engine):
+                    output_file = os.path.join(engine_dir, output_name(test_file, sheet_name, total))
+                    write_sheet_csv(rows, width, output_file, chunk_rows=1)
+                    written.append(sheet_name)
+            finally:
+                openpyxl.load_workbook = original_load
+            
+            if written != sheet_names:
+                print(f"{engine}: 工作表不一致 {written}")
+                return False
+            if engine == 'openpyxl' and len(opened) != 1:
+                print(f"{engine}: 工作簿打开了 {len(opened)} 次")
+                return False
+            for sheet_name in sheet_names:
+                output_file = os.path.join(engine_dir, output_name(test_file, sheet_name, len(sheet_names)))
+                error = csv_matches_excel(output_file, test_file, sheet_name)
+                if error:
+                    print(f"{engine}: 流式转换结果不一致: {sheet_name} {error}")
+                    return False
+            print(f"验证成功: {engine} 引擎 {len(sheet_names)} 个工作表与Excel取值一致")
+        return True
+        
+    except Exception as e:
+        print(f"流式转换测试失败: {str(e)}")
+        return False
+
 def main():
     """主测试函数"""
     print("=" * 50)
@@ -109,7 +229,8 @@ def main():
     test_file, temp_dir = create_test_excel()
     
     # 测试转换
-    success = test_conversion(test_file, temp_dir)
+    success = (test_conversion(test_file, temp_dir) and test_batch_conversion(test_file, temp_dir)
+               and test_streaming_conversion(test_file, temp_dir))
     
     if success:
         print("\n" + "=" * 50)
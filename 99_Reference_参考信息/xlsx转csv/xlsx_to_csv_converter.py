@@ -1,10 +1,210 @@
-import tkinter as tk
-from tkinter import filedialog, messagebox, ttk
-import pandas as pd
 import os
+import sys
+import csv
+import glob
+import math
+import argparse
 import threading
+import importlib.util
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, date, time, timedelta
 from pathlib import Path
 
+import pandas as pd
+
+try:
+    import tkinter as tk
+    from tkinter import filedialog, messagebox, ttk
+except ImportError:  # 无图形界面的环境只使用命令行批量转换
+    tk = None
+
+# 流式写入CSV时每块行数
+CSV_CHUNK_ROWS = 10000
+# 读取为空值的文本（与pd.read_excel默认na_values一致）
+EXCEL_NA_STRINGS = frozenset({
+    "", "#N/A", "#N/A N/A", "#NA", "-1.#IND", "-1.#QNAN", "-NaN", "-nan", "1.#IND", "1.#QNAN",
+    "<NA>", "N/A", "NA", "NULL", "NaN", "None", "n/a", "nan", "null",
+})
+
+
+def select_excel_engine(file_path):
+    """已安装python-calamine时使用calamine引擎（更快），否则xlsx使用openpyxl、xls使用pandas默认引擎"""
+    pandas_version = tuple(int(part) for part in pd.__version__.split(".")[:2] if part.isdigit())
+    if importlib.util.find_spec("python_calamine") is not None and pandas_version >= (2, 2):
+        return "calamine"
+    return None if file_path.lower().endswith(".xls") else "openpyxl"
+
+
+def iter_sheets(input_file, engine=None):
+    """
+    只打开一次工作簿，依次返回 (工作表名, 列数, 逐行值的迭代器, 工作表数)
+    calamine/openpyxl（只读模式）逐行读取；未安装calamine的xls按工作表读取后逐行返回
+    列数为工作表已使用区域的宽度
+    """
+    engine = engine or select_excel_engine(input_file)
+    if engine == "calamine":
+        from python_calamine import CalamineWorkbook
+        workbook = CalamineWorkbook.from_path(input_file)
+        try:
+            for name in workbook.sheet_names:
+                sheet = workbook.get_sheet_by_name(name)
+                # calamine从第一个非空列开始返回，补齐前面的空列（与pd.read_excel一致）
+                pad = [None] * (sheet.start[1] if sheet.start else 0)
+                width = len(pad) + sheet.width if sheet.width else 0
+                yield name, width, (pad + row for row in sheet.iter_rows()), len(workbook.sheet_names)
+        finally:
+            workbook.close()
+    elif engine == "openpyxl":
+        from openpyxl import load_workbook
+        workbook = load_workbook(input_file, read_only=True, data_only=True)
+        try:
+            for worksheet in workbook.worksheets:
+                if worksheet.max_column is None:
+                    worksheet.reset_dimensions()  # 未记录已使用区域时按实际单元格计算
+                yield (worksheet.title, worksheet.max_column or 0, worksheet.iter_rows(values_only=True),
+                       len(workbook.worksheets))
+        finally:
+            workbook.close()
+    else:
+        excel_file = pd.ExcelFile(input_file, engine=engine)
+        for name in excel_file.sheet_names:
+            df = excel_file.parse(sheet_name=name, header=None)
+            yield (name, df.shape[1], (list(row) for row in df.itertuples(index=False, name=None)),
+                   len(excel_file.sheet_names))
+
+
+def cell_value(value):
+    """单元格值转换为CSV字段：空值和默认空值文本为空，整数值的浮点数写为整数，日期时间写为 yyyy-mm-dd HH:MM:SS"""
+    if value is None:
+        return ""
+    if isinstance(value, float):
+        if math.isnan(value):
+            return ""
+        return int(value) if value.is_integer() else value
+    if isinstance(value, str):
+        return "" if value in EXCEL_NA_STRINGS else value
+    if isinstance(value, datetime):
+        return value.strftime("%Y-%m-%d %H:%M:%S")
+    if isinstance(value, date):
+        # calamine把时间为0点的日期时间单元格读为date，与openpyxl/pd.read_excel一样写为0点
+        return value.strftime("%Y-%m-%d 00:00:00")
+    if isinstance(value, time):
+        return value.isoformat()
+    if isinstance(value, timedelta):
+        return str(pd.Timedelta(value))
+    return value
+
+
+def header_names(row):
+    """表头行转换为列名（与pd.read_excel一致：空列名为 Unnamed: i，重复列名加 .1/.2 后缀）"""
+    names, seen = [], {}
+    for i, value in enumerate(row):
+        value = cell_value(value)
+        name = f"Unnamed: {i}" if value == "" else str(value)
+        base = name
+        while name in seen:
+            seen[base] += 1
+            name = f"{base}.{seen[base]}"
+        seen.setdefault(name, 0)
+        names.append(name)
+    return names
+
+
+def write_sheet_csv(rows, width, output_file, encoding="utf-8-sig", separator=",", chunk_rows=CSV_CHUNK_ROWS):
+    """
+    逐行把工作表写入CSV（每chunk_rows行写入一次，内存只与块大小有关），返回数据行数
+    第一行为表头，每行补齐/截取到width列；中间的空行保留，末尾的空行不写入
+    """
+    rows = iter(rows)
+    header = list(next(rows, None) or [])
+    count, pending, chunk = 0, 0, []
+    with open(output_file, "w", encoding=encoding, newline="") as f:
+        writer = csv.writer(f, delimiter=separator, lineterminator=os.linesep)
+        writer.writerow(header_names((header + [None] * width)[:width]))
+        for row in rows:
+            values = [cell_value(v) for v in row[:width]]
+            if all(v == "" for v in values):
+                pending += 1  # 空行暂存，遇到非空行时再写入
+                continue
+            chunk.extend([[""] * width] * pending)
+            chunk.append(values + [""] * (width - len(values)))
+            pending = 0
+            if len(chunk) >= chunk_rows:
+                writer.writerows(chunk)
+                count += len(chunk)
+                chunk = []
+        writer.writerows(chunk)
+        count += len(chunk)
+    return count
+
+
+def output_name(input_file, sheet_name, sheet_count):
+    """单工作表: 原文件名.csv；多工作表: 原文件名_工作表名.csv"""
+    base_name = Path(input_file).stem
+    return f"{base_name}_{sheet_name}.csv" if sheet_count > 1 else f"{base_name}.csv"
+
+
+def convert_workbook(input_file, output_dir=None, encoding="utf-8-sig", separator=",",
+                     chunk_rows=CSV_CHUNK_ROWS, log=print, on_sheet=None):
+    """
+    转换一个Excel文件的所有工作表：工作簿只打开一次，每个工作表只读取一遍并逐块写入CSV
+    
+    Args:
+        output_dir: 输出目录，为空时输出到原文件所在目录
+        log: 日志函数
+        on_sheet: 每个工作表转换完成后调用 on_sheet(已完成数, 工作表数)
+    Returns:
+        生成的CSV文件列表
+    """
+    output_dir = output_dir or os.path.dirname(os.path.abspath(input_file))
+    engine = select_excel_engine(input_file)
+    log(f"读取引擎: {engine or '默认'}")
+    converted_files = []
+    for i, (sheet_name, width, rows, total) in enumerate(iter_sheets(input_file, engine)):
+        if i == 0:
+            log(f"发现 {total} 个工作表")
+        log(f"正在转换工作表: {sheet_name}")
+        output_file = os.path.join(output_dir, output_name(input_file, sheet_name, total))
+        count = write_sheet_csv(rows, width, output_file, encoding, separator, chunk_rows)
+        converted_files.append(output_file)
+        log(f"已保存: {os.path.basename(output_file)}（{count} 行）")
+        if on_sheet is not None:
+            on_sheet(i + 1, total)
+    return converted_files
+
+
+def _convert_task(input_file, output_dir, encoding, separator, chunk_rows):
+    """子进程中转换一个文件（不输出逐表日志）"""
+    return convert_workbook(input_file, output_dir, encoding, separator, chunk_rows, log=lambda message: None)
+
+
+def convert_files(files, output_dir=None, encoding="utf-8-sig", separator=",", workers=1,
+                  chunk_rows=CSV_CHUNK_ROWS, log=print):
+    """
+    批量转换多个文件（workers>1时多进程并行），返回 {文件: CSV文件列表或异常}
+    """
+    results = {}
+    if workers <= 1 or len(files) <= 1:
+        for input_file in files:
+            log(f"正在转换文件: {input_file}")
+            try:
+                results[input_file] = convert_workbook(input_file, output_dir, encoding, separator, chunk_rows, log)
+            except Exception as e:
+                results[input_file] = e
+        return results
+    
+    with ProcessPoolExecutor(max_workers=min(workers, len(files))) as executor:
+        futures = {input_file: executor.submit(_convert_task, input_file, output_dir, encoding, separator, chunk_rows)
+                   for input_file in files}
+        for input_file, future in futures.items():
+            try:
+                results[input_file] = future.result()
+                log(f"已转换: {input_file} -> {len(results[input_file])} 个CSV文件")
+            except Exception as e:
+                results[input_file] = e
+    return results
+
+
 class XlsxToCsvConverter:
     def __init__(self, root):
         self.root = root
@@ -178,47 +378,16 @@ class XlsxToCsvConverter:
             self.progress_var.set(20)
             self.log_message("开始转换过程...")
             
-            # 读取Excel文件
+            # 工作簿只打开一次，逐个工作表流式写入CSV
             self.log_message(f"正在读取文件: {input_file}")
-            excel_file = pd.ExcelFile(input_file)
-            
-            # 获取所有工作表名称
-            sheet_names = excel_file.sheet_names
-            self.log_message(f"发现 {len(sheet_names)} 个工作表: {', '.join(sheet_names)}")
-            
             self.progress_var.set(40)
             self.status_label.config(text="正在转换数据...", foreground="orange")
             
-            # 转换每个工作表
-            converted_files = []
-            for i, sheet_name in enumerate(sheet_names):
-                self.log_message(f"正在转换工作表: {sheet_name}")
-                
-                # 读取工作表数据
-                df = pd.read_excel(input_file, sheet_name=sheet_name)
-                
-                # 生成输出文件名
-                base_name = Path(input_file).stem
-                if len(sheet_names) > 1:
-                    output_filename = f"{base_name}_{sheet_name}.csv"
-                else:
-                    output_filename = f"{base_name}.csv"
-                    
-                output_file = os.path.join(output_dir, output_filename)
-                
-                # 保存为CSV
-                df.to_csv(output_file, 
-                         encoding=encoding, 
-                         sep=separator, 
-                         index=False, 
-                         na_rep='')
-                
-                converted_files.append(output_file)
-                self.log_message(f"已保存: {output_filename}")
-                
-                # 更新进度
-                progress = 40 + (i + 1) * 50 / len(sheet_names)
-                self.progress_var.set(progress)
+            def on_sheet(done, total):
+                self.progress_var.set(40 + done * 50 / total)
+            
+            converted_files = convert_workbook(input_file, output_dir, encoding, separator,
+                                               log=self.log_message, on_sheet=on_sheet)
                 
             self.progress_var.set(100)
             self.status_label.config(text="转换完成！", foreground="green")
@@ -246,10 +415,45 @@ class XlsxToCsvConverter:
         self.status_label.config(text="就绪", foreground="blue")
         self.log_message("已清空所有内容")
 
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="XLSX转CSV工具（不指定文件时启动图形界面）")
+    parser.add_argument("files", nargs="*", help="Excel文件，支持通配符（如 data/*.xlsx）")
+    parser.add_argument("-o", "--output-dir", help="输出目录（默认与原文件相同）")
+    parser.add_argument("--encoding", default="utf-8-sig", help="CSV编码（默认 utf-8-sig）")
+    parser.add_argument("--sep", default=",", help="分隔符（默认逗号，\\t 表示制表符）")
+    parser.add_argument("-j", "--workers", type=int, default=os.cpu_count() or 1, help="并行转换的进程数")
+    parser.add_argument("--chunk-rows", type=int, default=CSV_CHUNK_ROWS, help="每次写入CSV的行数")
+    return parser.parse_args(argv)
+
+
+def run_batch(args):
+    """命令行批量转换，全部成功返回0，有文件失败返回1"""
+    files = []
+    for pattern in args.files:
+        files.extend(sorted(glob.glob(pattern)) if glob.has_magic(pattern) else [pattern])
+    if not files:
+        print("未找到要转换的文件")
+        return 1
+    if args.output_dir:
+        os.makedirs(args.output_dir, exist_ok=True)
+    separator = "\t" if args.sep in ("\\t", "tab") else args.sep
+    results = convert_files(files, args.output_dir, args.encoding, separator, args.workers, args.chunk_rows)
+    failed = {f: e for f, e in results.items() if isinstance(e, Exception)}
+    for input_file, error in failed.items():
+        print(f"转换失败: {input_file}: {error}")
+    print(f"转换完成: {len(files) - len(failed)}/{len(files)} 个文件")
+    return 1 if failed else 0
+
+
 def main():
+    if len(sys.argv) > 1:
+        sys.exit(run_batch(parse_args(sys.argv[1:])))
+    if tk is None:
+        print("未安装tkinter，请使用命令行批量转换: python xlsx_to_csv_converter.py 文件.xlsx [-o 输出目录]")
+        sys.exit(1)
     root = tk.Tk()
     app = XlsxToCsvConverter(root)
     root.mainloop()
 
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    main()